@@ -7,6 +7,7 @@ import traceback
 
 import streamlit as st
 
+from src.steganografia import backup_system
 from src.ui.hide_pages import HideDataPages
 from src.ui.image_utils import ResultDisplay
 
@@ -21,6 +22,9 @@ def main():
         # Setup della pagina
         AppLayout.setup_page()
 
+        # Parametri recenti separati per ogni sessione utente
+        backup_system.set_session(AppLayout.get_session_id())
+
         # Mostra selector del tipo di dato (cards cliccabili)
         data_type = AppLayout.show_data_type_selector()
 
@@ -41,6 +41,7 @@ class SteganographyMethod:
     LSB = "lsb"  # Least Significant Bit (default)
     DWT = "dwt"  # Discrete Wavelet Transform
     PVD = "pvd"  # Pixel Value Differencing
+    AUTO = "auto"  # Riconoscimento automatico (solo per il recupero)
 
     @staticmethod
     def get_all():
@@ -59,6 +60,13 @@ class SteganographyMethod:
         }
 
 
+# Livelli di calcolo delle metriche di qualità
+class MetricsLevel:
+    PSNR = "psnr"  # Solo MSE/PSNR esatti (il più veloce)
+    SAMPLED = "sampled"  # PSNR esatto e SSIM su tile campionate (default)
+    FULL = "full"  # PSNR e SSIM a piena risoluzione
+
+
 # Formati file supportati
 class SupportedFormats:
     IMAGE_FORMATS = ["png", "jpg", "jpeg"]
@@ -67,7 +75,7 @@ class SupportedFormats:
 
 # Messaggi di errore
 class ErrorMessages:
-    IMAGE_TOO_SMALL_MESSAGE = "Immagine troppo piccola per nascondere il messaggio. Messaggio: {msg_len} caratteri, Immagine: {width}x{height}"
+    IMAGE_TOO_SMALL_MESSAGE = "Immagine troppo piccola per nascondere il messaggio. Messaggio: {msg_len} byte, Immagine: {width}x{height}"
     IMAGE_TOO_SMALL_IMAGE = "Immagine host troppo piccola per nascondere l'altra immagine. Host: {host_width}x{host_height}, Da nascondere: {secret_width}x{secret_height}"
     IMAGE_TOO_SMALL_FILE = "Immagine troppo piccola per nascondere il file. File: {file_size} bytes, Immagine: {width}x{height}"
     INVALID_LSB = "Il valore di LSB deve essere compreso tra 1 e 8 oppure 0 per la modalità automatica"
@@ -83,4 +91,6 @@ class ErrorMessages:
     PARAMS_MISSING = "Parametri mancanti per il recupero. Fornisci un file backup (.dat) o inserisci i parametri manualmente"
     NO_MESSAGE_FOUND = "Nessun messaggio valido trovato nell'immagine"
     DECODE_FAILED = "Impossibile decodificare il messaggio dall'immagine. Verifica che contenga davvero un messaggio nascosto"
+    PAYLOAD_CORRUPTED = "Dati nascosti corrotti: il checksum CRC32 del payload non corrisponde. L'immagine potrebbe essere stata modificata o compressa"
+    METHOD_NOT_DETECTED = "Impossibile riconoscere il metodo usato per nascondere i dati. Seleziona il metodo manualmente"
     IMAGE_RECONSTRUCTION_FAILED = "Impossibile ricostruire l'immagine nascosta. Verifica i parametri di recupero. Errore: {error}"
@@ -5,6 +5,8 @@ from .core import (
     DIR,
     FILE,
     NO_ZIP,
+    capacity,
+    capacity_map,
     get_bin_file,
     get_image,
     get_last_params,
@@ -13,8 +15,12 @@ from .core import (
     hide_image,
     hide_message,
     load_backup_data,
+    preview_hide,
     save_image,
+    tune_parameters,
 )
+from .detection import detect_method
+from .metrics import QualityMetrics
 
 __all__ = [
     "hide_message",
@@ -26,6 +32,12 @@ __all__ = [
     "save_image",
     "load_backup_data",
     "get_last_params",
+    "detect_method",
+    "capacity",
+    "capacity_map",
+    "tune_parameters",
+    "preview_hide",
+    "QualityMetrics",
     "NO_ZIP",
     "FILE",
     "DIR",
@@ -2,67 +2,587 @@
 Sistema di backup e recupero dei parametri di steganografia
 """
 
+import hashlib
+import io
+import json
+import os
 import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Hashable, Iterator
+from contextlib import closing, contextmanager
+from contextvars import ContextVar
 from os.path import exists
-from typing import Any
+from typing import Any, BinaryIO
+
+import numpy as np
+from PIL import Image
 
 from config.constants import DataType
 
+# Sessione corrente (in Streamlit ogni sessione esegue lo script nel proprio
+# thread) e registrazione dei parametri recenti, disattivata dalle anteprime
+_session: ContextVar[str] = ContextVar("backup_session", default="default")
+_recording: ContextVar[bool] = ContextVar("backup_recording", default=True)
+
+# File di backup: percorso su disco oppure oggetto file binario (es. BytesIO o
+# il file caricato dall'utente), così l'interfaccia non passa dal disco
+BackupFile = str | BinaryIO
+
+
+def image_fingerprint(img: Image.Image | np.ndarray) -> str:
+    """
+    Impronta BLAKE2 dei pixel di un'immagine
+
+    La forma dell'array fa parte dell'impronta, così immagini con gli stessi
+    byte ma dimensioni o canali diversi restano distinte.
+    """
+    arr = np.ascontiguousarray(np.asarray(img).astype(np.uint8, copy=False))
+    digest = hashlib.blake2b(repr(arr.shape).encode(), digest_size=16)
+    digest.update(memoryview(arr).cast("B"))
+    return digest.hexdigest()
+
+
+class ParameterStore:
+    """Archivio in memoria limitato (LRU) con scadenza, sicuro tra thread"""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Inserisce un valore, eliminando i meno usati oltre il limite"""
+        now = time.monotonic()
+        with self._lock:
+            self._purge(now)
+            self._entries[key] = (now + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key: Hashable) -> Any | None:
+        """Restituisce il valore se presente e non scaduto"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._purge(time.monotonic())
+            return len(self._entries)
+
+    def _purge(self, now: float) -> None:
+        """Elimina le voci scadute (da chiamare con il lock acquisito)"""
+        expired = [key for key, (expiry, _) in self._entries.items() if expiry <= now]
+        for key in expired:
+            del self._entries[key]
+
+
+class ParameterIndex:
+    """
+    Indice persistente (SQLite) dei parametri per impronta dell'immagine
+
+    Ogni immagine prodotta è indicizzata dall'impronta dei suoi pixel: il
+    recupero delle immagini senza header (formato precedente) ritrova i
+    parametri con una ricerca per chiave primaria, senza file di backup. Ogni
+    operazione apre una propria connessione, così l'indice è condivisibile tra
+    thread e processi. È disattivato per default (vedi ParameterBackup.INDEX_FILE).
+    """
+
+    # Campi mai salvati su disco (contenuto in chiaro o nome dei dati nascosti,
+    # non necessari al recupero)
+    PRIVATE_FIELDS = ("original_message", "original_file")
+
+    def __init__(self, path: str):
+        self.path = path
+        self._ready = False
+        self._lock = threading.Lock()
+
+    def put(self, fingerprint: str, data_type: str, params: dict[str, Any]) -> None:
+        """Indicizza i parametri di un'immagine (sostituisce la voce esistente)"""
+        stored = {k: v for k, v in params.items() if k not in self.PRIVATE_FIELDS}
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO params VALUES (?, ?, ?, ?)",
+                    (
+                        fingerprint,
+                        data_type,
+                        json.dumps(stored, default=_json_default),
+                        time.time(),
+                    ),
+                )
+        except (sqlite3.Error, OSError, TypeError) as e:
+            print(f"Warning: parametri non indicizzati ({e})")
+
+    def get(self, fingerprint: str) -> tuple[str, dict[str, Any]] | None:
+        """Restituisce (tipo di dato, parametri) dell'immagine, se indicizzata"""
+        try:
+            with closing(self._connect()) as conn:
+                row = conn.execute(
+                    "SELECT data_type, params FROM params WHERE fingerprint = ?",
+                    (fingerprint,),
+                ).fetchone()
+        except (sqlite3.Error, OSError) as e:
+            print(f"Warning: indice dei parametri non leggibile ({e})")
+            return None
+        return None if row is None else (row[0], json.loads(row[1]))
+
+    def _connect(self) -> sqlite3.Connection:
+        """Apre l'indice, creandolo al primo utilizzo"""
+        if not self._ready:
+            with self._lock:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with closing(sqlite3.connect(self.path, timeout=5.0)) as conn, conn:
+                    conn.execute(
+                        "CREATE TABLE IF NOT EXISTS params ("
+                        "fingerprint TEXT PRIMARY KEY, data_type TEXT NOT NULL, "
+                        "params TEXT NOT NULL, created REAL NOT NULL)"
+                    )
+                self._ready = True
+        return sqlite3.connect(self.path, timeout=5.0)
+
+
+def _json_default(value: Any) -> Any:
+    """Converte i tipi numpy presenti nei parametri in tipi JSON"""
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    raise TypeError(f"Tipo non serializzabile: {type(value).__name__}")
+
+
+class _NoGlobalsUnpickler(pickle.Unpickler):
+    """Unpickler che rifiuta qualsiasi classe o funzione (solo tipi di base)"""
+
+    def find_class(self, module: str, name: str) -> Any:
+        raise pickle.UnpicklingError(f"Oggetto non consentito: {module}.{name}")
+
+
+class BackupFormat:
+    """
+    Formato dei file di backup: JSON versionato con uno o più record
+
+    Ogni record contiene tipo di dato, parametri ed eventualmente l'impronta
+    dell'immagine steganografata; i parametri sono validati con lo schema del
+    metodo che li ha prodotti. Il formato pickle precedente è leggibile solo
+    su richiesta esplicita e senza istanziare oggetti.
+    """
+
+    FORMAT = "steganografia-backup"
+    VERSION = 1
+    MAX_SIZE = 4 * 1024 * 1024
+
+    # Schema dei parametri per (tipo di dato, campo 'method'): nome -> tipo
+    SCHEMAS: dict[tuple[str, str], dict[str, str]] = {
+        (DataType.STRING, "string"): {"original_message": "str"},
+        (DataType.IMAGE, "image"): {
+            "lsb": "int",
+            "msb": "int",
+            "div": "number",
+            "width": "int",
+            "height": "int",
+            "original_img1_size": "size",
+            "original_img2_size": "size",
+        },
+        (DataType.BINARY, "binary"): {
+            "n": "int",
+            "div": "number",
+            "size": "int",
+            "zipMode": "int",
+            "original_file": "str",
+            "channels": "int",
+        },
+        (DataType.STRING, "dwt"): {
+            "msg_length": "int",
+            "wavelet": "str",
+            "alpha": "number",
+            "bands": "list[str]",
+            "levels": "int",
+            "channel": "int",
+            "use_all_channels": "bool",
+        },
+        (DataType.IMAGE, "dwt"): {
+            "width": "int",
+            "height": "int",
+            "wavelet": "str",
+            "seed": "int",
+            "step": "number",
+            "channel": "int",
+            "bits_per_pixel": "int",
+            "bands": "list[str]",
+            "levels": "int",
+        },
+        (DataType.BINARY, "dwt"): {
+            "size": "int",
+            "wavelet": "str",
+            "channel": "int",
+            "bands": "list[str]",
+            "levels": "int",
+            "alpha": "number",
+            "use_all_channels": "bool",
+        },
+        (DataType.STRING, "pvd"): {
+            "msg_length": "int",
+            "pair_step": "int",
+            "channels": "list[int]",
+            "ranges_type": "ranges",
+        },
+        (DataType.IMAGE, "pvd"): {
+            "width": "int",
+            "height": "int",
+            "secret_bits": "int",
+            "pair_step": "int",
+            "channels": "list[int]",
+            "ranges_type": "ranges",
+        },
+        (DataType.BINARY, "pvd"): {
+            "size": "int",
+            "pair_step": "int",
+            "channels": "list[int]",
+            "ranges_type": "ranges",
+        },
+    }
+
+    @staticmethod
+    def dumps(records: list[dict[str, Any]]) -> bytes:
+        """Serializza i record (validati) nel formato corrente"""
+        document = {
+            "format": BackupFormat.FORMAT,
+            "version": BackupFormat.VERSION,
+            "records": records,
+        }
+        text = json.dumps(
+            document, separators=(",", ":"), ensure_ascii=False, default=_json_default
+        )
+        # Valida i record come verranno riletti (tipi numpy e tuple convertiti)
+        for record in json.loads(text)["records"]:
+            BackupFormat.validate(record)
+        return text.encode("utf-8")
+
+    @staticmethod
+    def loads(data: bytes, allow_pickle: bool = False) -> list[dict[str, Any]]:
+        """
+        Legge e valida i record di un file di backup
+
+        Args:
+            data: Contenuto del file
+            allow_pickle: Accetta anche il formato pickle precedente
+
+        Returns:
+            Lista dei record ('type', 'params' ed eventuale 'fingerprint')
+        """
+        if len(data) > BackupFormat.MAX_SIZE:
+            raise ValueError(f"File di backup troppo grande ({len(data)} byte)")
+
+        if data[:1] == b"\x80":
+            if not allow_pickle:
+                raise ValueError(
+                    "Backup nel formato pickle precedente: caricalo solo se la "
+                    "fonte è affidabile, abilitando ALLOW_LEGACY_PICKLE"
+                )
+            legacy = _NoGlobalsUnpickler(io.BytesIO(data)).load()
+            if not isinstance(legacy, dict):
+                raise ValueError("Backup pickle non valido")
+            BackupFormat.validate(legacy, complete=False)
+            return [legacy]
+
+        try:
+            document = json.loads(data.decode("utf-8"))
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise ValueError(f"File di backup non valido: {e}") from e
+        if not isinstance(document, dict) or document.get("format") != (
+            BackupFormat.FORMAT
+        ):
+            raise ValueError("File di backup non riconosciuto")
+        version = document.get("version")
+        if not isinstance(version, int) or version > BackupFormat.VERSION:
+            raise ValueError(f"Versione del backup non supportata: {version}")
+        records = document.get("records")
+        if not isinstance(records, list) or not records:
+            raise ValueError("Il file di backup non contiene record")
+        for record in records:
+            BackupFormat.validate(record)
+        return records
+
+    @staticmethod
+    def validate(record: Any, complete: bool = True) -> None:
+        """
+        Verifica struttura e tipi di un record con lo schema del suo metodo
+
+        Args:
+            record: Record da verificare
+            complete: Richiede tutti i campi dello schema (i backup pickle
+                precedenti possono non averli)
+        """
+        if not isinstance(record, dict) or not isinstance(record.get("params"), dict):
+            raise ValueError("Record di backup non valido")
+        params = record["params"]
+        key = (record.get("type"), params.get("method"))
+        schema = BackupFormat.SCHEMAS.get(key)
+        if schema is None:
+            raise ValueError(f"Tipo o metodo del backup non riconosciuto: {key}")
+        fingerprint = record.get("fingerprint")
+        if fingerprint is not None and not isinstance(fingerprint, str):
+            raise ValueError("Impronta del backup non valida")
+
+        for name, kind in schema.items():
+            if name not in params:
+                if complete:
+                    raise ValueError(f"Parametro mancante nel backup: {name}")
+                continue
+            if not _check_type(params[name], kind):
+                raise ValueError(
+                    f"Parametro non valido nel backup: {name}={params[name]!r}"
+                )
+
+
+def _check_type(value: Any, kind: str) -> bool:
+    """Verifica un valore rispetto a un tipo dello schema dei backup"""
+    if kind == "int":
+        return isinstance(value, int) and not isinstance(value, bool)
+    if kind == "number":
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    if kind == "str":
+        return isinstance(value, str)
+    if kind == "bool":
+        return isinstance(value, bool)
+    if kind == "ranges":
+        return value in ("quality", "capacity")
+    if kind == "size":
+        return (
+            isinstance(value, (list, tuple))
+            and len(value) == 2
+            and all(_check_type(v, "int") for v in value)
+        )
+    item = kind[len("list[") : -1]
+    return isinstance(value, (list, tuple)) and all(_check_type(v, item) for v in value)
+
+
+def _backup_name(backup_file: BackupFile | bytes) -> str:
+    """Nome del file di backup per i messaggi di log"""
+    if isinstance(backup_file, str):
+        return backup_file
+    return getattr(backup_file, "name", None) or "memoria"
+
 
 class ParameterBackup:
     """Gestione del backup e recupero dei parametri"""
 
+    # Limiti dei parametri recenti in memoria (voci totali e durata in secondi)
+    MAX_ENTRIES: int = 1024
+    TTL_SECONDS: float = 3600.0
+
+    # Lettura dei backup pickle precedenti (non sicura su file non fidati)
+    ALLOW_LEGACY_PICKLE: bool = os.environ.get("STEGANOGRAFIA_ALLOW_PICKLE") == "1"
+
+    # Indice persistente dei parametri per immagine, opt-in: percorso del
+    # database in STEGANOGRAFIA_INDEX (non impostato o vuoto: disattivato, i
+    # parametri restano solo in memoria e nei file di backup)
+    INDEX_FILE: str = os.environ.get("STEGANOGRAFIA_INDEX", "")
+
     def __init__(self):
-        self._last_string_params: dict[str, Any] | None = None
-        self._last_image_params: dict[str, Any] | None = None
-        self._last_binary_params: dict[str, Any] | None = None
+        # Chiavi: (sessione, "last", tipo di dato) per l'ultima operazione e
+        # (sessione, "image", impronta) per ogni immagine prodotta
+        self._store = ParameterStore(self.MAX_ENTRIES, self.TTL_SECONDS)
+        self._index: ParameterIndex | None = None
+        self.set_index_file(self.INDEX_FILE)
+
+    def set_index_file(self, path: str | None) -> None:
+        """Imposta il file dell'indice persistente (None o "" lo disattiva)"""
+        self._index = ParameterIndex(path) if path else None
+
+    def set_session(self, session_id: str) -> None:
+        """Imposta la sessione a cui appartengono i parametri recenti"""
+        _session.set(session_id)
 
     def save_backup_data(
-        self, data_type: str, params: dict[str, Any], backup_file: str | None = None
+        self,
+        data_type: str,
+        params: dict[str, Any],
+        backup_file: BackupFile | None = None,
+        image: Image.Image | np.ndarray | None = None,
     ) -> None:
-        """Salva i parametri di occultamento in un file binario e nelle variabili locali"""
+        """
+        Salva i parametri di occultamento in un file di backup, in memoria e,
+        se attivato, nell'indice persistente (quando viene passata l'immagine)
+
+        Args:
+            data_type: Tipo di dato nascosto
+            params: Parametri di recupero
+            backup_file: Percorso o oggetto file dove salvare i parametri
+                (opzionale)
+            image: Immagine steganografata, per ritrovare i parametri a
+                partire dai suoi pixel
+        """
+        recording = _recording.get()
+        fingerprint = None
+        if image is not None and (recording or backup_file):
+            fingerprint = image_fingerprint(image)
 
-        # Salva nelle variabili locali per uso immediato
-        if data_type == DataType.STRING:
-            self._last_string_params = params
-        elif data_type == DataType.IMAGE:
-            self._last_image_params = params
-        elif data_type == DataType.BINARY:
-            self._last_binary_params = params
+        # Salva in memoria per la sessione corrente
+        if recording:
+            session = _session.get()
+            self._store.put((session, "last", data_type), params)
+            if fingerprint is not None:
+                self._store.put((session, "image", fingerprint), (data_type, params))
+                if self._index is not None:
+                    self._index.put(fingerprint, data_type, params)
 
         # Salva su file se specificato
         if backup_file:
-            try:
+            record = {"type": data_type, "params": params}
+            if fingerprint is not None:
+                record["fingerprint"] = fingerprint
+            self.save_backup_records([record], backup_file)
+
+    def save_backup_records(
+        self, records: list[dict[str, Any]], backup_file: BackupFile
+    ) -> None:
+        """Salva uno o più record ('type', 'params', 'fingerprint') in un file"""
+        try:
+            data = BackupFormat.dumps(records)
+            if isinstance(backup_file, str):
                 with open(backup_file, "wb") as f:
-                    backup_data = {"type": data_type, "params": params}
-                    pickle.dump(backup_data, f)
-                print(f"Parametri salvati in {backup_file}")
-            except Exception as e:
-                raise ValueError(f"Errore nel salvataggio backup: {e}")
-
-    def load_backup_data(self, backup_file: str) -> dict[str, Any] | None:
-        """Carica i parametri di occultamento da un file binario"""
+                    f.write(data)
+            else:
+                backup_file.write(data)
+            print(f"Parametri salvati in {_backup_name(backup_file)}")
+        except Exception as e:
+            raise ValueError(f"Errore nel salvataggio backup: {e}")
+
+    def dump_backup_data(
+        self,
+        data_type: str,
+        params: dict[str, Any],
+        image: Image.Image | np.ndarray | None = None,
+    ) -> bytes:
+        """Contenuto del file di backup di un'operazione, senza scrivere su disco"""
+        record = {"type": data_type, "params": params}
+        if image is not None:
+            record["fingerprint"] = image_fingerprint(image)
+        return BackupFormat.dumps([record])
+
+    def load_backup_records(
+        self, backup_file: BackupFile | bytes, allow_pickle: bool | None = None
+    ) -> list[dict[str, Any]] | None:
+        """
+        Carica e valida tutti i record di un file di backup
+
+        Args:
+            backup_file: Percorso, contenuto o oggetto file del backup
+            allow_pickle: Accetta il formato pickle precedente (default
+                ALLOW_LEGACY_PICKLE)
+
+        Returns:
+            Lista dei record, o None se il file non esiste
+        """
+        if allow_pickle is None:
+            allow_pickle = self.ALLOW_LEGACY_PICKLE
         try:
-            if exists(backup_file):
+            if isinstance(backup_file, (bytes, bytearray, memoryview)):
+                data = bytes(backup_file)
+            elif isinstance(backup_file, str):
+                if not exists(backup_file):
+                    print(f"File backup {backup_file} non trovato")
+                    return None
                 with open(backup_file, "rb") as f:
-                    backup_data = pickle.load(f)
-                print(f"Parametri caricati da {backup_file}")
-                return backup_data
-
-            print(f"File backup {backup_file} non trovato")
-            return None
+                    data = f.read()
+            else:
+                # Un file caricato può essere già stato letto in un rerun
+                if backup_file.seekable():
+                    backup_file.seek(0)
+                data = backup_file.read()
+            records = BackupFormat.loads(data, allow_pickle)
+            print(f"Parametri caricati da {_backup_name(backup_file)}")
+            return records
         except Exception as e:
             raise ValueError(f"Errore nel caricamento backup: {e}")
 
-    def get_last_params(self, data_type: str) -> dict[str, Any] | None:
-        """Ottiene gli ultimi parametri usati per il tipo di dato specificato"""
-        if data_type == DataType.STRING:
-            return self._last_string_params
-        if data_type == DataType.IMAGE:
-            return self._last_image_params
-        if data_type == DataType.BINARY:
-            return self._last_binary_params
-        return None
+    def load_backup_data(
+        self,
+        backup_file: BackupFile | bytes,
+        data_type: str | None = None,
+        image: Image.Image | np.ndarray | None = None,
+        allow_pickle: bool | None = None,
+    ) -> dict[str, Any] | None:
+        """
+        Carica i parametri di occultamento da un file di backup
+
+        Se il file contiene più record sceglie, tra quelli del tipo richiesto,
+        il record con l'impronta dell'immagine; altrimenti il primo.
+
+        Args:
+            backup_file: Percorso, contenuto o oggetto file del backup
+            data_type: Tipo di dato da recuperare (None: qualsiasi)
+            image: Immagine da cui recuperare i dati
+            allow_pickle: Accetta il formato pickle precedente (default
+                ALLOW_LEGACY_PICKLE)
+
+        Returns:
+            Record con 'type' e 'params', o None se non disponibile
+        """
+        records = self.load_backup_records(backup_file, allow_pickle)
+        if records is None:
+            return None
+        candidates = [r for r in records if data_type in (None, r["type"])]
+        if not candidates:
+            print(
+                f"Nessun parametro di tipo {data_type} in {_backup_name(backup_file)}"
+            )
+            return None
+        if image is not None and len(candidates) > 1:
+            fingerprint = image_fingerprint(image)
+            for record in candidates:
+                if record.get("fingerprint") == fingerprint:
+                    return record
+        return candidates[0]
+
+    def get_last_params(
+        self, data_type: str, image: Image.Image | np.ndarray | None = None
+    ) -> dict[str, Any] | None:
+        """
+        Ottiene i parametri recenti della sessione per il tipo di dato
+
+        Se viene passata l'immagine da cui recuperare restituisce i suoi
+        parametri, cercandoli tra quelli della sessione e poi nell'indice
+        persistente (se attivato); altrimenti quelli dell'ultima operazione
+        dello stesso tipo.
+        """
+        session = _session.get()
+        if image is not None:
+            fingerprint = image_fingerprint(image)
+            entry = self._store.get((session, "image", fingerprint))
+            if entry is None and self._index is not None:
+                entry = self._index.get(fingerprint)
+            if entry is not None and entry[0] == data_type:
+                return entry[1]
+        return self._store.get((session, "last", data_type))
+
+    @contextmanager
+    def keep_last_params(self) -> Iterator[None]:
+        """
+        Non registra i parametri recenti all'interno del blocco
+
+        Usato dalle anteprime, che eseguono un occultamento vero ma non devono
+        sostituire i parametri usati dal recupero automatico.
+        """
+        token = _recording.set(False)
+        try:
+            yield
+        finally:
+            _recording.reset(token)
 
 
 # Istanza globale del sistema di backup
@@ -2,54 +2,342 @@
 Operazioni core per la manipolazione dei bit nella steganografia
 """
 
+from __future__ import annotations
 
-def binary_convert(text: str) -> str:
-    """Converte una stringa di testo in una stringa binaria (carattere per carattere)"""
-    return "".join(format(ord(char), "08b") for char in text)
-
-
-def binary_convert_back(text: str) -> str:
-    """Converte una stringa binaria in una stringa di testo (8-bit)"""
-    return "".join(chr(int(text[i * 8 : i * 8 + 8], 2)) for i in range(len(text) // 8))
-
-
-def set_last_bit(value: int, bit: str) -> int:
-    """Setta l'ultimo bit di un numero"""
-    value_str = format(
-        value, "08b"
-    )  # converte un intero in una stringa di 8 caratteri (byte)
-    value_str = value_str[:7] + bit  # cambia l'ultimo bit
-    result = int(value_str, 2)  # riconverte la stringa in un numero
-    result = min(255, max(0, result))  # controlla se il numero è fuori range
-    return result
-
-
-def set_last_n_bits(value: int, bits: str, n: int) -> int:
-    """Setta gli ultimi n bits di un numero"""
-    value_str = format(value, "08b")
-    n = min(n, len(bits))
-    value_str = value_str[:-n] + bits
-    result = int(value_str, 2)
-    result = min(255, max(0, result))
-    return result
-
-
-def set_color_component(mat, i: int, j: int, color: int, channel: int):
-    """Cambia una componente di colore RGB di un pixel"""
-    if channel == 0:
-        mat[i, j] = (color, mat[i, j][1], mat[i, j][2])
-    elif channel == 1:
-        mat[i, j] = (mat[i, j][0], color, mat[i, j][2])
-    elif channel == 2:
-        mat[i, j] = (mat[i, j][0], mat[i, j][1], color)
-    return mat
-
-
-def string_to_bytes(bit_string: str) -> bytearray:
-    """Converte una stringa di bit in bytes"""
-    byte_array = bytearray()
-    for i in range(0, len(bit_string), 8):
-        byte = bit_string[i : i + 8]
-        if len(byte) == 8:
-            byte_array.append(int(byte, 2))
-    return byte_array
+import numpy as np
+
+# Numero di elementi elaborati per blocco nelle conversioni vettoriali
+# (limita la memoria temporanea con payload grandi)
+CHUNK_SIZE: int = 1 << 20
+
+# Larghezza massima (in bit) di un intero letto/scritto in un colpo solo
+MAX_UINT_WIDTH: int = 56
+
+# Codifica dei payload di testo e codifica dei payload precedenti a UTF-8
+TEXT_ENCODING = "utf-8"
+LEGACY_TEXT_ENCODING = "latin-1"
+
+
+class BitStream:
+    """
+    Sequenza di bit compatta memorizzata in un buffer numpy uint8 (MSB first)
+
+    Ogni bit occupa un bit di memoria, invece di un oggetto carattere come nelle
+    stringhe '0'/'1': un payload da 10 MB occupa circa 10 MB. I bit di padding
+    dell'ultimo byte sono sempre a zero.
+    """
+
+    __slots__ = ("_buffer", "_length")
+
+    def __init__(self, buffer: np.ndarray | None = None, length: int | None = None):
+        """
+        Args:
+            buffer: Byte che contengono i bit (MSB first)
+            length: Numero di bit validi (default: tutti i bit del buffer)
+        """
+        if buffer is None:
+            buffer = np.zeros(0, dtype=np.uint8)
+        buffer = np.asarray(buffer, dtype=np.uint8).reshape(-1)
+        if length is None:
+            length = buffer.size * 8
+        if length < 0 or length > buffer.size * 8:
+            raise ValueError(
+                f"Lunghezza non valida: {length} bit per un buffer di {buffer.size} byte"
+            )
+
+        buffer = buffer[: (length + 7) // 8]
+        padding = buffer.size * 8 - length
+        if padding and buffer[-1] & ((1 << padding) - 1):
+            # Azzera i bit oltre la lunghezza (copia solo in questo caso)
+            buffer = buffer.copy()
+            buffer[-1] &= (0xFF << padding) & 0xFF
+
+        self._buffer = buffer
+        self._length = length
+
+    # ======================================================
+    # Costruttori
+    # ======================================================
+
+    @staticmethod
+    def from_bytes(data: bytes | bytearray | memoryview) -> BitStream:
+        """Crea uno stream dai byte dati (senza copiarli)"""
+        return BitStream(np.frombuffer(data, dtype=np.uint8))
+
+    @staticmethod
+    def from_bits(bits: np.ndarray) -> BitStream:
+        """Crea uno stream da un array di valori 0/1 (un elemento per bit)"""
+        bits = np.asarray(bits, dtype=np.uint8).reshape(-1)
+        return BitStream(np.packbits(bits), bits.size)
+
+    @staticmethod
+    def from_str(bits: str) -> BitStream:
+        """Crea uno stream da una stringa di '0' e '1' (es. header costanti)"""
+        values = np.frombuffer(bits.encode("ascii"), dtype=np.uint8) - ord("0")
+        if np.any(values > 1):
+            raise ValueError(f"Stringa di bit non valida: {bits}")
+        return BitStream.from_bits(values)
+
+    @staticmethod
+    def from_uint(value: int, width: int) -> BitStream:
+        """Crea uno stream con un intero senza segno su width bit"""
+        if value < 0 or value >= 1 << width:
+            raise ValueError(f"Il valore {value} non è rappresentabile su {width} bit")
+        n_bytes = (width + 7) // 8
+        data = (value << (n_bytes * 8 - width)).to_bytes(n_bytes, "big")
+        return BitStream(np.frombuffer(data, dtype=np.uint8), width)
+
+    @staticmethod
+    def from_uints(values: np.ndarray, widths: int | np.ndarray) -> BitStream:
+        """
+        Crea uno stream concatenando interi senza segno
+
+        Args:
+            values: Valori da scrivere (uno per campo)
+            widths: Larghezza in bit di ogni campo (intero o array per campo)
+
+        Returns:
+            Stream con i valori scritti in sequenza, MSB first
+        """
+        values = np.asarray(values).reshape(-1).astype(np.uint64, copy=False)
+        if np.ndim(widths) == 0:
+            # Larghezza fissa: ogni campo diventa una riga di width bit
+            width = int(widths)
+            if width < 0 or width > MAX_UINT_WIDTH:
+                raise ValueError(
+                    f"Larghezza dei campi fuori range (0-{MAX_UINT_WIDTH})"
+                )
+            shifts = np.arange(width - 1, -1, -1, dtype=np.uint64)
+            bits = np.empty((values.size, width), dtype=np.uint8)
+            for chunk in range(0, values.size, CHUNK_SIZE):
+                chunk_values = values[chunk : chunk + CHUNK_SIZE, None]
+                bits[chunk : chunk + CHUNK_SIZE] = (chunk_values >> shifts) & 1
+            return BitStream.from_bits(bits)
+
+        widths = np.asarray(widths, dtype=np.int64).reshape(-1)
+        if widths.shape != values.shape:
+            raise ValueError("values e widths devono avere la stessa lunghezza")
+        if widths.size and (widths.min() < 0 or widths.max() > MAX_UINT_WIDTH):
+            raise ValueError(f"Larghezza dei campi fuori range (0-{MAX_UINT_WIDTH})")
+
+        ends = np.cumsum(widths)
+        total = int(ends[-1]) if ends.size else 0
+        bits = np.empty(total, dtype=np.uint8)
+
+        for chunk in range(0, values.size, CHUNK_SIZE):
+            chunk_values = values[chunk : chunk + CHUNK_SIZE]
+            chunk_widths = widths[chunk : chunk + CHUNK_SIZE]
+            chunk_ends = ends[chunk : chunk + CHUNK_SIZE]
+            if not chunk_values.size:
+                continue
+            bit_start = int(chunk_ends[0] - chunk_widths[0])
+            bit_stop = int(chunk_ends[-1])
+
+            # Per ogni bit: campo di appartenenza e posizione dentro il campo
+            field = np.repeat(np.arange(chunk_values.size), chunk_widths)
+            position = np.arange(bit_start, bit_stop) - np.repeat(
+                chunk_ends - chunk_widths, chunk_widths
+            )
+            shift = (chunk_widths[field] - 1 - position).astype(np.uint64)
+            bits[bit_start:bit_stop] = (chunk_values[field] >> shift) & np.uint64(1)
+
+        return BitStream.from_bits(bits)
+
+    @staticmethod
+    def concat(*streams: BitStream) -> BitStream:
+        """Concatena più stream (es. campi dell'header e dati)"""
+        if all(len(stream) % 8 == 0 for stream in streams[:-1]):
+            # Caso comune: campi allineati al byte, basta unire i buffer
+            buffers = [stream._buffer for stream in streams]
+            length = sum(len(stream) for stream in streams)
+            return BitStream(np.concatenate(buffers) if buffers else None, length)
+        return BitStream.from_bits(
+            np.concatenate([stream.to_bits() for stream in streams])
+        )
+
+    # ======================================================
+    # Accesso
+    # ======================================================
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __add__(self, other: BitStream) -> BitStream:
+        return BitStream.concat(self, other)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, BitStream):
+            return NotImplemented
+        return self._length == other._length and np.array_equal(
+            self._buffer, other._buffer
+        )
+
+    def __getitem__(self, key: slice) -> BitStream:
+        """Restituisce una sotto-sequenza (solo slice con passo 1)"""
+        if not isinstance(key, slice):
+            raise TypeError("BitStream supporta solo slice, usa read_uint per un bit")
+        start, stop, step = key.indices(self._length)
+        if step != 1:
+            raise ValueError("BitStream non supporta slice con passo diverso da 1")
+        stop = max(start, stop)
+        if start % 8 == 0:
+            return BitStream(self._buffer[start // 8 : (stop + 7) // 8], stop - start)
+        return BitStream.from_bits(self.to_bits(start, stop))
+
+    def to_bytes(self) -> bytes:
+        """Restituisce i byte dello stream (l'ultimo è completato con zeri)"""
+        return self._buffer.tobytes()
+
+    def to_bits(self, start: int = 0, stop: int | None = None) -> np.ndarray:
+        """Restituisce i bit nell'intervallo come array uint8 di 0/1"""
+        stop = self._length if stop is None else min(stop, self._length)
+        if stop <= start:
+            return np.zeros(0, dtype=np.uint8)
+        first_byte = start // 8
+        bits = np.unpackbits(self._buffer[first_byte : (stop + 7) // 8])
+        offset = start - first_byte * 8
+        return bits[offset : offset + stop - start]
+
+    def read_uint(self, start: int, width: int) -> int:
+        """Legge un intero senza segno di width bit a partire da start"""
+        if start < 0 or start + width > self._length:
+            raise ValueError(
+                f"Lettura oltre la fine dello stream ({start + width} > {self._length} bit)"
+            )
+        if width == 0:
+            return 0
+        first_byte, last_byte = start // 8, (start + width + 7) // 8
+        raw = int.from_bytes(self._buffer[first_byte:last_byte].tobytes(), "big")
+        return (raw >> (last_byte * 8 - start - width)) & ((1 << width) - 1)
+
+    def read_uints(self, starts: np.ndarray, widths: int | np.ndarray) -> np.ndarray:
+        """
+        Legge molti interi senza segno in modo vettoriale
+
+        I bit oltre la fine dello stream valgono zero (come un padding a destra),
+        così l'ultimo campo di un payload può essere letto anche se incompleto.
+
+        Args:
+            starts: Posizione (in bit) di inizio di ogni campo
+            widths: Larghezza in bit di ogni campo (intero o array per campo)
+
+        Returns:
+            Array con i valori letti (dtype intero senza segno più piccolo adatto)
+        """
+        starts = np.asarray(starts, dtype=np.int64).reshape(-1)
+        widths = np.broadcast_to(np.asarray(widths, dtype=np.int64), starts.shape)
+        max_width = int(widths.max()) if widths.size else 0
+        if max_width > MAX_UINT_WIDTH:
+            raise ValueError(f"Larghezza dei campi fuori range (0-{MAX_UINT_WIDTH})")
+
+        out_dtype = np.uint8
+        for dtype in (np.uint16, np.uint32, np.uint64):
+            if max_width > np.iinfo(out_dtype).bits:
+                out_dtype = dtype
+        result = np.zeros(starts.size, dtype=out_dtype)
+        if not self._buffer.size or not starts.size:
+            return result
+
+        # Byte da leggere per coprire il campo più largo con qualsiasi offset
+        n_bytes = (7 + max_width + 7) // 8
+        window_dtype = np.uint32 if n_bytes <= 4 else np.uint64
+        last_index = self._buffer.size - 1
+
+        for chunk in range(0, starts.size, CHUNK_SIZE):
+            chunk_starts = starts[chunk : chunk + CHUNK_SIZE]
+            chunk_widths = widths[chunk : chunk + CHUNK_SIZE]
+            byte_index = chunk_starts >> 3
+
+            # Finestra di n_bytes byte consecutivi (oltre la fine valgono zero)
+            window = np.zeros(chunk_starts.size, dtype=window_dtype)
+            for k in range(n_bytes):
+                index = byte_index + k
+                byte = self._buffer[np.minimum(index, last_index)].astype(window_dtype)
+                byte[index > last_index] = 0
+                window <<= window_dtype(8)
+                window |= byte
+
+            shift = (n_bytes * 8 - (chunk_starts & 7) - chunk_widths).astype(
+                window_dtype
+            )
+            mask = (window_dtype(1) << chunk_widths.astype(window_dtype)) - 1
+            result[chunk : chunk + CHUNK_SIZE] = (window >> shift) & mask
+
+        return result
+
+    def find(self, pattern: BitStream, start: int = 0, stop: int | None = None) -> int:
+        """
+        Cerca la prima occorrenza di pattern (al massimo MAX_UINT_WIDTH bit)
+
+        Args:
+            pattern: Sequenza da cercare
+            start: Prima posizione di inizio da considerare
+            stop: Posizioni di inizio considerate fino a stop escluso
+
+        Returns:
+            Posizione della prima occorrenza oppure -1
+        """
+        width = len(pattern)
+        if width > MAX_UINT_WIDTH:
+            raise ValueError(f"Pattern troppo lungo (max {MAX_UINT_WIDTH} bit)")
+        last_start = self._length - width + 1
+        stop = last_start if stop is None else min(stop, last_start)
+        target = pattern.read_uint(0, width)
+
+        for chunk in range(start, stop, CHUNK_SIZE):
+            positions = np.arange(chunk, min(chunk + CHUNK_SIZE, stop))
+            matches = np.flatnonzero(self.read_uints(positions, width) == target)
+            if matches.size:
+                return int(positions[matches[0]])
+        return -1
+
+
+# ======================================================
+# Conversioni testo e helper per i pixel
+# ======================================================
+
+
+def encode_text(text: str) -> bytes:
+    """Codifica un testo nei byte del payload (UTF-8)"""
+    return text.encode(TEXT_ENCODING)
+
+
+def decode_text(data: bytes) -> str:
+    """
+    Decodifica i byte di un payload di testo
+
+    I payload creati prima del passaggio a UTF-8 usano un byte per carattere
+    (Latin-1): se i byte non sono UTF-8 valido vengono letti in quel formato.
+    """
+    try:
+        return data.decode(TEXT_ENCODING)
+    except UnicodeDecodeError:
+        return data.decode(LEGACY_TEXT_ENCODING)
+
+
+def text_to_bits(text: str) -> BitStream:
+    """Converte un testo in bit (byte UTF-8)"""
+    return BitStream.from_bytes(encode_text(text))
+
+
+def bits_to_text(bits: BitStream) -> str:
+    """Converte una sequenza di bit in testo (byte UTF-8, fallback Latin-1)"""
+    return decode_text(bits[: len(bits) // 8 * 8].to_bytes())
+
+
+def xor_checksum(data: bytes) -> int:
+    """Checksum XOR di tutti i byte del payload"""
+    if not data:
+        return 0
+    return int(np.bitwise_xor.reduce(np.frombuffer(data, dtype=np.uint8)))
+
+
+def set_last_n_bits(values: np.ndarray, bits: np.ndarray, n: int) -> np.ndarray:
+    """Setta gli ultimi n bit di ogni valore (uint8) con i valori in bits"""
+    mask = np.uint8((0xFF << n) & 0xFF)
+    return (values & mask) | np.asarray(bits, dtype=np.uint8)
+
+
+def get_last_n_bits(values: np.ndarray, n: int) -> np.ndarray:
+    """Restituisce gli ultimi n bit di ogni valore (uint8)"""
+    return values & np.uint8((1 << n) - 1)
@@ -0,0 +1,62 @@
+"""
+Elementi comuni alle stime esatte di capacità
+
+Le stime vere e proprie stanno accanto alla logica di ogni metodo
+(pvd_capacity in pvd/pair_operations.py, dwt_capacity in dwt/transform.py,
+payload_capacity in ogni engine): qui ci sono la dimensione dei blocchi
+della mappa, il formato del risultato e la conversione da bit a byte utili.
+"""
+
+import numpy as np
+from PIL import Image
+
+from .container import header_rows
+from .ecc import encoded_bits
+from .metrics import heat_image
+
+BLOCK_SIZE = 32  # Lato in pixel dei blocchi della mappa di capacità
+
+
+def capacity_estimate(capacity_map: np.ndarray, block_size: int) -> dict:
+    """
+    Compone il risultato di una stima
+
+    Returns:
+        {
+            'bits': capacità totale in bit,
+            'map': bit disponibili per blocco (righe x colonne di blocchi),
+            'heatmap': mappa in falsi colori (relativa al blocco più capiente),
+            'block_size': lato in pixel di un blocco
+        }
+    """
+    peak = max(int(capacity_map.max()), 1)
+    return {
+        "bits": int(capacity_map.sum()),
+        "map": capacity_map,
+        "heatmap": heat_image(capacity_map / peak),
+        "block_size": block_size,
+    }
+
+
+def image_array(img: Image.Image) -> np.ndarray:
+    """Pixel RGB dell'immagine come array (come li vede l'embedding)"""
+    return np.asarray(img if img.mode == "RGB" else img.convert("RGB"))
+
+
+def region_components(width: int, height: int, channels: int = 3) -> int:
+    """Componenti dell'immagine disponibili per il payload (dopo l'header)"""
+    return max(height - header_rows(width, channels), 0) * width * channels
+
+
+def usable_bytes(bits: int, ecc: bool = False) -> int:
+    """
+    Byte di payload che entrano in un certo numero di bit nascosti
+
+    Args:
+        bits: Bit disponibili nel carrier (header escluso)
+        ecc: Se True il payload è protetto da Hamming(7,4)
+
+    Returns:
+        Numero massimo di byte del payload (dopo l'eventuale compressione)
+    """
+    return bits // (encoded_bits(1) if ecc else 8)
@@ -0,0 +1,407 @@
+"""
+Contenitore autodescrittivo del payload nascosto
+
+Ogni metodo scrive in cima all'immagine un header versionato con tutto ciò che
+serve per il recupero (metodo, tipo di dato, parametri, lunghezza del payload).
+L'header occupa sempre l'LSB delle prime componenti in ordine raster, nelle
+righe riservate da header_rows: si legge con una sola lettura, senza backup e
+senza ricerche. Il payload vero e proprio viene nascosto dal metodo scelto
+nelle righe successive.
+
+Layout (big-endian):
+    magic (4 byte) | versione (1) | metodo (1) | tipo di dato (1) | flag (1) |
+    lunghezza payload (4) | CRC32 del payload (4) | lunghezza parametri (2) |
+    parametri JSON | CRC32 dell'header (4)
+
+Il CRC32 del payload viene verificato durante il recupero prima di scrivere
+qualsiasi output: un carrier danneggiato fallisce subito invece di produrre
+file corrotti.
+
+Il metodo DWT nasconde anche un descrittore nel dominio della trasformata,
+prima del payload: magic, flag, lunghezza e CRC32 del payload, protetti da
+Hamming(7,4) e ripetuti DESCRIPTOR_COPIES volte. Una ricompressione con
+perdita (es. JPEG) cancella gli LSB dell'header ma non i coefficienti: con i
+parametri DWT del backup (o quelli configurati) il descrittore sostituisce
+l'header nel recupero.
+
+I due bit bassi dei flag indicano il codec con cui è compresso il payload
+(nessuno, zlib, lzma, bz2), il bit FLAG_ECC che il payload è protetto dal
+codice di Hamming(7,4). Lunghezza e CRC32 si riferiscono ai byte compressi,
+prima della codifica ECC: encode_payload e decode_payload applicano l'intera
+pipeline (compressione, ECC, CRC32) per tutti i metodi.
+"""
+
+import bz2
+import json
+import lzma
+import struct
+import zlib
+
+import numpy as np
+from PIL import Image
+
+from config.constants import DataType, ErrorMessages, SteganographyMethod
+
+from .bit_operations import BitStream, set_last_n_bits
+from .ecc import encoded_bits, hamming_decode, hamming_encode
+
+MAGIC = b"STEG"
+VERSION = 2
+HEADER_CAPACITY = 256  # Byte riservati all'header (parametri inclusi)
+
+METHOD_IDS = {
+    SteganographyMethod.LSB: 1,
+    SteganographyMethod.PVD: 2,
+    SteganographyMethod.DWT: 3,
+}
+DATA_TYPE_IDS = {
+    DataType.STRING: 1,
+    DataType.IMAGE: 2,
+    DataType.BINARY: 3,
+}
+
+# Codec di compressione del payload (bit bassi dei flag)
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_LZMA = 2
+CODEC_BZ2 = 3
+CODEC_MASK = 0x03
+FLAG_ECC = 0x04  # Payload protetto da Hamming(7,4)
+_CODECS = {
+    CODEC_ZLIB: ("zlib", zlib.compress, zlib.decompress),
+    CODEC_LZMA: ("lzma", lzma.compress, lzma.decompress),
+    CODEC_BZ2: ("bz2", bz2.compress, bz2.decompress),
+}
+
+_FIXED = struct.Struct(">4sBBBBIIH")
+_CRC_SIZE = 4
+
+# Descrittore del payload nel dominio della trasformata (magic, flag,
+# lunghezza, CRC32), con ECC e ripetuto per il voto a maggioranza
+DESCRIPTOR_MAGIC = b"STGD"
+DESCRIPTOR_COPIES = 3
+_DESCRIPTOR = struct.Struct(">4sBII")
+DESCRIPTOR_BITS = encoded_bits(_DESCRIPTOR.size) * DESCRIPTOR_COPIES
+
+
+def header_rows(width: int, channels: int = 3) -> int:
+    """Numero di righe in cima all'immagine riservate all'header"""
+    return -(-HEADER_CAPACITY * 8 // (width * channels))
+
+
+def carrier_region(img_array: np.ndarray) -> np.ndarray:
+    """
+    Vista sulla parte dell'immagine disponibile per il payload
+
+    Args:
+        img_array: Immagine come array (altezza, larghezza, canali)
+
+    Returns:
+        Vista sulle righe successive a quelle riservate all'header
+
+    Raises:
+        ValueError: Se l'immagine non ha righe libere oltre all'header
+    """
+    height, width, channels = img_array.shape
+    rows = header_rows(width, channels)
+    if height <= rows:
+        raise ValueError(
+            f"Immagine troppo piccola per il contenitore: servono più di {rows} righe"
+        )
+    return img_array[rows:]
+
+
+def changed_rows(img_array: np.ndarray, n_components: int) -> tuple[int, int]:
+    """
+    Righe toccate da header e payload (per limitare il calcolo delle metriche)
+
+    Args:
+        img_array: Immagine come array (altezza, larghezza, canali)
+        n_components: Componenti della regione del carrier usate dal payload,
+            a partire dall'inizio
+
+    Returns:
+        Intervallo di righe [inizio, fine)
+    """
+    height, width, channels = img_array.shape
+    rows = header_rows(width, channels) + -(-n_components // (width * channels))
+    return 0, min(height, rows)
+
+
+def build_header(
+    method: str, data_type: str, params: dict, payload: bytes, flags: int = 0
+) -> BitStream:
+    """
+    Costruisce l'header del contenitore
+
+    Args:
+        method: Metodo di steganografia ('lsb', 'pvd', 'dwt')
+        data_type: Tipo di dato nascosto (DataType)
+        params: Parametri del metodo necessari al recupero (serializzabili JSON)
+        payload: Byte del payload (per lunghezza e CRC32)
+        flags: Flag (i bit bassi contengono il codec del payload)
+
+    Returns:
+        Header come stream di bit
+    """
+    params_bytes = json.dumps(params, separators=(",", ":")).encode("utf-8")
+    header = _FIXED.pack(
+        MAGIC,
+        VERSION,
+        METHOD_IDS[method],
+        DATA_TYPE_IDS[data_type],
+        flags,
+        len(payload),
+        zlib.crc32(payload),
+        len(params_bytes),
+    )
+    header += params_bytes
+    header += zlib.crc32(header).to_bytes(_CRC_SIZE, "big")
+    if len(header) > HEADER_CAPACITY:
+        raise ValueError(
+            f"Parametri troppo lunghi per l'header ({len(header)}/{HEADER_CAPACITY} byte)"
+        )
+    return BitStream.from_bytes(header)
+
+
+def write_header(img_array: np.ndarray, header: BitStream) -> None:
+    """Scrive l'header nell'LSB delle prime componenti (array uint8, in place)"""
+    rows = header_rows(img_array.shape[1], img_array.shape[2])
+    flat = img_array[:rows].reshape(-1)
+    flat[: len(header)] = set_last_n_bits(flat[: len(header)], header.to_bits(), 1)
+
+
+def read_header(img: Image.Image) -> dict | None:
+    """
+    Legge l'header del contenitore (solo le righe riservate)
+
+    Args:
+        img: Immagine che potrebbe contenere un payload
+
+    Returns:
+        Dizionario con version, method, data_type, flags, params,
+        payload_length, payload_crc e codec, oppure None se l'immagine non
+        contiene un header valido
+    """
+    channels = 4 if img.mode == "RGBA" else 3
+    rows = header_rows(img.width, channels)
+    if img.height <= rows:
+        return None
+
+    region = img.crop((0, 0, img.width, rows))
+    if region.mode not in ("RGB", "RGBA"):
+        region = region.convert("RGB")
+    flat = np.asarray(region).reshape(-1)[: HEADER_CAPACITY * 8]
+    data = BitStream.from_bits(flat & 1).to_bytes()
+
+    (
+        magic,
+        version,
+        method_id,
+        type_id,
+        flags,
+        payload_length,
+        payload_crc,
+        params_length,
+    ) = _FIXED.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        return None
+
+    params_end = _FIXED.size + params_length
+    if params_end + _CRC_SIZE > HEADER_CAPACITY:
+        return None
+    crc = int.from_bytes(data[params_end : params_end + _CRC_SIZE], "big")
+    if zlib.crc32(data[:params_end]) != crc:
+        return None
+
+    methods = {value: key for key, value in METHOD_IDS.items()}
+    data_types = {value: key for key, value in DATA_TYPE_IDS.items()}
+    if method_id not in methods or type_id not in data_types:
+        return None
+
+    return {
+        "version": version,
+        "method": methods[method_id],
+        "data_type": data_types[type_id],
+        "flags": flags,
+        "params": json.loads(data[_FIXED.size : params_end]),
+        "payload_length": payload_length,
+        "payload_crc": payload_crc,
+        "codec": flags & CODEC_MASK,
+    }
+
+
+def build_descriptor(payload: bytes, flags: int = 0) -> BitStream:
+    """
+    Costruisce il descrittore da nascondere prima del payload (metodo DWT)
+
+    Args:
+        payload: Byte del payload (per lunghezza e CRC32), come per build_header
+        flags: Flag del payload (codec ed ECC)
+
+    Returns:
+        Stream di DESCRIPTOR_BITS bit
+    """
+    data = _DESCRIPTOR.pack(DESCRIPTOR_MAGIC, flags, len(payload), zlib.crc32(payload))
+    encoded = hamming_encode(data)
+    return BitStream.concat(*([encoded] * DESCRIPTOR_COPIES))
+
+
+def read_descriptor(bits: BitStream) -> dict | None:
+    """
+    Legge il descrittore dai primi DESCRIPTOR_BITS bit estratti
+
+    Ogni bit è votato a maggioranza tra le copie e poi corretto con l'ECC.
+
+    Args:
+        bits: Bit estratti dal dominio della trasformata
+
+    Returns:
+        Dizionario con flags, payload_length, payload_crc e codec (utilizzabile
+        al posto dell'header con embedded_bits e decode_payload), oppure None
+        se i bit non contengono un descrittore valido
+    """
+    if len(bits) < DESCRIPTOR_BITS:
+        return None
+    copies = bits.to_bits(0, DESCRIPTOR_BITS).reshape(DESCRIPTOR_COPIES, -1)
+    voted = BitStream.from_bits(copies.sum(axis=0) * 2 > DESCRIPTOR_COPIES)
+    data, _ = hamming_decode(voted, _DESCRIPTOR.size)
+
+    magic, flags, payload_length, payload_crc = _DESCRIPTOR.unpack(data)
+    if magic != DESCRIPTOR_MAGIC:
+        return None
+    return {
+        "flags": flags,
+        "payload_length": payload_length,
+        "payload_crc": payload_crc,
+        "codec": flags & CODEC_MASK,
+    }
+
+
+def check_header(header: dict, method: str, data_type: str) -> None:
+    """Verifica che l'header corrisponda al metodo e al tipo di dato richiesti"""
+    if header["method"] != method or header["data_type"] != data_type:
+        raise ValueError(
+            f"L'immagine contiene un payload '{header['data_type']}' nascosto con "
+            f"il metodo '{header['method']}', non '{data_type}' con '{method}'"
+        )
+
+
+def verify_payload(header: dict, payload: bytes, strict: bool = True) -> bool:
+    """
+    Verifica il CRC32 del payload estratto prima di scrivere l'output
+
+    Args:
+        header: Header letto da read_header
+        payload: Byte del payload estratto
+        strict: Se False un CRC errato produce solo un avviso (per i metodi
+            che tollerano qualche bit errato, come il QIM di DWT su immagini)
+
+    Returns:
+        True se il CRC corrisponde
+
+    Raises:
+        ValueError: Se il CRC non corrisponde e strict è True
+    """
+    if zlib.crc32(payload) == header["payload_crc"]:
+        return True
+    if strict:
+        raise ValueError(ErrorMessages.PAYLOAD_CORRUPTED)
+    print(f"ATTENZIONE: {ErrorMessages.PAYLOAD_CORRUPTED}")
+    return False
+
+
+def compress_payload(data: bytes) -> tuple[bytes, int]:
+    """
+    Comprime il payload con il codec più efficace
+
+    Prova zlib, lzma e bz2 e tiene il risultato più corto solo se è più corto
+    dei dati originali (i payload piccoli o già compressi restano invariati).
+
+    Args:
+        data: Byte del payload
+
+    Returns:
+        Tupla con (byte_da_nascondere, codec) da passare a build_header come flag
+    """
+    best, codec = data, CODEC_NONE
+    for codec_id, (_, compress, _) in _CODECS.items():
+        candidate = compress(data)
+        if len(candidate) < len(best):
+            best, codec = candidate, codec_id
+
+    if codec != CODEC_NONE:
+        print(
+            f"Payload compresso con {_CODECS[codec][0]}: {len(data)} -> {len(best)} byte"
+        )
+    return best, codec
+
+
+def decompress_payload(header: dict, payload: bytes) -> bytes:
+    """Decomprime il payload estratto con il codec indicato nell'header"""
+    codec = header["codec"]
+    if codec == CODEC_NONE:
+        return payload
+    if codec not in _CODECS:
+        raise ValueError(ErrorMessages.DECODE_FAILED)
+    try:
+        return _CODECS[codec][2](payload)
+    except (zlib.error, lzma.LZMAError, OSError, ValueError) as e:
+        raise ValueError(ErrorMessages.DECODE_FAILED) from e
+
+
+def encode_payload(data: bytes, ecc: bool = False) -> tuple[bytes, BitStream, int]:
+    """
+    Prepara un payload per l'embedding (compressione ed ECC opzionale)
+
+    Args:
+        data: Byte originali del payload
+        ecc: Se True protegge il payload con Hamming(7,4)
+
+    Returns:
+        Tupla con (byte_per_header, bit_da_nascondere, flag): i byte e i flag
+        vanno passati a build_header, i bit vanno nascosti nell'immagine
+    """
+    payload, flags = compress_payload(data)
+    if not ecc:
+        return payload, BitStream.from_bytes(payload), flags
+
+    bits = hamming_encode(payload)
+    print(f"ECC Hamming(7,4): {len(payload) * 8} -> {len(bits)} bit")
+    return payload, bits, flags | FLAG_ECC
+
+
+def embedded_bits(header: dict) -> int:
+    """Numero di bit da estrarre per il payload descritto dall'header"""
+    if header["flags"] & FLAG_ECC:
+        return encoded_bits(header["payload_length"])
+    return header["payload_length"] * 8
+
+
+def decode_payload(header: dict, bits: BitStream) -> bytes:
+    """
+    Ricostruisce il payload originale dai bit estratti
+
+    Corregge gli errori con l'ECC (se presente), verifica il CRC32 e
+    decomprime, prima che il chiamante scriva qualsiasi output.
+
+    Args:
+        header: Header letto da read_header
+        bits: Bit estratti dall'immagine (almeno embedded_bits(header))
+
+    Returns:
+        Byte originali del payload
+
+    Raises:
+        ValueError: Se il payload è corrotto o non decomprimibile
+    """
+    length = header["payload_length"]
+    if header["flags"] & FLAG_ECC:
+        payload, corrected = hamming_decode(bits, length)
+        if corrected:
+            print(f"ECC: corrette {corrected} parole di codice")
+    else:
+        payload = bits[: length * 8].to_bytes()
+
+    verify_payload(header, payload)
+    return decompress_payload(header, payload)
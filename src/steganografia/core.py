@@ -2,11 +2,22 @@
 API principale per le operazioni di steganografia
 """
 
+import os
+import tempfile
+from concurrent.futures import Future
+
 from PIL import Image
 
-from config.constants import CompressionMode, SteganographyMethod
+from config.constants import (
+    CompressionMode,
+    DataType,
+    MetricsLevel,
+    SteganographyMethod,
+)
 
-from .backup import backup_system
+from .backup import BackupFile, backup_system
+from .bit_operations import encode_text
+from .detection import detect_method
 
 # Import DWT
 from .dwt.binary_operations import BinarySteganography as DwtBinary
@@ -18,11 +29,13 @@ from .file_utils import _save_image
 from .lsb.binary_operations import BinarySteganography as LsbBinary
 from .lsb.image_operations import ImageSteganography as LsbImage
 from .lsb.message_operations import MessageSteganography as LsbMessage
+from .preview import HidePreview
 
 # Import PVD
 from .pvd.binary_operations import BinarySteganography as PvdBinary
 from .pvd.image_operations import ImageSteganography as PvdImage
 from .pvd.message_operations import MessageSteganography as PvdMessage
+from .tuning import ParameterTuner
 
 # Esporta le costanti per compatibilità
 NO_ZIP = CompressionMode.NO_ZIP
@@ -34,9 +47,14 @@ DIR = CompressionMode.DIR
 def hide_message(
     img: Image.Image,
     message: str,
-    backup_file: str | None = None,
+    backup_file: BackupFile | None = None,
     method: str = SteganographyMethod.LSB,
-) -> tuple[Image.Image, dict, float]:
+    ecc: bool = False,
+    matrix: bool = False,
+    metrics_level: str = MetricsLevel.SAMPLED,
+    async_metrics: bool = False,
+    change_maps: bool = False,
+) -> tuple[Image.Image, dict | Future, float]:
     """
     Nasconde una stringa in un'immagine. Restituisce (immagine, metriche, percentuale)
 
@@ -45,18 +63,49 @@ def hide_message(
         message: Messaggio da nascondere
         backup_file: File di backup opzionale
         method: Metodo di steganografia ('lsb', 'dwt', 'pvd')
+        ecc: Protegge il payload con un codice correttore d'errore (Hamming)
+        matrix: Usa il matrix embedding per modificare meno pixel (solo LSB)
+        metrics_level: Livello delle metriche di qualità ('psnr', 'sampled', 'full')
+        async_metrics: Restituisce subito l'immagine e, al posto delle metriche,
+            un Future che si risolve nel dizionario a calcolo concluso
+        change_maps: Aggiunge alle metriche le mappe delle modifiche (per la UI)
     """
     if method == SteganographyMethod.DWT:
-        return DwtMessage.hide_message(img, message, backup_file)
+        return DwtMessage.hide_message(
+            img,
+            message,
+            backup_file,
+            ecc,
+            metrics_level=metrics_level,
+            async_metrics=async_metrics,
+            change_maps=change_maps,
+        )
     elif method == SteganographyMethod.PVD:
-        return PvdMessage.hide_message(img, message, backup_file)
+        return PvdMessage.hide_message(
+            img,
+            message,
+            backup_file,
+            ecc,
+            metrics_level=metrics_level,
+            async_metrics=async_metrics,
+            change_maps=change_maps,
+        )
     else:  # Default: LSB
-        return LsbMessage.hide_message(img, message, backup_file)
+        return LsbMessage.hide_message(
+            img,
+            message,
+            backup_file,
+            ecc,
+            matrix,
+            metrics_level=metrics_level,
+            async_metrics=async_metrics,
+            change_maps=change_maps,
+        )
 
 
 def get_message(
     img: Image.Image,
-    backup_file: str | None = None,
+    backup_file: BackupFile | None = None,
     method: str = SteganographyMethod.LSB,
 ) -> str:
     """
@@ -65,8 +114,11 @@ def get_message(
     Args:
         img: Immagine contenente il messaggio
         backup_file: File di backup opzionale
-        method: Metodo di steganografia usato ('lsb', 'dwt', 'pvd')
+        method: Metodo di steganografia usato ('lsb', 'dwt', 'pvd', 'auto')
     """
+    if method == SteganographyMethod.AUTO:
+        method = detect_method(img, DataType.STRING)
+
     if method == SteganographyMethod.DWT:
         return DwtMessage.get_message(img, backup_file)
     elif method == SteganographyMethod.PVD:
@@ -82,9 +134,12 @@ def hide_image(
     lsb: int = 0,
     msb: int = 8,
     div: float = 0,
-    backup_file: str | None = None,
+    backup_file: BackupFile | None = None,
     method: str = SteganographyMethod.LSB,
-) -> tuple[Image.Image, int, int, float, int, int, dict, float]:
+    metrics_level: str = MetricsLevel.SAMPLED,
+    async_metrics: bool = False,
+    change_maps: bool = False,
+) -> tuple[Image.Image, int, int, float, int, int, dict | Future, float]:
     """
     Nasconde un'immagine in un'altra. Restituisce (immagine, lsb, msb, div, width, height, metriche, percentuale)
 
@@ -94,13 +149,41 @@ def hide_image(
         lsb, msb, div: Parametri per LSB (ignorati in DWT/PVD)
         backup_file: File di backup opzionale
         method: Metodo di steganografia ('lsb', 'dwt', 'pvd')
+        metrics_level: Livello delle metriche di qualità ('psnr', 'sampled', 'full')
+        async_metrics: Restituisce subito l'immagine e, al posto delle metriche,
+            un Future che si risolve nel dizionario a calcolo concluso
+        change_maps: Aggiunge alle metriche le mappe delle modifiche (per la UI)
     """
     if method == SteganographyMethod.DWT:
-        return DwtImage.hide_image(host_img, secret_img, backup_file)
+        return DwtImage.hide_image(
+            host_img,
+            secret_img,
+            backup_file,
+            metrics_level=metrics_level,
+            async_metrics=async_metrics,
+            change_maps=change_maps,
+        )
     elif method == SteganographyMethod.PVD:
-        return PvdImage.hide_image(host_img, secret_img, backup_file)
+        return PvdImage.hide_image(
+            host_img,
+            secret_img,
+            backup_file,
+            metrics_level=metrics_level,
+            async_metrics=async_metrics,
+            change_maps=change_maps,
+        )
     else:  # Default: LSB
-        return LsbImage.hide_image(host_img, secret_img, lsb, msb, div, backup_file)
+        return LsbImage.hide_image(
+            host_img,
+            secret_img,
+            lsb,
+            msb,
+            div,
+            backup_file,
+            metrics_level=metrics_level,
+            async_metrics=async_metrics,
+            change_maps=change_maps,
+        )
 
 
 def get_image(
@@ -111,7 +194,7 @@ def get_image(
     div: float | None = None,
     width: int | None = None,
     height: int | None = None,
-    backup_file: str | None = None,
+    backup_file: BackupFile | None = None,
     method: str = SteganographyMethod.LSB,
 ) -> Image.Image:
     """
@@ -122,8 +205,11 @@ def get_image(
         output_path: Percorso di output
         lsb, msb, div, width, height: Parametri di recupero
         backup_file: File di backup opzionale
-        method: Metodo di steganografia usato ('lsb', 'dwt', 'pvd')
+        method: Metodo di steganografia usato ('lsb', 'dwt', 'pvd', 'auto')
     """
+    if method == SteganographyMethod.AUTO:
+        method = detect_method(img, DataType.IMAGE)
+
     if method == SteganographyMethod.DWT:
         return DwtImage.get_image(
             img, output_path, width=width, height=height, backup_file=backup_file
@@ -145,9 +231,14 @@ def hide_bin_file(
     compression_mode: int = NO_ZIP,
     n: int = 0,
     div: float = 0,
-    backup_file: str | None = None,
+    backup_file: BackupFile | None = None,
     method: str = SteganographyMethod.LSB,
-) -> tuple[Image.Image, int, float, int, dict, float]:
+    ecc: bool = False,
+    matrix: bool = False,
+    metrics_level: str = MetricsLevel.SAMPLED,
+    async_metrics: bool = False,
+    change_maps: bool = False,
+) -> tuple[Image.Image, int, float, int, dict | Future, float]:
     """
     Nasconde un file binario in un'immagine. Restituisce (immagine, n, div, size, metriche, percentuale)
 
@@ -158,14 +249,46 @@ def hide_bin_file(
         n, div: Parametri per LSB (ignorati in DWT/PVD)
         backup_file: File di backup opzionale
         method: Metodo di steganografia ('lsb', 'dwt', 'pvd')
+        ecc: Protegge il payload con un codice correttore d'errore (Hamming)
+        matrix: Usa il matrix embedding per modificare meno pixel (solo LSB)
+        metrics_level: Livello delle metriche di qualità ('psnr', 'sampled', 'full')
+        async_metrics: Restituisce subito l'immagine e, al posto delle metriche,
+            un Future che si risolve nel dizionario a calcolo concluso
+        change_maps: Aggiunge alle metriche le mappe delle modifiche (per la UI)
     """
     if method == SteganographyMethod.DWT:
-        return DwtBinary.hide_binary_file(img, file_path, backup_file)
+        return DwtBinary.hide_binary_file(
+            img,
+            file_path,
+            backup_file,
+            ecc,
+            metrics_level=metrics_level,
+            async_metrics=async_metrics,
+            change_maps=change_maps,
+        )
     elif method == SteganographyMethod.PVD:
-        return PvdBinary.hide_binary_file(img, file_path, backup_file)
+        return PvdBinary.hide_binary_file(
+            img,
+            file_path,
+            backup_file,
+            ecc,
+            metrics_level=metrics_level,
+            async_metrics=async_metrics,
+            change_maps=change_maps,
+        )
     else:  # Default: LSB
         return LsbBinary.hide_binary_file(
-            img, file_path, compression_mode, n, div, backup_file
+            img,
+            file_path,
+            compression_mode,
+            n,
+            div,
+            backup_file,
+            matrix,
+            ecc,
+            metrics_level=metrics_level,
+            async_metrics=async_metrics,
+            change_maps=change_maps,
         )
 
 
@@ -176,12 +299,13 @@ def get_bin_file(
     n: int | None = None,
     div: float | None = None,
     size: int | None = None,
-    backup_file: str | None = None,
+    backup_file: BackupFile | None = None,
     method: str = SteganographyMethod.LSB,
     # Parametri manuali per DWT
     dwt_alpha: float | None = None,
     dwt_bands: list[str] | None = None,
     dwt_use_all_channels: bool | None = None,
+    dwt_levels: int | None = None,
     # Parametri manuali per PVD
     pvd_ranges_type: str | None = None,
     pvd_pair_step: int | None = None,
@@ -195,10 +319,13 @@ def get_bin_file(
         output_path: Percorso di output
         compression_mode, n, div, size: Parametri di recupero
         backup_file: File di backup opzionale
-        method: Metodo di steganografia usato ('lsb', 'dwt', 'pvd')
+        method: Metodo di steganografia usato ('lsb', 'dwt', 'pvd', 'auto')
         dwt_*: Parametri manuali per DWT
         pvd_*: Parametri manuali per PVD
     """
+    if method == SteganographyMethod.AUTO:
+        method = detect_method(img, DataType.BINARY)
+
     if method == SteganographyMethod.DWT:
         DwtBinary.get_binary_file(
             img,
@@ -207,6 +334,7 @@ def get_bin_file(
             alpha=dwt_alpha,
             bands=dwt_bands,
             use_all_channels=dwt_use_all_channels,
+            levels=dwt_levels,
         )
     elif method == SteganographyMethod.PVD:
         return PvdBinary.get_binary_file(
@@ -223,15 +351,218 @@ def get_bin_file(
         )
 
 
+# API per la capacità
+_ENGINES = {
+    SteganographyMethod.LSB: {
+        DataType.STRING: LsbMessage,
+        DataType.IMAGE: LsbImage,
+        DataType.BINARY: LsbBinary,
+    },
+    SteganographyMethod.DWT: {
+        DataType.STRING: DwtMessage,
+        DataType.IMAGE: DwtImage,
+        DataType.BINARY: DwtBinary,
+    },
+    SteganographyMethod.PVD: {
+        DataType.STRING: PvdMessage,
+        DataType.IMAGE: PvdImage,
+        DataType.BINARY: PvdBinary,
+    },
+}
+
+
+def capacity(
+    img: Image.Image, method: str, data_type: str, config: dict | None = None
+) -> int:
+    """
+    Byte di payload nascondibili nell'immagine, senza eseguire l'embedding
+
+    Le righe riservate all'header del contenitore sono già escluse. Gli
+    engine usano lo stesso calcolo per rifiutare un payload troppo grande
+    prima di toccare i pixel.
+
+    Args:
+        img: Immagine host
+        method: Metodo di steganografia ('lsb', 'dwt', 'pvd')
+        data_type: Tipo di dato da nascondere ('string', 'image', 'binary')
+        config: Parametri dell'occultamento che cambiano la capacità:
+            'ecc' (stringhe e file), 'n' e 'matrix'
+            (file LSB), 'lsb' e 'msb' (immagini LSB). DWT e PVD usano la
+            loro configurazione corrente e accettano 'estimate', il risultato
+            di capacity_map già calcolato, per non ripetere la stima
+
+    Returns:
+        Byte del payload (dopo l'eventuale compressione) per stringhe e file,
+        componenti RGB dell'immagine segreta (larghezza * altezza * 3) per
+        le immagini
+    """
+    if method not in _ENGINES or data_type not in _ENGINES[method]:
+        raise ValueError(f"Capacità non disponibile per {method} ({data_type})")
+    return _ENGINES[method][data_type].payload_capacity(img, **(config or {}))
+
+
+def capacity_map(img: Image.Image, method: str, data_type: str) -> dict:
+    """
+    Capacità esatta e mappa per blocchi del carrier (solo DWT e PVD)
+
+    Usa la configurazione corrente del metodo e non esegue alcun embedding.
+
+    Args:
+        img: Immagine host
+        method: Metodo di steganografia ('dwt', 'pvd')
+        data_type: Tipo di dato da nascondere ('string', 'image', 'binary')
+
+    Returns:
+        Dizionario con 'bits', 'map' (bit per blocco), 'heatmap' e 'block_size'
+    """
+    if method == SteganographyMethod.LSB or data_type not in _ENGINES.get(method, {}):
+        raise ValueError(
+            f"Mappa di capacità non disponibile per {method} ({data_type})"
+        )
+    return _ENGINES[method][data_type].capacity(img)
+
+
+def tune_parameters(
+    img: Image.Image,
+    method: str,
+    data_type: str,
+    payload_size: int,
+    min_psnr: float,
+    ecc: bool = False,
+) -> dict:
+    """
+    Sceglie i parametri che nascondono il payload rispettando un PSNR minimo
+
+    Le configurazioni vengono valutate con stime della distorsione, senza
+    embedding. Per DWT e PVD la configurazione scelta viene impostata
+    sull'engine (come le preconfigurazioni); per LSB i parametri scelti vanno
+    passati a hide_*.
+
+    Args:
+        img: Immagine host
+        method: Metodo di steganografia ('lsb', 'dwt', 'pvd')
+        data_type: Tipo di dato da nascondere ('string', 'image', 'binary')
+        payload_size: Dimensione del payload come in capacity (byte, o
+            componenti RGB dell'immagine segreta)
+        min_psnr: PSNR minimo in dB
+        ecc: Se True il payload è protetto da Hamming(7,4)
+
+    Returns:
+        Dizionario con 'params' (argomenti per hide_*), 'config' (attributi
+        impostati sull'engine), 'psnr' (stimato) e 'candidates'
+    """
+    if method not in _ENGINES or data_type not in _ENGINES[method]:
+        raise ValueError(f"Ricerca dei parametri non disponibile per {method}")
+    engine = _ENGINES[method][data_type]
+    result = ParameterTuner.tune(
+        engine, img, method, data_type, payload_size, min_psnr, ecc
+    )
+    for name, value in result["config"].items():
+        setattr(engine, name, value)
+    return result
+
+
+def preview_hide(
+    img: Image.Image,
+    payload: str | Image.Image | bytes,
+    method: str,
+    data_type: str,
+    max_pixels: int | None = None,
+    metrics_level: str = MetricsLevel.SAMPLED,
+    **options,
+) -> dict:
+    """
+    Anteprima dell'occultamento su una versione ridotta del carrier
+
+    Esegue l'engine scelto su un carrier di circa max_pixels pixel con il
+    payload scalato nella stessa proporzione, così metriche e risultato visivo
+    approssimano quelli a piena risoluzione in tempi interattivi. I parametri
+    recenti usati dal recupero automatico non vengono modificati.
+
+    Args:
+        img: Immagine host a piena risoluzione
+        payload: Messaggio (stringhe), immagine segreta (immagini) o contenuto
+            del file da nascondere (file binari)
+        method: Metodo di steganografia ('lsb', 'dwt', 'pvd')
+        data_type: Tipo di dato da nascondere ('string', 'image', 'binary')
+        max_pixels: Pixel massimi del carrier ridotto (default
+            HidePreview.MAX_PIXELS)
+        metrics_level: Livello delle metriche di qualità
+        **options: Parametri della funzione hide_* corrispondente (ecc,
+            matrix, lsb, msb, div, n, compression_mode)
+
+    Returns:
+        Dizionario con 'image' (carrier ridotto con il payload), 'metrics',
+        'percentage', 'scale' (rapporto fra le capacità) e 'payload_size'
+        (byte, o componenti RGB dell'immagine segreta, nascosti)
+    """
+    small, scale = HidePreview.scale_carrier(img, max_pixels)
+    print(f"Anteprima su {small.width}x{small.height} (scala payload {scale:.4f})")
+
+    with backup_system.keep_last_params():
+        if data_type == DataType.STRING:
+            message = HidePreview.scale_message(payload, scale)
+            payload_size = len(encode_text(message))
+            result = hide_message(
+                small,
+                message,
+                method=method,
+                metrics_level=metrics_level,
+                **options,
+            )
+        elif data_type == DataType.IMAGE:
+            secret = HidePreview.scale_secret(payload, scale)
+            payload_size = secret.width * secret.height * 3
+            result = hide_image(
+                small,
+                secret,
+                method=method,
+                metrics_level=metrics_level,
+                **options,
+            )
+        else:
+            # Il file viene compresso in memoria e l'anteprima ne nasconde un
+            # prefisso; su disco finisce solo il prefisso, rimosso subito dopo
+            compression_mode = options.pop("compression_mode", NO_ZIP)
+            data = HidePreview.scale_data(
+                HidePreview.compress_data(payload, compression_mode), scale
+            )
+            payload_size = len(data)
+            with tempfile.NamedTemporaryFile(suffix=".bin", delete=False) as f:
+                f.write(data)
+            try:
+                result = hide_bin_file(
+                    small,
+                    f.name,
+                    method=method,
+                    metrics_level=metrics_level,
+                    **options,
+                )
+            finally:
+                os.remove(f.name)
+
+    return {
+        "image": result[0],
+        "metrics": result[-2],
+        "percentage": result[-1],
+        "scale": scale,
+        "payload_size": payload_size,
+    }
+
+
 # API per il backup
-def load_backup_data(backup_file: str):
-    """Carica i parametri da un file di backup"""
-    return backup_system.load_backup_data(backup_file)
+def load_backup_data(
+    backup_file: BackupFile | bytes,
+    data_type: str | None = None,
+    image: Image.Image | None = None,
+):
+    """Carica i parametri da un file di backup (il record del tipo e dell'immagine)"""
+    return backup_system.load_backup_data(backup_file, data_type, image)
 
 
-def get_last_params(data_type: str):
-    """Ottiene gli ultimi parametri usati"""
-    return backup_system.get_last_params(data_type)
+def get_last_params(data_type: str, image: Image.Image | None = None):
+    """Ottiene gli ultimi parametri usati nella sessione (per l'immagine, se data)"""
+    return backup_system.get_last_params(data_type, image)
 
 
 def save_image(img: Image.Image, file_path: str) -> bool:
@@ -0,0 +1,93 @@
+"""
+Riconoscimento automatico del metodo usato per nascondere i dati
+
+Le immagini con il contenitore si riconoscono con una sola lettura
+dell'header. Per quelle senza header (formato precedente, o DWT dopo una
+ricompressione che ha cancellato l'header) i probe dei vari metodi leggono
+solo i pochi bit dell'header magico o del descrittore DWT e girano in
+parallelo; se più
+probe trovano un header vince il primo in ordine di priorità (LSB, PVD, DWT),
+così il risultato non dipende da quale thread termina prima.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from config.constants import DataType, ErrorMessages, SteganographyMethod
+
+from .container import read_header
+from .dwt.binary_operations import BinarySteganography as DwtBinary
+from .dwt.message_operations import MessageSteganography as DwtMessage
+from .lsb.message_operations import MessageSteganography as LsbMessage
+from .pvd.binary_operations import BinarySteganography as PvdBinary
+from .pvd.message_operations import MessageSteganography as PvdMessage
+
+# Probe delle immagini senza header per tipo di dato, in ordine di priorità
+# (le immagini e i file LSB del formato precedente non avevano header e non si
+# possono riconoscere; DWT prova prima il descrittore nei coefficienti)
+LEGACY_PROBES = {
+    DataType.STRING: {
+        SteganographyMethod.LSB: (LsbMessage.has_legacy_payload,),
+        SteganographyMethod.PVD: (PvdMessage.has_legacy_payload,),
+        SteganographyMethod.DWT: (
+            DwtMessage.has_descriptor,
+            DwtMessage.has_legacy_payload,
+        ),
+    },
+    DataType.IMAGE: {},
+    DataType.BINARY: {
+        SteganographyMethod.PVD: (PvdBinary.has_legacy_payload,),
+        SteganographyMethod.DWT: (
+            DwtBinary.has_descriptor,
+            DwtBinary.has_legacy_payload,
+        ),
+    },
+}
+
+
+def _run_probe(probes, img: Image.Image) -> bool:
+    """Esegue i probe di un metodo considerando un errore come header assente"""
+    for probe in probes:
+        try:
+            if probe(img):
+                return True
+        except Exception:
+            continue
+    return False
+
+
+def detect_method(img: Image.Image, data_type: str) -> str:
+    """
+    Riconosce il metodo con cui sono stati nascosti i dati
+
+    Args:
+        img: Immagine contenente i dati
+        data_type: Tipo di dato da recuperare (DataType)
+
+    Returns:
+        Metodo di steganografia ('lsb', 'dwt', 'pvd')
+
+    Raises:
+        ValueError: Se nessun metodo riconosce l'immagine
+    """
+    header = read_header(img)
+    if header is not None:
+        print(f"Metodo riconosciuto dall'header: {header['method']}")
+        return header["method"]
+
+    probes = LEGACY_PROBES.get(data_type, {})
+    if not probes:
+        raise ValueError(ErrorMessages.METHOD_NOT_DETECTED)
+
+    # Carica i pixel una volta sola prima di condividere l'immagine tra i thread
+    img.load()
+    with ThreadPoolExecutor(max_workers=len(probes)) as pool:
+        found = list(pool.map(lambda probe: _run_probe(probe, img), probes.values()))
+
+    for method, matched in zip(probes, found):
+        if matched:
+            print(f"Metodo riconosciuto (formato precedente): {method}")
+            return method
+
+    raise ValueError(ErrorMessages.METHOD_NOT_DETECTED)
@@ -3,5 +3,12 @@
 from .binary_operations import BinarySteganography
 from .image_operations import ImageSteganography
 from .message_operations import MessageSteganography
+from .transform import DecompositionCache, decomposition_cache
 
-__all__ = ["MessageSteganography", "ImageSteganography", "BinarySteganography"]
+__all__ = [
+    "MessageSteganography",
+    "ImageSteganography",
+    "BinarySteganography",
+    "DecompositionCache",
+    "decomposition_cache",
+]
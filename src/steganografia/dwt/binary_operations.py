@@ -3,13 +3,47 @@ Operazioni di steganografia per file binari usando DWT (Discrete Wavelet Transfo
 """
 
 import numpy as np
-import pywt
 from PIL import Image
 
-from config.constants import DataType, ErrorMessages
-
-from ..backup import backup_system
+from config.constants import (
+    DataType,
+    ErrorMessages,
+    MetricsLevel,
+    SteganographyMethod,
+)
+
+from ..backup import BackupFile, backup_system
+from ..bit_operations import BitStream
+from ..capacity import usable_bytes
+from ..container import (
+    DESCRIPTOR_BITS,
+    build_descriptor,
+    build_header,
+    carrier_region,
+    check_header,
+    decode_payload,
+    embedded_bits,
+    encode_payload,
+    read_descriptor,
+    read_header,
+    write_header,
+)
 from ..metrics import QualityMetrics
+from .transform import (
+    decompose,
+    decomposition_cache,
+    dwt_capacity,
+    get_band,
+    reconstruct,
+    required_levels,
+    resolve_precision,
+    track_peak_memory,
+    validate_levels,
+    writable_band,
+)
+
+# Header magico (64 bit) del formato precedente al contenitore
+MAGIC_HEADER = "1100100100001111010110010100110011010101010011110000101011001101"
 
 
 class BinarySteganography:
@@ -17,17 +51,65 @@ class BinarySteganography:
 
     WAVELET: str = "haar"  # Wavelet di Haar per semplicità
     CHANNEL: int = 0  # Canale principale (0=R, 1=G, 2=B)
-    BANDS: list[str] = ["cH"]  # Banda DWT da usare per binary
+    BANDS: list[str] = [
+        "cH"
+    ]  # Banda DWT da usare per binary (es. 'cH2' per il livello 2)
+    LEVELS: int = (
+        1  # Livelli di decomposizione (le bande senza suffisso usano l'ultimo)
+    )
     ALPHA: float = (
         0.1  # Fattore di embedding - PARAMETRO PRINCIPALE (controlla strength = 1.0 / ALPHA)
     )
     USE_ALL_CHANNELS: bool = False  # Se True usa tutti e 3 i canali RGB (3x capacità)
+    PRECISION: str = "float32"  # Precisione dei coefficienti: 'float32' | 'float64'
+
+    @staticmethod
+    def capacity(img: Image.Image) -> dict:
+        """
+        Capacità esatta con la configurazione corrente, senza trasformata
+
+        Returns:
+            Dizionario con 'bits' e la mappa per blocchi (vedi dwt_capacity)
+        """
+        return dwt_capacity(
+            img.height,
+            img.width,
+            BinarySteganography.WAVELET,
+            BinarySteganography.BANDS,
+            BinarySteganography.LEVELS,
+            3 if BinarySteganography.USE_ALL_CHANNELS else 1,
+        )
+
+    @staticmethod
+    def payload_capacity(
+        img: Image.Image, ecc: bool = False, estimate: dict | None = None
+    ) -> int:
+        """
+        Byte di payload nascondibili con la configurazione corrente
+
+        Args:
+            img: Immagine host
+            ecc: Se True il payload è protetto da Hamming(7,4)
+            estimate: Risultato di capacity() già calcolato (evita di
+                ripetere la stima)
+
+        Returns:
+            Numero massimo di byte del payload (dopo l'eventuale compressione)
+        """
+        estimate = estimate or BinarySteganography.capacity(img)
+        bits = estimate["bits"] - DESCRIPTOR_BITS
+        return usable_bytes(max(0, bits), ecc)
 
     @staticmethod
+    @track_peak_memory("DWT Hide Binary")
     def hide_binary_file(
         img: Image.Image,
         file_path: str,
-        backup_file: str | None = None,
+        backup_file: BackupFile | None = None,
+        ecc: bool = False,
+        metrics_level: str = MetricsLevel.SAMPLED,
+        async_metrics: bool = False,
+        change_maps: bool = False,
         **kwargs,  # Ignora compression_mode, n, div per compatibilità API
     ) -> tuple[Image.Image, int, float, int, dict, float]:
         """
@@ -37,6 +119,10 @@ class BinarySteganography:
             img: Immagine host
             file_path: Percorso del file da nascondere
             backup_file: File di backup opzionale
+            ecc: Se True protegge il payload con un codice correttore d'errore
+            metrics_level: Livello delle metriche di qualità ('psnr', 'sampled', 'full')
+            async_metrics: Calcola le metriche in background (restituisce un Future)
+            change_maps: Aggiunge alle metriche le mappe delle modifiche
         """
         # Legge il file
         with open(file_path, "rb") as f:
@@ -44,19 +130,15 @@ class BinarySteganography:
 
         file_size = len(file_data)
 
-        # Converte in binario
-        file_binary = "".join(format(byte, "08b") for byte in file_data)
-
-        # Prepara payload con header robusto a 64 bit (riduce falsi positivi)
-        magic_header = (
-            "1100100100001111010110010100110011010101010011110000101011001101"  # 64 bit
-        )
-        size_binary = format(file_size, "032b")  # 32 bit
-        terminator = "1111000011110000"  # 16 bit
-        full_payload = magic_header + size_binary + file_binary + terminator
+        # Payload: byte del file (compressi se conviene, con ECC opzionale),
+        # descritti dall'header del contenitore
+        payload_bytes, full_payload, flags = encode_payload(file_data, ecc)
+        # Il descrittore precede il payload: resta leggibile nei coefficienti
+        # anche se l'header nei pixel viene perso
+        full_payload = build_descriptor(payload_bytes, flags) + full_payload
 
-        # Verifica capacità (header 64 + size 32 + file + terminator 16)
-        max_capacity = img.width * img.height * 3 // 4
+        # Verifica capacità (esatta, prima di calcolare la trasformata)
+        max_capacity = BinarySteganography.capacity(img)["bits"]
         if len(full_payload) > max_capacity:
             raise ValueError(
                 ErrorMessages.IMAGE_TOO_SMALL_FILE.format(
@@ -69,10 +151,11 @@ class BinarySteganography:
 
         print(f"Nascondendo file binario ({file_size} bytes) con DWT...")
         print(
-            f"DWT Hide Binary - Parametri: WAVELET={BinarySteganography.WAVELET}, ALPHA={BinarySteganography.ALPHA}, BANDS={BinarySteganography.BANDS}, USE_ALL_CHANNELS={BinarySteganography.USE_ALL_CHANNELS}"
+            f"DWT Hide Binary - Parametri: WAVELET={BinarySteganography.WAVELET}, ALPHA={BinarySteganography.ALPHA}, BANDS={BinarySteganography.BANDS}, LEVELS={BinarySteganography.LEVELS}, USE_ALL_CHANNELS={BinarySteganography.USE_ALL_CHANNELS}"
         )
-        original_img = img.copy()
-        img_array = np.array(img, dtype=np.float32)
+        dtype = resolve_precision(BinarySteganography.PRECISION)
+        original = np.asarray(img)  # Pixel originali (hash e metriche)
+        img_array = original.astype(dtype)
 
         # Determina quali canali usare
         channels_to_use = (
@@ -81,63 +164,86 @@ class BinarySteganography:
             else [BinarySteganography.CHANNEL]
         )
         selected_bands = BinarySteganography.BANDS
+        levels = required_levels(selected_bands, BinarySteganography.LEVELS)
+        region = carrier_region(img_array)  # Righe dopo l'header
+        validate_levels(region.shape, BinarySteganography.WAVELET, levels)
+        image_hash = decomposition_cache.image_hash(carrier_region(original))
 
         bit_index = 0
         for channel_idx in channels_to_use:
             if bit_index >= len(full_payload):
                 break
 
-            channel_data = img_array[:, :, channel_idx]
-            coeffs = pywt.dwt2(channel_data, BinarySteganography.WAVELET)
-            cA, (cH, cV, cD) = coeffs
+            channel_data = region[:, :, channel_idx]
+            coeffs = decomposition_cache.decompose(
+                image_hash,
+                channel_idx,
+                channel_data,
+                BinarySteganography.WAVELET,
+                levels,
+                dtype,
+            )
 
             # Usa le bande configurate
-            band_map = {"cH": cH, "cV": cV, "cD": cD}
-
             for band_name in selected_bands:
-                if band_name not in band_map or bit_index >= len(full_payload):
+                if bit_index >= len(full_payload):
                     continue
 
-                coeff_flat = band_map[band_name].flatten()
-                for i in range(len(coeff_flat)):
-                    if bit_index >= len(full_payload):
-                        break
-                    bit = int(full_payload[bit_index])
-                    # EMBEDDING BASATO SU SEGNO CON ALTA ROBUSTEZZA:
-                    # Forza coefficienti a valori grandi e distinti per sopravvivere a clip/uint8
-                    # bit=1 → coefficiente GRANDE e POSITIVO
-                    # bit=0 → coefficiente GRANDE e NEGATIVO
-                    abs_val = abs(coeff_flat[i])
-                    if abs_val < 1.0:  # Coefficiente troppo piccolo
-                        abs_val = 2.0
-
-                    # Usa moltiplicatori fissi robusti basati su ALPHA
-                    strength = max(
-                        5.0, 1.0 / BinarySteganography.ALPHA
-                    )  # Min 5x per robustezza
-
-                    if bit == 1:
-                        # bit=1: grande valore POSITIVO
-                        coeff_flat[i] = abs_val * strength
-                    else:
-                        # bit=0: grande valore NEGATIVO
-                        coeff_flat[i] = -abs_val * strength
-                    bit_index += 1
-
-                # Aggiorna la banda modificata
-                band_map[band_name] = coeff_flat.reshape(band_map[band_name].shape)
+                # Vista piatta sulla banda: le modifiche vanno direttamente nei coefficienti
+                coeff_flat = writable_band(coeffs, band_name).reshape(-1)
+                n_bits = min(len(coeff_flat), len(full_payload) - bit_index)
+                bits = full_payload.to_bits(bit_index, bit_index + n_bits)
+
+                # EMBEDDING BASATO SU SEGNO CON ALTA ROBUSTEZZA:
+                # Forza coefficienti a valori grandi e distinti per sopravvivere a clip/uint8
+                # bit=1 → coefficiente GRANDE e POSITIVO
+                # bit=0 → coefficiente GRANDE e NEGATIVO
+                abs_val = np.abs(coeff_flat[:n_bits])
+                abs_val[abs_val < 1.0] = 2.0  # Coefficienti troppo piccoli
+
+                # Usa moltiplicatori fissi robusti basati su ALPHA
+                strength = max(
+                    5.0, 1.0 / BinarySteganography.ALPHA
+                )  # Min 5x per robustezza
+                magnitude = abs_val * strength
+                coeff_flat[:n_bits] = np.where(bits == 1, magnitude, -magnitude)
+                bit_index += n_bits
 
             # Ricostruisce con le bande modificate
-            cH = band_map["cH"]
-            cV = band_map["cV"]
-            cD = band_map["cD"]
-            reconstructed = pywt.idwt2((cA, (cH, cV, cD)), BinarySteganography.WAVELET)
-            reconstructed = reconstructed[
-                : channel_data.shape[0], : channel_data.shape[1]
-            ]
-            img_array[:, :, channel_idx] = reconstructed
-
-        img_array = np.clip(img_array, 0, 255).astype(np.uint8)
+            reconstructed = reconstruct(
+                coeffs, BinarySteganography.WAVELET, channel_data.shape
+            )
+            region[:, :, channel_idx] = reconstructed
+
+        if bit_index < len(full_payload):
+            raise ValueError(
+                ErrorMessages.IMAGE_TOO_SMALL_FILE.format(
+                    file_size=file_size, width=img.width, height=img.height
+                )
+            )
+
+        # Arrotonda: la ricostruzione in virgola mobile non restituisce interi esatti
+        img_array = np.clip(np.rint(img_array), 0, 255).astype(np.uint8)
+
+        # Header del contenitore con i parametri di recupero
+        header_params = {
+            "wavelet": BinarySteganography.WAVELET,
+            "alpha": BinarySteganography.ALPHA,
+            "bands": BinarySteganography.BANDS,
+            "levels": BinarySteganography.LEVELS,
+            "channels": channels_to_use,
+            "descriptor": True,
+        }
+        write_header(
+            img_array,
+            build_header(
+                SteganographyMethod.DWT,
+                DataType.BINARY,
+                header_params,
+                payload_bytes,
+                flags=flags,
+            ),
+        )
         result_img = Image.fromarray(img_array, mode="RGB")
 
         # Calcola percentuale di bit usati
@@ -154,25 +260,36 @@ class BinarySteganography:
             "wavelet": BinarySteganography.WAVELET,
             "channel": BinarySteganography.CHANNEL,
             "bands": BinarySteganography.BANDS,
+            "levels": BinarySteganography.LEVELS,
             "alpha": BinarySteganography.ALPHA,
             "use_all_channels": BinarySteganography.USE_ALL_CHANNELS,
         }
-        backup_system.save_backup_data(DataType.BINARY, params, backup_file)
+        backup_system.save_backup_data(
+            DataType.BINARY, params, backup_file, image=img_array
+        )
 
-        metrics = QualityMetrics.calculate_metrics(original_img, result_img)
+        metrics = QualityMetrics.calculate_metrics(
+            original,
+            img_array,
+            metrics_level,
+            background=async_metrics,
+            change_maps=change_maps,
+        )
         print("File nascosto con successo usando DWT")
 
         return result_img, 1, 0.0, file_size, metrics, float(percentage)
 
     @staticmethod
+    @track_peak_memory("DWT Get Binary")
     def get_binary_file(
         img: Image.Image,
         output_path: str,
-        backup_file: str | None = None,
+        backup_file: BackupFile | None = None,
         # Parametri manuali opzionali (usati se manual_params=True)
         alpha: float | None = None,
         bands: list[str] | None = None,
         use_all_channels: bool | None = None,
+        levels: int | None = None,
         **kwargs,  # Ignora n, div per compatibilità API
     ) -> None:
         """
@@ -185,70 +302,255 @@ class BinarySteganography:
             alpha: Fattore di embedding manuale (opzionale)
             bands: Bande DWT manuali (opzionale)
             use_all_channels: Usa tutti i canali RGB (opzionale)
+            levels: Livelli di decomposizione DWT manuali (opzionale)
+        """
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+
+        header = read_header(img)
+        if header is None:
+            # Header assente o danneggiato (es. ricompressione JPEG): parametri
+            # manuali, dal backup o configurati, poi il descrittore nei coefficienti
+            recovery = BinarySteganography._recovery_params(
+                img, backup_file, alpha, bands, use_all_channels, levels
+            )
+            file_data = BinarySteganography._get_described_data(img, recovery)
+            if file_data is None:
+                return BinarySteganography._get_legacy_binary_file(
+                    img, output_path, recovery
+                )
+            with open(output_path, "wb") as f:
+                f.write(file_data)
+            print(f"File recuperato e salvato in {output_path}")
+            return
+        check_header(header, SteganographyMethod.DWT, DataType.BINARY)
+
+        # I parametri scritti nell'header hanno la precedenza su quelli manuali
+        params = header["params"]
+        print(
+            f"DWT Get Binary - Parametri dall'header: WAVELET={params['wavelet']}, BANDS={params['bands']}, LEVELS={params['levels']}, CHANNELS={params['channels']}"
+        )
+
+        dtype = resolve_precision(BinarySteganography.PRECISION)
+        region = carrier_region(np.array(img, dtype=dtype))
+        decomposition_levels = required_levels(params["bands"], params["levels"])
+        validate_levels(region.shape, params["wavelet"], decomposition_levels)
+
+        # Le immagini con il descrittore lo hanno prima del payload
+        skip = DESCRIPTOR_BITS if params.get("descriptor") else 0
+        n_bits = skip + embedded_bits(header)
+        payload = BinarySteganography._extract_sign_bits(
+            region,
+            params["channels"],
+            params["wavelet"],
+            params["bands"],
+            decomposition_levels,
+            dtype,
+            n_bits,
+        )
+        if len(payload) < n_bits:
+            raise ValueError(ErrorMessages.DECODE_FAILED)
+        file_data = decode_payload(header, payload[skip:])
+
+        with open(output_path, "wb") as f:
+            f.write(file_data)
+
+        print(f"File recuperato e salvato in {output_path}")
+
+    @staticmethod
+    def has_legacy_payload(img: Image.Image) -> bool:
+        """
+        Verifica se l'immagine contiene un file nel formato precedente
+
+        Legge solo i segni dei primi coefficienti, dove il formato precedente
+        scriveva l'header magico a 64 bit.
+        """
+        dtype = resolve_precision(BinarySteganography.PRECISION)
+        img_array = np.array(img.convert("RGB"), dtype=dtype)
+        channels = (
+            [0, 1, 2]
+            if BinarySteganography.USE_ALL_CHANNELS
+            else [BinarySteganography.CHANNEL]
+        )
+        levels = required_levels(BinarySteganography.BANDS, BinarySteganography.LEVELS)
+        validate_levels(img_array.shape, BinarySteganography.WAVELET, levels)
+
+        magic = BitStream.from_str(MAGIC_HEADER)
+        bits = BinarySteganography._extract_sign_bits(
+            img_array,
+            channels,
+            BinarySteganography.WAVELET,
+            BinarySteganography.BANDS,
+            levels,
+            dtype,
+            len(magic),
+        )
+        return bits == magic
+
+    @staticmethod
+    def has_descriptor(img: Image.Image) -> bool:
+        """
+        Verifica se l'immagine contiene un descrittore DWT con la
+        configurazione corrente (payload il cui header è andato perso)
+        """
+        try:
+            bits = BinarySteganography._extract_region_bits(
+                img, BinarySteganography._config_params(), DESCRIPTOR_BITS
+            )
+        except ValueError:
+            return False
+        return read_descriptor(bits) is not None
+
+    @staticmethod
+    def _get_described_data(img: Image.Image, params: dict) -> bytes | None:
+        """
+        Recupera i byte del file dal descrittore nei coefficienti
+
+        Returns:
+            Byte del file, oppure None se con questi parametri non c'è un
+            descrittore (immagine nel formato precedente)
         """
-        # PRIORITÀ: parametri manuali > backup file > cache recente > default
+        try:
+            descriptor = read_descriptor(
+                BinarySteganography._extract_region_bits(img, params, DESCRIPTOR_BITS)
+            )
+        except ValueError:
+            return None
+        if descriptor is None:
+            return None
+
+        print("Header del contenitore non leggibile: uso il descrittore DWT")
+        n_bits = DESCRIPTOR_BITS + embedded_bits(descriptor)
+        payload = BinarySteganography._extract_region_bits(img, params, n_bits)
+        if len(payload) < n_bits:
+            raise ValueError(ErrorMessages.DECODE_FAILED)
+        return decode_payload(descriptor, payload[DESCRIPTOR_BITS:])
+
+    @staticmethod
+    def _extract_region_bits(img: Image.Image, params: dict, n_bits: int) -> BitStream:
+        """
+        Legge i primi n_bits bit dalla regione del carrier con i parametri dati
+        (wavelet, bands, levels, channel, use_all_channels)
+        """
+        dtype = resolve_precision(BinarySteganography.PRECISION)
+        region = carrier_region(np.array(img.convert("RGB"), dtype=dtype))
+        levels = required_levels(params["bands"], params["levels"])
+        validate_levels(region.shape, params["wavelet"], levels)
+        channels = [0, 1, 2] if params["use_all_channels"] else [params["channel"]]
+        return BinarySteganography._extract_sign_bits(
+            region, channels, params["wavelet"], params["bands"], levels, dtype, n_bits
+        )
+
+    @staticmethod
+    def _config_params() -> dict:
+        """Parametri di recupero della configurazione corrente"""
+        return {
+            "wavelet": BinarySteganography.WAVELET,
+            "alpha": BinarySteganography.ALPHA,
+            "bands": BinarySteganography.BANDS,
+            "levels": BinarySteganography.LEVELS,
+            "channel": BinarySteganography.CHANNEL,
+            "use_all_channels": BinarySteganography.USE_ALL_CHANNELS,
+        }
+
+    @staticmethod
+    def _recovery_params(
+        img: Image.Image,
+        backup_file: BackupFile | None = None,
+        alpha: float | None = None,
+        bands: list[str] | None = None,
+        use_all_channels: bool | None = None,
+        levels: int | None = None,
+    ) -> dict:
+        """
+        Parametri di recupero senza header
+
+        PRIORITÀ: parametri manuali > backup file > cache recente > default.
+        Restano locali: la configurazione della classe non va modificata.
+        """
+        params = BinarySteganography._config_params()
         # Se sono forniti parametri manuali, usali
-        if alpha is not None or bands is not None or use_all_channels is not None:
+        if (
+            alpha is not None
+            or bands is not None
+            or use_all_channels is not None
+            or levels is not None
+        ):
             print("Usando parametri MANUALI forniti dall'interfaccia")
-            # Usa parametri manuali se forniti, altrimenti default
-            alpha = alpha if alpha is not None else BinarySteganography.ALPHA
-            bands = bands if bands is not None else BinarySteganography.BANDS
-            use_all_channels = (
-                use_all_channels
-                if use_all_channels is not None
-                else BinarySteganography.USE_ALL_CHANNELS
-            )
-            # Altri parametri sempre da default
-            wavelet = BinarySteganography.WAVELET
-            channel_idx = BinarySteganography.CHANNEL
+            # Usa parametri manuali se forniti, altrimenti default; gli altri
+            # parametri sempre da default
+            manual = {
+                "alpha": alpha,
+                "bands": bands,
+                "use_all_channels": use_all_channels,
+                "levels": levels,
+            }
+            params.update({k: v for k, v in manual.items() if v is not None})
         else:
             # Carica parametri da backup o cache
             backup_data = None
             if backup_file:
-                backup_data = backup_system.load_backup_data(backup_file)
+                backup_data = backup_system.load_backup_data(
+                    backup_file, DataType.BINARY, image=img
+                )
 
             # Se non c'è backup file, usa cache dell'ultima operazione
             if not backup_data:
-                recent_params = backup_system.get_last_params(DataType.BINARY)
+                recent_params = backup_system.get_last_params(
+                    DataType.BINARY, image=img
+                )
                 if recent_params:
                     print("Usando parametri dall'ultima operazione di nascondimento")
                     backup_data = {"params": recent_params}
 
             if backup_data and "params" in backup_data:
-                params = backup_data["params"]
                 # Carica TUTTI i parametri DWT
-                wavelet = params.get("wavelet", BinarySteganography.WAVELET)
-                channel_idx = params.get("channel", BinarySteganography.CHANNEL)
-                bands = params.get("bands", BinarySteganography.BANDS)
-                alpha = params.get("alpha", BinarySteganography.ALPHA)
-                use_all_channels = params.get(
-                    "use_all_channels", BinarySteganography.USE_ALL_CHANNELS
-                )
-            else:
-                # Usa valori di default se non c'è backup
-                wavelet = BinarySteganography.WAVELET
-                channel_idx = BinarySteganography.CHANNEL
-                bands = BinarySteganography.BANDS
-                alpha = BinarySteganography.ALPHA
-                use_all_channels = BinarySteganography.USE_ALL_CHANNELS
+                saved = backup_data["params"]
+                for key in params:
+                    params[key] = saved.get(key, params[key])
+                params["levels"] = saved.get("levels", 1)
 
         print(
-            f"DWT Get Binary - Parametri: WAVELET={wavelet}, ALPHA={alpha}, BANDS={bands}, USE_ALL_CHANNELS={use_all_channels}"
+            f"DWT Get Binary - Parametri: WAVELET={params['wavelet']}, ALPHA={params['alpha']}, BANDS={params['bands']}, LEVELS={params['levels']}, USE_ALL_CHANNELS={params['use_all_channels']}"
         )
+        return params
+
+    @staticmethod
+    def _get_legacy_binary_file(
+        img: Image.Image, output_path: str, params: dict
+    ) -> None:
+        """
+        Recupera un file nascosto prima dell'introduzione del contenitore
+
+        Il formato precedente apre il payload con un header magico a 64 bit e
+        la dimensione del file.
+
+        Args:
+            img: Immagine contenente il file
+            output_path: Percorso di output
+            params: Parametri di recupero (vedi _recovery_params)
+        """
+        wavelet = params["wavelet"]
+        channel_idx = params["channel"]
+        bands = params["bands"]
+        use_all_channels = params["use_all_channels"]
+        levels = params["levels"]
 
         if img.mode != "RGB":
             img = img.convert("RGB")
 
         print("Recuperando file binario con DWT (dimensione dall'header)...")
-        img_array = np.array(img, dtype=np.float32)
+        dtype = resolve_precision(BinarySteganography.PRECISION)
+        img_array = np.array(img, dtype=dtype)
 
         # Determina quali canali usare (deve corrispondere a hide)
         channels_to_use = [0, 1, 2] if use_all_channels else [channel_idx]
-        extracted_bits = []
 
         # Assicura che bands non sia None
         if bands is None:
             bands = ["cH"]
+        decomposition_levels = required_levels(bands, levels)
+        validate_levels(img_array.shape, wavelet, decomposition_levels)
 
         # === ESTRAZIONE SINCRONIZZATA IN DUE FASI ===
         # FASE 1: Estrai solo header (64 bit) + size (32 bit) = 96 bit
@@ -257,44 +559,26 @@ class BinarySteganography:
         HEADER_BITS = 64
         SIZE_BITS = 32
         TERMINATOR_BITS = 16
-        magic_header = (
-            "1100100100001111010110010100110011010101010011110000101011001101"
-        )
 
         # FASE 1: Estrai primi 96 bit (header + size)
         bits_needed = HEADER_BITS + SIZE_BITS
-        extracted_bits = []
-
-        for ch_idx in channels_to_use:
-            if len(extracted_bits) >= bits_needed:
-                break
-
-            channel_data = img_array[:, :, ch_idx]
-            coeffs = pywt.dwt2(channel_data, wavelet)
-            cA, (cH, cV, cD) = coeffs
-            band_map = {"cH": cH, "cV": cV, "cD": cD}
-
-            for band_name in bands:
-                if band_name not in band_map:
-                    continue
-                if len(extracted_bits) >= bits_needed:
-                    break
-
-                coeff_flat = band_map[band_name].flatten()
-                for coeff in coeff_flat:
-                    if len(extracted_bits) >= bits_needed:
-                        break
-                    extracted_bits.append("1" if coeff > 0 else "0")
-
-        bitstream = "".join(extracted_bits)
+        bitstream = BinarySteganography._extract_sign_bits(
+            img_array,
+            channels_to_use,
+            wavelet,
+            bands,
+            decomposition_levels,
+            dtype,
+            bits_needed,
+        )
 
         # Verifica header DEVE essere all'inizio (no find!)
-        if len(bitstream) < HEADER_BITS + SIZE_BITS:
+        if len(bitstream) < bits_needed:
             raise ValueError(
                 "Immagine troppo piccola o corrotta: impossibile leggere header"
             )
 
-        if bitstream[:HEADER_BITS] != magic_header:
+        if bitstream[:HEADER_BITS] != BitStream.from_str(MAGIC_HEADER):
             raise ValueError(
                 "Header non valido: nessun file DWT nascosto trovato. "
                 "Possibili cause: (1) Metodo sbagliato (usa LSB/PVD invece di DWT), "
@@ -302,60 +586,72 @@ class BinarySteganography:
             )
 
         # Decodifica file_size dai bit 64-96
-        file_size_binary = bitstream[HEADER_BITS : HEADER_BITS + SIZE_BITS]
-        file_size = int(file_size_binary, 2)
+        file_size = bitstream.read_uint(HEADER_BITS, SIZE_BITS)
 
         # FASE 2: Calcola bit totali necessari e continua estrazione
         total_bits_needed = HEADER_BITS + SIZE_BITS + (file_size * 8) + TERMINATOR_BITS
+        if len(bitstream) < total_bits_needed:
+            bitstream = BinarySteganography._extract_sign_bits(
+                img_array,
+                channels_to_use,
+                wavelet,
+                bands,
+                decomposition_levels,
+                dtype,
+                total_bits_needed,
+            )
 
-        # Continua estrazione per il payload rimanente (solo se servono più bit)
-        if len(extracted_bits) < total_bits_needed:
-            # Traccia posizione: quale canale, banda e coefficiente abbiamo letto finora
-            bits_read = len(extracted_bits)
-            current_bit_index = 0
-
-            for ch_idx in channels_to_use:
-                if len(extracted_bits) >= total_bits_needed:
-                    break
-
-                channel_data = img_array[:, :, ch_idx]
-                coeffs = pywt.dwt2(channel_data, wavelet)
-                cA, (cH, cV, cD) = coeffs
-                band_map = {"cH": cH, "cV": cV, "cD": cD}
-
-                for band_name in bands:
-                    if band_name not in band_map:
-                        continue
-                    if len(extracted_bits) >= total_bits_needed:
-                        break
+        # Estrai payload file (dopo header + size), solo byte completi
+        file_start = HEADER_BITS + SIZE_BITS
+        file_end = min(file_start + (file_size * 8), len(bitstream))
+        file_end -= (file_end - file_start) % 8
+        file_bytes = bitstream[file_start:file_end].to_bytes()
 
-                    coeff_flat = band_map[band_name].flatten()
-                    for coeff in coeff_flat:
-                        # Salta i bit già estratti nella FASE 1
-                        if current_bit_index < bits_read:
-                            current_bit_index += 1
-                            continue
+        with open(output_path, "wb") as f:
+            f.write(file_bytes)
 
-                        if len(extracted_bits) >= total_bits_needed:
-                            break
-                        extracted_bits.append("1" if coeff > 0 else "0")
-                        current_bit_index += 1
+        print(f"File recuperato e salvato in {output_path}")
 
-        bitstream = "".join(extracted_bits)
+    @staticmethod
+    def _extract_sign_bits(
+        img_array: np.ndarray,
+        channels: list[int],
+        wavelet: str,
+        bands: list[str],
+        levels: int,
+        dtype: np.dtype,
+        bits_needed: int,
+    ) -> BitStream:
+        """
+        Legge i segni dei coefficienti nello stesso ordine dell'hide
 
-        # Estrai payload file (dopo header + size)
-        file_start = HEADER_BITS + SIZE_BITS
-        file_end = file_start + (file_size * 8)
-        file_binary = bitstream[file_start:file_end]
+        Args:
+            img_array: Immagine come array (float)
+            channels: Canali da scorrere
+            wavelet: Wavelet usata nell'hide
+            bands: Bande da scorrere
+            levels: Livelli di decomposizione
+            dtype: Precisione dei coefficienti
+            bits_needed: Numero di bit da leggere (si ferma appena raggiunto)
+
+        Returns:
+            Stream con i bit letti (eventualmente più corto di bits_needed)
+        """
+        chunks = []
+        bits_read = 0
+        for channel in channels:
+            if bits_read >= bits_needed:
+                break
 
-        # Ricostruisce il file
-        file_bytes = bytearray()
-        for i in range(0, len(file_binary), 8):
-            byte = file_binary[i : i + 8]
-            if len(byte) == 8:
-                file_bytes.append(int(byte, 2))
+            coeffs = decompose(img_array[:, :, channel], wavelet, levels, dtype)
+            for band_name in bands:
+                if bits_read >= bits_needed:
+                    break
 
-        with open(output_path, "wb") as f:
-            f.write(file_bytes)
+                coeff_flat = get_band(coeffs, band_name).ravel()
+                chunks.append(coeff_flat[: bits_needed - bits_read] > 0)
+                bits_read += len(chunks[-1])
 
-        print(f"File recuperato e salvato in {output_path}")
+        return BitStream.from_bits(
+            np.concatenate(chunks) if chunks else np.zeros(0, dtype=bool)
+        )
@@ -3,13 +3,37 @@ Operazioni di steganografia per immagini usando DWT (Discrete Wavelet Transform)
 """
 
 import numpy as np
-import pywt
 from PIL import Image
 
-from config.constants import DataType, ErrorMessages
-
-from ..backup import backup_system
+from config.constants import (
+    DataType,
+    ErrorMessages,
+    MetricsLevel,
+    SteganographyMethod,
+)
+
+from ..backup import BackupFile, backup_system
+from ..container import (
+    build_header,
+    carrier_region,
+    check_header,
+    read_header,
+    verify_payload,
+    write_header,
+)
 from ..metrics import QualityMetrics
+from .transform import (
+    decompose,
+    decomposition_cache,
+    dwt_capacity,
+    get_band,
+    reconstruct,
+    required_levels,
+    resolve_precision,
+    track_peak_memory,
+    validate_levels,
+    writable_band,
+)
 
 
 class ImageSteganography:
@@ -25,13 +49,55 @@ class ImageSteganography:
     BANDS: list[str] = [
         "cH",
         "cV",
-    ]  # Bande DWT da usare: ['cH'] | ['cH','cV'] | ['cH','cV','cD']
+    ]  # Bande DWT da usare: ['cH'] | ['cH','cV'] | ['cH','cV','cD'] (o 'cH2' per il livello 2)
+    LEVELS: int = (
+        1  # Livelli di decomposizione (le bande senza suffisso usano l'ultimo)
+    )
+    PRECISION: str = "float32"  # Precisione dei coefficienti: 'float32' | 'float64'
 
     @staticmethod
+    def capacity(img: Image.Image) -> dict:
+        """
+        Capacità esatta con la configurazione corrente, senza trasformata
+
+        Returns:
+            Dizionario con 'bits' e la mappa per blocchi (vedi dwt_capacity)
+        """
+        return dwt_capacity(
+            img.height,
+            img.width,
+            ImageSteganography.WAVELET,
+            ImageSteganography.BANDS,
+            ImageSteganography.LEVELS,
+            1,  # Solo il canale CHANNEL,
+        )
+
+    @staticmethod
+    def payload_capacity(host_img: Image.Image, estimate: dict | None = None) -> int:
+        """
+        Byte (componenti RGB) dell'immagine segreta nascondibili
+
+        Args:
+            host_img: Immagine host
+            estimate: Risultato di capacity() già calcolato (evita di
+                ripetere la stima)
+
+        Returns:
+            Numero massimo di componenti segrete (larghezza * altezza * 3)
+        """
+        estimate = estimate or ImageSteganography.capacity(host_img)
+        bits = estimate["bits"]
+        return bits // ImageSteganography.BITS_SECRET
+
+    @staticmethod
+    @track_peak_memory("DWT Hide")
     def hide_image(
         host_img: Image.Image,
         secret_img: Image.Image,
-        backup_file: str | None = None,
+        backup_file: BackupFile | None = None,
+        metrics_level: str = MetricsLevel.SAMPLED,
+        async_metrics: bool = False,
+        change_maps: bool = False,
         **kwargs,  # Ignora lsb, msb, div per compatibilità API
     ) -> tuple[Image.Image, int, int, float, int, int, dict, float]:
         """
@@ -41,9 +107,22 @@ class ImageSteganography:
             host_img: Immagine host
             secret_img: Immagine da nascondere
             backup_file: File di backup opzionale
+            metrics_level: Livello delle metriche di qualità ('psnr', 'sampled', 'full')
+            async_metrics: Calcola le metriche in background (restituisce un Future)
+            change_maps: Aggiunge alle metriche le mappe delle modifiche
         """
-        # Validazione dimensioni DWT (usa calcolo personalizzato)
-        # Non usa validate_image_size_for_image perché DWT ha capacità diversa da LSB
+        # Validazione dimensioni DWT: la capacità esatta si ricava dalle bande
+        # senza calcolare la trasformata
+        required = (
+            secret_img.width * secret_img.height * 3 * ImageSteganography.BITS_SECRET
+        )
+        available = ImageSteganography.capacity(host_img)["bits"]
+        if required > available:
+            raise ValueError(
+                f"Immagine host troppo piccola per DWT. "
+                f"Richiesti: {required} bit, Disponibili: {available} bit. "
+                f"Host: {host_img.width}x{host_img.height}, Secret: {secret_img.width}x{secret_img.height}"
+            )
 
         # Converte in RGB
         if host_img.mode != "RGB":
@@ -52,103 +131,120 @@ class ImageSteganography:
             secret_img = secret_img.convert("RGB")
 
         print("Nascondendo immagine con DWT...")
-        original_host = host_img.copy()
-        host_array = np.array(host_img, dtype=np.float32)
-        secret_array = np.array(secret_img, dtype=np.float32).flatten()
+        dtype = resolve_precision(ImageSteganography.PRECISION)
+        original = np.asarray(host_img)  # Pixel originali (hash e metriche)
+        host_array = original.astype(dtype)
+        secret_array = np.asarray(secret_img, dtype=np.uint8).reshape(-1)
 
         secret_width, secret_height = secret_img.size
 
         # Riduce profondità bit per robustezza: parametrizzabile
+        # (prende solo i bit più significativi di ogni componente, MSB first)
         bits_secret = ImageSteganography.BITS_SECRET
-        secret_bits = []
-        for pixel_value in secret_array:
-            # Prende solo i bit più significativi (riduzione parametrica)
-            shift = 8 - bits_secret
-            msb_value = int(pixel_value) >> shift
-            secret_bits.append(format(msb_value, f"0{bits_secret}b"))
-        secret_binary = "".join(secret_bits)
+        shift = 8 - bits_secret
+        bit_shifts = np.arange(bits_secret - 1, -1, -1, dtype=np.uint8)
+        secret_bits = (((secret_array[:, None] >> shift) >> bit_shifts) & 1).reshape(-1)
 
         # Calcola capacità totale disponibile (selezione deterministica fissa)
         step = ImageSteganography.STEP
         channel_idx = ImageSteganography.CHANNEL
         rng = np.random.default_rng(ImageSteganography.SEED)
 
-        # DWT sul canale selezionato
-        channel_data = host_array[:, :, channel_idx]
-        coeffs = pywt.dwt2(channel_data, ImageSteganography.WAVELET)
-        cA, (cH, cV, cD) = coeffs
-
-        # Raccoglie coefficienti da tutte le bande configurate
-        band_map = {"cH": cH, "cV": cV, "cD": cD}
+        # DWT multi-livello sul canale selezionato (solo i livelli necessari)
         selected_bands = ImageSteganography.BANDS
+        levels = required_levels(selected_bands, ImageSteganography.LEVELS)
+        region = carrier_region(host_array)  # Righe dopo l'header
+        validate_levels(region.shape, ImageSteganography.WAVELET, levels)
+        image_hash = decomposition_cache.image_hash(carrier_region(original))
+        channel_data = region[:, :, channel_idx]
+        coeffs = decomposition_cache.decompose(
+            image_hash,
+            channel_idx,
+            channel_data,
+            ImageSteganography.WAVELET,
+            levels,
+            dtype,
+        )
 
         print(
-            f"DWT Hide - Parametri: STEP={step}, BITS={bits_secret}, BANDS={selected_bands}"
+            f"DWT Hide - Parametri: STEP={step}, BITS={bits_secret}, BANDS={selected_bands}, LEVELS={levels}"
         )
 
-        all_coeffs = []
-        for band_name in selected_bands:
-            if band_name in band_map:
-                coeff_flat = band_map[band_name].flatten()
-                # USA TUTTI i coefficienti (nessun filtro, come quando funzionava)
-                # Questo garantisce determinismo perfetto tra hide e get
-                for idx in range(len(coeff_flat)):
-                    all_coeffs.append((band_name, idx, coeff_flat[idx]))
-
-        total_usable = len(all_coeffs)
-        if len(secret_binary) > total_usable:
+        # Viste piatte sulle bande configurate: indice globale = offset banda + indice
+        band_views = [
+            writable_band(coeffs, band_name).reshape(-1) for band_name in selected_bands
+        ]
+        band_offsets = np.cumsum([0] + [view.size for view in band_views])
+
+        total_usable = int(band_offsets[-1])
+        if len(secret_bits) > total_usable:
             raise ValueError(
                 f"Immagine host troppo piccola per DWT. "
-                f"Richiesti: {len(secret_binary)} bit, Disponibili: {total_usable} bit. "
+                f"Richiesti: {len(secret_bits)} bit, Disponibili: {total_usable} bit. "
                 f"Host: {host_img.width}x{host_img.height}, Secret: {secret_img.width}x{secret_img.height}"
             )
 
-        # Shuffle deterministico della lista completa
-        rng.shuffle(all_coeffs)
-        selected_coeffs = all_coeffs[: len(secret_binary)]
+        # Permutazione deterministica degli indici (stesso ordine dello shuffle
+        # della lista completa di coefficienti usato nelle versioni precedenti)
+        selected_indices = rng.permutation(total_usable)[: len(secret_bits)]
 
         # Embedding dei bit con QIM bin-centered su tutte le bande
-        band_arrays = {name: band_map[name].flatten().copy() for name in selected_bands}
-
-        for bit_idx, (band_name, flat_idx, original_val) in enumerate(selected_coeffs):
-            bit_value = int(secret_binary[bit_idx])
-            coeff_value = band_arrays[band_name][flat_idx]
-            sign = np.sign(coeff_value)
-            if sign == 0:
-                sign = 1  # Default per coefficienti nulli
-            abs_val = abs(coeff_value)
-
-            # QIM: determina parità target (0=pari, 1=dispari)
-            quantized_index = int(abs_val // step)
-            if quantized_index % 2 != bit_value:
-                quantized_index += 1 if bit_value == 1 else -1
-            if quantized_index < 0:
-                quantized_index = 0
+        for view, band_start, band_end in zip(
+            band_views, band_offsets[:-1], band_offsets[1:]
+        ):
+            in_band = (selected_indices >= band_start) & (selected_indices < band_end)
+            flat_idx = selected_indices[in_band] - band_start
+            bit_values = secret_bits[in_band]
+
+            coeff_values = view[flat_idx]
+            sign = np.where(coeff_values < 0, -1, 1)  # Default +1 per i nulli
+            abs_val = np.abs(coeff_values)
+
+            # QIM: porta la parità dell'indice al valore del bit (0=pari, 1=dispari)
+            quantized_index = (abs_val // step).astype(np.int64)
+            mismatch = quantized_index % 2 != bit_values
+            quantized_index += np.where(mismatch, np.where(bit_values == 1, 1, -1), 0)
+            np.maximum(quantized_index, 0, out=quantized_index)
 
             # Scrive al CENTRO del bin per robustezza numerica
-            new_abs_val = (quantized_index + 0.5) * step
-            band_arrays[band_name][flat_idx] = sign * new_abs_val
-
-        # Ricostruisce tutte le bande modificate
-        for band_name in selected_bands:
-            if band_name == "cH":
-                cH = band_arrays[band_name].reshape(cH.shape)
-            elif band_name == "cV":
-                cV = band_arrays[band_name].reshape(cV.shape)
-            elif band_name == "cD":
-                cD = band_arrays[band_name].reshape(cD.shape)
-        reconstructed = pywt.idwt2((cA, (cH, cV, cD)), ImageSteganography.WAVELET)
-        reconstructed = reconstructed[: channel_data.shape[0], : channel_data.shape[1]]
-        host_array[:, :, channel_idx] = reconstructed
-
-        host_array = np.clip(host_array, 0, 255).astype(np.uint8)
+            view[flat_idx] = sign * (quantized_index + 0.5) * step
+
+        reconstructed = reconstruct(
+            coeffs, ImageSteganography.WAVELET, channel_data.shape
+        )
+        region[:, :, channel_idx] = reconstructed
+
+        # Arrotonda i pixel ricostruiti invece di troncarli
+        host_array = np.clip(np.rint(host_array), 0, 255).astype(np.uint8)
+
+        # Header del contenitore con i parametri di recupero
+        header_params = {
+            "width": secret_width,
+            "height": secret_height,
+            "wavelet": ImageSteganography.WAVELET,
+            "seed": ImageSteganography.SEED,
+            "step": ImageSteganography.STEP,
+            "channel": ImageSteganography.CHANNEL,
+            "bits_per_pixel": ImageSteganography.BITS_SECRET,
+            "bands": ImageSteganography.BANDS,
+            "levels": ImageSteganography.LEVELS,
+        }
+        write_header(
+            host_array,
+            build_header(
+                SteganographyMethod.DWT,
+                DataType.IMAGE,
+                header_params,
+                np.packbits(secret_bits).tobytes(),
+            ),
+        )
         result_img = Image.fromarray(host_array, mode="RGB")
 
         # Calcola percentuale di bit usati
         total_bits_host = host_img.width * host_img.height * 3
-        percentage = format((len(secret_binary) / total_bits_host) * 100, ".2f")
+        percentage = format((len(secret_bits) / total_bits_host) * 100, ".2f")
         print(
-            f"TERMINATO - Percentuale di pixel usati con DWT: {percentage}% ({len(secret_binary)}/{total_bits_host} bit)"
+            f"TERMINATO - Percentuale di pixel usati con DWT: {percentage}% ({len(secret_bits)}/{total_bits_host} bit)"
         )
 
         # Salva parametri (sempre nella cache, opzionalmente su file)
@@ -162,10 +258,20 @@ class ImageSteganography:
             "channel": ImageSteganography.CHANNEL,
             "bits_per_pixel": ImageSteganography.BITS_SECRET,
             "bands": ImageSteganography.BANDS,
+            "levels": ImageSteganography.LEVELS,
+            "container": True,
         }
-        backup_system.save_backup_data(DataType.IMAGE, params, backup_file)
+        backup_system.save_backup_data(
+            DataType.IMAGE, params, backup_file, image=host_array
+        )
 
-        metrics = QualityMetrics.calculate_metrics(original_host, result_img)
+        metrics = QualityMetrics.calculate_metrics(
+            original,
+            host_array,
+            metrics_level,
+            background=async_metrics,
+            change_maps=change_maps,
+        )
         print("Immagine nascosta con successo usando DWT")
 
         # Restituisce con parametri dummy per compatibilità
@@ -181,12 +287,13 @@ class ImageSteganography:
         )
 
     @staticmethod
+    @track_peak_memory("DWT Get")
     def get_image(
         img: Image.Image,
         output_path: str,
         width: int | None = None,
         height: int | None = None,
-        backup_file: str | None = None,
+        backup_file: BackupFile | None = None,
         **kwargs,  # Ignora lsb, msb, div per compatibilità API
     ) -> Image.Image:
         """
@@ -199,154 +306,151 @@ class ImageSteganography:
             height: Altezza dell'immagine nascosta (manuale)
             backup_file: File di backup opzionale
         """
-        # Carica parametri da backup se necessario
-        if backup_file:
-            backup_data = backup_system.load_backup_data(backup_file)
-            if backup_data and "params" in backup_data:
-                # MERGE: parametri manuali hanno priorità
-                width = (
-                    width if width is not None else backup_data["params"].get("width")
-                )
-                height = (
-                    height
-                    if height is not None
-                    else backup_data["params"].get("height")
-                )
-                # CRITICO: carica TUTTI i parametri DWT usati durante hide
-                ImageSteganography.WAVELET = backup_data["params"].get(
-                    "wavelet", ImageSteganography.WAVELET
-                )
-                ImageSteganography.STEP = backup_data["params"].get(
-                    "step", ImageSteganography.STEP
-                )
-                ImageSteganography.BITS_SECRET = backup_data["params"].get(
-                    "bits_per_pixel", ImageSteganography.BITS_SECRET
-                )
-                ImageSteganography.BANDS = backup_data["params"].get(
-                    "bands", ImageSteganography.BANDS
-                )
-
-                ImageSteganography.SEED = backup_data["params"].get(
-                    "seed", ImageSteganography.SEED
-                )
-                ImageSteganography.CHANNEL = backup_data["params"].get(
-                    "channel", ImageSteganography.CHANNEL
-                )
-                print(
-                    f"Parametri DWT caricati da backup: WAVELET={ImageSteganography.WAVELET}, STEP={ImageSteganography.STEP}, "
-                    f"BITS={ImageSteganography.BITS_SECRET}, BANDS={ImageSteganography.BANDS}"
-                )
+        if img.mode != "RGB":
+            img = img.convert("RGB")
 
-        # Se non c'è backup, prova a recuperare dall'ultima operazione
-        if width is None or height is None:
-            recent_params = backup_system.get_last_params(DataType.IMAGE)
-            if recent_params:
-                print("Usando parametri dall'ultima operazione di nascondimento")
-                width = recent_params.get("width")
-                height = recent_params.get("height")
-                # Carica anche i parametri DWT dalla cache
-                ImageSteganography.WAVELET = recent_params.get(
-                    "wavelet", ImageSteganography.WAVELET
-                )
-                ImageSteganography.STEP = recent_params.get(
-                    "step", ImageSteganography.STEP
-                )
-                ImageSteganography.BITS_SECRET = recent_params.get(
-                    "bits_per_pixel", ImageSteganography.BITS_SECRET
-                )
-                ImageSteganography.BANDS = recent_params.get(
-                    "bands", ImageSteganography.BANDS
-                )
+        # I parametri di recupero restano locali: la configurazione della classe
+        # è quella dell'occultamento e non va modificata dal recupero
+        params = {
+            "wavelet": ImageSteganography.WAVELET,
+            "seed": ImageSteganography.SEED,
+            "step": ImageSteganography.STEP,
+            "channel": ImageSteganography.CHANNEL,
+            "bits_per_pixel": ImageSteganography.BITS_SECRET,
+            "bands": ImageSteganography.BANDS,
+            "levels": ImageSteganography.LEVELS,
+        }
 
-                ImageSteganography.SEED = recent_params.get(
-                    "seed", ImageSteganography.SEED
-                )
-                ImageSteganography.CHANNEL = recent_params.get(
-                    "channel", ImageSteganography.CHANNEL
-                )
-                print(
-                    f"Parametri DWT dalla cache: WAVELET={ImageSteganography.WAVELET}, STEP={ImageSteganography.STEP}, "
-                    f"BITS={ImageSteganography.BITS_SECRET}, BANDS={ImageSteganography.BANDS}"
+        header = read_header(img)
+        # Le immagini nel contenitore hanno il payload dopo le righe dell'header
+        in_container = header is not None
+        if header is not None:
+            # I parametri scritti nell'header hanno la precedenza
+            check_header(header, SteganographyMethod.DWT, DataType.IMAGE)
+            params.update(header["params"])
+            width, height = params["width"], params["height"]
+        else:
+            # Header assente o danneggiato (es. ricompressione JPEG) o formato
+            # precedente al contenitore: parametri forniti o dai backup
+            # Carica parametri da backup se necessario
+            if backup_file:
+                backup_data = backup_system.load_backup_data(
+                    backup_file, DataType.IMAGE, image=img
                 )
+                if backup_data and "params" in backup_data:
+                    # MERGE: parametri manuali hanno priorità
+                    width = (
+                        width
+                        if width is not None
+                        else backup_data["params"].get("width")
+                    )
+                    height = (
+                        height
+                        if height is not None
+                        else backup_data["params"].get("height")
+                    )
+                    # CRITICO: carica TUTTI i parametri DWT usati durante hide
+                    ImageSteganography._merge_params(params, backup_data["params"])
+                    in_container = bool(backup_data["params"].get("container"))
+                    print(
+                        f"Parametri DWT caricati da backup: WAVELET={params['wavelet']}, STEP={params['step']}, "
+                        f"BITS={params['bits_per_pixel']}, BANDS={params['bands']}, LEVELS={params['levels']}"
+                    )
+
+            # Se non c'è backup, prova a recuperare dall'ultima operazione
+            if width is None or height is None:
+                recent_params = backup_system.get_last_params(DataType.IMAGE, image=img)
+                if recent_params:
+                    print("Usando parametri dall'ultima operazione di nascondimento")
+                    width = recent_params.get("width")
+                    height = recent_params.get("height")
+                    # Carica anche i parametri DWT dalla cache
+                    ImageSteganography._merge_params(params, recent_params)
+                    in_container = bool(recent_params.get("container"))
+                    print(
+                        f"Parametri DWT dalla cache: WAVELET={params['wavelet']}, STEP={params['step']}, "
+                        f"BITS={params['bits_per_pixel']}, BANDS={params['bands']}, LEVELS={params['levels']}"
+                    )
 
         if width is None or height is None:
             raise ValueError(ErrorMessages.PARAMS_MISSING)
 
-        if img.mode != "RGB":
-            img = img.convert("RGB")
-
         print("Recuperando immagine con DWT...")
-        img_array = np.array(img, dtype=np.float32)
+        dtype = resolve_precision(ImageSteganography.PRECISION)
+        img_array = np.array(img, dtype=dtype)
+        if in_container:
+            img_array = carrier_region(img_array)
 
         # Riduzione profondità bit parametrica
-        bits_secret = ImageSteganography.BITS_SECRET
+        bits_secret = params["bits_per_pixel"]
         total_bits_needed = width * height * 3 * bits_secret
-        extracted_bits = []
 
         # Stessi parametri del nascondimento
-        step = ImageSteganography.STEP
-        channel_idx = ImageSteganography.CHANNEL
-        rng = np.random.default_rng(ImageSteganography.SEED)  # Stesso seed
-
-        # DWT sul canale selezionato
+        step = params["step"]
+        channel_idx = params["channel"]
+        rng = np.random.default_rng(params["seed"])  # Stesso seed
+
+        # DWT multi-livello sul canale selezionato (stessi livelli dell'hide)
+        selected_bands = params["bands"]
+        levels = required_levels(selected_bands, params["levels"])
+        validate_levels(img_array.shape, params["wavelet"], levels)
         channel_data = img_array[:, :, channel_idx]
-        coeffs = pywt.dwt2(channel_data, ImageSteganography.WAVELET)
-        cA, (cH, cV, cD) = coeffs
-
-        # Raccoglie coefficienti da tutte le bande configurate (STESSA logica di hide)
-        band_map = {"cH": cH, "cV": cV, "cD": cD}
-        selected_bands = ImageSteganography.BANDS
+        coeffs = decompose(channel_data, params["wavelet"], levels, dtype)
 
         print(
-            f"DWT Get - Parametri: STEP={step}, BITS={bits_secret}, BANDS={selected_bands}"
+            f"DWT Get - Parametri: STEP={step}, BITS={bits_secret}, BANDS={selected_bands}, LEVELS={levels}"
         )
 
-        all_coeffs = []
-        for band_name in selected_bands:
-            if band_name in band_map:
-                coeff_flat = band_map[band_name].flatten()
-                # USA TUTTI i coefficienti (STESSO metodo di hide, nessun filtro)
-                for idx in range(len(coeff_flat)):
-                    all_coeffs.append((band_name, idx, coeff_flat[idx]))
+        # Viste piatte sulle bande configurate (STESSA logica di hide)
+        band_views = [
+            get_band(coeffs, band_name).ravel() for band_name in selected_bands
+        ]
+        band_offsets = np.cumsum([0] + [view.size for view in band_views])
 
-        # STESSO shuffle deterministico
-        rng.shuffle(all_coeffs)
-        selected_coeffs = all_coeffs[:total_bits_needed]
-
-        # Estrazione dei bit con QIM bin-centered
-        for band_name, flat_idx, coeff_value in selected_coeffs:
-            if len(extracted_bits) >= total_bits_needed:
-                break
-
-            abs_val = abs(coeff_value)
-            # Decodifica QIM dal centro del bin
-            quantized_index = int(round(float(abs_val) / step - 0.5))
-            bit_value = quantized_index % 2  # Legge parità (0=pari, 1=dispari)
-            extracted_bits.append(str(bit_value))
-
-        # Verifica di aver estratto abbastanza bit
-        if len(extracted_bits) < total_bits_needed:
+        # Verifica che le bande contengano abbastanza coefficienti
+        total_usable = int(band_offsets[-1])
+        if total_usable < total_bits_needed:
             raise ValueError(
-                f"Non abbastanza dati estratti. Estratti: {len(extracted_bits)} bit, "
+                f"Non abbastanza dati estratti. Estratti: {total_usable} bit, "
                 f"Richiesti: {total_bits_needed} bit per immagine {width}x{height}"
             )
 
-        # Ricostruisce l'immagine (espande N bit a 8 bit)
-        secret_binary = "".join(extracted_bits[:total_bits_needed])
-        secret_pixels = []
+        # STESSA permutazione deterministica
+        selected_indices = rng.permutation(total_usable)[:total_bits_needed]
 
-        for i in range(0, len(secret_binary), bits_secret):
-            bits = secret_binary[i : i + bits_secret]
-            if len(bits) == bits_secret:
-                # Espande N MSB a 8 bit (shifta a sinistra)
-                shift = 8 - bits_secret
-                pixel_value = int(bits, 2) << shift
-                secret_pixels.append(pixel_value)
-
-        secret_array = np.array(secret_pixels, dtype=np.uint8)
+        # Estrazione dei bit con QIM bin-centered
+        extracted_bits = np.empty(total_bits_needed, dtype=np.uint8)
+        for view, band_start, band_end in zip(
+            band_views, band_offsets[:-1], band_offsets[1:]
+        ):
+            in_band = (selected_indices >= band_start) & (selected_indices < band_end)
+            abs_val = np.abs(view[selected_indices[in_band] - band_start]).astype(
+                np.float64
+            )
+            # Decodifica QIM dal centro del bin e legge la parità (0=pari, 1=dispari)
+            quantized_index = np.round(abs_val / step - 0.5).astype(np.int64)
+            extracted_bits[in_band] = quantized_index % 2
+        if header is not None:
+            # Il QIM tollera qualche bit errato dovuto agli arrotondamenti a
+            # uint8: l'immagine resta un'approssimazione e viene comunque salvata
+            verify_payload(header, np.packbits(extracted_bits).tobytes(), strict=False)
+
+        # Ricostruisce l'immagine (espande N bit MSB a 8 bit shiftando a sinistra)
+        bit_weights = 1 << np.arange(bits_secret - 1, -1, -1)
+        msb_values = extracted_bits.reshape(-1, bits_secret) @ bit_weights
+        secret_array = (msb_values << (8 - bits_secret)).astype(np.uint8)
         secret_array = secret_array.reshape((height, width, 3))
         secret_img = Image.fromarray(secret_array, mode="RGB")
         secret_img.save(output_path)
 
         print(f"Immagine recuperata e salvata in {output_path}")
         return secret_img
+
+    @staticmethod
+    def _merge_params(params: dict, source: dict) -> None:
+        """Aggiorna i parametri di recupero con quelli salvati da un backup"""
+        for key in params:
+            if key in source:
+                params[key] = source[key]
+        # I backup precedenti ai livelli multipli usavano un solo livello
+        params["levels"] = source.get("levels", 1)
@@ -3,15 +3,56 @@ Operazioni di steganografia per messaggi usando DWT (Discrete Wavelet Transform)
 """
 
 import numpy as np
-import pywt
 from PIL import Image
 
-from config.constants import DataType
-
-from ..backup import backup_system
-from ..bit_operations import binary_convert, binary_convert_back
+from config.constants import (
+    DataType,
+    ErrorMessages,
+    MetricsLevel,
+    SteganographyMethod,
+)
+
+from ..backup import BackupFile, backup_system
+from ..bit_operations import (
+    BitStream,
+    bits_to_text,
+    decode_text,
+    encode_text,
+    xor_checksum,
+)
+from ..capacity import usable_bytes
+from ..container import (
+    DESCRIPTOR_BITS,
+    build_descriptor,
+    build_header,
+    carrier_region,
+    check_header,
+    decode_payload,
+    embedded_bits,
+    encode_payload,
+    read_descriptor,
+    read_header,
+    write_header,
+)
 from ..metrics import QualityMetrics
-from ..validator import ParameterValidator
+from .transform import (
+    decompose,
+    decomposition_cache,
+    dwt_capacity,
+    get_band,
+    reconstruct,
+    required_levels,
+    resolve_precision,
+    track_peak_memory,
+    validate_levels,
+    writable_band,
+)
+
+# Header magico (64 bit) del formato precedente al contenitore
+MAGIC_HEADER = "1100100100001111010110010100110011010101010011110000101011001101"
+
+# Soglia minima per i coefficienti utilizzabili nel formato precedente
+THRESHOLD = 1.0
 
 
 class MessageSteganography:
@@ -19,15 +60,63 @@ class MessageSteganography:
 
     WAVELET: str = "haar"  # Wavelet di Haar per semplicità
     ALPHA: float = 0.1  # Fattore di embedding (quanto modificare i coefficienti)
-    BANDS: list[str] = ["cH"]  # Bande DWT da usare
+    BANDS: list[str] = ["cH"]  # Bande DWT da usare (es. 'cH' o 'cH2' per il livello 2)
+    LEVELS: int = (
+        1  # Livelli di decomposizione (le bande senza suffisso usano l'ultimo)
+    )
     CHANNEL: int = 0  # Canale principale quando USE_ALL_CHANNELS=False (0=R, 1=G, 2=B)
     USE_ALL_CHANNELS: bool = (
         True  # Se True usa tutti e 3 i canali RGB, altrimenti solo CHANNEL
     )
+    PRECISION: str = "float32"  # Precisione dei coefficienti: 'float32' | 'float64'
 
     @staticmethod
+    def capacity(img: Image.Image) -> dict:
+        """
+        Capacità esatta con la configurazione corrente, senza trasformata
+
+        Returns:
+            Dizionario con 'bits' e la mappa per blocchi (vedi dwt_capacity)
+        """
+        return dwt_capacity(
+            img.height,
+            img.width,
+            MessageSteganography.WAVELET,
+            MessageSteganography.BANDS,
+            MessageSteganography.LEVELS,
+            3 if MessageSteganography.USE_ALL_CHANNELS else 1,
+        )
+
+    @staticmethod
+    def payload_capacity(
+        img: Image.Image, ecc: bool = False, estimate: dict | None = None
+    ) -> int:
+        """
+        Byte di payload nascondibili con la configurazione corrente
+
+        Args:
+            img: Immagine host
+            ecc: Se True il payload è protetto da Hamming(7,4)
+            estimate: Risultato di capacity() già calcolato (evita di
+                ripetere la stima)
+
+        Returns:
+            Numero massimo di byte del payload (dopo l'eventuale compressione)
+        """
+        estimate = estimate or MessageSteganography.capacity(img)
+        bits = estimate["bits"] - DESCRIPTOR_BITS
+        return usable_bytes(max(0, bits), ecc)
+
+    @staticmethod
+    @track_peak_memory("DWT Hide")
     def hide_message(
-        img: Image.Image, message: str, backup_file: str | None = None
+        img: Image.Image,
+        message: str,
+        backup_file: BackupFile | None = None,
+        ecc: bool = False,
+        metrics_level: str = MetricsLevel.SAMPLED,
+        async_metrics: bool = False,
+        change_maps: bool = False,
     ) -> tuple[Image.Image, dict, float]:
         """
         Nasconde una stringa in un'immagine usando DWT
@@ -36,39 +125,33 @@ class MessageSteganography:
             img: Immagine PIL dove nascondere il messaggio
             message: Messaggio da nascondere
             backup_file: File dove salvare i parametri di backup
+            ecc: Se True protegge il payload con un codice correttore d'errore
+            metrics_level: Livello delle metriche di qualità ('psnr', 'sampled', 'full')
+            async_metrics: Calcola le metriche in background (restituisce un Future)
+            change_maps: Aggiunge alle metriche le mappe delle modifiche
 
         Returns:
             Tupla con (immagine_con_messaggio, metrics, percentuale)
         """
-        # Validazione
-        ParameterValidator.validate_image_size_for_message(img, message)
-
         # Converte in RGB se necessario
         if img.mode != "RGB":
             img = img.convert("RGB")
 
         print("Nascondendo messaggio con DWT...")
-        img_array = np.array(img, dtype=np.float32)
-        original_img = img.copy()
-
-        # Prepara il messaggio binario con header robusto a 64 bit
-        msg_binary = binary_convert(message)
-        magic_header = (
-            "1100100100001111010110010100110011010101010011110000101011001101"  # 64 bit
-        )
-        msg_length = format(len(message), "032b")  # 32 bit
-        checksum = 0
-        for char in message:
-            checksum ^= ord(char)
-        checksum_binary = format(checksum, "032b")  # 32 bit (era 16)
-        terminator = "1111000011110000"  # 16 bit (non più usato per compatibilità)
-
-        full_payload = (
-            magic_header + msg_length + checksum_binary + msg_binary + terminator
-        )
-
-        # Verifica capacità
-        max_capacity = img.width * img.height * 3 // 4  # Approssimazione
+        dtype = resolve_precision(MessageSteganography.PRECISION)
+        original = np.asarray(img)  # Pixel originali (hash e metriche)
+        img_array = original.astype(dtype)
+
+        # Payload: byte UTF-8 del messaggio (compressi se conviene, con ECC
+        # opzionale), descritti dall'header del contenitore
+        msg_bytes = encode_text(message)
+        payload_bytes, full_payload, flags = encode_payload(msg_bytes, ecc)
+        # Il descrittore precede il payload: resta leggibile nei coefficienti
+        # anche se l'header nei pixel viene perso
+        full_payload = build_descriptor(payload_bytes, flags) + full_payload
+
+        # Verifica capacità (esatta, prima di calcolare la trasformata)
+        max_capacity = MessageSteganography.capacity(img)["bits"]
         if len(full_payload) > max_capacity:
             raise ValueError(
                 f"Messaggio troppo lungo per questa immagine. "
@@ -82,69 +165,83 @@ class MessageSteganography:
             else [MessageSteganography.CHANNEL]
         )
 
+        # Calcola solo i livelli necessari per le bande selezionate
+        selected_bands = MessageSteganography.BANDS
+        levels = required_levels(selected_bands, MessageSteganography.LEVELS)
+        region = carrier_region(img_array)  # Righe dopo l'header
+        validate_levels(region.shape, MessageSteganography.WAVELET, levels)
+        image_hash = decomposition_cache.image_hash(carrier_region(original))
+
         # Nasconde nei coefficienti DWT dei canali selezionati
         bit_index = 0
         for channel in channels_to_use:
-            channel_data = img_array[:, :, channel]
-
-            # Applica DWT 2D
-            coeffs = pywt.dwt2(channel_data, MessageSteganography.WAVELET)
-            cA, (cH, cV, cD) = coeffs  # Approssimazione e dettagli
-
-            # Usa le bande configurate
-            band_map = {"cH": cH, "cV": cV, "cD": cD}
-            selected_bands = MessageSteganography.BANDS
+            channel_data = region[:, :, channel]
+
+            # Applica DWT 2D multi-livello
+            coeffs = decomposition_cache.decompose(
+                image_hash,
+                channel,
+                channel_data,
+                MessageSteganography.WAVELET,
+                levels,
+                dtype,
+            )
 
             for band_name in selected_bands:
-                if band_name not in band_map or bit_index >= len(full_payload):
+                if bit_index >= len(full_payload):
                     continue
 
-                band_coeffs = band_map[band_name]
-                band_flat = band_coeffs.flatten()
-
-                # Usa solo coefficienti significativi (abbastanza grandi)
-                threshold = 1.0  # Soglia minima per i coefficienti
-                usable_indices = [
-                    i for i, c in enumerate(band_flat) if abs(c) > threshold
-                ]
-
-                for i in usable_indices:
-                    if bit_index >= len(full_payload):
-                        break
-
-                    # Modifica il coefficiente usando ALPHA
-                    bit = int(full_payload[bit_index])
-
-                    # Delta scalato da ALPHA (moltiplicato per 50 per robustezza)
-                    delta = MessageSteganography.ALPHA * 50.0
-
-                    if bit == 1:
-                        # Assicura che il coefficiente sia positivo
-                        band_flat[i] = abs(band_flat[i]) + delta
-                    else:
-                        # Assicura che il coefficiente sia negativo
-                        band_flat[i] = -abs(band_flat[i]) - delta
+                # Vista piatta sulla banda: le modifiche vanno direttamente nei coefficienti
+                band_flat = writable_band(coeffs, band_name).reshape(-1)
 
-                    bit_index += 1
+                # Un bit per coefficiente, nell'ordine della banda
+                n_bits = min(len(band_flat), len(full_payload) - bit_index)
+                bits = full_payload.to_bits(bit_index, bit_index + n_bits)
 
-                # Aggiorna la banda modificata
-                band_map[band_name] = band_flat.reshape(band_coeffs.shape)
+                # Bit 1 -> coefficiente positivo, bit 0 -> negativo, con delta
+                # scalato da ALPHA (moltiplicato per 50 per robustezza)
+                delta = MessageSteganography.ALPHA * 50.0
+                magnitude = np.abs(band_flat[:n_bits]) + delta
+                band_flat[:n_bits] = np.where(bits == 1, magnitude, -magnitude)
+                bit_index += n_bits
 
-            # Ricostruisce con le bande modificate
-            cH = band_map["cH"]
-            cV = band_map["cV"]
-            cD = band_map["cD"]
-            reconstructed = pywt.idwt2((cA, (cH, cV, cD)), MessageSteganography.WAVELET)
+            # Ricostruisce con le bande modificate (rimuove il padding)
+            reconstructed = reconstruct(
+                coeffs, MessageSteganography.WAVELET, channel_data.shape
+            )
 
-            # Gestisce eventuali differenze di dimensione dovute al padding
-            reconstructed = reconstructed[
-                : channel_data.shape[0], : channel_data.shape[1]
-            ]
+            region[:, :, channel] = reconstructed
 
-            img_array[:, :, channel] = reconstructed
+        if bit_index < len(full_payload):
+            raise ValueError(
+                f"Messaggio troppo lungo per questa immagine. "
+                f"Lunghezza payload: {len(full_payload)} bit, Capacità: {bit_index} bit"
+            )
 
         # Converte in immagine
-        img_array = np.clip(img_array, 0, 255).astype(np.uint8)
+        # Arrotonda prima della conversione: troncando, i pixel ricostruiti
+        # appena sotto l'intero (es. 99.9999) perderebbero 1 anche fuori dal payload
+        img_array = np.clip(np.rint(img_array), 0, 255).astype(np.uint8)
+
+        # Header del contenitore con i parametri di recupero
+        header_params = {
+            "wavelet": MessageSteganography.WAVELET,
+            "alpha": MessageSteganography.ALPHA,
+            "bands": MessageSteganography.BANDS,
+            "levels": MessageSteganography.LEVELS,
+            "channels": channels_to_use,
+            "descriptor": True,
+        }
+        write_header(
+            img_array,
+            build_header(
+                SteganographyMethod.DWT,
+                DataType.STRING,
+                header_params,
+                payload_bytes,
+                flags=flags,
+            ),
+        )
         result_img = Image.fromarray(img_array, mode="RGB")
 
         # Calcola percentuale di bit usati
@@ -157,23 +254,33 @@ class MessageSteganography:
         # Salva parametri (sempre nella cache, opzionalmente su file)
         params = {
             "method": "dwt",
-            "msg_length": len(message),
+            "msg_length": len(msg_bytes),
             "wavelet": MessageSteganography.WAVELET,
             "alpha": MessageSteganography.ALPHA,
             "bands": MessageSteganography.BANDS,
+            "levels": MessageSteganography.LEVELS,
             "channel": MessageSteganography.CHANNEL,
             "use_all_channels": MessageSteganography.USE_ALL_CHANNELS,
         }
-        backup_system.save_backup_data(DataType.STRING, params, backup_file)
+        backup_system.save_backup_data(
+            DataType.STRING, params, backup_file, image=img_array
+        )
 
         # Calcola metriche
-        metrics = QualityMetrics.calculate_metrics(original_img, result_img)
+        metrics = QualityMetrics.calculate_metrics(
+            original,
+            img_array,
+            metrics_level,
+            background=async_metrics,
+            change_maps=change_maps,
+        )
 
         print("Messaggio nascosto con successo usando DWT")
         return result_img, metrics, float(percentage)
 
     @staticmethod
-    def get_message(img: Image.Image, backup_file: str | None = None) -> str:
+    @track_peak_memory("DWT Get")
+    def get_message(img: Image.Image, backup_file: BackupFile | None = None) -> str:
         """
         Recupera una stringa da un'immagine usando DWT
 
@@ -184,64 +291,220 @@ class MessageSteganography:
         Returns:
             Messaggio recuperato
         """
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+
+        header = read_header(img)
+        if header is None:
+            # Header assente o danneggiato (es. ricompressione JPEG): parametri
+            # dal backup o configurati, poi il descrittore nei coefficienti
+            params = MessageSteganography._recovery_params(img, backup_file)
+            message = MessageSteganography._get_described_message(img, params)
+            if message is not None:
+                return message
+            return MessageSteganography._get_legacy_message(img, params)
+        check_header(header, SteganographyMethod.DWT, DataType.STRING)
+
+        # I parametri dell'header restano locali: la configurazione della
+        # classe è quella dell'occultamento e non va modificata dal recupero
+        params = header["params"]
+        print(
+            f"Parametri DWT letti dall'header: WAVELET={params['wavelet']}, "
+            f"BANDS={params['bands']}, LEVELS={params['levels']}, CHANNELS={params['channels']}"
+        )
+
+        print("Recuperando messaggio con DWT...")
+        dtype = resolve_precision(MessageSteganography.PRECISION)
+        region = carrier_region(np.array(img, dtype=dtype))
+        levels = required_levels(params["bands"], params["levels"])
+        validate_levels(region.shape, params["wavelet"], levels)
+
+        # Le immagini con il descrittore lo hanno prima del payload
+        skip = DESCRIPTOR_BITS if params.get("descriptor") else 0
+        n_bits = skip + embedded_bits(header)
+        payload = MessageSteganography._extract_sign_bits(
+            region,
+            params["channels"],
+            params["wavelet"],
+            params["bands"],
+            levels,
+            dtype,
+            n_bits,
+            threshold=None,
+        )
+        if len(payload) < n_bits:
+            raise ValueError(ErrorMessages.DECODE_FAILED)
+
+        message = decode_text(decode_payload(header, payload[skip:]))
+        print("Messaggio recuperato con successo usando DWT")
+        return message
+
+    @staticmethod
+    def has_descriptor(img: Image.Image) -> bool:
+        """
+        Verifica se l'immagine contiene un descrittore DWT con la
+        configurazione corrente (payload il cui header è andato perso)
+        """
+        try:
+            bits = MessageSteganography._extract_region_bits(
+                img, MessageSteganography._config_params(), DESCRIPTOR_BITS
+            )
+        except ValueError:
+            return False
+        return read_descriptor(bits) is not None
+
+    @staticmethod
+    def _get_described_message(img: Image.Image, params: dict) -> str | None:
+        """
+        Recupera un messaggio dal descrittore nei coefficienti
+
+        Returns:
+            Messaggio recuperato, oppure None se con questi parametri non c'è
+            un descrittore (immagine nel formato precedente)
+        """
+        try:
+            descriptor = read_descriptor(
+                MessageSteganography._extract_region_bits(img, params, DESCRIPTOR_BITS)
+            )
+        except ValueError:
+            return None
+        if descriptor is None:
+            return None
+
+        print("Header del contenitore non leggibile: uso il descrittore DWT")
+        n_bits = DESCRIPTOR_BITS + embedded_bits(descriptor)
+        payload = MessageSteganography._extract_region_bits(img, params, n_bits)
+        if len(payload) < n_bits:
+            raise ValueError(ErrorMessages.DECODE_FAILED)
+
+        message = decode_text(decode_payload(descriptor, payload[DESCRIPTOR_BITS:]))
+        print("Messaggio recuperato con successo usando DWT")
+        return message
+
+    @staticmethod
+    def _extract_region_bits(img: Image.Image, params: dict, n_bits: int) -> BitStream:
+        """
+        Legge i primi n_bits bit dalla regione del carrier con i parametri dati
+        (wavelet, bands, levels, channel, use_all_channels)
+        """
+        dtype = resolve_precision(MessageSteganography.PRECISION)
+        region = carrier_region(np.array(img.convert("RGB"), dtype=dtype))
+        levels = required_levels(params["bands"], params["levels"])
+        validate_levels(region.shape, params["wavelet"], levels)
+        channels = [0, 1, 2] if params["use_all_channels"] else [params["channel"]]
+        return MessageSteganography._extract_sign_bits(
+            region,
+            channels,
+            params["wavelet"],
+            params["bands"],
+            levels,
+            dtype,
+            n_bits,
+            threshold=None,
+        )
+
+    @staticmethod
+    def _config_params() -> dict:
+        """Parametri di recupero della configurazione corrente"""
+        return {
+            "wavelet": MessageSteganography.WAVELET,
+            "alpha": MessageSteganography.ALPHA,
+            "bands": MessageSteganography.BANDS,
+            "levels": MessageSteganography.LEVELS,
+            "channel": MessageSteganography.CHANNEL,
+            "use_all_channels": MessageSteganography.USE_ALL_CHANNELS,
+        }
+
+    @staticmethod
+    def _recovery_params(
+        img: Image.Image, backup_file: BackupFile | None = None
+    ) -> dict:
+        """
+        Parametri di recupero senza header: dal backup, dalla cache dell'ultima
+        operazione o, in mancanza, dalla configurazione corrente
+
+        Restano locali: la configurazione della classe è quella
+        dell'occultamento e non va modificata dal recupero.
+        """
+        params = MessageSteganography._config_params()
+        saved = None
         # Carica parametri da backup se disponibile
         if backup_file:
-            backup_data = backup_system.load_backup_data(backup_file)
+            backup_data = backup_system.load_backup_data(
+                backup_file, DataType.STRING, image=img
+            )
             if backup_data and "params" in backup_data:
-                MessageSteganography.WAVELET = backup_data["params"].get(
-                    "wavelet", MessageSteganography.WAVELET
-                )
-                MessageSteganography.ALPHA = backup_data["params"].get(
-                    "alpha", MessageSteganography.ALPHA
-                )
-                MessageSteganography.BANDS = backup_data["params"].get(
-                    "bands", MessageSteganography.BANDS
-                )
-                MessageSteganography.CHANNEL = backup_data["params"].get(
-                    "channel", MessageSteganography.CHANNEL
-                )
-                MessageSteganography.USE_ALL_CHANNELS = backup_data["params"].get(
-                    "use_all_channels", MessageSteganography.USE_ALL_CHANNELS
-                )
-                print(
-                    f"Parametri DWT caricati da backup: WAVELET={MessageSteganography.WAVELET}, ALPHA={MessageSteganography.ALPHA}, "
-                    f"BANDS={MessageSteganography.BANDS}, CHANNEL={MessageSteganography.CHANNEL}, USE_ALL_CHANNELS={MessageSteganography.USE_ALL_CHANNELS}"
-                )
+                saved = backup_data["params"]
+                source = "caricati da backup"
         else:
             # Usa parametri dalla cache dell'ultima operazione
-            recent = backup_system.get_last_params(DataType.STRING)
-            if recent:
-                MessageSteganography.WAVELET = recent.get(
-                    "wavelet", MessageSteganography.WAVELET
-                )
-                MessageSteganography.ALPHA = recent.get(
-                    "alpha", MessageSteganography.ALPHA
-                )
-                MessageSteganography.BANDS = recent.get(
-                    "bands", MessageSteganography.BANDS
-                )
-                MessageSteganography.CHANNEL = recent.get(
-                    "channel", MessageSteganography.CHANNEL
-                )
-                MessageSteganography.USE_ALL_CHANNELS = recent.get(
-                    "use_all_channels", MessageSteganography.USE_ALL_CHANNELS
-                )
-                print(
-                    f"Parametri DWT dalla cache: WAVELET={MessageSteganography.WAVELET}, ALPHA={MessageSteganography.ALPHA}, "
-                    f"BANDS={MessageSteganography.BANDS}, CHANNEL={MessageSteganography.CHANNEL}, USE_ALL_CHANNELS={MessageSteganography.USE_ALL_CHANNELS}"
-                )
+            saved = backup_system.get_last_params(DataType.STRING, image=img)
+            source = "dalla cache"
+        if saved:
+            for key in params:
+                params[key] = saved.get(key, params[key])
+            # I backup precedenti ai livelli multipli usavano un solo livello
+            params["levels"] = saved.get("levels", 1)
+            print(
+                f"Parametri DWT {source}: WAVELET={params['wavelet']}, ALPHA={params['alpha']}, "
+                f"BANDS={params['bands']}, LEVELS={params['levels']}, CHANNEL={params['channel']}, USE_ALL_CHANNELS={params['use_all_channels']}"
+            )
+        return params
 
+    @staticmethod
+    def has_legacy_payload(img: Image.Image) -> bool:
+        """
+        Verifica se l'immagine contiene un messaggio nel formato precedente
+
+        Legge solo i segni dei primi coefficienti significativi, dove il
+        formato precedente scriveva l'header magico a 64 bit.
+        """
+        dtype = resolve_precision(MessageSteganography.PRECISION)
+        img_array = np.array(img.convert("RGB"), dtype=dtype)
+        channels = (
+            [0, 1, 2]
+            if MessageSteganography.USE_ALL_CHANNELS
+            else [MessageSteganography.CHANNEL]
+        )
+        levels = required_levels(
+            MessageSteganography.BANDS, MessageSteganography.LEVELS
+        )
+        validate_levels(img_array.shape, MessageSteganography.WAVELET, levels)
+
+        magic = BitStream.from_str(MAGIC_HEADER)
+        bits = MessageSteganography._extract_sign_bits(
+            img_array,
+            channels,
+            MessageSteganography.WAVELET,
+            MessageSteganography.BANDS,
+            levels,
+            dtype,
+            len(magic),
+        )
+        return bits == magic
+
+    @staticmethod
+    def _get_legacy_message(img: Image.Image, params: dict) -> str:
+        """
+        Recupera un messaggio nascosto prima dell'introduzione del contenitore
+
+        Il formato precedente usa solo i coefficienti con modulo sopra THRESHOLD
+        e apre il payload con header magico a 64 bit, lunghezza e checksum XOR.
+
+        Args:
+            img: Immagine contenente il messaggio
+            params: Parametri di recupero (vedi _recovery_params)
+        """
         if img.mode != "RGB":
             img = img.convert("RGB")
 
         print("Recuperando messaggio con DWT...")
-        img_array = np.array(img, dtype=np.float32)
+        dtype = resolve_precision(MessageSteganography.PRECISION)
+        img_array = np.array(img, dtype=dtype)
 
         # Determina quali canali usare (stessi dell'hide)
         channels_to_use = (
-            [0, 1, 2]
-            if MessageSteganography.USE_ALL_CHANNELS
-            else [MessageSteganography.CHANNEL]
+            [0, 1, 2] if params["use_all_channels"] else [params["channel"]]
         )
 
         # === ESTRAZIONE SINCRONIZZATA IN DUE FASI ===
@@ -252,61 +515,30 @@ class MessageSteganography:
         LENGTH_BITS = 32
         CHECKSUM_BITS = 32
         TERMINATOR_BITS = 16
-        magic_header = (
-            "1100100100001111010110010100110011010101010011110000101011001101"
-        )
+
+        selected_bands = params["bands"]
+        levels = required_levels(selected_bands, params["levels"])
+        validate_levels(img_array.shape, params["wavelet"], levels)
 
         # FASE 1: Estrai primi 128 bit (header + length + checksum)
         bits_needed = HEADER_BITS + LENGTH_BITS + CHECKSUM_BITS
-        extracted_bits = []
-        threshold = 1.0  # Soglia minima per coefficienti utilizzabili
-
-        for channel in channels_to_use:
-            if len(extracted_bits) >= bits_needed:
-                break
-
-            channel_data = img_array[:, :, channel]
-
-            # Applica DWT 2D
-            coeffs = pywt.dwt2(channel_data, MessageSteganography.WAVELET)
-            cA, (cH, cV, cD) = coeffs
-
-            # Usa le stesse bande configurate nell'hide
-            band_map = {"cH": cH, "cV": cV, "cD": cD}
-            selected_bands = MessageSteganography.BANDS
-
-            for band_name in selected_bands:
-                if band_name not in band_map:
-                    continue
-                if len(extracted_bits) >= bits_needed:
-                    break
-
-                band_coeffs = band_map[band_name]
-                band_flat = band_coeffs.flatten()
-
-                # Usa solo coefficienti significativi (stessa soglia dell'hide)
-                usable_indices = [
-                    i for i, c in enumerate(band_flat) if abs(c) > threshold
-                ]
-
-                for i in usable_indices:
-                    if len(extracted_bits) >= bits_needed:
-                        break
-                    # Estrae il bit dal segno del coefficiente
-                    if band_flat[i] > 0:
-                        extracted_bits.append("1")
-                    else:
-                        extracted_bits.append("0")
-
-        bitstream = "".join(extracted_bits)
+        bitstream = MessageSteganography._extract_sign_bits(
+            img_array,
+            channels_to_use,
+            params["wavelet"],
+            selected_bands,
+            levels,
+            dtype,
+            bits_needed,
+        )
 
         # Verifica header DEVE essere all'inizio (no find!)
-        if len(bitstream) < HEADER_BITS + LENGTH_BITS + CHECKSUM_BITS:
+        if len(bitstream) < bits_needed:
             raise ValueError(
                 "Immagine troppo piccola o corrotta: impossibile leggere header messaggio DWT"
             )
 
-        if bitstream[:HEADER_BITS] != magic_header:
+        if bitstream[:HEADER_BITS] != BitStream.from_str(MAGIC_HEADER):
             raise ValueError(
                 "Header non valido: nessun messaggio DWT trovato. "
                 "Possibili cause: (1) Metodo sbagliato (usa LSB/PVD invece di DWT), "
@@ -314,13 +546,9 @@ class MessageSteganography:
             )
 
         # Decodifica msg_length e checksum
-        msg_length_binary = bitstream[HEADER_BITS : HEADER_BITS + LENGTH_BITS]
-        msg_length = int(msg_length_binary, 2)
-
+        msg_length = bitstream.read_uint(HEADER_BITS, LENGTH_BITS)
         checksum_start = HEADER_BITS + LENGTH_BITS
-        expected_checksum = int(
-            bitstream[checksum_start : checksum_start + CHECKSUM_BITS], 2
-        )
+        expected_checksum = bitstream.read_uint(checksum_start, CHECKSUM_BITS)
 
         # FASE 2: Calcola bit totali e continua estrazione
         total_bits_needed = (
@@ -330,67 +558,83 @@ class MessageSteganography:
             + (msg_length * 8)
             + TERMINATOR_BITS
         )
-
-        # Continua estrazione solo se servono più bit
-        if len(extracted_bits) < total_bits_needed:
-            bits_read = len(extracted_bits)
-            current_bit_index = 0
-
-            for channel in channels_to_use:
-                if len(extracted_bits) >= total_bits_needed:
-                    break
-
-                channel_data = img_array[:, :, channel]
-                coeffs = pywt.dwt2(channel_data, MessageSteganography.WAVELET)
-                cA, (cH, cV, cD) = coeffs
-                band_map = {"cH": cH, "cV": cV, "cD": cD}
-                selected_bands = MessageSteganography.BANDS
-
-                for band_name in selected_bands:
-                    if band_name not in band_map:
-                        continue
-                    if len(extracted_bits) >= total_bits_needed:
-                        break
-
-                    band_coeffs = band_map[band_name]
-                    band_flat = band_coeffs.flatten()
-                    usable_indices = [
-                        i for i, c in enumerate(band_flat) if abs(c) > threshold
-                    ]
-
-                    for i in usable_indices:
-                        # Salta bit già estratti nella FASE 1
-                        if current_bit_index < bits_read:
-                            current_bit_index += 1
-                            continue
-
-                        if len(extracted_bits) >= total_bits_needed:
-                            break
-                        if band_flat[i] > 0:
-                            extracted_bits.append("1")
-                        else:
-                            extracted_bits.append("0")
-                        current_bit_index += 1
-
-        bitstream = "".join(extracted_bits)
+        if len(bitstream) < total_bits_needed:
+            bitstream = MessageSteganography._extract_sign_bits(
+                img_array,
+                channels_to_use,
+                params["wavelet"],
+                selected_bands,
+                levels,
+                dtype,
+                total_bits_needed,
+            )
 
         # Legge il messaggio
         msg_start = HEADER_BITS + LENGTH_BITS + CHECKSUM_BITS
         msg_end = msg_start + (msg_length * 8)
-        msg_binary = bitstream[msg_start:msg_end]
+        msg_bits = bitstream[msg_start:msg_end]
 
         # Decodifica
-        message = binary_convert_back(msg_binary)
+        message = bits_to_text(msg_bits)
 
         # Verifica checksum
-        actual_checksum = 0
-        for char in message:
-            actual_checksum ^= ord(char)
-
-        if actual_checksum != expected_checksum:
+        if xor_checksum(msg_bits.to_bytes()) != expected_checksum:
             print(
                 "Warning: Checksum non corrisponde. Messaggio potrebbe essere corrotto."
             )
 
         print("Messaggio recuperato con successo usando DWT")
         return message
+
+    @staticmethod
+    def _extract_sign_bits(
+        img_array: np.ndarray,
+        channels: list[int],
+        wavelet: str,
+        bands: list[str],
+        levels: int,
+        dtype: np.dtype,
+        bits_needed: int,
+        threshold: float | None = THRESHOLD,
+    ) -> BitStream:
+        """
+        Legge i segni dei coefficienti nello stesso ordine dell'hide
+
+        Args:
+            img_array: Immagine come array (float)
+            channels: Canali da scorrere
+            wavelet: Wavelet usata nell'hide
+            bands: Bande da leggere, nell'ordine dell'hide
+            levels: Livelli di decomposizione
+            dtype: Precisione dei coefficienti
+            bits_needed: Numero di bit da leggere (si ferma appena raggiunto)
+            threshold: Considera solo i coefficienti con modulo maggiore
+                (None: tutti i coefficienti)
+
+        Returns:
+            Stream con i bit letti (eventualmente più corto di bits_needed)
+        """
+        chunks = []
+        bits_read = 0
+        for channel in channels:
+            if bits_read >= bits_needed:
+                break
+
+            coeffs = decompose(img_array[:, :, channel], wavelet, levels, dtype)
+            for band_name in bands:
+                if bits_read >= bits_needed:
+                    break
+
+                # Estrae il bit dal segno dei coefficienti (stessa soglia dell'hide)
+                band_flat = get_band(coeffs, band_name).ravel()
+                usable = (
+                    band_flat
+                    if threshold is None
+                    else band_flat[np.abs(band_flat) > threshold]
+                )
+                chunks.append(usable[: bits_needed - bits_read] > 0)
+                bits_read += len(chunks[-1])
+
+        return BitStream.from_bits(
+            np.concatenate(chunks) if chunks else np.zeros(0, dtype=bool)
+        )
@@ -0,0 +1,344 @@
+"""
+Utilità condivise per la decomposizione wavelet multi-livello (pywt.wavedec2)
+"""
+
+import functools
+import hashlib
+import os
+import threading
+import tracemalloc
+from collections import OrderedDict
+from collections.abc import Callable
+
+import numpy as np
+import pywt
+
+from ..capacity import BLOCK_SIZE, capacity_estimate
+from ..container import header_rows
+
+# Bande di dettaglio disponibili ad ogni livello
+BAND_NAMES: tuple[str, ...] = ("cH", "cV", "cD")
+
+# Precisioni supportate per i coefficienti (float32 dimezza la memoria)
+PRECISIONS: dict[str, type] = {"float32": np.float32, "float64": np.float64}
+
+
+def parse_band(band: str, levels: int) -> tuple[str, int]:
+    """
+    Scompone il nome di una banda in (nome, livello)
+
+    Args:
+        band: Nome della banda, es. 'cH' (livello più grossolano) o 'cH2' (livello 2)
+        levels: Numero di livelli della decomposizione
+
+    Returns:
+        Tupla (nome_banda, livello) con livello compreso tra 1 e levels
+    """
+    name, suffix = band[:2], band[2:]
+    if name not in BAND_NAMES or (suffix and not suffix.isdigit()):
+        raise ValueError(f"Banda DWT non valida: {band}")
+
+    level = int(suffix) if suffix else levels
+    if level < 1 or level > levels:
+        raise ValueError(
+            f"Livello della banda {band} fuori range: deve essere tra 1 e {levels}"
+        )
+    return name, level
+
+
+def required_levels(bands: list[str], levels: int) -> int:
+    """Calcola il numero minimo di livelli da decomporre per accedere alle bande"""
+    return max(parse_band(band, levels)[1] for band in bands)
+
+
+def band_options(levels: int) -> list[str]:
+    """Restituisce i nomi delle bande selezionabili per il numero di livelli dato"""
+    if levels <= 1:
+        return list(BAND_NAMES)
+    return [f"{name}{level}" for level in range(levels, 0, -1) for name in BAND_NAMES]
+
+
+def resolve_precision(precision: str) -> type:
+    """Restituisce il dtype numpy corrispondente alla precisione richiesta"""
+    if precision not in PRECISIONS:
+        raise ValueError(
+            f"Precisione DWT non valida: {precision} "
+            f"(valori ammessi: {', '.join(PRECISIONS)})"
+        )
+    return PRECISIONS[precision]
+
+
+def validate_levels(shape: tuple[int, ...], wavelet: str, levels: int) -> None:
+    """Verifica che l'immagine sia abbastanza grande per il numero di livelli"""
+    max_level = pywt.dwt_max_level(min(shape[:2]), wavelet)
+    if levels < 1 or levels > max(1, max_level):
+        raise ValueError(
+            f"Numero di livelli DWT non valido ({levels}): per un'immagine "
+            f"{shape[1]}x{shape[0]} con wavelet {wavelet} il massimo è {max(1, max_level)}"
+        )
+
+
+def decompose(
+    channel_data: np.ndarray, wavelet: str, levels: int, dtype: type = np.float32
+) -> list:
+    """
+    Applica la DWT 2D multi-livello a un canale
+
+    Args:
+        channel_data: Dati del canale
+        wavelet: Tipo di wavelet
+        levels: Numero di livelli
+        dtype: Precisione dei coefficienti (np.float32 o np.float64)
+
+    Returns:
+        Lista [cA_n, [cH_n, cV_n, cD_n], ..., [cH_1, cV_1, cD_1]] con i dettagli
+        in liste modificabili
+    """
+    coeffs = pywt.wavedec2(np.asarray(channel_data, dtype=dtype), wavelet, level=levels)
+    return [coeffs[0].astype(dtype, copy=False)] + [
+        [band.astype(dtype, copy=False) for band in details] for details in coeffs[1:]
+    ]
+
+
+def get_band(coeffs: list, band: str) -> np.ndarray:
+    """Restituisce i coefficienti di una banda dalla decomposizione"""
+    levels = len(coeffs) - 1
+    name, level = parse_band(band, levels)
+    return coeffs[levels - level + 1][BAND_NAMES.index(name)]
+
+
+def set_band(coeffs: list, band: str, values: np.ndarray) -> None:
+    """Sostituisce i coefficienti di una banda nella decomposizione"""
+    levels = len(coeffs) - 1
+    name, level = parse_band(band, levels)
+    coeffs[levels - level + 1][BAND_NAMES.index(name)] = values
+
+
+def writable_band(coeffs: list, band: str) -> np.ndarray:
+    """
+    Restituisce una banda modificabile in place
+
+    Se la banda è condivisa con la cache (sola lettura) ne crea una sola copia
+    e la sostituisce nella decomposizione, così le modifiche fatte tramite
+    band.reshape(-1) arrivano direttamente alla ricostruzione.
+    """
+    values = get_band(coeffs, band)
+    if not values.flags.writeable:
+        values = values.copy()
+        set_band(coeffs, band, values)
+    return values
+
+
+def reconstruct(coeffs: list, wavelet: str, shape: tuple[int, ...]) -> np.ndarray:
+    """Applica la DWT inversa e rimuove l'eventuale padding"""
+    reconstructed = pywt.waverec2(coeffs, wavelet)
+    return reconstructed[: shape[0], : shape[1]]
+
+
+def dwt_capacity(
+    height: int,
+    width: int,
+    wavelet: str,
+    bands: list[str],
+    levels: int,
+    n_channels: int,
+    block_size: int = BLOCK_SIZE,
+) -> dict:
+    """
+    Capacità DWT esatta del carrier (un bit per coefficiente)
+
+    Le forme delle bande vengono da pywt.wavedecn_shapes; il coefficiente i
+    di una banda al livello L copre le righe (e colonne) da i * 2^L.
+
+    Args:
+        height, width: Dimensioni dell'immagine
+        wavelet: Wavelet usata
+        bands: Bande selezionate (es. 'cH', 'cV2')
+        levels: Livelli configurati
+        n_channels: Numero di canali usati
+        block_size: Lato dei blocchi della mappa
+
+    Returns:
+        Dizionario {'bits', 'map', 'heatmap', 'block_size'} (vedi capacity_estimate)
+    """
+    offset = header_rows(width)
+    region_height = height - offset
+    if region_height <= 0:
+        raise ValueError(
+            f"Immagine troppo piccola per il contenitore: servono più di {offset} righe"
+        )
+    levels = required_levels(bands, levels)
+    validate_levels((region_height, width), wavelet, levels)
+    shapes = pywt.wavedecn_shapes((region_height, width), wavelet, level=levels)
+
+    n_rows, n_cols = -(-height // block_size), -(-width // block_size)
+    capacity_map = np.zeros((n_rows, n_cols), dtype=np.int64)
+    for band in bands:
+        _, level = parse_band(band, levels)
+        band_rows, band_cols = shapes[levels - level + 1]["dd"]
+        rows = np.minimum(np.arange(band_rows) << level, region_height - 1) + offset
+        cols = np.minimum(np.arange(band_cols) << level, width - 1)
+        row_counts = np.bincount(rows // block_size, minlength=n_rows)
+        col_counts = np.bincount(cols // block_size, minlength=n_cols)
+        capacity_map += np.outer(row_counts, col_counts) * n_channels
+    return capacity_estimate(capacity_map, block_size)
+
+
+# Misura del picco di memoria (opzionale: tracemalloc rallenta ogni allocazione)
+TRACK_MEMORY: bool = os.environ.get("STEGANOGRAFIA_PEAK_MEMORY") == "1"
+
+# Finestre di misura aperte (tracemalloc è globale al processo: resta attivo
+# finché almeno un'operazione DWT è in corso)
+_memory_lock = threading.Lock()
+_memory_windows = 0
+
+
+def track_peak_memory(label: str) -> Callable:
+    """
+    Decoratore che misura il picco di memoria allocata durante la chiamata
+
+    Apre una finestra tracemalloc (decomposizione, embedding, ricostruzione)
+    e stampa il picco rispetto alla memoria già allocata all'inizio, quindi
+    riguarda solo l'operazione e non la vita del processo. Con più operazioni
+    DWT contemporanee il picco include anche le allocazioni delle altre.
+
+    Disattivato per default: si abilita con STEGANOGRAFIA_PEAK_MEMORY=1
+    (o impostando TRACK_MEMORY), altrimenti la funzione è chiamata direttamente.
+
+    Args:
+        label: Etichetta stampata insieme al picco
+    """
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            global _memory_windows
+            if not TRACK_MEMORY:
+                return func(*args, **kwargs)
+            with _memory_lock:
+                if _memory_windows == 0:
+                    tracemalloc.start()
+                _memory_windows += 1
+                baseline, _ = tracemalloc.get_traced_memory()
+                tracemalloc.reset_peak()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with _memory_lock:
+                    _, peak = tracemalloc.get_traced_memory()
+                    _memory_windows -= 1
+                    if _memory_windows == 0:
+                        tracemalloc.stop()
+                print(f"{label} - Picco memoria: {(peak - baseline) / 2**20:.1f} MB")
+
+        return wrapper
+
+    return decorator
+
+
+class DecompositionCache:
+    """
+    Cache LRU delle decomposizioni DWT delle immagini host
+
+    Evita di ricalcolare la trasformata quando si ripete l'occultamento sulla
+    stessa immagine cambiando solo ALPHA, STEP o le bande. Le chiavi sono
+    (hash_immagine, wavelet, canale, livelli, precisione). Oltre MAX_BYTES
+    vengono scartate le voci meno usate di recente delle altre immagini:
+    tutti i canali dell'ultima immagine restano in cache anche se da soli
+    superano il limite (un host da 20 MP occupa ~240 MB in float32). È
+    condivisa tra le sessioni (thread) e protetta da un lock.
+    """
+
+    # Memoria oltre la quale si scartano le decomposizioni delle immagini
+    # precedenti (MB, configurabile con STEGANOGRAFIA_DWT_CACHE_MB; 0 disattiva
+    # la cache)
+    MAX_BYTES: int = int(os.environ.get("STEGANOGRAFIA_DWT_CACHE_MB", "64")) << 20
+
+    def __init__(self):
+        self._entries: OrderedDict[tuple, list] = OrderedDict()
+        self._sizes: dict[tuple, int] = {}
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def image_hash(img_array: np.ndarray) -> str:
+        """Calcola l'hash del contenuto (e della forma) di un'immagine"""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(str((img_array.shape, img_array.dtype.str)).encode())
+        digest.update(np.ascontiguousarray(img_array).tobytes())
+        return digest.hexdigest()
+
+    def decompose(
+        self,
+        image_hash: str,
+        channel: int,
+        channel_data: np.ndarray,
+        wavelet: str,
+        levels: int,
+        dtype: type = np.float32,
+    ) -> list:
+        """
+        Restituisce la decomposizione del canale, calcolandola solo se assente
+
+        Args:
+            image_hash: Hash dell'immagine calcolato con image_hash()
+            channel: Indice del canale decomposto
+            channel_data: Dati del canale (usati solo se la voce non è in cache)
+            wavelet: Tipo di wavelet
+            levels: Numero di livelli
+            dtype: Precisione dei coefficienti
+
+        Returns:
+            Nuova lista di coefficienti nel formato di decompose(); le bande sono
+            condivise con la cache e in sola lettura, usare writable_band per modificarle
+        """
+        key = (image_hash, wavelet, channel, levels, np.dtype(dtype).str)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+        if cached is None:
+            # Calcolata fuori dal lock: le altre sessioni non restano in attesa
+            cached = decompose(channel_data, wavelet, levels, dtype)
+            for array in [cached[0]] + [band for level in cached[1:] for band in level]:
+                array.setflags(write=False)
+            self._store(key, cached)
+        else:
+            print(f"Decomposizione DWT riutilizzata dalla cache (canale {channel})")
+
+        return [cached[0]] + [list(details) for details in cached[1:]]
+
+    def _store(self, key: tuple, coeffs: list) -> None:
+        """Inserisce una voce e scarta le meno recenti delle altre immagini"""
+        if DecompositionCache.MAX_BYTES <= 0:
+            return
+        size = coeffs[0].nbytes + sum(
+            band.nbytes for level in coeffs[1:] for band in level
+        )
+
+        with self._lock:
+            # Un'altra sessione può averla già inserita nel frattempo
+            if key in self._entries:
+                return
+            self._entries[key] = coeffs
+            self._sizes[key] = size
+            self._total_bytes += size
+            # Le voci dell'immagine corrente non vengono scartate: gli altri
+            # canali servono alla stessa operazione e a quelle successive
+            for old_key in list(self._entries):
+                if self._total_bytes <= DecompositionCache.MAX_BYTES:
+                    break
+                if old_key[0] != key[0]:
+                    del self._entries[old_key]
+                    self._total_bytes -= self._sizes.pop(old_key)
+
+    def clear(self) -> None:
+        """Svuota la cache"""
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._total_bytes = 0
+
+
+# Istanza globale della cache delle decomposizioni
+decomposition_cache = DecompositionCache()
@@ -0,0 +1,102 @@
+"""
+Codice correttore d'errore per i payload nascosti
+
+Codice di Hamming(7,4): ogni nibble del payload diventa una parola di 7 bit
+che corregge un bit errato. Codifica e decodifica (sindrome) sono lookup su
+tabelle precalcolate applicate a tutto il payload in blocco, senza cicli
+Python per bit.
+"""
+
+import numpy as np
+
+from .bit_operations import BitStream
+
+CODEWORD_BITS = 7
+
+# Matrice generatrice in forma sistematica: i 4 bit di dato seguiti dai 3 di
+# parità (d1 d2 d3 d4 p1 p2 p3)
+_GENERATOR = np.array(
+    [
+        [1, 0, 0, 0, 1, 1, 0],
+        [0, 1, 0, 0, 1, 0, 1],
+        [0, 0, 1, 0, 0, 1, 1],
+        [0, 0, 0, 1, 1, 1, 1],
+    ],
+    dtype=np.uint8,
+)
+
+
+def _build_tables() -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Tabelle nibble -> parola di codice, byte -> 14 bit codificati e parola
+    ricevuta -> nibble corretto
+    """
+    nibble_bits = np.unpackbits(np.arange(16, dtype=np.uint8)[:, None], axis=1)[:, 4:]
+    codeword_bits = nibble_bits @ _GENERATOR % 2
+    weights = 1 << np.arange(CODEWORD_BITS - 1, -1, -1)
+    encode = (codeword_bits @ weights).astype(np.uint8)
+
+    # Il codice è perfetto: ogni parola di 7 bit dista al più 1 da una sola
+    # parola di codice, che è quella a distanza minima
+    received = np.arange(1 << CODEWORD_BITS, dtype=np.uint8)
+    distances = np.unpackbits((received[:, None] ^ encode[None, :])[..., None], axis=2)
+    decode = distances.sum(axis=2).argmin(axis=1).astype(np.uint8)
+
+    # Bit delle due parole di codice di ogni byte (nibble alto, poi basso)
+    byte_values = np.arange(256)
+    byte_bits = np.concatenate(
+        [codeword_bits[byte_values >> 4], codeword_bits[byte_values & 0x0F]], axis=1
+    ).astype(np.uint8)
+    return encode, byte_bits, decode
+
+
+_ENCODE, _BYTE_BITS, _DECODE = _build_tables()
+_CODEWORD_SHIFTS = np.arange(7 * CODEWORD_BITS, -1, -CODEWORD_BITS, dtype=np.uint64)
+
+
+def encoded_bits(n_bytes: int) -> int:
+    """Numero di bit nascosti per un payload di n_bytes con ECC"""
+    return n_bytes * 2 * CODEWORD_BITS
+
+
+def hamming_encode(data: bytes) -> BitStream:
+    """
+    Codifica un payload con Hamming(7,4)
+
+    Args:
+        data: Byte del payload
+
+    Returns:
+        Stream di bit da nascondere (14 bit per byte)
+    """
+    return BitStream.from_bits(_BYTE_BITS[np.frombuffer(data, dtype=np.uint8)])
+
+
+def hamming_decode(bits: BitStream, n_bytes: int) -> tuple[bytes, int]:
+    """
+    Decodifica un payload Hamming(7,4) correggendo un bit per parola
+
+    Args:
+        bits: Stream di bit estratto dall'immagine
+        n_bytes: Lunghezza del payload originale in byte
+
+    Returns:
+        Tupla con (byte_corretti, numero_di_parole_corrette)
+    """
+    # 7 byte dello stream contengono esattamente 8 parole di codice: si
+    # ricompongono come interi a 56 bit e si separano con shift vettoriali
+    n_codewords = n_bytes * 2
+    raw = np.frombuffer(bits[: encoded_bits(n_bytes)].to_bytes(), dtype=np.uint8)
+    groups = np.pad(raw, (0, -len(raw) % CODEWORD_BITS)).reshape(-1, CODEWORD_BITS)
+    packed = np.zeros(len(groups), dtype=np.uint64)
+    for column in range(CODEWORD_BITS):
+        packed = (packed << np.uint64(8)) | groups[:, column]
+    codewords = (
+        (packed[:, None] >> _CODEWORD_SHIFTS) & np.uint64((1 << CODEWORD_BITS) - 1)
+    ).astype(np.uint8)
+    codewords = codewords.reshape(-1)[:n_codewords]
+
+    nibbles = _DECODE[codewords]
+    corrected = int(np.count_nonzero(_ENCODE[nibbles] != codewords))
+    data = (nibbles[0::2] << 4) | nibbles[1::2]
+    return data.tobytes(), corrected
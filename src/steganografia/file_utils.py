@@ -4,15 +4,15 @@ Utilità per operazioni sui file e compressione
 
 import zipfile
 from os import remove, walk
-from os.path import exists, getsize, join, relpath
+from os.path import exists, join, relpath
 
 from config.constants import CompressionMode
 
 
-def find_div(dim: int, file_path: str, n: int) -> float:
-    """Calcola il valore di divisione per la distribuzione dei bit"""
+def find_div(dim: int, n_bits: int, n: int) -> float:
+    """Calcola il valore di divisione per distribuire n_bits bit del payload"""
     image_dim = dim * n
-    div = (image_dim - n) / (getsize(file_path) * 8)
+    div = (image_dim - n) / n_bits
     return div
 
 
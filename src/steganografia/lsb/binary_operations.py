@@ -9,18 +9,67 @@ from os.path import getsize
 import numpy as np
 from PIL import Image
 
-from config.constants import CompressionMode, DataType, ErrorMessages
-
-from ..backup import backup_system
-from ..bit_operations import set_last_n_bits, string_to_bytes
+from config.constants import (
+    CompressionMode,
+    DataType,
+    ErrorMessages,
+    MetricsLevel,
+    SteganographyMethod,
+)
+
+from ..backup import BackupFile, backup_system
+from ..bit_operations import BitStream, get_last_n_bits, set_last_n_bits
+from ..capacity import region_components, usable_bytes
+from ..container import (
+    build_header,
+    carrier_region,
+    changed_rows,
+    check_header,
+    decode_payload,
+    embedded_bits,
+    encode_payload,
+    read_header,
+    write_header,
+)
 from ..file_utils import cleanup_temp_files, compress_file, find_div
 from ..metrics import QualityMetrics
 from ..validator import ParameterValidator
+from . import matrix_embedding
+
+
+def _group_positions(n_groups: int, div: float) -> np.ndarray:
+    """Posizioni dei gruppi di bit: round(0), round(div), round(2*div), ..."""
+    steps = np.full(max(n_groups - 1, 0), div, dtype=np.float64)
+    offsets = np.concatenate(([0.0], np.cumsum(steps)))[:n_groups]
+    return np.round(offsets).astype(np.int64)
 
 
 class BinarySteganography:
     """Classe per operazioni di steganografia su file binari"""
 
+    @staticmethod
+    def payload_capacity(
+        img: Image.Image, n: int = 0, matrix: bool = False, ecc: bool = False
+    ) -> int:
+        """
+        Byte di file nascondibili (n bit per componente dopo l'header)
+
+        Args:
+            img: Immagine host (RGBA usa anche il canale alpha)
+            n: Bit da modificare per componente (0 = automatico, fino a 8)
+            matrix: Se True usa il matrix embedding (solo piano LSB)
+            ecc: Se True il payload è protetto da Hamming(7,4)
+
+        Returns:
+            Numero massimo di byte del file (dopo l'eventuale compressione)
+        """
+        channels = 4 if img.mode == "RGBA" else 3
+        bits_per_component = 1 if matrix else n or 8
+        return usable_bytes(
+            region_components(img.width, img.height, channels) * bits_per_component,
+            ecc,
+        )
+
     @staticmethod
     def hide_binary_file(
         img: Image.Image,
@@ -28,7 +77,12 @@ class BinarySteganography:
         compression_mode: int = CompressionMode.NO_ZIP,
         n: int = 0,
         div: float = 0,
-        backup_file: str | None = None,
+        backup_file: BackupFile | None = None,
+        matrix: bool = False,
+        ecc: bool = False,
+        metrics_level: str = MetricsLevel.SAMPLED,
+        async_metrics: bool = False,
+        change_maps: bool = False,
     ) -> tuple[Image.Image, int, float, int, dict, float]:
         """
         Nasconde un file binario o una cartella in un'immagine
@@ -40,6 +94,12 @@ class BinarySteganography:
             n: Numero di bit da modificare per pixel
             div: Divisore per la distribuzione
             backup_file: File dove salvare i parametri
+            matrix: Se True usa il matrix embedding sul piano LSB (n e div
+                vengono ignorati)
+            ecc: Se True protegge il payload con un codice correttore d'errore
+            metrics_level: Livello delle metriche di qualità ('psnr', 'sampled', 'full')
+            async_metrics: Calcola le metriche in background (restituisce un Future)
+            change_maps: Aggiunge alle metriche le mappe delle modifiche
 
         Returns:
             Tupla con (immagine_risultato, n_finale, div_finale, dimensione_file, metrics)
@@ -62,11 +122,23 @@ class BinarySteganography:
         try:
             # Ottieni dimensione file
             total_bytes = getsize(working_file)
+            with open(working_file, "rb") as f:
+                file_data = f.read()
+
+            # Payload: byte del file (compressi se conviene, con ECC opzionale),
+            # descritti dall'header del contenitore
+            payload_bytes, file_bits, flags = encode_payload(file_data, ecc)
+            payload_size = len(payload_bytes)
 
-            # Calcolo automatico di n se necessario
-            if n == 0:
+            # Calcolo automatico di n se necessario (il matrix embedding usa
+            # sempre il solo piano LSB)
+            if matrix:
                 n = 1
-                while (img.width * img.height) * channels * n < total_bytes * 8:
+            elif n == 0:
+                n = 1
+                while (
+                    BinarySteganography.payload_capacity(img, n, ecc=ecc) < payload_size
+                ):
                     n += 1
                     if n > 8:
                         raise ValueError(
@@ -77,56 +149,63 @@ class BinarySteganography:
                             )
                         )
 
-            # Verifica dimensioni
-            ParameterValidator.validate_image_size_for_file(
-                img, total_bytes, n, channels
-            )
+            # Verifica dimensioni (righe dell'header escluse)
+            if BinarySteganography.payload_capacity(img, n, ecc=ecc) < payload_size:
+                raise ValueError(
+                    ErrorMessages.IMAGE_TOO_SMALL_FILE.format(
+                        file_size=total_bytes, width=img.width, height=img.height
+                    )
+                )
 
-            # Converte immagine in array
-            arr = np.array(img).flatten().copy()
+            # Converte immagine in array (il file va nelle righe dopo l'header)
+            img_array = np.array(img)
+            arr = carrier_region(img_array).reshape(-1)
             total_pixels_ch = len(arr)
 
-            # Calcola o valida DIV
-            if div == 0:
-                div = find_div(total_pixels_ch, working_file, n)
+            # Calcola o valida DIV (il matrix embedding usa componenti contigue)
+            if matrix:
+                div = 1.0
+            elif div == 0:
+                div = find_div(total_pixels_ch, len(file_bits), n)
             else:
                 ParameterValidator.validate_div_for_file(
-                    div, total_pixels_ch, total_bytes, n
+                    div, total_pixels_ch, -(-len(file_bits) // 8), n
                 )
 
             # Inizia a nascondere il file
             print("Nascondendo file...")
-            rsv = ""
-            ind, pos = 0.0, 0
 
-            # Leggi file
-            with open(working_file, "rb") as f:
-                f.seek(0)
-                for _ in range(total_bytes):
-                    byte = f.read(1)
-                    bits = format(ord(byte), "08b")
-                    bits = rsv + bits
-                    rsv = ""
-                    while len(bits) >= n:
-                        tmp = bits[:n]
-                        bits = bits[n:]
-                        # Setta gli ultimi n bit del pixel
-                        arr[pos] = set_last_n_bits(arr[pos], tmp, n)
-                        ind += div
-                        pos = round(ind)
-                    if len(bits) > 0:
-                        rsv = bits
-
-            # Gestisci bit rimanenti
-            while len(rsv) > 0:
-                tmp = rsv[:n]
-                rsv = rsv[n:]
-                arr[pos] = set_last_n_bits(arr[pos], tmp, n)
-                ind += div
-                pos = round(ind)
+            # Header del contenitore con i parametri di recupero
+            header_params = {"n": n, "div": div, "zip_mode": compression_mode}
+
+            if matrix:
+                k = matrix_embedding.choose_k(len(file_bits), len(arr))
+                changed = matrix_embedding.embed(arr, file_bits, k)
+                used = -(-len(file_bits) // k) * ((1 << k) - 1)
+                print(f"Matrix embedding k={k}: {changed} LSB modificati")
+                header_params["matrix_k"] = k
+            else:
+                # Gruppi di n bit (l'ultimo completato con zeri a destra)
+                n_groups = -(-len(file_bits) // n)
+                groups = file_bits.read_uints(np.arange(n_groups) * n, n)
+
+                # Setta gli ultimi n bit dei pixel alle posizioni round(k * div)
+                positions = _group_positions(n_groups, div)
+                arr[positions] = set_last_n_bits(arr[positions], groups, n)
+                used = int(positions[-1]) + 1 if n_groups else 0
+            write_header(
+                img_array,
+                build_header(
+                    SteganographyMethod.LSB,
+                    DataType.BINARY,
+                    header_params,
+                    payload_bytes,
+                    flags=flags,
+                ),
+            )
 
             percentage = format(
-                ((total_bytes * 8) / ((img.width * img.height) * channels * n)) * 100,
+                (len(file_bits) / ((img.width * img.height) * channels * n)) * 100,
                 ".2f",
             )
             print(
@@ -134,20 +213,18 @@ class BinarySteganography:
             )
 
             # Crea immagine risultato
-            result_img = Image.fromarray(arr.reshape(img.height, img.width, channels))
+            result_img = Image.fromarray(img_array)
 
-            # Calcola metriche di qualità (SSIM e PSNR)
-            # Per RGB confronto con l'originale, per RGBA converto entrambe in RGB
-            img_for_metrics = img.convert("RGB") if img.mode == "RGBA" else img
-            result_for_metrics = (
-                result_img.convert("RGB") if result_img.mode == "RGBA" else result_img
-            )
+            # Calcola metriche di qualità (SSIM e PSNR) sui soli canali RGB
             metrics = QualityMetrics.calculate_metrics(
-                img_for_metrics, result_for_metrics
-            )
-            print(
-                f"Metriche di qualità - SSIM: {metrics['ssim']:.4f}, PSNR: {metrics['psnr']:.2f} dB"
+                img,
+                img_array,
+                metrics_level,
+                changed_rows(img_array, used),
+                background=async_metrics,
+                change_maps=change_maps,
             )
+            QualityMetrics.log_metrics(metrics)
 
             # Salva i parametri per il recupero
             params = {
@@ -159,7 +236,9 @@ class BinarySteganography:
                 "original_file": file_path,
                 "channels": channels,
             }
-            backup_system.save_backup_data(DataType.BINARY, params, backup_file)
+            backup_system.save_backup_data(
+                DataType.BINARY, params, backup_file, image=img_array
+            )
 
             return (result_img, n, div, total_bytes, metrics, float(percentage))
 
@@ -176,7 +255,7 @@ class BinarySteganography:
         n: int | None = None,
         div: float | None = None,
         size: int | None = None,
-        backup_file: str | None = None,
+        backup_file: BackupFile | None = None,
     ) -> None:
         """
         Recupera un file binario da un'immagine
@@ -187,39 +266,61 @@ class BinarySteganography:
             compression_mode, n, div, size: Parametri per il recupero
             backup_file: File di backup dei parametri
         """
-        # Recupera parametri automaticamente se non forniti
-        if any(param is None for param in [compression_mode, n, div, size]):
-            print("Alcuni parametri mancanti, cercando nei backup...")
-
-            # Controlla se esistono parametri di backup
-            backup_data = None
-            if backup_file:
-                backup_data = backup_system.load_backup_data(backup_file)
-
-            # Se non ci sono backup file, controlla le variabili locali
-            if not backup_data:
-                recent_params = backup_system.get_last_params(DataType.BINARY)
-                if recent_params:
+        header = read_header(img)
+        if header is not None:
+            # I parametri scritti nell'header hanno la precedenza
+            check_header(header, SteganographyMethod.LSB, DataType.BINARY)
+            params = header["params"]
+            compression_mode = params["zip_mode"]
+            n, div = params["n"], params["div"]
+            matrix_k = params.get("matrix_k")
+            size = header["payload_length"]
+            n_bits = embedded_bits(header)
+            arr = carrier_region(np.asarray(img)).reshape(-1)
+            print(
+                f"Parametri letti dall'header: zipMode={compression_mode}, n={n}, div={div:.2f}, size={size}"
+            )
+        else:
+            # Formato precedente al contenitore: parametri forniti o dai backup
+            if any(param is None for param in [compression_mode, n, div, size]):
+                print("Alcuni parametri mancanti, cercando nei backup...")
+
+                # Controlla se esistono parametri di backup
+                backup_data = None
+                if backup_file:
+                    backup_data = backup_system.load_backup_data(
+                        backup_file, DataType.BINARY, image=img
+                    )
+
+                # Se non ci sono backup file, controlla le variabili locali
+                if not backup_data:
+                    recent_params = backup_system.get_last_params(
+                        DataType.BINARY, image=img
+                    )
+                    if recent_params:
+                        print(
+                            "Usando parametri dall'ultima operazione di occultamento file binari"
+                        )
+                        backup_data = {"type": DataType.BINARY, "params": recent_params}
+
+                if backup_data and "params" in backup_data:
+                    params = backup_data["params"]
+                    compression_mode = (
+                        compression_mode
+                        if compression_mode is not None
+                        else params.get("zipMode")
+                    )
+                    n = n if n is not None else params.get("n")
+                    div = div if div is not None else params.get("div")
+                    size = size if size is not None else params.get("size")
                     print(
-                        "Usando parametri dall'ultima operazione di occultamento file binari"
+                        f"Parametri recuperati: zipMode={compression_mode}, n={n}, div={div:.2f}, size={size}"
                     )
-                    backup_data = {"type": DataType.BINARY, "params": recent_params}
-
-            if backup_data and "params" in backup_data:
-                params = backup_data["params"]
-                compression_mode = (
-                    compression_mode
-                    if compression_mode is not None
-                    else params.get("zipMode")
-                )
-                n = n if n is not None else params.get("n")
-                div = div if div is not None else params.get("div")
-                size = size if size is not None else params.get("size")
-                print(
-                    f"Parametri recuperati: zipMode={compression_mode}, n={n}, div={div:.2f}, size={size}"
-                )
-            else:
-                raise ValueError(ErrorMessages.PARAMS_MISSING)
+                else:
+                    raise ValueError(ErrorMessages.PARAMS_MISSING)
+
+            arr = np.asarray(img).reshape(-1)
+            matrix_k = None
 
         # Verifica parametri
         ParameterValidator.validate_recovery_params(compression_mode, n, div, size)
@@ -239,11 +340,10 @@ class BinarySteganography:
         print("Cercando file...")
 
         # Inizia recupero file
-        arr = np.array(img).flatten().copy()
-        bits, res = "", ""
-        ind, pos = 0.0, 0
-        diff = size * 8
-        err = round(size * 8 / n)
+        res = ""
+        if header is None:
+            n_bits = size * 8
+        n_groups = -(-n_bits // n)
 
         # Gestione file compresso
         working_output = output_path
@@ -251,25 +351,20 @@ class BinarySteganography:
             res = output_path
             working_output = "tmp.zip"
 
-        with open(working_output, "wb") as file:
-            for _ in range(err):
-                if diff < n:
-                    bits += format(arr[pos], "08b")[-diff:]
-                else:
-                    bits += format(arr[pos], "08b")[-n:]
-
-                if len(bits) >= 1024:
-                    wr = bits[:1024]
-                    wr = string_to_bytes(wr)
-                    file.write(wr)
-                    bits = bits[1024:]
+        if matrix_k:
+            hidden_bits = matrix_embedding.extract(arr, n_bits, matrix_k)
+        else:
+            # Legge gli ultimi n bit dei pixel alle stesse posizioni usate per nascondere
+            positions = _group_positions(n_groups, div)
+            hidden_bits = BitStream.from_uints(get_last_n_bits(arr[positions], n), n)
+        if header is not None:
+            # ECC, CRC32 e decompressione prima di scrivere l'output
+            file_data = decode_payload(header, hidden_bits)
+        else:
+            file_data = hidden_bits[: size * 8].to_bytes()
 
-                ind += div
-                pos = round(ind)
-
-            if bits:
-                bits = string_to_bytes(bits)
-                file.write(bits)
+        with open(working_output, "wb") as file:
+            file.write(file_data)
 
         # Gestione decompressione
         if compression_mode == CompressionMode.NO_ZIP:
@@ -5,17 +5,56 @@ Operazioni di steganografia per le immagini
 import numpy as np
 from PIL import Image
 
-from config.constants import DataType, ErrorMessages
-
-from ..backup import backup_system
-from ..bit_operations import set_last_n_bits
+from config.constants import (
+    DataType,
+    ErrorMessages,
+    MetricsLevel,
+    SteganographyMethod,
+)
+
+from ..backup import BackupFile, backup_system
+from ..bit_operations import BitStream, get_last_n_bits, set_last_n_bits
+from ..capacity import region_components
+from ..container import (
+    build_header,
+    carrier_region,
+    changed_rows,
+    check_header,
+    read_header,
+    verify_payload,
+    write_header,
+)
 from ..metrics import QualityMetrics
 from ..validator import ParameterValidator
 
 
+def _group_positions(n_groups: int, div: float) -> np.ndarray:
+    """Posizioni (float) dei gruppi di bit: 0, div, 2*div, ... sommate come nel ciclo"""
+    steps = np.full(max(n_groups - 1, 0), div, dtype=np.float64)
+    return np.concatenate(([0.0], np.cumsum(steps)))[:n_groups]
+
+
 class ImageSteganography:
     """Classe per operazioni di steganografia su immagini"""
 
+    @staticmethod
+    def payload_capacity(host_img: Image.Image, lsb: int = 0, msb: int = 8) -> int:
+        """
+        Byte (componenti RGB) dell'immagine segreta nascondibili
+
+        Args:
+            host_img: Immagine che nasconde
+            lsb: Bit di host_img da modificare (0 = automatico, al più msb)
+            msb: Bit di ogni componente segreta da nascondere
+
+        Returns:
+            Numero massimo di componenti segrete (larghezza * altezza * 3)
+        """
+        components = region_components(host_img.width, host_img.height)
+        if lsb == 0 or msb == 0:
+            return components
+        return components * lsb // msb
+
     @staticmethod
     def hide_image(
         host_img: Image.Image,
@@ -23,7 +62,10 @@ class ImageSteganography:
         lsb: int = 0,
         msb: int = 8,
         div: float = 0,
-        backup_file: str | None = None,
+        backup_file: BackupFile | None = None,
+        metrics_level: str = MetricsLevel.SAMPLED,
+        async_metrics: bool = False,
+        change_maps: bool = False,
     ) -> tuple[Image.Image, int, int, float, int, int, dict, float]:
         """
         Nasconde un'immagine in un'altra
@@ -35,6 +77,9 @@ class ImageSteganography:
             msb: Numero di bit più significativi di secret_img da nascondere
             div: Divisore per la distribuzione
             backup_file: File dove salvare i parametri
+            metrics_level: Livello delle metriche di qualità ('psnr', 'sampled', 'full')
+            async_metrics: Calcola le metriche in background (restituisce un Future)
+            change_maps: Aggiunge alle metriche le mappe delle modifiche
 
         Returns:
             Tupla con (immagine_risultato, lsb_finale, msb_finale, div_finale, width, height, metrics, percentuale)
@@ -45,11 +90,10 @@ class ImageSteganography:
         ParameterValidator.validate_msb(msb)
 
         # Determina LSB e MSB automatici se necessario
+        secret_size = secret_img.width * secret_img.height * 3
         if lsb == 0:
             lsb = 1
-            while (lsb * host_img.width * host_img.height * 3) < (
-                msb * secret_img.width * secret_img.height * 3
-            ):
+            while ImageSteganography.payload_capacity(host_img, lsb, msb) < secret_size:
                 lsb += 1
                 if lsb > msb:
                     # Se LSB supera MSB, riparti da 1 e riduci MSB
@@ -69,8 +113,16 @@ class ImageSteganography:
                 f"Modalità automatica: LSB={lsb}, MSB={msb} calcolati automaticamente"
             )
 
-        # Verifica dimensioni
-        ParameterValidator.validate_image_size_for_image(host_img, secret_img, lsb, msb)
+        # Verifica dimensioni (righe dell'header escluse)
+        if ImageSteganography.payload_capacity(host_img, lsb, msb) < secret_size:
+            raise ValueError(
+                ErrorMessages.IMAGE_TOO_SMALL_IMAGE.format(
+                    host_width=host_img.width,
+                    host_height=host_img.height,
+                    secret_width=secret_img.width,
+                    secret_height=secret_img.height,
+                )
+            )
 
         # Converte immagini in RGB
         if host_img.mode != "RGB":
@@ -80,8 +132,9 @@ class ImageSteganography:
 
         # Inizia a nascondere l'immagine
         print("Nascondendo immagine...")
-        arr1 = np.array(host_img).flatten().copy()
-        arr2 = np.array(secret_img).flatten().copy()
+        host_array = np.array(host_img)
+        arr1 = carrier_region(host_array).reshape(-1)  # Righe dopo l'header
+        arr2 = np.asarray(secret_img).reshape(-1)  # Solo lettura
 
         if div == 0:
             div = (len(arr1) * lsb) / (len(arr2) * msb)
@@ -90,52 +143,32 @@ class ImageSteganography:
                 div, len(arr1), len(arr2), lsb, msb
             )
 
-        # Algoritmo per nascondere l'immagine
-        pos_in_img1 = 0.0
-        bit_buffer = ""
-
-        for i in range(0, len(arr2), 3):  # Processa ogni pixel di secret_img (RGB)
-            if i + 2 >= len(arr2):
-                break
-
-            # Estrai i bit più significativi da ogni canale di secret_img
-            r_bits = format(arr2[i], "08b")[:msb]
-            g_bits = format(arr2[i + 1], "08b")[:msb]
-            b_bits = format(arr2[i + 2], "08b")[:msb]
-
-            # Aggiungi tutti i bit al buffer
-            bit_buffer += r_bits + g_bits + b_bits
-
-            # Inserisci i bit in host_img quando ne abbiamo abbastanza
-            while len(bit_buffer) >= lsb and pos_in_img1 < len(arr1):
-                # Prendi lsb bit dal buffer
-                bits_to_hide = bit_buffer[:lsb]
-                bit_buffer = bit_buffer[lsb:]
-
-                # Nascondili nel pixel corrente di host_img
-                pixel_pos = int(pos_in_img1)
-                if pixel_pos < len(arr1):
-                    arr1[pixel_pos] = set_last_n_bits(
-                        arr1[pixel_pos], bits_to_hide, lsb
-                    )
-
-                # Avanza nella posizione di host_img
-                pos_in_img1 += div
+        # Flusso dei bit segreti: i primi msb bit di ogni componente (R, G, B)
+        secret_bits = BitStream.from_uints(arr2 >> (8 - msb), msb)
 
-        # Gestisci eventuali bit rimanenti nel buffer
-        if bit_buffer and pos_in_img1 < len(arr1):
-            # Padda i bit rimanenti con zeri a destra per raggiungere lsb bit
-            while len(bit_buffer) < lsb:
-                bit_buffer += "0"
+        # Gruppi di lsb bit (l'ultimo completato con zeri a destra) e posizioni
+        # in host_img: la posizione avanza di div a ogni gruppo
+        n_groups = -(-len(secret_bits) // lsb)
+        groups = secret_bits.read_uints(np.arange(n_groups) * lsb, lsb)
+        positions = _group_positions(n_groups, div)
+        fits = positions < len(arr1)
+        pixel_pos = positions[fits].astype(np.int64)
+        arr1[pixel_pos] = set_last_n_bits(arr1[pixel_pos], groups[fits], lsb)
 
-            pixel_pos = int(pos_in_img1)
-            if pixel_pos < len(arr1):
-                arr1[pixel_pos] = set_last_n_bits(
-                    arr1[pixel_pos], bit_buffer[:lsb], lsb
-                )
+        # Header del contenitore con i parametri di recupero
+        w, h = secret_img.width, secret_img.height
+        header_params = {"lsb": lsb, "msb": msb, "div": div, "width": w, "height": h}
+        write_header(
+            host_array,
+            build_header(
+                SteganographyMethod.LSB,
+                DataType.IMAGE,
+                header_params,
+                secret_bits.to_bytes(),
+            ),
+        )
 
         # Crea immagine risultato
-        w, h = secret_img.width, secret_img.height
         percentage = format(
             (msb * secret_img.width * secret_img.height * 3)
             / (lsb * host_img.width * host_img.height * 3)
@@ -146,13 +179,19 @@ class ImageSteganography:
             f"TERMINATO - Percentuale di pixel usati con lsb={lsb}, msb={msb} e div={div:.2f}: {percentage}%"
         )
 
-        result_img = Image.fromarray(arr1.reshape(host_img.height, host_img.width, 3))
+        result_img = Image.fromarray(host_array)
 
         # Calcola metriche di qualità (SSIM e PSNR)
-        metrics = QualityMetrics.calculate_metrics(host_img, result_img)
-        print(
-            f"Metriche di qualità - SSIM: {metrics['ssim']:.4f}, PSNR: {metrics['psnr']:.2f} dB"
+        used = int(pixel_pos[-1]) + 1 if len(pixel_pos) else 0
+        metrics = QualityMetrics.calculate_metrics(
+            host_img,
+            host_array,
+            metrics_level,
+            changed_rows(host_array, used),
+            background=async_metrics,
+            change_maps=change_maps,
         )
+        QualityMetrics.log_metrics(metrics)
 
         # Salva i parametri per il recupero
         params = {
@@ -165,7 +204,9 @@ class ImageSteganography:
             "original_img1_size": (host_img.width, host_img.height),
             "original_img2_size": (secret_img.width, secret_img.height),
         }
-        backup_system.save_backup_data(DataType.IMAGE, params, backup_file)
+        backup_system.save_backup_data(
+            DataType.IMAGE, params, backup_file, image=host_array
+        )
 
         return (result_img, lsb, msb, div, w, h, metrics, float(percentage))
 
@@ -178,7 +219,7 @@ class ImageSteganography:
         div: float | None = None,
         width: int | None = None,
         height: int | None = None,
-        backup_file: str | None = None,
+        backup_file: BackupFile | None = None,
     ) -> Image.Image:
         """
         Recupera un'immagine nascosta da un'altra
@@ -194,36 +235,57 @@ class ImageSteganography:
         """
         print("Cercando immagine nascosta...")
 
-        # Recupera parametri automaticamente se non forniti
-        if any(param is None for param in [lsb, msb, div, width, height]):
-            print("Alcuni parametri mancanti, cercando nei backup...")
-
-            # Controlla se esistono parametri di backup
-            backup_data = None
-            if backup_file:
-                backup_data = backup_system.load_backup_data(backup_file)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+
+        header = read_header(img)
+        if header is not None:
+            # I parametri scritti nell'header hanno la precedenza
+            check_header(header, SteganographyMethod.LSB, DataType.IMAGE)
+            params = header["params"]
+            lsb, msb, div = params["lsb"], params["msb"], params["div"]
+            width, height = params["width"], params["height"]
+            arr = carrier_region(np.asarray(img)).reshape(-1)
+            print(
+                f"Parametri letti dall'header: lsb={lsb}, msb={msb}, div={div:.2f}, size={width}x{height}"
+            )
+        else:
+            # Formato precedente al contenitore: parametri forniti o dai backup
+            if any(param is None for param in [lsb, msb, div, width, height]):
+                print("Alcuni parametri mancanti, cercando nei backup...")
+
+                # Controlla se esistono parametri di backup
+                backup_data = None
+                if backup_file:
+                    backup_data = backup_system.load_backup_data(
+                        backup_file, DataType.IMAGE, image=img
+                    )
 
-            # Se non ci sono backup file, controlla le variabili locali
-            if not backup_data:
-                recent_params = backup_system.get_last_params(DataType.IMAGE)
-                if recent_params:
+                # Se non ci sono backup file, controlla le variabili locali
+                if not backup_data:
+                    recent_params = backup_system.get_last_params(
+                        DataType.IMAGE, image=img
+                    )
+                    if recent_params:
+                        print(
+                            "Usando parametri dall'ultima operazione di occultamento immagini"
+                        )
+                        backup_data = {"type": DataType.IMAGE, "params": recent_params}
+
+                if backup_data and "params" in backup_data:
+                    params = backup_data["params"]
+                    lsb = lsb if lsb is not None else params.get("lsb")
+                    msb = msb if msb is not None else params.get("msb")
+                    div = div if div is not None else params.get("div")
+                    width = width if width is not None else params.get("width")
+                    height = height if height is not None else params.get("height")
                     print(
-                        "Usando parametri dall'ultima operazione di occultamento immagini"
+                        f"Parametri recuperati: lsb={lsb}, msb={msb}, div={div:.2f}, size={width}x{height}"
                     )
-                    backup_data = {"type": DataType.IMAGE, "params": recent_params}
-
-            if backup_data and "params" in backup_data:
-                params = backup_data["params"]
-                lsb = lsb if lsb is not None else params.get("lsb")
-                msb = msb if msb is not None else params.get("msb")
-                div = div if div is not None else params.get("div")
-                width = width if width is not None else params.get("width")
-                height = height if height is not None else params.get("height")
-                print(
-                    f"Parametri recuperati: lsb={lsb}, msb={msb}, div={div:.2f}, size={width}x{height}"
-                )
-            else:
-                raise ValueError(ErrorMessages.PARAMS_MISSING)
+                else:
+                    raise ValueError(ErrorMessages.PARAMS_MISSING)
+
+            arr = np.asarray(img).reshape(-1)
 
         # Verifica che tutti i parametri siano validi
         ParameterValidator.validate_recovery_params(lsb, msb, div, width, height)
@@ -234,37 +296,21 @@ class ImageSteganography:
 
         # Recupera immagine
         size = width * height * 3
-        arr = np.array(img).flatten().copy()
         res = np.zeros(size, dtype=np.uint8)
 
-        # Algoritmo per estrarre l'immagine
-        pos_in_img1 = 0.0
-        bit_buffer = ""
-        pixels_written = 0
-
-        while pixels_written < size and pos_in_img1 < len(arr):
-            # Estrai lsb bit dal pixel corrente
-            pixel_pos = int(pos_in_img1)
-            if pixel_pos < len(arr):
-                extracted_bits = format(arr[pixel_pos], "08b")[-lsb:]
-                bit_buffer += extracted_bits
-
-            # Quando abbiamo abbastanza bit, ricostruisci un pixel
-            while len(bit_buffer) >= msb and pixels_written < size:
-                # Prendi msb bit dal buffer
-                pixel_bits = bit_buffer[:msb]
-                bit_buffer = bit_buffer[msb:]
-
-                # Padda a sinistra con zeri per ottenere 8 bit
-                while len(pixel_bits) < 8:
-                    pixel_bits = pixel_bits + "0"
-
-                # Converte in valore pixel e salva
-                res[pixels_written] = int(pixel_bits, 2)
-                pixels_written += 1
-
-            # Avanza nella posizione
-            pos_in_img1 += div
+        # Algoritmo per estrarre l'immagine: stesse posizioni usate per nascondere
+        n_groups = -(-size * msb // lsb)
+        positions = _group_positions(n_groups, div)
+        positions = positions[positions < len(arr)].astype(np.int64)
+        hidden_bits = BitStream.from_uints(get_last_n_bits(arr[positions], lsb), lsb)
+        if header is not None:
+            verify_payload(header, hidden_bits[: size * msb].to_bytes())
+
+        # Ricostruisce i pixel: msb bit per componente, completati con zeri a destra
+        pixels_written = min(size, len(hidden_bits) // msb)
+        res[:pixels_written] = hidden_bits.read_uints(
+            np.arange(pixels_written) * msb, msb
+        ) << (8 - msb)
 
         # Converte il risultato in immagine
         try:
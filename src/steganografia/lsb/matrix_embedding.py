@@ -0,0 +1,94 @@
+"""
+Matrix embedding (codifica a sindrome di Hamming) sul piano LSB
+
+Ogni blocco di 2^k - 1 componenti trasporta k bit nella sindrome dei propri
+LSB: la sindrome è lo XOR degli indici (da 1) delle componenti con LSB a 1.
+Per scrivere k bit basta invertire al più un LSB per blocco (quello con
+indice sindrome XOR messaggio), contro la metà dei bit toccati del LSB
+classico. Sindromi e modifiche sono calcolate su tutti i blocchi in blocco.
+"""
+
+import numpy as np
+
+from ..bit_operations import BitStream
+
+MAX_K = 16  # Blocchi da 65535 componenti al massimo
+
+
+def choose_k(n_bits: int, n_cover: int) -> int:
+    """
+    Sceglie il k più grande con cui il payload entra nel carrier
+
+    Un k più grande modifica meno LSB per bit nascosto ma usa blocchi più
+    lunghi: si prende il massimo compatibile con la capacità.
+
+    Args:
+        n_bits: Bit da nascondere
+        n_cover: Componenti disponibili
+
+    Returns:
+        k (1 equivale al LSB classico)
+
+    Raises:
+        ValueError: Se il payload non entra nemmeno con k = 1
+    """
+    if n_bits > n_cover:
+        raise ValueError(
+            f"Payload troppo grande per il matrix embedding: {n_bits} bit, "
+            f"{n_cover} componenti disponibili"
+        )
+    best = 1
+    for k in range(2, MAX_K + 1):
+        if (n_cover // ((1 << k) - 1)) * k < n_bits:
+            break
+        best = k
+    return best
+
+
+def _syndromes(blocks: np.ndarray) -> np.ndarray:
+    """Sindrome di ogni blocco: XOR degli indici (da 1) con LSB a 1"""
+    indices = np.arange(1, blocks.shape[1] + 1, dtype=np.uint32)
+    return np.bitwise_xor.reduce((blocks & 1) * indices, axis=1)
+
+
+def embed(cover: np.ndarray, bits: BitStream, k: int) -> int:
+    """
+    Nasconde i bit negli LSB di cover (array piatto uint8, in place)
+
+    Args:
+        cover: Componenti del carrier (vista piatta modificabile)
+        bits: Bit da nascondere
+        k: Bit per blocco di 2^k - 1 componenti
+
+    Returns:
+        Numero di LSB modificati
+    """
+    block_size = (1 << k) - 1
+    n_blocks = -(-len(bits) // k)
+    blocks = cover[: n_blocks * block_size].reshape(n_blocks, block_size)
+
+    # L'ultimo gruppo di bit è completato con zeri a destra
+    message = bits.read_uints(np.arange(n_blocks, dtype=np.int64) * k, k)
+    flip = _syndromes(blocks) ^ message.astype(np.uint32)
+
+    rows = np.flatnonzero(flip)
+    blocks[rows, flip[rows].astype(np.int64) - 1] ^= 1
+    return len(rows)
+
+
+def extract(cover: np.ndarray, n_bits: int, k: int) -> BitStream:
+    """
+    Recupera n_bits bit dalle sindromi dei blocchi di cover
+
+    Args:
+        cover: Componenti del carrier (array piatto uint8)
+        n_bits: Bit da recuperare
+        k: Bit per blocco usato durante l'embedding
+
+    Returns:
+        Stream con i bit recuperati
+    """
+    block_size = (1 << k) - 1
+    n_blocks = -(-n_bits // k)
+    blocks = cover[: n_blocks * block_size].reshape(n_blocks, block_size)
+    return BitStream.from_uints(_syndromes(blocks), k)[:n_bits]
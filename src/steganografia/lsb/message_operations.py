@@ -2,27 +2,75 @@
 Operazioni di steganografia LSB per i messaggi (stringhe)
 """
 
+import numpy as np
 from PIL import Image
 
-from config.constants import DataType, ErrorMessages
+from config.constants import (
+    DataType,
+    ErrorMessages,
+    MetricsLevel,
+    SteganographyMethod,
+)
 
-from ..backup import backup_system
+from ..backup import BackupFile, backup_system
 from ..bit_operations import (
-    binary_convert,
-    binary_convert_back,
-    set_color_component,
-    set_last_bit,
+    BitStream,
+    bits_to_text,
+    decode_text,
+    encode_text,
+    get_last_n_bits,
+    set_last_n_bits,
+    xor_checksum,
+)
+from ..capacity import region_components, usable_bytes
+from ..container import (
+    build_header,
+    carrier_region,
+    changed_rows,
+    check_header,
+    decode_payload,
+    embedded_bits,
+    encode_payload,
+    read_header,
+    write_header,
 )
 from ..metrics import QualityMetrics
-from ..validator import ParameterValidator
+from . import matrix_embedding
+
+# Header magico e terminatore del formato precedente al contenitore (16 bit)
+MAGIC_HEADER = "1010101011110000"
+TERMINATOR = "1111000011110000"
 
 
 class MessageSteganography:
     """Classe per operazioni di steganografia LSB su stringhe"""
 
+    @staticmethod
+    def payload_capacity(img: Image.Image, ecc: bool = False) -> int:
+        """
+        Byte di payload nascondibili (un bit per componente dopo l'header)
+
+        Il matrix embedding non cambia la capacità: con k=1 usa ogni componente.
+
+        Args:
+            img: Immagine host
+            ecc: Se True il payload è protetto da Hamming(7,4)
+
+        Returns:
+            Numero massimo di byte del payload (dopo l'eventuale compressione)
+        """
+        return usable_bytes(region_components(img.width, img.height), ecc)
+
     @staticmethod
     def hide_message(
-        img: Image.Image, message: str, backup_file: str | None = None
+        img: Image.Image,
+        message: str,
+        backup_file: BackupFile | None = None,
+        ecc: bool = False,
+        matrix: bool = False,
+        metrics_level: str = MetricsLevel.SAMPLED,
+        async_metrics: bool = False,
+        change_maps: bool = False,
     ) -> tuple[Image.Image, dict, float]:
         """
         Nasconde una stringa in un'immagine
@@ -31,82 +79,86 @@ class MessageSteganography:
             img: Immagine PIL dove nascondere il messaggio
             message: Messaggio da nascondere
             backup_file: File dove salvare i parametri di backup
+            ecc: Se True protegge il payload con un codice correttore d'errore
+            matrix: Se True usa il matrix embedding (meno LSB modificati per bit)
+            metrics_level: Livello delle metriche di qualità ('psnr', 'sampled', 'full')
+            async_metrics: Calcola le metriche in background (restituisce un Future)
+            change_maps: Aggiunge alle metriche le mappe delle modifiche
 
         Returns:
             Tupla con (immagine_con_messaggio, metrics, percentuale) dove metrics è un dizionario con 'ssim' e 'psnr' e percentuale è la percentuale di pixel usati
         """
-        # Validazione
-        ParameterValidator.validate_image_size_for_message(img, message)
-
         # Converte in RGB se necessario
         if img.mode != "RGB":
             img = img.convert("RGB")
 
         # Inizia a nascondere
         print("Nascondendo messaggio...")
-        img_copy = img.copy()
-        mat = img_copy.load()
-        if mat is None:
-            raise ValueError("Impossibile caricare i dati dell'immagine")
 
-        # Crea il payload con header robusto
-        msg_binary = binary_convert(message)
-
-        # Header magico (16 bit): 1010101011110000
-        magic_header = "1010101011110000"
-
-        # Lunghezza del messaggio (32 bit): per sapere esattamente quanti caratteri leggere
-        msg_length = format(len(message), "032b")
-
-        # Calcola checksum semplice (16 bit): XOR di tutti i byte del messaggio
-        checksum = 0
-        for char in message:
-            checksum ^= ord(char)
-        checksum_binary = format(checksum, "016b")
-
-        # Terminatore (16 bit) - pattern complesso per evitare falsi positivi
-        terminator = "1111000011110000"
-
-        # Costruisce il payload completo: HEADER + LENGTH + CHECKSUM + MESSAGE + TERMINATOR
-        full_payload = (
-            magic_header + msg_length + checksum_binary + msg_binary + terminator
+        # Payload: byte UTF-8 del messaggio (compressi se conviene, con ECC
+        # opzionale), descritti dall'header del contenitore
+        payload_bytes, payload, flags = encode_payload(encode_text(message), ecc)
+        if len(payload_bytes) > MessageSteganography.payload_capacity(img, ecc):
+            raise ValueError(
+                ErrorMessages.IMAGE_TOO_SMALL_MESSAGE.format(
+                    msg_len=len(payload_bytes), width=img.width, height=img.height
+                )
+            )
+
+        # Nasconde il payload nell'LSB delle componenti dopo le righe dell'header
+        img_array = np.array(img)
+        region = carrier_region(img_array).reshape(-1)
+        if matrix:
+            k = matrix_embedding.choose_k(len(payload), len(region))
+            changed = matrix_embedding.embed(region, payload, k)
+            used = -(-len(payload) // k) * ((1 << k) - 1)
+            print(f"Matrix embedding k={k}: {changed} LSB modificati")
+            header_params = {"matrix_k": k}
+        else:
+            region[: len(payload)] = set_last_n_bits(
+                region[: len(payload)], payload.to_bits(), 1
+            )
+            used = len(payload)
+            header_params = {}
+        header = build_header(
+            SteganographyMethod.LSB,
+            DataType.STRING,
+            header_params,
+            payload_bytes,
+            flags=flags,
         )
-        msg_list = list(full_payload)
-
-        for i in range(img.width):
-            for j in range(img.height):
-                for z in range(3):
-                    if msg_list:
-                        bit = msg_list.pop(0)
-                        pixel = mat[i, j]
-                        color = int(pixel[z])  # type: ignore[index]
-                        color = set_last_bit(color, bit)
-                        mat = set_color_component(mat, i, j, color, z)
-                    else:
-                        break
-
-        original_len = len(full_payload)
+        write_header(img_array, header)
+        img_copy = Image.fromarray(img_array)
+
         percentage = format(
-            ((original_len / ((img.width * img.height) * 3)) * 100), ".2f"
+            (((len(header) + used) / ((img.width * img.height) * 3)) * 100),
+            ".2f",
         )
         print(
-            f"TERMINATO - Percentuale di pixel usati: {percentage}% (Header: {len(magic_header + msg_length + checksum_binary + terminator)} bit, Messaggio: {len(msg_binary)} bit)"
+            f"TERMINATO - Percentuale di pixel usati: {percentage}% (Header: {len(header)} bit, Messaggio: {len(payload)} bit)"
         )
 
         # Salva i parametri per il recupero
         params = {"original_message": message, "method": "string"}
-        backup_system.save_backup_data(DataType.STRING, params, backup_file)
+        backup_system.save_backup_data(
+            DataType.STRING, params, backup_file, image=img_array
+        )
 
         # Calcola metriche di qualità (SSIM e PSNR)
-        metrics = QualityMetrics.calculate_metrics(img, img_copy)
-        print(
-            f"Metriche di qualità - SSIM: {metrics['ssim']:.4f}, PSNR: {metrics['psnr']:.2f} dB"
+        metrics = QualityMetrics.calculate_metrics(
+            img,
+            img_array,
+            metrics_level,
+            changed_rows(img_array, used),
+            background=async_metrics,
+            change_maps=change_maps,
         )
+        QualityMetrics.log_metrics(metrics)
 
         return img_copy, metrics, float(percentage)
 
     @staticmethod
-    def get_message(img: Image.Image, backup_file: str | None = None) -> str:
+    def get_message(img: Image.Image, backup_file: BackupFile | None = None) -> str:
         """
         Recupera un messaggio nascosto da un'immagine
 
@@ -117,55 +169,87 @@ class MessageSteganography:
         Returns:
             Messaggio recuperato
         """
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+
+        header = read_header(img)
+        if header is None:
+            return MessageSteganography._get_legacy_message(img, backup_file)
+        check_header(header, SteganographyMethod.LSB, DataType.STRING)
+
+        # Legge il payload dall'LSB delle componenti dopo l'header
+        n_bits = embedded_bits(header)
+        region = carrier_region(np.asarray(img)).reshape(-1)
+        if n_bits > len(region):
+            raise ValueError(ErrorMessages.DECODE_FAILED)
+        k = header["params"].get("matrix_k")
+        if k:
+            payload = matrix_embedding.extract(region, n_bits, k)
+        else:
+            payload = BitStream.from_bits(get_last_n_bits(region[:n_bits], 1))
+
+        message = decode_text(decode_payload(header, payload))
+        print(f"Messaggio recuperato: {len(message)} caratteri")
+        return message
+
+    @staticmethod
+    def has_legacy_payload(img: Image.Image) -> bool:
+        """
+        Verifica se l'immagine contiene un messaggio nel formato precedente
+
+        Legge solo le prime colonne: l'header magico va cercato nei primi 1000
+        bit e la lunghezza che lo segue deve essere plausibile.
+        """
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+
+        search_limit = min(1000, img.width * img.height * 3 - 72)
+        columns = min(img.width, -(-(search_limit + 48) // (img.height * 3)))
+        scan = np.asarray(img.crop((0, 0, columns, img.height)))
+        bits = BitStream.from_bits(
+            get_last_n_bits(scan.transpose(1, 0, 2).reshape(-1), 1)
+        )
+
+        start_pos = bits.find(BitStream.from_str(MAGIC_HEADER), 0, search_limit)
+        if start_pos == -1 or start_pos + 48 > len(bits):
+            return False
+        return 0 < bits.read_uint(start_pos + 16, 32) <= 10000
+
+    @staticmethod
+    def _get_legacy_message(
+        img: Image.Image, backup_file: BackupFile | None = None
+    ) -> str:
+        """
+        Recupera un messaggio nascosto prima dell'introduzione del contenitore
+
+        Il formato precedente scorre l'immagine per colonne e delimita il
+        messaggio con header magico, lunghezza, checksum XOR e terminatore.
+        """
         # Controlla se esistono parametri di backup
         backup_data = None
         if backup_file:
-            backup_data = backup_system.load_backup_data(backup_file)
+            backup_data = backup_system.load_backup_data(
+                backup_file, DataType.STRING, image=img
+            )
 
         # Se non ci sono backup file, controlla le variabili locali
         if not backup_data:
-            recent_params = backup_system.get_last_params(DataType.STRING)
+            recent_params = backup_system.get_last_params(DataType.STRING, image=img)
             if recent_params:
                 print("Usando parametri dall'ultima operazione di occultamento")
                 backup_data = {"type": DataType.STRING, "params": recent_params}
 
-        if img.mode != "RGB":
-            img = img.convert("RGB")
-
-        # Inizia la procedura di recupero
-        mat = img.load()
-        if mat is None:
-            raise ValueError("Impossibile caricare i dati dell'immagine")
-
-        # Estrae tutti i bit dall'immagine
-        all_bits = []
-        for i in range(img.width):
-            for j in range(img.height):
-                for z in range(3):
-                    pixel = mat[i, j]
-                    color = int(pixel[z])  # type: ignore[index]
-                    bit = format(color, "08b")[-1]
-                    all_bits.append(bit)
-
-        # Cerca l'header magico
-        magic_header = "1010101011110000"
-        header_found = False
-        start_pos = 0
+        # Estrae tutti i bit dall'immagine (stesso ordine di scansione dell'hide)
+        scan = np.asarray(img).transpose(1, 0, 2).reshape(-1)
+        all_bits = BitStream.from_bits(get_last_n_bits(scan, 1))
 
         # Cerca l'header nei primi bit dell'immagine (entro i primi 1000 bit per performance)
         search_limit = min(
             1000, len(all_bits) - 72
         )  # 72 = header(16) + length(32) + checksum(16) + min_terminator(8)
+        start_pos = all_bits.find(BitStream.from_str(MAGIC_HEADER), 0, search_limit)
 
-        for pos in range(search_limit):
-            if pos + 16 <= len(all_bits):
-                candidate_header = "".join(all_bits[pos : pos + 16])
-                if candidate_header == magic_header:
-                    header_found = True
-                    start_pos = pos
-                    break
-
-        if not header_found:
+        if start_pos == -1:
             raise ValueError(ErrorMessages.NO_MESSAGE_FOUND)
 
         print(f"Header magico trovato alla posizione {start_pos}")
@@ -175,25 +259,20 @@ class MessageSteganography:
         if length_start + 32 > len(all_bits):
             raise ValueError(ErrorMessages.DECODE_FAILED)
 
-        length_bits = "".join(all_bits[length_start : length_start + 32])
-        try:
-            message_length = int(length_bits, 2)
-        except ValueError:
-            raise ValueError(ErrorMessages.DECODE_FAILED)
+        message_length = all_bits.read_uint(length_start, 32)
 
         # Controllo di sanità sulla lunghezza
         if message_length <= 0 or message_length > 10000:  # Limite ragionevole
             raise ValueError(ErrorMessages.NO_MESSAGE_FOUND)
 
-        print(f"Lunghezza messaggio attesa: {message_length} caratteri")
+        print(f"Lunghezza messaggio attesa: {message_length} byte")
 
         # Estrae il checksum (16 bit dopo la lunghezza)
         checksum_start = length_start + 32
         if checksum_start + 16 > len(all_bits):
             raise ValueError(ErrorMessages.DECODE_FAILED)
 
-        checksum_bits = "".join(all_bits[checksum_start : checksum_start + 16])
-        expected_checksum = int(checksum_bits, 2)
+        expected_checksum = all_bits.read_uint(checksum_start, 16)
 
         # Estrae il messaggio (message_length * 8 bit dopo il checksum)
         message_start = checksum_start + 16
@@ -202,29 +281,25 @@ class MessageSteganography:
         if message_start + message_bits_length > len(all_bits):
             raise ValueError(ErrorMessages.DECODE_FAILED)
 
-        message_bits = "".join(
-            all_bits[message_start : message_start + message_bits_length]
-        )
+        message_bits = all_bits[message_start : message_start + message_bits_length]
 
         # Verifica il terminatore (16 bit dopo il messaggio)
         terminator_start = message_start + message_bits_length
         if terminator_start + 16 > len(all_bits):
             raise ValueError(ErrorMessages.DECODE_FAILED)
 
-        terminator_bits = "".join(all_bits[terminator_start : terminator_start + 16])
-        if terminator_bits != "1111000011110000":
+        terminator_bits = all_bits[terminator_start : terminator_start + 16]
+        if terminator_bits != BitStream.from_str(TERMINATOR):
             raise ValueError(ErrorMessages.NO_MESSAGE_FOUND)
 
         # Decodifica il messaggio
         try:
-            message = binary_convert_back(message_bits)
+            message = bits_to_text(message_bits)
         except Exception as e:
             raise ValueError(ErrorMessages.DECODE_FAILED) from e
 
         # Verifica il checksum
-        calculated_checksum = 0
-        for char in message:
-            calculated_checksum ^= ord(char)
+        calculated_checksum = xor_checksum(message_bits.to_bytes())
 
         if calculated_checksum != expected_checksum:
             raise ValueError("Messaggio corrotto: checksum non valido")
@@ -1,70 +1,499 @@
 """
 Metriche di qualità per la steganografia
 Calcola SSIM (Structural Similarity Index) e PSNR (Peak Signal-to-Noise Ratio)
+
+Il costo dipende dal livello (MetricsLevel): MSE/PSNR sono sempre esatti e
+calcolati in un solo passaggio, l'SSIM è stimato su tile campionate in modo
+deterministico (con un margine d'errore) oppure calcolato a piena risoluzione
+solo se richiesto.
+
+Il confronto è limitato alle righe modificate (indicate dal metodo o ricavate
+dalle immagini): fuori da quelle righe l'errore è nullo e le finestre SSIM
+confrontano pixel identici (SSIM 1), quindi il costo segue il payload e non
+le dimensioni del carrier.
+
+Con background=True il calcolo avviene in un pool di thread condiviso e il
+chiamante riceve subito un Future, così l'immagine stego è disponibile senza
+attendere le metriche.
 """
 
-import warnings
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import numpy as np
 from PIL import Image
-from skimage.metrics import peak_signal_noise_ratio as psnr
 from skimage.metrics import structural_similarity as ssim
 
+from config.constants import MetricsLevel
+
+
+def _heat_palette() -> np.ndarray:
+    """Palette in falsi colori (nero -> rosso -> giallo -> bianco) per la heatmap"""
+    ramp = np.arange(256) / 255 * 3
+    channels = [np.clip(ramp - offset, 0, 1) for offset in range(3)]
+    return (np.stack(channels, axis=1) * 255).round().astype(np.uint8)
+
+
+_HEAT_PALETTE = _heat_palette()
+
+
+def heat_image(fraction: np.ndarray) -> Image.Image:
+    """Immagine in falsi colori di una mappa con valori tra 0 e 1"""
+    return Image.fromarray(
+        _HEAT_PALETTE[(fraction * 255).round().astype(np.intp)], mode="RGB"
+    )
+
 
 class QualityMetrics:
     """Classe per calcolare metriche di qualità delle immagini"""
 
+    # Campionamento SSIM: tile quadrate distribuite uniformemente sull'immagine
+    TILE_SIZE = 64
+    MAX_TILES = 32
+
+    # Finestra dell'SSIM (default di scikit-image)
+    WIN_SIZE = 7
+
+    # Mappe delle modifiche: lato massimo del residuo e celle della heatmap
+    PREVIEW_SIZE = 512
+    HEATMAP_CELLS = 64
+
+    # Pool condiviso per il calcolo in background (creato al primo uso, sotto
+    # lock: più sessioni possono chiedere metriche in background insieme)
+    MAX_WORKERS = 2
+    _executor: ThreadPoolExecutor | None = None
+    _executor_lock = threading.Lock()
+
     @staticmethod
-    def calculate_metrics(original_img: Image.Image, modified_img: Image.Image) -> dict:
+    def calculate_metrics(
+        original_img: Image.Image | np.ndarray,
+        modified_img: Image.Image | np.ndarray,
+        level: str = MetricsLevel.SAMPLED,
+        rows: tuple[int, int] | None = None,
+        background: bool = False,
+        change_maps: bool = False,
+    ) -> dict | Future:
         """
         Calcola SSIM e PSNR tra immagine originale e modificata
 
         Args:
-            original_img: Immagine originale (host)
-            modified_img: Immagine modificata (con steganografia)
+            original_img: Immagine originale (host), come immagine PIL o come
+                array (altezza, larghezza, canali) con valori 0-255
+            modified_img: Immagine modificata (con steganografia), come sopra;
+                gli array vengono usati senza copie (RGBA -> vista sui canali RGB)
+            level: Livello di calcolo ('psnr', 'sampled', 'full')
+            rows: Intervallo di righe [inizio, fine) modificate, se noto al
+                metodo (altrimenti viene ricavato confrontando le immagini)
+            background: Se True calcola le metriche nel pool condiviso e
+                restituisce subito un Future che si risolve nel dizionario
+            change_maps: Se True aggiunge le mappe delle modifiche (servono
+                solo per la visualizzazione, con qualsiasi livello)
 
         Returns:
-            Dizionario con le metriche:
+            Dizionario (o Future del dizionario) con le metriche:
             {
-                'ssim': valore SSIM (0-1, 1 = identiche),
-                'psnr': valore PSNR in dB (maggiore = migliore)
+                'ssim': valore SSIM (0-1, 1 = identiche; None con 'psnr'),
+                'ssim_error': margine d'errore al 95% della stima SSIM
+                    (0 se esatto, None con 'psnr'),
+                'psnr': valore PSNR in dB (maggiore = migliore),
+                'mse': errore quadratico medio,
+                'changed_rows': intervallo di righe confrontato,
+                'change_maps': mappe delle modifiche (vedi change_maps),
+                    solo se richieste
             }
         """
-        # Converte in RGB se necessario
-        if original_img.mode != "RGB":
-            original_img = original_img.convert("RGB")
-        if modified_img.mode != "RGB":
-            modified_img = modified_img.convert("RGB")
+        if background:
+            with QualityMetrics._executor_lock:
+                if QualityMetrics._executor is None:
+                    QualityMetrics._executor = ThreadPoolExecutor(
+                        max_workers=QualityMetrics.MAX_WORKERS,
+                        thread_name_prefix="metrics",
+                    )
+            return QualityMetrics._executor.submit(
+                QualityMetrics.calculate_metrics,
+                original_img,
+                modified_img,
+                level,
+                rows,
+                change_maps=change_maps,
+            )
+
+        original_array = QualityMetrics._rgb_array(original_img)
+        modified_array = QualityMetrics._rgb_array(modified_img)
 
         # Verifica che le dimensioni siano uguali
-        if original_img.size != modified_img.size:
+        if original_array.shape != modified_array.shape:
+            original_size = original_array.shape[1::-1]
+            modified_size = modified_array.shape[1::-1]
             raise ValueError(
                 f"Le immagini devono avere le stesse dimensioni. "
-                f"Originale: {original_img.size}, Modificata: {modified_img.size}"
+                f"Originale: {original_size}, Modificata: {modified_size}"
             )
 
-        # Converte in array numpy
-        original_array = np.array(original_img)
-        modified_array = np.array(modified_img)
+        if rows is None:
+            rows = QualityMetrics.changed_rows(original_array, modified_array)
+        top, bottom = rows
 
-        # Calcola SSIM (per immagini multichannel)
-        ssim_value = ssim(
-            original_array,
-            modified_array,
-            channel_axis=2,  # RGB ha 3 canali
-            data_range=255,  # Range dei valori dei pixel (0-255)
+        # Fuori dalle righe modificate l'errore è nullo
+        squared_error = QualityMetrics.squared_error(
+            original_array[top:bottom], modified_array[top:bottom]
         )
+        mse = squared_error / original_array.size
+        metrics = {
+            "ssim": None,
+            "ssim_error": None,
+            "psnr": QualityMetrics.psnr_from_mse(mse),
+            "mse": mse,
+            "changed_rows": (top, bottom),
+        }
+        if change_maps:
+            metrics["change_maps"] = QualityMetrics.change_maps(
+                original_array, modified_array, (top, bottom)
+            )
 
-        # Calcola PSNR
-        # Se le immagini sono identiche, PSNR è infinito (evita warning di divisione per zero)
-        if np.array_equal(original_array, modified_array):
-            psnr_value = np.inf
-        else:
-            with warnings.catch_warnings():
-                warnings.filterwarnings("ignore", category=RuntimeWarning)
-                psnr_value = psnr(original_array, modified_array, data_range=255)
+        if level in (MetricsLevel.SAMPLED, MetricsLevel.FULL):
+            metrics["ssim"], metrics["ssim_error"] = QualityMetrics.region_ssim(
+                original_array,
+                modified_array,
+                (top, bottom),
+                sampled=level == MetricsLevel.SAMPLED,
+            )
+        elif level != MetricsLevel.PSNR:
+            raise ValueError(f"Livello di metriche non valido: {level}")
+
+        return metrics
+
+    @staticmethod
+    def distortion_report(
+        original_img: Image.Image | np.ndarray,
+        modified_img: Image.Image | np.ndarray,
+        rows: tuple[int, int] | None = None,
+    ) -> dict:
+        """
+        Report dettagliato della distorsione per canale e per bitplane
+
+        Tutto deriva da un solo conteggio congiunto (canale, |delta|, XOR)
+        sulle righe modificate: MSE, campioni modificati, istogramma dei delta
+        e cambi per bitplane si ottengono poi sommando sugli assi.
+
+        Args:
+            original_img: Immagine originale (PIL o array, come in
+                calculate_metrics)
+            modified_img: Immagine modificata
+            rows: Intervallo di righe [inizio, fine) modificate, se noto
+
+        Returns:
+            Dizionario con il report:
+            {
+                'mse', 'psnr': valori globali,
+                'channel_mse', 'channel_psnr': array con un valore per canale,
+                'modified': numero di campioni (componenti) modificati,
+                'modified_fraction': frazione di campioni modificati,
+                'channel_modified': campioni modificati per canale,
+                'delta_histogram': conteggi di |delta| da 0 a 255,
+                'bitplane_changes': cambi per canale e bitplane
+                    (canali x 8, colonna 0 = LSB)
+            }
+        """
+        original = QualityMetrics._rgb_array(original_img)
+        modified = QualityMetrics._rgb_array(modified_img)
+        if original.shape != modified.shape:
+            raise ValueError(
+                f"Le immagini devono avere le stesse dimensioni. "
+                f"Originale: {original.shape[1::-1]}, Modificata: {modified.shape[1::-1]}"
+            )
+        if original.dtype != np.uint8:
+            original = original.astype(np.uint8)
+        if modified.dtype != np.uint8:
+            modified = modified.astype(np.uint8)
+
+        if rows is None:
+            rows = QualityMetrics.changed_rows(original, modified)
+        top, bottom = rows
+        before, after = original[top:bottom], modified[top:bottom]
+        height, width, channels = original.shape
+
+        # Chiave congiunta (canale, |delta|, XOR) per ogni campione
+        delta = np.maximum(before, after) - np.minimum(before, after)
+        key = (np.arange(channels, dtype=np.int32) << 8) + delta
+        key = (key << 8) | (before ^ after)
+        joint = np.bincount(key.reshape(-1), minlength=channels << 16)
+        joint = joint.reshape(channels, 256, 256)
+
+        # Le righe fuori dall'intervallo sono invariate (delta e XOR nulli)
+        joint[:, 0, 0] += (height - (bottom - top)) * width
+        delta_counts = joint.sum(axis=2)
+        xor_counts = joint.sum(axis=1)
+
+        values = np.arange(256, dtype=np.int64)
+        samples = height * width
+        channel_mse = delta_counts @ (values * values) / samples
+        channel_modified = samples - delta_counts[:, 0]
+        bits = (values[:, None] >> np.arange(8)) & 1
+        mse = float(channel_mse.mean())
+
+        return {
+            "mse": mse,
+            "psnr": QualityMetrics.psnr_from_mse(mse),
+            "channel_mse": channel_mse,
+            "channel_psnr": np.array(
+                [QualityMetrics.psnr_from_mse(value) for value in channel_mse]
+            ),
+            "modified": int(channel_modified.sum()),
+            "modified_fraction": float(channel_modified.sum() / (samples * channels)),
+            "channel_modified": channel_modified,
+            "delta_histogram": delta_counts.sum(axis=0),
+            "bitplane_changes": xor_counts @ bits,
+        }
+
+    @staticmethod
+    def change_maps(
+        original_img: Image.Image | np.ndarray,
+        modified_img: Image.Image | np.ndarray,
+        rows: tuple[int, int] | None = None,
+    ) -> dict:
+        """
+        Mappe per vedere dove sono stati nascosti i dati
+
+        Entrambe sono ridotte a blocchi (riduzioni numpy sulle sole righe
+        modificate), quindi restano piccole anche per immagini grandi.
+
+        Args:
+            original_img: Immagine originale (PIL o array, come in
+                calculate_metrics)
+            modified_img: Immagine modificata
+            rows: Intervallo di righe [inizio, fine) modificate, se noto
+
+        Returns:
+            Dizionario con le mappe:
+            {
+                'residual': differenza amplificata (|delta| massimo per blocco
+                    e canale, scalato sull'intera scala 0-255),
+                'heatmap': frazione di pixel modificati per cella, in falsi
+                    colori e alla stessa risoluzione del residuo,
+                'block_size': lato in pixel di un blocco del residuo
+            }
+        """
+        original = QualityMetrics._rgb_array(original_img)
+        modified = QualityMetrics._rgb_array(modified_img)
+        if rows is None:
+            rows = QualityMetrics.changed_rows(original, modified)
+        top, bottom = rows
+
+        # Residuo: un blocco per pixel dell'anteprima
+        height, width, channels = original.shape
+        block = -(-max(height, width) // QualityMetrics.PREVIEW_SIZE)
+        row_starts = np.arange(0, height, block)
+        col_starts = np.arange(0, width, block)
+        shape = (len(row_starts), len(col_starts))
+        peak = np.zeros(shape + (channels,), dtype=np.uint8)
+        moved = np.zeros(shape, dtype=np.int64)
+        if bottom > top:
+            first, last = top // block, -(-bottom // block)
+            strip = slice(first * block, min(height, last * block))
+            before, after = original[strip], modified[strip]
+            delta = np.maximum(before, after) - np.minimum(before, after)
+
+            # Pixel modificato: OR dei canali (più rapido di any sull'ultimo asse)
+            changed = delta[:, :, 0] != 0
+            for channel in range(1, channels):
+                changed |= delta[:, :, channel] != 0
 
-        return {"ssim": ssim_value, "psnr": psnr_value}
+            peak[first:last] = np.maximum.reduceat(
+                QualityMetrics._reduce_row_blocks(np.maximum, delta, block),
+                col_starts,
+                axis=1,
+            )
+            moved[first:last] = np.add.reduceat(
+                QualityMetrics._reduce_row_blocks(np.add, changed, block, np.int64),
+                col_starts,
+                axis=1,
+            )
+        residual = peak * (255 // max(int(peak.max()), 1))
+
+        # Heatmap: celle di factor x factor blocchi, poi riportata alla
+        # risoluzione del residuo
+        factor = -(-max(shape) // QualityMetrics.HEATMAP_CELLS)
+        cell_rows = np.arange(0, shape[0], factor)
+        cell_cols = np.arange(0, shape[1], factor)
+        counts = np.add.reduceat(
+            np.add.reduceat(moved, cell_rows, axis=0), cell_cols, axis=1
+        )
+        row_sizes = np.add.reduceat(np.diff(row_starts, append=height), cell_rows)
+        col_sizes = np.add.reduceat(np.diff(col_starts, append=width), cell_cols)
+        fraction = counts / np.outer(row_sizes, col_sizes)
+        fraction = fraction.repeat(factor, axis=0).repeat(factor, axis=1)
+
+        return {
+            "residual": Image.fromarray(residual, mode="RGB"),
+            "heatmap": heat_image(fraction[: shape[0], : shape[1]]),
+            "block_size": block,
+        }
+
+    @staticmethod
+    def _reduce_row_blocks(
+        ufunc: np.ufunc, array: np.ndarray, block: int, dtype=None
+    ) -> np.ndarray:
+        """
+        Riduce gruppi di block righe consecutive (l'ultimo può essere incompleto)
+
+        Un'operazione vettoriale per ogni offset nel blocco sulle righe prese a
+        passo block: molto più rapido di reduceat lungo il primo asse.
+        """
+        result = array[::block].astype(dtype or array.dtype)
+        for offset in range(1, block):
+            rows = array[offset::block]
+            ufunc(result[: len(rows)], rows, out=result[: len(rows)])
+        return result
+
+    @staticmethod
+    def _rgb_array(img: Image.Image | np.ndarray) -> np.ndarray:
+        """Pixel RGB come array (vista senza copia se è già un array)"""
+        if isinstance(img, np.ndarray):
+            return img[:, :, :3]
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        return np.asarray(img)
+
+    @staticmethod
+    def changed_rows(original: np.ndarray, modified: np.ndarray) -> tuple[int, int]:
+        """Intervallo [inizio, fine) delle righe in cui le immagini differiscono"""
+        changed = np.flatnonzero((original != modified).any(axis=(1, 2)))
+        if not changed.size:
+            return 0, 0
+        return int(changed[0]), int(changed[-1]) + 1
+
+    @staticmethod
+    def squared_error(original: np.ndarray, modified: np.ndarray) -> int:
+        """Somma dei quadrati delle differenze, in un solo passaggio su interi"""
+        diff = (original.astype(np.int16) - modified).reshape(-1)
+        return int(np.einsum("i,i->", diff, diff, dtype=np.int64))
+
+    @staticmethod
+    def psnr_from_mse(mse: float, data_range: float = 255.0) -> float:
+        """PSNR in dB (infinito se le immagini sono identiche)"""
+        if mse == 0:
+            return np.inf
+        return float(10 * np.log10(data_range**2 / mse))
+
+    @staticmethod
+    def sampled_ssim(original: np.ndarray, modified: np.ndarray) -> tuple[float, float]:
+        """
+        Stima l'SSIM su un campione deterministico di tile
+
+        Le tile (TILE_SIZE x TILE_SIZE) sono scelte a intervalli regolari
+        sulla griglia dell'immagine, quindi la stessa coppia di immagini dà
+        sempre lo stesso risultato. Le immagini che non superano il budget di
+        campionamento vengono misurate per intero.
+
+        Args:
+            original: Immagine originale (altezza, larghezza, canali)
+            modified: Immagine modificata
+
+        Returns:
+            Tupla con (ssim_stimato, margine_errore_95%)
+        """
+        tile = QualityMetrics.TILE_SIZE
+        height, width = original.shape[:2]
+        rows, cols = height // tile, width // tile
+        n_tiles = rows * cols
+        if n_tiles <= QualityMetrics.MAX_TILES:
+            return QualityMetrics._ssim(original, modified), 0.0
+
+        chosen = np.linspace(0, n_tiles - 1, QualityMetrics.MAX_TILES).round()
+        values = np.empty(len(chosen))
+        for i, index in enumerate(chosen.astype(np.int64)):
+            y, x = divmod(int(index), cols)
+            window = (slice(y * tile, (y + 1) * tile), slice(x * tile, (x + 1) * tile))
+            values[i] = QualityMetrics._ssim(original[window], modified[window])
+
+        # Margine al 95% della media campionaria (con correzione per
+        # popolazione finita: le tile sono estratte senza ripetizione)
+        n = len(values)
+        correction = np.sqrt(1 - n / n_tiles)
+        error = 1.96 * values.std(ddof=1) / np.sqrt(n) * correction
+        return float(values.mean()), float(error)
+
+    @staticmethod
+    def region_ssim(
+        original: np.ndarray,
+        modified: np.ndarray,
+        rows: tuple[int, int],
+        sampled: bool = False,
+    ) -> tuple[float, float]:
+        """
+        SSIM dell'immagine intera calcolato solo vicino alle righe modificate
+
+        Le finestre SSIM che non toccano le righe modificate confrontano pixel
+        identici e valgono 1: basta sommare il deficit (1 - SSIM) delle finestre
+        restanti, calcolate su una striscia con il margine della finestra. Il
+        risultato coincide con l'SSIM a piena risoluzione.
+
+        Args:
+            original: Immagine originale (altezza, larghezza, canali)
+            modified: Immagine modificata
+            rows: Intervallo di righe [inizio, fine) modificate
+            sampled: Se True e la striscia supera il budget di campionamento,
+                stima l'SSIM della striscia su tile campionate
+
+        Returns:
+            Tupla con (ssim, margine_errore_95%)
+        """
+        pad = (QualityMetrics.WIN_SIZE - 1) // 2
+        height, width, channels = original.shape
+        map_rows, map_cols = height - 2 * pad, width - 2 * pad
+        if map_rows <= 0 or map_cols <= 0:
+            return QualityMetrics._ssim(original, modified), 0.0
+
+        # Righe della mappa SSIM (senza il bordo ignorato) le cui finestre
+        # toccano le righe modificate
+        top, bottom = rows
+        first, last = max(top - pad, pad), min(bottom + pad, height - pad)
+        if last <= first:
+            return 1.0, 0.0
+        strip = slice(first - pad, last + pad)
+        affected = (last - first) / map_rows
+
+        budget = QualityMetrics.MAX_TILES * QualityMetrics.TILE_SIZE**2
+        if sampled and (last - first) * width > budget:
+            estimate, error = QualityMetrics.sampled_ssim(
+                original[strip], modified[strip]
+            )
+            return 1.0 - affected * (1.0 - estimate), affected * error
+
+        _, ssim_map = ssim(
+            original[strip],
+            modified[strip],
+            channel_axis=2,
+            data_range=255,
+            full=True,
+        )
+        window = ssim_map[pad : pad + last - first, pad : width - pad]
+        deficit = np.sum(1.0 - window, dtype=np.float64)
+        return float(1.0 - deficit / (map_rows * map_cols * channels)), 0.0
+
+    @staticmethod
+    def _ssim(original: np.ndarray, modified: np.ndarray) -> float:
+        """SSIM a piena risoluzione (per immagini multichannel)"""
+        return float(
+            ssim(
+                original,
+                modified,
+                channel_axis=2,  # RGB ha 3 canali
+                data_range=255,  # Range dei valori dei pixel (0-255)
+            )
+        )
+
+    @staticmethod
+    def log_metrics(metrics: dict | Future) -> None:
+        """Stampa le metriche (a calcolo concluso se sono in background)"""
+        if isinstance(metrics, Future):
+            metrics.add_done_callback(
+                lambda future: future.exception()
+                or QualityMetrics.log_metrics(future.result())
+            )
+            return
+        print(f"Metriche di qualità - {QualityMetrics.format_metrics(metrics)}")
 
     @staticmethod
     def format_metrics(metrics: dict) -> str:
@@ -81,7 +510,9 @@ class QualityMetrics:
         psnr_val = metrics["psnr"]
 
         # Interpreta SSIM
-        if ssim_val >= 0.99:
+        if ssim_val is None:
+            ssim_quality = "non calcolato"
+        elif ssim_val >= 0.99:
             ssim_quality = "Eccellente"
         elif ssim_val >= 0.95:
             ssim_quality = "Ottima"
@@ -112,7 +543,14 @@ class QualityMetrics:
             psnr_quality = "Bassa"
             psnr_str = f"{psnr_val:.2f}"
 
+        if ssim_val is None:
+            ssim_str = "n/d"
+        elif metrics.get("ssim_error"):
+            ssim_str = f"{ssim_val:.4f} ± {metrics['ssim_error']:.4f}"
+        else:
+            ssim_str = f"{ssim_val:.4f}"
+
         return (
-            f"SSIM: {ssim_val:.4f} ({ssim_quality}) | "
+            f"SSIM: {ssim_str} ({ssim_quality}) | "
             f"PSNR: {psnr_str} dB ({psnr_quality})"
         )
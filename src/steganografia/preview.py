@@ -0,0 +1,99 @@
+"""
+Anteprima rapida dell'occultamento su una versione ridotta del carrier
+"""
+
+import io
+import math
+import zipfile
+
+from PIL import Image
+
+from config.constants import CompressionMode
+
+from .bit_operations import TEXT_ENCODING, encode_text
+from .capacity import region_components
+
+
+class HidePreview:
+    """Riduzione del carrier e del payload per l'anteprima interattiva"""
+
+    # Pixel massimi del carrier ridotto (~1 MP: embedding e metriche in tempi
+    # interattivi anche con host da 20+ MP)
+    MAX_PIXELS: int = 1_000_000
+
+    @staticmethod
+    def scale_carrier(
+        img: Image.Image, max_pixels: int | None = None
+    ) -> tuple[Image.Image, float]:
+        """
+        Riduce il carrier a circa max_pixels pixel mantenendo le proporzioni
+
+        Args:
+            img: Immagine host a piena risoluzione
+            max_pixels: Pixel massimi dell'anteprima (default MAX_PIXELS)
+
+        Returns:
+            Tuple di (carrier ridotto, rapporto fra le regioni utili di
+            anteprima e originale, header escluso). Il rapporto scala il
+            payload in modo da riempire il carrier nella stessa proporzione
+        """
+        max_pixels = max_pixels or HidePreview.MAX_PIXELS
+        width, height = img.size
+        if width * height <= max_pixels:
+            return img, 1.0
+
+        factor = math.sqrt(max_pixels / (width * height))
+        size = (max(1, round(width * factor)), max(1, round(height * factor)))
+        # BOX con reducing_gap: riduzione intera veloce seguita da un filtro
+        # ad area sul fattore residuo
+        small = img.resize(size, Image.Resampling.BOX, reducing_gap=2.0)
+
+        full = region_components(width, height)
+        ratio = region_components(*size) / full if full else 0.0
+        return small, ratio
+
+    @staticmethod
+    def scale_message(message: str, ratio: float) -> str:
+        """Tronca il messaggio alla frazione ratio dei suoi byte UTF-8"""
+        data = HidePreview.scale_data(encode_text(message), ratio)
+        # Un carattere multibyte troncato a metà viene scartato
+        return data.decode(TEXT_ENCODING, errors="ignore")
+
+    @staticmethod
+    def scale_secret(secret_img: Image.Image, ratio: float) -> Image.Image:
+        """Riduce l'immagine segreta perché i suoi pixel scalino di ratio"""
+        factor = math.sqrt(ratio)
+        if factor >= 1:
+            return secret_img
+        width, height = secret_img.size
+        size = (max(1, round(width * factor)), max(1, round(height * factor)))
+        return secret_img.resize(size, Image.Resampling.BOX, reducing_gap=2.0)
+
+    @staticmethod
+    def scale_data(data: bytes, ratio: float) -> bytes:
+        """Prefisso dei dati lungo la frazione ratio (almeno un byte)"""
+        return data[: max(1, round(len(data) * ratio))]
+
+    @staticmethod
+    def compress_data(data: bytes, compression_mode: int) -> bytes:
+        """
+        Comprime in memoria i dati di un file come farebbe compress_file
+
+        Args:
+            data: Contenuto del file da nascondere
+            compression_mode: Modalità di compressione (NO_ZIP, FILE, DIR)
+
+        Returns:
+            Dati dell'archivio zip (o i dati originali con NO_ZIP)
+        """
+        if compression_mode == CompressionMode.NO_ZIP:
+            return data
+        method = (
+            zipfile.ZIP_STORED
+            if compression_mode == CompressionMode.FILE
+            else zipfile.ZIP_DEFLATED
+        )
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", method) as zf:
+            zf.writestr("payload", data)
+        return buffer.getvalue()
@@ -5,10 +5,40 @@ Operazioni di steganografia per file binari usando PVD (Pixel Value Differencing
 import numpy as np
 from PIL import Image
 
-from config.constants import DataType, ErrorMessages
-
-from ..backup import backup_system
+from config.constants import (
+    DataType,
+    ErrorMessages,
+    MetricsLevel,
+    SteganographyMethod,
+)
+
+from ..backup import BackupFile, backup_system
+from ..bit_operations import BitStream
+from ..capacity import image_array, usable_bytes
+from ..container import (
+    build_header,
+    carrier_region,
+    changed_rows,
+    check_header,
+    decode_payload,
+    embedded_bits,
+    encode_payload,
+    read_header,
+    write_header,
+)
 from ..metrics import QualityMetrics
+from .pair_operations import (
+    embed_payload,
+    extract_payload,
+    gather_pairs,
+    pvd_capacity,
+    range_tables,
+    scatter_pairs,
+    used_rows,
+)
+
+# Header magico del formato precedente al contenitore (16 bit)
+MAGIC_HEADER = "1010101011110000"
 
 
 class BinarySteganography:
@@ -36,95 +66,53 @@ class BinarySteganography:
     RANGES = RANGES_QUALITY
     PAIR_STEP: int = 1
     CHANNELS = [0, 1, 2]
+    FALLBACK_RANGE = (128, 255, 7)  # Range per le differenze non coperte da RANGES
 
     @staticmethod
-    def _get_range_capacity(diff: int) -> tuple[int, int, int]:
-        """Ottiene la capacità in bit per una data differenza di pixel"""
-        abs_diff = abs(diff)
-        for lower, upper, capacity in BinarySteganography.RANGES:
-            if lower <= abs_diff <= upper:
-                return lower, upper, capacity
-        return 128, 255, 7  # Default al range più alto
-
-    @staticmethod
-    def _embed_in_pair(pixel1: int, pixel2: int, bits: str) -> tuple[int, int]:
+    def capacity(img: Image.Image) -> dict:
         """
-        Nasconde bit in una coppia di pixel usando PVD
-
-        Args:
-            pixel1, pixel2: Valori dei pixel (0-255)
-            bits: Stringa di bit da nascondere
+        Capacità esatta con la configurazione corrente, senza embedding
 
         Returns:
-            Tupla con i nuovi valori dei pixel
+            Dizionario con 'bits' e la mappa per blocchi (vedi pvd_capacity)
         """
-        diff = pixel2 - pixel1
-        lower, upper, capacity = BinarySteganography._get_range_capacity(diff)
-
-        # Limita i bit alla capacità del range
-        bits = bits[:capacity]
-        if len(bits) == 0:
-            return pixel1, pixel2
-
-        # Converte i bit in valore decimale
-        decimal_value = int(bits.ljust(capacity, "0"), 2)
-
-        # Calcola la nuova differenza
-        new_diff = lower + decimal_value
-
-        #  CRITICAL: clamp per auto-sincronizzazione
-        new_diff = min(new_diff, upper)
-
-        # Mantiene il segno della differenza originale
-        if diff < 0:
-            new_diff = -new_diff
-
-        # Calcola i nuovi pixel
-        m = abs(new_diff) - abs(diff)
-
-        #  Early return se nessuna modifica
-        if m == 0:
-            return pixel1, pixel2
-
-        if diff % 2 == 0:  # diff pari
-            new_pixel1 = pixel1 - m // 2
-            new_pixel2 = pixel2 + m - m // 2
-        else:  # diff dispari
-            new_pixel1 = pixel1 - (m + 1) // 2
-            new_pixel2 = pixel2 + m - (m + 1) // 2
-
-        # Clipping per rimanere nel range valido
-        new_pixel1 = max(0, min(255, new_pixel1))
-        new_pixel2 = max(0, min(255, new_pixel2))
-
-        return new_pixel1, new_pixel2
+        return pvd_capacity(
+            image_array(img),
+            BinarySteganography.PAIR_STEP,
+            BinarySteganography.CHANNELS,
+            range_tables(
+                BinarySteganography.RANGES, BinarySteganography.FALLBACK_RANGE
+            ),
+        )
 
     @staticmethod
-    def _extract_from_pair(pixel1: int, pixel2: int) -> str:
+    def payload_capacity(
+        img: Image.Image, ecc: bool = False, estimate: dict | None = None
+    ) -> int:
         """
-        Estrae bit da una coppia di pixel usando PVD
+        Byte di payload nascondibili con la configurazione corrente
+
+        Args:
+            img: Immagine host
+            ecc: Se True il payload è protetto da Hamming(7,4)
+            estimate: Risultato di capacity() già calcolato (evita di
+                ripetere la stima)
 
         Returns:
-            Stringa di bit estratti
+            Numero massimo di byte del payload (dopo l'eventuale compressione)
         """
-        diff = pixel2 - pixel1
-        lower, upper, capacity = BinarySteganography._get_range_capacity(diff)
-
-        # Calcola il valore nascosto
-        value = abs(diff) - lower
-
-        #  Clamp difensivo
-        value = max(0, min(value, (1 << capacity) - 1))
-
-        # Converte in binario
-        bits = format(value, f"0{capacity}b")
-        return bits
+        estimate = estimate or BinarySteganography.capacity(img)
+        return usable_bytes(estimate["bits"], ecc)
 
     @staticmethod
     def hide_binary_file(
         img: Image.Image,
         file_path: str,
-        backup_file: str | None = None,
+        backup_file: BackupFile | None = None,
+        ecc: bool = False,
+        metrics_level: str = MetricsLevel.SAMPLED,
+        async_metrics: bool = False,
+        change_maps: bool = False,
         **kwargs,  # Ignora compression_mode, n, div per compatibilità API
     ) -> tuple[Image.Image, int, float, int, dict, float]:
         """
@@ -134,68 +122,82 @@ class BinarySteganography:
             img: Immagine host
             file_path: Percorso del file da nascondere
             backup_file: File di backup opzionale
+            ecc: Se True protegge il payload con un codice correttore d'errore
+            metrics_level: Livello delle metriche di qualità ('psnr', 'sampled', 'full')
+            async_metrics: Calcola le metriche in background (restituisce un Future)
+            change_maps: Aggiunge alle metriche le mappe delle modifiche
         """
         with open(file_path, "rb") as f:
             file_data = f.read()
 
         file_size = len(file_data)
-        file_binary = "".join(format(byte, "08b") for byte in file_data)
 
-        magic_header = "1010101011110000"
-        size_binary = format(file_size, "032b")
-        terminator = "1111000011110000"  # Terminatore complesso (16 bit)
-        full_payload = magic_header + size_binary + file_binary + terminator
+        # Payload: byte del file (compressi se conviene, con ECC opzionale)
+        payload_bytes, payload, flags = encode_payload(file_data, ecc)
 
         if img.mode != "RGB":
             img = img.convert("RGB")
 
-        print(f"Nascondendo file binario ({file_size} bytes) con PVD...")
-        original_img = img.copy()
-        img_array = np.array(img, dtype=np.int32).copy()
+        # Verifica capacità (esatta, prima di toccare i pixel)
+        if len(payload_bytes) > BinarySteganography.payload_capacity(img, ecc):
+            raise ValueError(
+                ErrorMessages.IMAGE_TOO_SMALL_FILE.format(
+                    file_size=file_size, width=img.width, height=img.height
+                )
+            )
 
-        bit_index = 0
+        print(f"Nascondendo file binario ({file_size} bytes) con PVD...")
+        img_array = np.array(img, dtype=np.int32)
         height, width, _ = img_array.shape
 
-        for channel in BinarySteganography.CHANNELS:
-            for row in range(height):
-                for col in range(0, width - 1, 2 * BinarySteganography.PAIR_STEP):
-                    if bit_index >= len(full_payload):
-                        break
-
-                    pixel1 = int(img_array[row, col, channel])
-                    pixel2 = int(
-                        img_array[row, col + BinarySteganography.PAIR_STEP, channel]
-                    )
-
-                    _, _, capacity = BinarySteganography._get_range_capacity(
-                        pixel2 - pixel1
-                    )
-                    bits_to_embed = full_payload[bit_index : bit_index + capacity]
-
-                    if bits_to_embed:
-                        new_p1, new_p2 = BinarySteganography._embed_in_pair(
-                            pixel1, pixel2, bits_to_embed
-                        )
-                        img_array[row, col, channel] = new_p1
-                        img_array[row, col + BinarySteganography.PAIR_STEP, channel] = (
-                            new_p2
-                        )
-                        # BUG FIX 2: Incrementa di capacity perché ljust() scrive sempre capacity bit
-                        bit_index += capacity
-
-                if bit_index >= len(full_payload):
-                    break
-            if bit_index >= len(full_payload):
-                break
-
-        if bit_index < len(full_payload):
+        region = carrier_region(img_array)  # Righe dopo l'header
+        pixel1, pixel2 = gather_pairs(
+            region, BinarySteganography.PAIR_STEP, BinarySteganography.CHANNELS
+        )
+        try:
+            used = embed_payload(
+                pixel1,
+                pixel2,
+                payload,
+                range_tables(
+                    BinarySteganography.RANGES, BinarySteganography.FALLBACK_RANGE
+                ),
+            )
+        except ValueError as e:
             raise ValueError(
                 ErrorMessages.IMAGE_TOO_SMALL_FILE.format(
                     file_size=file_size, width=img.width, height=img.height
                 )
-            )
+            ) from e
+        scatter_pairs(
+            region,
+            BinarySteganography.PAIR_STEP,
+            BinarySteganography.CHANNELS,
+            pixel1,
+            pixel2,
+        )
+        bit_index = len(payload)
 
         img_array = np.clip(img_array, 0, 255).astype(np.uint8)
+
+        # Header del contenitore con i parametri di recupero
+        is_quality = BinarySteganography.RANGES == BinarySteganography.RANGES_QUALITY
+        ranges_type = "quality" if is_quality else "capacity"
+        header_params = {
+            "pair_step": BinarySteganography.PAIR_STEP,
+            "channels": BinarySteganography.CHANNELS,
+            "ranges_type": ranges_type,
+        }
+        write_header(
+            img_array,
+            build_header(
+                SteganographyMethod.PVD,
+                DataType.BINARY,
+                header_params,
+                payload_bytes,
+                flags=flags,
+            ),
+        )
         result_img = Image.fromarray(img_array, mode="RGB")
 
         # Calcola percentuale di bit usati
@@ -206,18 +208,26 @@ class BinarySteganography:
         )
 
         # Salva parametri (sempre nella cache, opzionalmente su file)
-        # Determina se RANGES è quality o capacity
-        is_quality = BinarySteganography.RANGES == BinarySteganography.RANGES_QUALITY
         params = {
             "method": "pvd",
             "size": file_size,
             "pair_step": BinarySteganography.PAIR_STEP,
             "channels": BinarySteganography.CHANNELS,
-            "ranges_type": "quality" if is_quality else "capacity",
+            "ranges_type": ranges_type,
         }
-        backup_system.save_backup_data(DataType.BINARY, params, backup_file)
+        backup_system.save_backup_data(
+            DataType.BINARY, params, backup_file, image=img_array
+        )
 
-        metrics = QualityMetrics.calculate_metrics(original_img, result_img)
+        rows = used_rows(len(region), width, BinarySteganography.PAIR_STEP, used)
+        metrics = QualityMetrics.calculate_metrics(
+            img,
+            img_array,
+            metrics_level,
+            changed_rows(img_array, rows * width * 3),
+            background=async_metrics,
+            change_maps=change_maps,
+        )
         print("File nascosto con successo usando PVD")
 
         return result_img, 1, 0.0, file_size, metrics, float(percentage)
@@ -226,7 +236,7 @@ class BinarySteganography:
     def get_binary_file(
         img: Image.Image,
         output_path: str,
-        backup_file: str | None = None,
+        backup_file: BackupFile | None = None,
         # Parametri manuali opzionali
         ranges_type: str | None = None,  # "quality" o "capacity"
         pair_step: int | None = None,
@@ -234,19 +244,93 @@ class BinarySteganography:
         **kwargs,  # Ignora n, div per compatibilità API
     ) -> None:
         """Recupera un file binario da un'immagine usando PVD"""
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+
+        header = read_header(img)
+        if header is None:
+            return BinarySteganography._get_legacy_binary_file(
+                img, output_path, backup_file, ranges_type, pair_step, channels
+            )
+        check_header(header, SteganographyMethod.PVD, DataType.BINARY)
+
+        # I parametri scritti nell'header hanno la precedenza su quelli manuali
+        params = header["params"]
+        ranges = (
+            BinarySteganography.RANGES_QUALITY
+            if params["ranges_type"] == "quality"
+            else BinarySteganography.RANGES_CAPACITY
+        )
+        print(
+            f"Parametri PVD letti dall'header: ranges={params['ranges_type']}, pair_step={params['pair_step']}, channels={params['channels']}"
+        )
+
+        print("Recuperando file binario con PVD...")
+        region = carrier_region(np.array(img, dtype=np.int32))
+        pixel1, pixel2 = gather_pairs(region, params["pair_step"], params["channels"])
+        n_bits = embedded_bits(header)
+        payload = extract_payload(
+            pixel1,
+            pixel2,
+            range_tables(ranges, BinarySteganography.FALLBACK_RANGE),
+            n_bits,
+        )
+        if len(payload) < n_bits:
+            raise ValueError(ErrorMessages.DECODE_FAILED)
+        file_data = decode_payload(header, payload)
+
+        with open(output_path, "wb") as f:
+            f.write(file_data)
+
+        print(f"File recuperato e salvato in {output_path}")
+
+    @staticmethod
+    def has_legacy_payload(img: Image.Image) -> bool:
+        """
+        Verifica se l'immagine contiene un file nel formato precedente
+
+        Il payload iniziava con l'header magico nella prima coppia: basta
+        leggere le coppie della prima riga del primo canale.
+        """
+        row = np.array(img.convert("RGB").crop((0, 0, img.width, 1)), dtype=np.int32)
+        pixel1, pixel2 = gather_pairs(
+            row, BinarySteganography.PAIR_STEP, BinarySteganography.CHANNELS[:1]
+        )
+        magic = BitStream.from_str(MAGIC_HEADER)
+        bits = extract_payload(
+            pixel1,
+            pixel2,
+            range_tables(
+                BinarySteganography.RANGES, BinarySteganography.FALLBACK_RANGE
+            ),
+            len(magic),
+        )
+        return bits == magic
+
+    @staticmethod
+    def _get_legacy_binary_file(
+        img: Image.Image,
+        output_path: str,
+        backup_file: BackupFile | None = None,
+        ranges_type: str | None = None,
+        pair_step: int | None = None,
+        channels: list[int] | None = None,
+    ) -> None:
+        """Recupera un file nascosto prima dell'introduzione del contenitore"""
 
         # Inizializza con valori di default
         final_pair_step: int = BinarySteganography.PAIR_STEP
         final_channels: list[int] = BinarySteganography.CHANNELS
+        ranges = BinarySteganography.RANGES
 
         # PRIORITÀ: parametri manuali > backup file > cache recente > default
         if ranges_type is not None or pair_step is not None or channels is not None:
             print("Usando parametri MANUALI forniti dall'interfaccia")
             # Usa parametri manuali se forniti, altrimenti default
             if ranges_type == "quality":
-                BinarySteganography.RANGES = BinarySteganography.RANGES_QUALITY
+                ranges = BinarySteganography.RANGES_QUALITY
             elif ranges_type == "capacity":
-                BinarySteganography.RANGES = BinarySteganography.RANGES_CAPACITY
+                ranges = BinarySteganography.RANGES_CAPACITY
             final_pair_step = (
                 pair_step if pair_step is not None else BinarySteganography.PAIR_STEP
             )
@@ -257,7 +341,9 @@ class BinarySteganography:
             # Carica parametri da backup o cache
 
             if backup_file:
-                backup_data = backup_system.load_backup_data(backup_file)
+                backup_data = backup_system.load_backup_data(
+                    backup_file, DataType.BINARY, image=img
+                )
                 if backup_data and "params" in backup_data:
                     final_pair_step = backup_data["params"].get(
                         "pair_step", final_pair_step
@@ -267,20 +353,22 @@ class BinarySteganography:
                     )
                     # Carica RANGES
                     ranges_type = backup_data["params"].get("ranges_type", "quality")
-                    BinarySteganography.RANGES = (
+                    ranges = (
                         BinarySteganography.RANGES_QUALITY
                         if ranges_type == "quality"
                         else BinarySteganography.RANGES_CAPACITY
                     )
             else:
-                recent_params = backup_system.get_last_params(DataType.BINARY)
+                recent_params = backup_system.get_last_params(
+                    DataType.BINARY, image=img
+                )
                 if recent_params:
                     print("Usando parametri dall'ultima operazione di nascondimento")
                     final_pair_step = recent_params.get("pair_step", final_pair_step)
                     final_channels = recent_params.get("channels", final_channels)
                     # Carica RANGES dalla cache
                     ranges_type = recent_params.get("ranges_type", "quality")
-                    BinarySteganography.RANGES = (
+                    ranges = (
                         BinarySteganography.RANGES_QUALITY
                         if ranges_type == "quality"
                         else BinarySteganography.RANGES_CAPACITY
@@ -292,39 +380,23 @@ class BinarySteganography:
         print("Recuperando file binario con PVD...")
         img_array = np.array(img, dtype=np.int32)
 
-        extracted_bits = []
-        height, width, _ = img_array.shape
-
-        for channel in final_channels:
-            for row in range(height):
-                for col in range(0, width - 1, 2 * final_pair_step):
-                    pixel1 = int(img_array[row, col, channel])
-                    pixel2 = int(img_array[row, col + final_pair_step, channel])
-
-                    bits = BinarySteganography._extract_from_pair(pixel1, pixel2)
-                    extracted_bits.append(bits)
-
-        full_binary = "".join(extracted_bits)
-        magic_header = "1010101011110000"
+        pixel1, pixel2 = gather_pairs(img_array, final_pair_step, final_channels)
+        full_binary = extract_payload(
+            pixel1, pixel2, range_tables(ranges, BinarySteganography.FALLBACK_RANGE)
+        )
 
-        header_pos = full_binary.find(magic_header)
+        header_pos = full_binary.find(BitStream.from_str(MAGIC_HEADER))
         if header_pos == -1:
             raise ValueError("Nessun file trovato nell'immagine")
 
         size_start = header_pos + 16
-        size_end = size_start + 32
-        file_size_binary = full_binary[size_start:size_end]
-        file_size = int(file_size_binary, 2)
+        if size_start + 32 > len(full_binary):
+            raise ValueError(ErrorMessages.DECODE_FAILED)
+        file_size = full_binary.read_uint(size_start, 32)
 
-        file_start = size_end
+        file_start = size_start + 32
         file_end = file_start + (file_size * 8)
-        file_binary = full_binary[file_start:file_end]
-
-        file_bytes = bytearray()
-        for i in range(0, len(file_binary), 8):
-            byte = file_binary[i : i + 8]
-            if len(byte) == 8:
-                file_bytes.append(int(byte, 2))
+        file_bytes = full_binary[file_start:file_end].to_bytes()
 
         with open(output_path, "wb") as f:
             f.write(file_bytes)
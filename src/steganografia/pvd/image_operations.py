@@ -6,11 +6,35 @@ Wu & Tsai (2003) inspired implementation
 import numpy as np
 from PIL import Image
 
-from config.constants import DataType, ErrorMessages
-
-from ..backup import backup_system
+from config.constants import (
+    DataType,
+    ErrorMessages,
+    MetricsLevel,
+    SteganographyMethod,
+)
+
+from ..backup import BackupFile, backup_system
+from ..bit_operations import BitStream
+from ..capacity import image_array
+from ..container import (
+    build_header,
+    carrier_region,
+    changed_rows,
+    check_header,
+    read_header,
+    verify_payload,
+    write_header,
+)
 from ..metrics import QualityMetrics
-from ..validator import ParameterValidator
+from .pair_operations import (
+    embed_payload,
+    extract_payload,
+    gather_pairs,
+    pvd_capacity,
+    range_tables,
+    scatter_pairs,
+    used_rows,
+)
 
 
 class ImageSteganography:
@@ -41,6 +65,7 @@ class ImageSteganography:
     RANGES = RANGES_QUALITY
     PAIR_STEP: int = 1  # sparsity
     CHANNELS = [0, 1, 2]  # RGB
+    SECRET_BITS: int = 2  # Bit (MSB) nascosti per componente dell'immagine segreta
 
     # ======================================================
     # Configuration helpers
@@ -79,80 +104,70 @@ class ImageSteganography:
         )
 
     # ======================================================
-    # Core PVD logic
+    # Public API
     # ======================================================
 
     @staticmethod
-    def _range_for_difference(diff: int):
-        d = abs(diff)
-        for low, high, bits in ImageSteganography.RANGES:
-            if low <= d <= high:
-                return low, high, bits
-        # FIX: usa l'ultimo range definito invece di hardcoded (compatibile con QUALITY e CAPACITY)
-        return ImageSteganography.RANGES[-1]
-
-    @staticmethod
-    def _embed_pair(p1: int, p2: int, bits: str):
-        diff = p2 - p1
-        low, high, capacity = ImageSteganography._range_for_difference(diff)
-
-        bits = bits[:capacity]
-        if not bits:
-            return p1, p2, 0
-
-        value = int(bits, 2)
-        new_diff = low + value
-        new_diff = min(new_diff, high)
-        new_diff = -new_diff if diff < 0 else new_diff
-
-        delta = new_diff - diff
-
-        #  Ottimizzazione: evita micro-shift quando value == 0
-        if delta == 0:
-            return p1, p2, len(bits)
-
-        if diff % 2 == 0:
-            p1 -= delta // 2
-            p2 += delta - delta // 2
-        else:
-            p1 -= (delta + 1) // 2
-            p2 += delta - (delta + 1) // 2
-
-        p1 = np.clip(p1, 0, 255)
-        p2 = np.clip(p2, 0, 255)
-
-        return int(p1), int(p2), len(bits)
+    def capacity(img: Image.Image) -> dict:
+        """
+        Capacità esatta con la configurazione corrente, senza embedding
+
+        Returns:
+            Dizionario con 'bits' e la mappa per blocchi (vedi pvd_capacity)
+        """
+        return pvd_capacity(
+            image_array(img),
+            ImageSteganography.PAIR_STEP,
+            ImageSteganography.CHANNELS,
+            range_tables(ImageSteganography.RANGES),
+        )
 
     @staticmethod
-    def _extract_pair(p1: int, p2: int):
-        diff = p2 - p1
-        low, _, capacity = ImageSteganography._range_for_difference(diff)
-        value = abs(diff) - low
-
-        # Clamp difensivo per casi limite
-        value = max(0, min(value, (1 << capacity) - 1))
-
-        return format(value, f"0{capacity}b")
-
-    # ======================================================
-    # Public API
-    # ======================================================
+    def payload_capacity(host_img: Image.Image, estimate: dict | None = None) -> int:
+        """
+        Byte (componenti RGB) dell'immagine segreta nascondibili
+
+        Args:
+            host_img: Immagine host
+            estimate: Risultato di capacity() già calcolato (evita di
+                ripetere la stima)
+
+        Returns:
+            Numero massimo di componenti segrete (larghezza * altezza * 3)
+        """
+        estimate = estimate or ImageSteganography.capacity(host_img)
+        bits = estimate["bits"]
+        return bits // ImageSteganography.SECRET_BITS
 
     @staticmethod
     def hide_image(
         host_img: Image.Image,
         secret_img: Image.Image,
-        backup_file: str | None = None,
+        backup_file: BackupFile | None = None,
+        metrics_level: str = MetricsLevel.SAMPLED,
+        async_metrics: bool = False,
+        change_maps: bool = False,
         **kwargs,
     ):
-        ParameterValidator.validate_image_size_for_image(host_img, secret_img, 1, 8)
+        # Verifica capacità (esatta, prima di toccare i pixel)
+        if (
+            secret_img.width * secret_img.height * 3
+            > ImageSteganography.payload_capacity(host_img)
+        ):
+            raise ValueError(
+                ErrorMessages.IMAGE_TOO_SMALL_IMAGE.format(
+                    host_width=host_img.width,
+                    host_height=host_img.height,
+                    secret_width=secret_img.width,
+                    secret_height=secret_img.height,
+                )
+            )
 
         host_img = host_img.convert("RGB")
         secret_img = secret_img.convert("RGB")
 
-        original = host_img.copy()
         host = np.array(host_img, dtype=np.int32)
-        secret = np.array(secret_img, dtype=np.uint8).flatten()
+        secret = np.asarray(secret_img, dtype=np.uint8).reshape(-1)
 
         width, height = secret_img.size
 
@@ -160,44 +175,53 @@ class ImageSteganography:
         # - SECRET_BITS = 2 raccomandato per qualità ottimale (PSNR > 40 dB)
         # - Riduciamo la precisione: buttiamo via (8 - SECRET_BITS) bit per canale
         # - L'immagine recuperata sarà simile ma non identica (quantizzazione intenzionale)
-        SECRET_BITS = 2
+        SECRET_BITS = ImageSteganography.SECRET_BITS
         shift = 8 - SECRET_BITS
-        secret_bits = "".join(format(px >> shift, f"0{SECRET_BITS}b") for px in secret)
+        secret_bits = BitStream.from_uints(secret >> shift, SECRET_BITS)
 
-        bit_idx = 0
         h, w, _ = host.shape
+        region = carrier_region(host)  # Righe dopo l'header
+        pixel1, pixel2 = gather_pairs(
+            region, ImageSteganography.PAIR_STEP, ImageSteganography.CHANNELS
+        )
+        try:
+            used = embed_payload(
+                pixel1, pixel2, secret_bits, range_tables(ImageSteganography.RANGES)
+            )
+        except ValueError as e:
+            raise ValueError(ErrorMessages.IMAGE_TOO_SMALL_IMAGE) from e
+        scatter_pairs(
+            region,
+            ImageSteganography.PAIR_STEP,
+            ImageSteganography.CHANNELS,
+            pixel1,
+            pixel2,
+        )
+        bit_idx = len(secret_bits)
 
-        for ch in ImageSteganography.CHANNELS:
-            for y in range(h):
-                # FIX: usa w - PAIR_STEP per evitare out-of-bounds quando x + PAIR_STEP
-                for x in range(
-                    0,
-                    w - ImageSteganography.PAIR_STEP,
-                    2 * ImageSteganography.PAIR_STEP,
-                ):
-                    if bit_idx >= len(secret_bits):
-                        break
-
-                    p1 = host[y, x, ch]
-                    p2 = host[y, x + ImageSteganography.PAIR_STEP, ch]
-
-                    low, high, cap = ImageSteganography._range_for_difference(p2 - p1)
-                    chunk = secret_bits[bit_idx : bit_idx + cap]
-
-                    p1n, p2n, used = ImageSteganography._embed_pair(p1, p2, chunk)
-                    host[y, x, ch] = p1n
-                    host[y, x + ImageSteganography.PAIR_STEP, ch] = p2n
-                    bit_idx += used
-
-                if bit_idx >= len(secret_bits):
-                    break
-            if bit_idx >= len(secret_bits):
-                break
-
-        if bit_idx < len(secret_bits):
-            raise ValueError(ErrorMessages.IMAGE_TOO_SMALL_IMAGE)
+        host = host.astype(np.uint8)
 
-        stego = Image.fromarray(host.astype(np.uint8), "RGB")
+        # Header del contenitore con i parametri di recupero
+        is_quality = ImageSteganography.RANGES == ImageSteganography.RANGES_QUALITY
+        ranges_type = "quality" if is_quality else "capacity"
+        header_params = {
+            "width": width,
+            "height": height,
+            "secret_bits": SECRET_BITS,
+            "pair_step": ImageSteganography.PAIR_STEP,
+            "channels": ImageSteganography.CHANNELS,
+            "ranges_type": ranges_type,
+        }
+        write_header(
+            host,
+            build_header(
+                SteganographyMethod.PVD,
+                DataType.IMAGE,
+                header_params,
+                secret_bits.to_bytes(),
+            ),
+        )
+        stego = Image.fromarray(host, "RGB")
 
         # Calcola percentuale di bit usati
         total_bits_host = h * w * len(ImageSteganography.CHANNELS)
@@ -206,8 +230,6 @@ class ImageSteganography:
             f"TERMINATO - Percentuale di pixel usati con PVD: {percentage}% ({bit_idx}/{total_bits_host} bit)"
         )
 
-        # Determina se RANGES è quality o capacity
-        is_quality = ImageSteganography.RANGES == ImageSteganography.RANGES_QUALITY
         params = {
             "method": "pvd",
             "width": width,
@@ -215,11 +237,19 @@ class ImageSteganography:
             "secret_bits": SECRET_BITS,
             "pair_step": ImageSteganography.PAIR_STEP,
             "channels": ImageSteganography.CHANNELS,
-            "ranges_type": "quality" if is_quality else "capacity",
+            "ranges_type": ranges_type,
         }
-        backup_system.save_backup_data(DataType.IMAGE, params, backup_file)
-
-        metrics = QualityMetrics.calculate_metrics(original, stego)
+        backup_system.save_backup_data(DataType.IMAGE, params, backup_file, image=host)
+
+        rows = used_rows(len(region), w, ImageSteganography.PAIR_STEP, used)
+        metrics = QualityMetrics.calculate_metrics(
+            host_img,
+            host,
+            metrics_level,
+            changed_rows(host, rows * w * 3),
+            background=async_metrics,
+            change_maps=change_maps,
+        )
         return stego, 1, 8, 0.0, width, height, metrics, float(percentage)
 
     @staticmethod
@@ -228,80 +258,69 @@ class ImageSteganography:
         output_path: str,
         width: int | None = None,
         height: int | None = None,
-        backup_file: str | None = None,
+        backup_file: BackupFile | None = None,
         **kwargs,
     ):
         img = img.convert("RGB")
 
-        # Carica parametri con gestione None
-        if backup_file:
-            backup_data = backup_system.load_backup_data(backup_file)
-            if backup_data and "params" in backup_data:
-                data = backup_data["params"]
-            else:
-                data = backup_system.get_last_params(DataType.IMAGE)
+        header = read_header(img)
+        if header is not None:
+            # I parametri scritti nell'header hanno la precedenza
+            check_header(header, SteganographyMethod.PVD, DataType.IMAGE)
+            data = header["params"]
+            width, height = data["width"], data["height"]
+            arr = carrier_region(np.array(img, dtype=np.int32))
         else:
-            data = backup_system.get_last_params(DataType.IMAGE)
+            # Formato precedente al contenitore: parametri forniti o dai backup
+            if backup_file:
+                backup_data = backup_system.load_backup_data(
+                    backup_file, DataType.IMAGE, image=img
+                )
+                if backup_data and "params" in backup_data:
+                    data = backup_data["params"]
+                else:
+                    data = backup_system.get_last_params(DataType.IMAGE, image=img)
+            else:
+                data = backup_system.get_last_params(DataType.IMAGE, image=img)
 
-        if not data:
-            raise ValueError(ErrorMessages.PARAMS_MISSING)
+            if not data:
+                raise ValueError(ErrorMessages.PARAMS_MISSING)
 
-        # MERGE: parametri manuali hanno priorità su backup
-        width = width if width is not None else data["width"]
-        height = height if height is not None else data["height"]
+            # MERGE: parametri manuali hanno priorità su backup
+            width = width if width is not None else data["width"]
+            height = height if height is not None else data["height"]
+            arr = np.array(img, dtype=np.int32)
 
-        # Type safety: garantisce che width e height non siano None
-        if width is None or height is None:
-            raise ValueError("Width e height mancanti nei parametri di backup")
+            # Type safety: garantisce che width e height non siano None
+            if width is None or height is None:
+                raise ValueError("Width e height mancanti nei parametri di backup")
 
         SECRET_BITS = data.get("secret_bits", 2)  # Default: 2 bit (qualità ottimale)
         pair_step = data.get("pair_step", ImageSteganography.PAIR_STEP)
         channels = data.get("channels", ImageSteganography.CHANNELS)
-        # Carica RANGES
+        # Carica RANGES (locale: la configurazione della classe non cambia)
         ranges_type = data.get("ranges_type", "quality")
-        ImageSteganography.RANGES = (
+        ranges = (
             ImageSteganography.RANGES_QUALITY
             if ranges_type == "quality"
             else ImageSteganography.RANGES_CAPACITY
         )
 
-        # FIX: usa len(channels) invece di hardcoded 3 per total_bits
-        total_bits = width * height * len(channels) * SECRET_BITS
-
-        arr = np.array(img, dtype=np.int32)
-        extracted = []
-        count = 0
-
-        h, w, _ = arr.shape
-        for ch in channels:
-            for y in range(h):
-                # FIX: usa w - pair_step per evitare out-of-bounds
-                for x in range(0, w - pair_step, 2 * pair_step):
-                    if count >= total_bits:
-                        break
-                    bits = ImageSteganography._extract_pair(
-                        arr[y, x, ch],
-                        arr[y, x + pair_step, ch],
-                    )
-                    extracted.append(bits)
-                    count += len(bits)
-                if count >= total_bits:
-                    break
-            if count >= total_bits:
-                break
-
-        bitstream = "".join(extracted)[:total_bits]
+        # L'immagine segreta è sempre RGB: 3 componenti per pixel, indipendentemente
+        # dai canali host usati per l'embedding
+        total_bits = width * height * 3 * SECRET_BITS
+
+        pixel1, pixel2 = gather_pairs(arr, pair_step, channels)
+        bitstream = extract_payload(pixel1, pixel2, range_tables(ranges), total_bits)
+        if header is not None:
+            verify_payload(header, bitstream.to_bytes())
 
         #  Ricostruzione LOSSY: shiftiamo indietro i bit ridotti
         # L'immagine recuperata ha perdita di precisione di (8 - SECRET_BITS) bit/canale
         # Questa è la natura intrinseca di PVD, non un bug
-        pixels = []
         shift = 8 - SECRET_BITS
-        for i in range(0, len(bitstream), SECRET_BITS):
-            chunk = bitstream[i : i + SECRET_BITS]
-            pixels.append(int(chunk, 2) << shift)
-
-        secret = np.array(pixels[: width * height * 3], dtype=np.uint8)
+        starts = np.arange(width * height * 3) * SECRET_BITS
+        secret = (bitstream.read_uints(starts, SECRET_BITS) << shift).astype(np.uint8)
         secret = secret.reshape((height, width, 3))
         result = Image.fromarray(secret, "RGB")
         result.save(output_path)
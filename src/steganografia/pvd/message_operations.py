@@ -5,12 +5,46 @@ Operazioni di steganografia per messaggi usando PVD (Pixel Value Differencing)
 import numpy as np
 from PIL import Image
 
-from config.constants import DataType
-
-from ..backup import backup_system
-from ..bit_operations import binary_convert, binary_convert_back
+from config.constants import (
+    DataType,
+    ErrorMessages,
+    MetricsLevel,
+    SteganographyMethod,
+)
+
+from ..backup import BackupFile, backup_system
+from ..bit_operations import (
+    BitStream,
+    bits_to_text,
+    decode_text,
+    encode_text,
+    xor_checksum,
+)
+from ..capacity import image_array, usable_bytes
+from ..container import (
+    build_header,
+    carrier_region,
+    changed_rows,
+    check_header,
+    decode_payload,
+    embedded_bits,
+    encode_payload,
+    read_header,
+    write_header,
+)
 from ..metrics import QualityMetrics
-from ..validator import ParameterValidator
+from .pair_operations import (
+    embed_payload,
+    extract_payload,
+    gather_pairs,
+    pvd_capacity,
+    range_tables,
+    scatter_pairs,
+    used_rows,
+)
+
+# Header magico del formato precedente al contenitore (16 bit)
+MAGIC_HEADER = "1010101011110000"
 
 
 class MessageSteganography:
@@ -40,168 +74,127 @@ class MessageSteganography:
     CHANNELS = [0, 1, 2]
 
     @staticmethod
-    def _get_range_capacity(diff: int) -> tuple[int, int, int]:
-        """Ottiene la capacità in bit per una data differenza di pixel"""
-        abs_diff = abs(diff)
-        for lower, upper, capacity in MessageSteganography.RANGES:
-            if lower <= abs_diff <= upper:
-                return lower, upper, capacity
-        # FIX: usa l'ultimo range definito invece di hardcoded (compatibile con QUALITY e CAPACITY)
-        return MessageSteganography.RANGES[-1]
-
-    @staticmethod
-    def _embed_in_pair(pixel1: int, pixel2: int, bits: str) -> tuple[int, int]:
+    def capacity(img: Image.Image) -> dict:
         """
-        Nasconde bit in una coppia di pixel usando PVD
-
-        Args:
-            pixel1, pixel2: Valori dei pixel (0-255)
-            bits: Stringa di bit da nascondere
+        Capacità esatta con la configurazione corrente, senza embedding
 
         Returns:
-            Tupla con i nuovi valori dei pixel
+            Dizionario con 'bits' e la mappa per blocchi (vedi pvd_capacity)
         """
-        diff = pixel2 - pixel1
-        lower, upper, capacity = MessageSteganography._get_range_capacity(diff)
-
-        # Limita i bit alla capacità del range
-        bits = bits[:capacity]
-        if len(bits) == 0:
-            return pixel1, pixel2
-
-        # Converte i bit in valore decimale
-        decimal_value = int(bits.ljust(capacity, "0"), 2)
-
-        # Calcola la nuova differenza
-        new_diff = lower + decimal_value
-
-        #  CRITICAL: clamp per auto-sincronizzazione
-        new_diff = min(new_diff, upper)
-
-        # Mantiene il segno della differenza originale
-        if diff < 0:
-            new_diff = -new_diff
-
-        # Calcola i nuovi pixel
-        m = abs(new_diff) - abs(diff)
-
-        #  Early return se nessuna modifica
-        if m == 0:
-            return pixel1, pixel2
-
-        if diff % 2 == 0:  # diff pari
-            new_pixel1 = pixel1 - m // 2
-            new_pixel2 = pixel2 + m - m // 2
-        else:  # diff dispari
-            new_pixel1 = pixel1 - (m + 1) // 2
-            new_pixel2 = pixel2 + m - (m + 1) // 2
-
-        # Clipping per rimanere nel range valido
-        new_pixel1 = max(0, min(255, new_pixel1))
-        new_pixel2 = max(0, min(255, new_pixel2))
-
-        return new_pixel1, new_pixel2
+        return pvd_capacity(
+            image_array(img),
+            MessageSteganography.PAIR_STEP,
+            MessageSteganography.CHANNELS,
+            range_tables(MessageSteganography.RANGES),
+        )
 
     @staticmethod
-    def _extract_from_pair(pixel1: int, pixel2: int) -> str:
+    def payload_capacity(
+        img: Image.Image, ecc: bool = False, estimate: dict | None = None
+    ) -> int:
         """
-        Estrae bit da una coppia di pixel usando PVD
+        Byte di payload nascondibili con la configurazione corrente
+
+        Args:
+            img: Immagine host
+            ecc: Se True il payload è protetto da Hamming(7,4)
+            estimate: Risultato di capacity() già calcolato (evita di
+                ripetere la stima)
 
         Returns:
-            Stringa di bit estratti
+            Numero massimo di byte del payload (dopo l'eventuale compressione)
         """
-        diff = pixel2 - pixel1
-        lower, upper, capacity = MessageSteganography._get_range_capacity(diff)
-
-        # Calcola il valore nascosto
-        value = abs(diff) - lower
-
-        #  Clamp difensivo
-        value = max(0, min(value, (1 << capacity) - 1))
-
-        # Converte in binario
-        bits = format(value, f"0{capacity}b")
-        return bits
+        estimate = estimate or MessageSteganography.capacity(img)
+        return usable_bytes(estimate["bits"], ecc)
 
     @staticmethod
     def hide_message(
-        img: Image.Image, message: str, backup_file: str | None = None
+        img: Image.Image,
+        message: str,
+        backup_file: BackupFile | None = None,
+        ecc: bool = False,
+        metrics_level: str = MetricsLevel.SAMPLED,
+        async_metrics: bool = False,
+        change_maps: bool = False,
     ) -> tuple[Image.Image, dict, float]:
-        """Nasconde una stringa in un'immagine usando PVD"""
-        ParameterValidator.validate_image_size_for_message(img, message)
+        """
+        Nasconde una stringa in un'immagine usando PVD
 
+        Args:
+            img: Immagine PIL dove nascondere il messaggio
+            message: Messaggio da nascondere
+            backup_file: File dove salvare i parametri di backup
+            ecc: Se True protegge il payload con un codice correttore d'errore
+            metrics_level: Livello delle metriche di qualità ('psnr', 'sampled', 'full')
+            async_metrics: Calcola le metriche in background (restituisce un Future)
+            change_maps: Aggiunge alle metriche le mappe delle modifiche
+        """
         if img.mode != "RGB":
             img = img.convert("RGB")
 
         print("Nascondendo messaggio con PVD...")
-        original_img = img.copy()
-        img_array = np.array(img, dtype=np.int32).copy()  # int32 per evitare overflow
-
-        # Prepara il payload
-        msg_binary = binary_convert(message)
-        magic_header = "1010101011110000"
-        msg_length = format(len(message), "032b")
-        checksum = 0
-        for char in message:
-            checksum ^= ord(char)
-        checksum_binary = format(checksum, "016b")
-        terminator = "1111000011110000"  # Terminatore complesso (16 bit)
-
-        full_payload = (
-            magic_header + msg_length + checksum_binary + msg_binary + terminator
-        )
+        img_array = np.array(img, dtype=np.int32)  # int32 per evitare overflow
 
-        # Nasconde nei pixel usando coppie orizzontali
-        bit_index = 0
-        height, width, _ = img_array.shape
+        # Payload: byte UTF-8 del messaggio (compressi se conviene, con ECC
+        # opzionale), descritti dall'header del contenitore
+        msg_bytes = encode_text(message)
+        payload_bytes, payload, flags = encode_payload(msg_bytes, ecc)
 
-        for channel in MessageSteganography.CHANNELS:
-            for row in range(height):
-                # FIX: usa width - PAIR_STEP per evitare out-of-bounds quando col + PAIR_STEP
-                for col in range(
-                    0,
-                    width - MessageSteganography.PAIR_STEP,
-                    2 * MessageSteganography.PAIR_STEP,
-                ):
-                    if bit_index >= len(full_payload):
-                        break
-
-                    pixel1 = int(img_array[row, col, channel])
-                    pixel2 = int(
-                        img_array[row, col + MessageSteganography.PAIR_STEP, channel]
-                    )
-
-                    # Determina quanti bit possiamo nascondere
-                    _, _, capacity = MessageSteganography._get_range_capacity(
-                        pixel2 - pixel1
-                    )
-                    bits_to_embed = full_payload[bit_index : bit_index + capacity]
-
-                    if bits_to_embed:
-                        new_p1, new_p2 = MessageSteganography._embed_in_pair(
-                            pixel1, pixel2, bits_to_embed
-                        )
-                        img_array[row, col, channel] = new_p1
-                        img_array[
-                            row, col + MessageSteganography.PAIR_STEP, channel
-                        ] = new_p2
-                        # FIX: Incrementa di len(bits_to_embed) non capacity (evita desync quando payload finisce)
-                        bit_index += len(bits_to_embed)
-
-                if bit_index >= len(full_payload):
-                    break
-            if bit_index >= len(full_payload):
-                break
-
-        # Verifica che tutto il messaggio sia stato nascosto
-        if bit_index < len(full_payload):
+        # Verifica capacità (esatta, prima di toccare i pixel)
+        if len(payload_bytes) > MessageSteganography.payload_capacity(img, ecc):
             raise ValueError(
-                f"Immagine troppo piccola per nascondere il messaggio. "
-                f"Nascosti {bit_index}/{len(full_payload)} bit"
+                ErrorMessages.IMAGE_TOO_SMALL_MESSAGE.format(
+                    msg_len=len(payload_bytes), width=img.width, height=img.height
+                )
+            )
+
+        # Nasconde nei pixel dopo le righe dell'header usando coppie orizzontali
+        height, width, _ = img_array.shape
+        region = carrier_region(img_array)
+        pixel1, pixel2 = gather_pairs(
+            region, MessageSteganography.PAIR_STEP, MessageSteganography.CHANNELS
+        )
+        try:
+            used = embed_payload(
+                pixel1,
+                pixel2,
+                payload,
+                range_tables(MessageSteganography.RANGES),
             )
+        except ValueError as e:
+            raise ValueError(
+                f"Immagine troppo piccola per nascondere il messaggio. {e}"
+            ) from e
+        scatter_pairs(
+            region,
+            MessageSteganography.PAIR_STEP,
+            MessageSteganography.CHANNELS,
+            pixel1,
+            pixel2,
+        )
+        bit_index = len(payload)
 
         # Converte in immagine
         img_array = np.clip(img_array, 0, 255).astype(np.uint8)
+
+        # Header del contenitore con i parametri di recupero
+        is_quality = MessageSteganography.RANGES == MessageSteganography.RANGES_QUALITY
+        ranges_type = "quality" if is_quality else "capacity"
+        header_params = {
+            "pair_step": MessageSteganography.PAIR_STEP,
+            "channels": MessageSteganography.CHANNELS,
+            "ranges_type": ranges_type,
+        }
+        write_header(
+            img_array,
+            build_header(
+                SteganographyMethod.PVD,
+                DataType.STRING,
+                header_params,
+                payload_bytes,
+                flags=flags,
+            ),
+        )
         result_img = Image.fromarray(img_array, mode="RGB")
 
         # Calcola percentuale di bit usati
@@ -212,39 +205,104 @@ class MessageSteganography:
         )
 
         # Salva parametri (sempre nella cache, opzionalmente su file)
-        # Determina se RANGES è quality o capacity confrontandolo
-        is_quality = MessageSteganography.RANGES == MessageSteganography.RANGES_QUALITY
         params = {
             "method": "pvd",
-            "msg_length": len(message),
+            "msg_length": len(msg_bytes),
             "pair_step": MessageSteganography.PAIR_STEP,
             "channels": MessageSteganography.CHANNELS,
-            "ranges_type": "quality" if is_quality else "capacity",
+            "ranges_type": ranges_type,
         }
-        backup_system.save_backup_data(DataType.STRING, params, backup_file)
+        backup_system.save_backup_data(
+            DataType.STRING, params, backup_file, image=img_array
+        )
 
-        metrics = QualityMetrics.calculate_metrics(original_img, result_img)
+        rows = used_rows(len(region), width, MessageSteganography.PAIR_STEP, used)
+        metrics = QualityMetrics.calculate_metrics(
+            img,
+            img_array,
+            metrics_level,
+            changed_rows(img_array, rows * width * 3),
+            background=async_metrics,
+            change_maps=change_maps,
+        )
         print("Messaggio nascosto con successo usando PVD")
         return result_img, metrics, float(percentage)
 
     @staticmethod
-    def get_message(img: Image.Image, backup_file: str | None = None) -> str:
+    def get_message(img: Image.Image, backup_file: BackupFile | None = None) -> str:
         """Recupera una stringa da un'immagine usando PVD"""
         if img.mode != "RGB":
             img = img.convert("RGB")
 
+        header = read_header(img)
+        if header is None:
+            return MessageSteganography._get_legacy_message(img, backup_file)
+        check_header(header, SteganographyMethod.PVD, DataType.STRING)
+
+        # Tabella dei range locale: la configurazione della classe non cambia
+        params = header["params"]
+        ranges = (
+            MessageSteganography.RANGES_QUALITY
+            if params["ranges_type"] == "quality"
+            else MessageSteganography.RANGES_CAPACITY
+        )
+        print(
+            f"Parametri PVD letti dall'header: ranges={params['ranges_type']}, pair_step={params['pair_step']}, channels={params['channels']}"
+        )
+
+        print("Recuperando messaggio con PVD...")
+        region = carrier_region(np.array(img, dtype=np.int32))
+        pixel1, pixel2 = gather_pairs(region, params["pair_step"], params["channels"])
+        n_bits = embedded_bits(header)
+        payload = extract_payload(pixel1, pixel2, range_tables(ranges), n_bits)
+        if len(payload) < n_bits:
+            raise ValueError(ErrorMessages.DECODE_FAILED)
+
+        message = decode_text(decode_payload(header, payload))
+        print("Messaggio recuperato con successo usando PVD")
+        return message
+
+    @staticmethod
+    def has_legacy_payload(img: Image.Image) -> bool:
+        """
+        Verifica se l'immagine contiene un messaggio nel formato precedente
+
+        Il payload iniziava con l'header magico nella prima coppia: basta
+        leggere le coppie della prima riga del primo canale.
+        """
+        row = np.array(img.convert("RGB").crop((0, 0, img.width, 1)), dtype=np.int32)
+        pixel1, pixel2 = gather_pairs(
+            row, MessageSteganography.PAIR_STEP, MessageSteganography.CHANNELS[:1]
+        )
+        magic = BitStream.from_str(MAGIC_HEADER)
+        bits = extract_payload(
+            pixel1,
+            pixel2,
+            range_tables(MessageSteganography.RANGES),
+            len(magic),
+        )
+        return bits == magic
+
+    @staticmethod
+    def _get_legacy_message(
+        img: Image.Image, backup_file: BackupFile | None = None
+    ) -> str:
+        """Recupera un messaggio nascosto prima dell'introduzione del contenitore"""
         # Carica parametri
         pair_step = MessageSteganography.PAIR_STEP
         channels = MessageSteganography.CHANNELS
+        ranges = MessageSteganography.RANGES
 
         if backup_file:
-            backup_data = backup_system.load_backup_data(backup_file)
+            backup_data = backup_system.load_backup_data(
+                backup_file, DataType.STRING, image=img
+            )
             if backup_data and "params" in backup_data:
                 pair_step = backup_data["params"].get("pair_step", pair_step)
                 channels = backup_data["params"].get("channels", channels)
                 # CRITICO: carica RANGES
                 ranges_type = backup_data["params"].get("ranges_type", "quality")
-                MessageSteganography.RANGES = (
+                ranges = (
                     MessageSteganography.RANGES_QUALITY
                     if ranges_type == "quality"
                     else MessageSteganography.RANGES_CAPACITY
@@ -253,13 +311,13 @@ class MessageSteganography:
                     f"Parametri PVD caricati da backup: ranges={ranges_type}, pair_step={pair_step}, channels={channels}"
                 )
         else:
-            recent = backup_system.get_last_params(DataType.STRING)
+            recent = backup_system.get_last_params(DataType.STRING, image=img)
             if recent:
                 pair_step = recent.get("pair_step", pair_step)
                 channels = recent.get("channels", channels)
                 # CRITICO: carica RANGES dalla cache
                 ranges_type = recent.get("ranges_type", "quality")
-                MessageSteganography.RANGES = (
+                ranges = (
                     MessageSteganography.RANGES_QUALITY
                     if ranges_type == "quality"
                     else MessageSteganography.RANGES_CAPACITY
@@ -271,52 +329,32 @@ class MessageSteganography:
         print("Recuperando messaggio con PVD...")
         img_array = np.array(img, dtype=np.int32)
 
-        # Estrae i bit
-        extracted_bits = []
-        height, width, _ = img_array.shape
-
-        for channel in channels:
-            for row in range(height):
-                # FIX: usa width - pair_step per evitare out-of-bounds
-                for col in range(0, width - pair_step, 2 * pair_step):
-                    pixel1 = int(img_array[row, col, channel])
-                    # FIX CRITICO: usa pair_step invece di hardcoded +1
-                    pixel2 = int(img_array[row, col + pair_step, channel])
+        # Estrae i bit da tutte le coppie
+        pixel1, pixel2 = gather_pairs(img_array, pair_step, channels)
+        full_binary = extract_payload(pixel1, pixel2, range_tables(ranges))
 
-                    bits = MessageSteganography._extract_from_pair(pixel1, pixel2)
-                    extracted_bits.append(bits)
-
-        full_binary = "".join(extracted_bits)
-        magic_header = "1010101011110000"
-
-        header_pos = full_binary.find(magic_header)
+        header_pos = full_binary.find(BitStream.from_str(MAGIC_HEADER))
         if header_pos == -1:
             raise ValueError(
                 "Nessun messaggio trovato nell'immagine (header magic mancante)"
             )
 
-        # Legge lunghezza
+        # Legge lunghezza e checksum
         length_start = header_pos + 16
-        length_end = length_start + 32
-        msg_length_binary = full_binary[length_start:length_end]
-        msg_length = int(msg_length_binary, 2)
-
-        # Legge checksum
-        checksum_start = length_end
-        checksum_end = checksum_start + 16
-        expected_checksum = int(full_binary[checksum_start:checksum_end], 2)
+        checksum_start = length_start + 32
+        if checksum_start + 16 > len(full_binary):
+            raise ValueError(ErrorMessages.DECODE_FAILED)
+        msg_length = full_binary.read_uint(length_start, 32)
+        expected_checksum = full_binary.read_uint(checksum_start, 16)
 
         # Legge messaggio
-        msg_start = checksum_end
+        msg_start = checksum_start + 16
         msg_end = msg_start + (msg_length * 8)
-        msg_binary = full_binary[msg_start:msg_end]
-
-        message = binary_convert_back(msg_binary)
+        msg_bits = full_binary[msg_start:msg_end]
+        message = bits_to_text(msg_bits)
 
         # Verifica checksum
-        actual_checksum = 0
-        for char in message:
-            actual_checksum ^= ord(char)
+        actual_checksum = xor_checksum(msg_bits.to_bytes())
 
         if actual_checksum != expected_checksum:
             print(
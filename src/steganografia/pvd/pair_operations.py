@@ -0,0 +1,259 @@
+"""
+Logica PVD vettoriale condivisa da messaggi, immagini e file binari
+
+Le coppie di pixel sono disgiunte, quindi la capacità di ogni coppia dipende
+solo dai suoi valori originali: capacità e offset nel payload si calcolano tutti
+insieme e l'embedding avviene in un'unica passata numpy.
+"""
+
+import numpy as np
+
+from ..bit_operations import BitStream
+from ..capacity import BLOCK_SIZE, capacity_estimate
+from ..container import carrier_region
+
+# Range PVD: lista di (lower, upper, bits)
+Ranges = list[tuple[int, int, int]]
+
+
+def range_tables(
+    ranges: Ranges, fallback: tuple[int, int, int] | None = None
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Costruisce le tabelle (lower, upper, capacità) indicizzate per |diff| (0-255)
+
+    Args:
+        ranges: Range di quantizzazione
+        fallback: Range usato per le differenze non coperte (default: l'ultimo)
+
+    Returns:
+        Tupla (lower, upper, capacity) di array lunghi 256
+    """
+    fallback = fallback or ranges[-1]
+    lower = np.full(256, fallback[0], dtype=np.int32)
+    upper = np.full(256, fallback[1], dtype=np.int32)
+    capacity = np.full(256, fallback[2], dtype=np.int32)
+
+    # Ordine inverso: in caso di sovrapposizione vince il primo range (come nel ciclo)
+    for low, high, bits in reversed(ranges):
+        lower[low : high + 1] = low
+        upper[low : high + 1] = high
+        capacity[low : high + 1] = bits
+    return lower, upper, capacity
+
+
+def pair_columns(width: int, pair_step: int) -> np.ndarray:
+    """Colonne del primo pixel di ogni coppia orizzontale"""
+    return np.arange(0, width - pair_step, 2 * pair_step)
+
+
+def used_rows(height: int, width: int, pair_step: int, used: int) -> int:
+    """
+    Righe (dall'inizio della regione) toccate dalle prime `used` coppie
+
+    Nell'ordine (canale, riga, colonna) solo un payload che sta nel primo
+    canale lascia intatte le righe finali.
+    """
+    n_columns = len(pair_columns(width, pair_step))
+    if not n_columns or used > height * n_columns:
+        return height
+    return -(-used // n_columns)
+
+
+def gather_pairs(
+    img_array: np.ndarray, pair_step: int, channels: list[int]
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Raccoglie le coppie nell'ordine di scansione (canale, riga, colonna)
+
+    Returns:
+        Tupla (pixel1, pixel2) di array int32 piatti
+    """
+    columns = pair_columns(img_array.shape[1], pair_step)
+    first = [img_array[:, columns, channel].reshape(-1) for channel in channels]
+    second = [
+        img_array[:, columns + pair_step, channel].reshape(-1) for channel in channels
+    ]
+    return (
+        np.concatenate(first).astype(np.int32),
+        np.concatenate(second).astype(np.int32),
+    )
+
+
+def scatter_pairs(
+    img_array: np.ndarray,
+    pair_step: int,
+    channels: list[int],
+    pixel1: np.ndarray,
+    pixel2: np.ndarray,
+) -> None:
+    """Riscrive nell'immagine le coppie raccolte con gather_pairs"""
+    height = img_array.shape[0]
+    columns = pair_columns(img_array.shape[1], pair_step)
+    per_channel = height * len(columns)
+    for i, channel in enumerate(channels):
+        block = slice(i * per_channel, (i + 1) * per_channel)
+        img_array[:, columns, channel] = pixel1[block].reshape(height, -1)
+        img_array[:, columns + pair_step, channel] = pixel2[block].reshape(height, -1)
+
+
+def pair_capacities(
+    pixel1: np.ndarray, pixel2: np.ndarray, tables: tuple
+) -> np.ndarray:
+    """Numero di bit trasportati da ogni coppia"""
+    return tables[2][np.abs(pixel2 - pixel1)]
+
+
+def pair_distortion(tables: tuple) -> np.ndarray:
+    """
+    Errore quadratico atteso di una coppia per ogni |diff| (0-255)
+
+    Stessa regola di embed_payload con bit del payload uniformi: la nuova
+    differenza è lower + valore (limitata a upper) e la variazione si divide
+    tra i due pixel. La traslazione ai bordi 0-255 è ignorata.
+
+    Args:
+        tables: Tabelle (lower, upper, capacity) di range_tables
+
+    Returns:
+        Array float64 lungo 256 (somma degli errori quadratici dei due pixel)
+    """
+    lower, upper, capacity = tables
+    abs_diff = np.arange(256)[:, None]
+    values = np.arange(1 << int(capacity.max()))[None, :]
+    delta = np.minimum(lower[:, None] + values, upper[:, None]) - abs_diff
+    half = np.where(abs_diff % 2 == 0, delta // 2, (delta + 1) // 2)
+    squared = half**2 + (delta - half) ** 2
+    valid = values < (1 << capacity)[:, None]
+    return np.where(valid, squared, 0).sum(axis=1) / (1 << capacity)
+
+
+def embed_payload(
+    pixel1: np.ndarray, pixel2: np.ndarray, payload: BitStream, tables: tuple
+) -> int:
+    """
+    Nasconde il payload nelle coppie (modifica pixel1 e pixel2 in place)
+
+    L'ultimo gruppo di bit, se incompleto, viene completato con zeri a destra.
+
+    Returns:
+        Numero di coppie usate
+
+    Raises:
+        ValueError: Se le coppie non bastano per il payload
+    """
+    lower, upper, capacity = tables
+    caps = pair_capacities(pixel1, pixel2, tables)
+    ends = np.cumsum(caps, dtype=np.int64)
+    if not ends.size or ends[-1] < len(payload):
+        available = int(ends[-1]) if ends.size else 0
+        raise ValueError(
+            f"Capacità PVD insufficiente: {available}/{len(payload)} bit disponibili"
+        )
+
+    used = int(np.searchsorted(ends, len(payload))) + 1
+    p1, p2 = pixel1[:used], pixel2[:used]
+    values = payload.read_uints(ends[:used] - caps[:used], caps[:used])
+
+    diff = p2 - p1
+    abs_diff = np.abs(diff)
+    new_diff = np.minimum(lower[abs_diff] + values.astype(np.int32), upper[abs_diff])
+    new_diff = np.where(diff < 0, -new_diff, new_diff)
+    delta = new_diff - diff
+
+    # Distribuisce la variazione tra i due pixel (arrotondamento dipendente dalla parità)
+    half = np.where(diff % 2 == 0, delta // 2, (delta + 1) // 2)
+    p1 -= half
+    p2 += delta - half
+
+    # Se un pixel esce da 0-255 trasla la coppia: la differenza resta invariata
+    shift = np.maximum(0, -np.minimum(p1, p2)) - np.maximum(0, np.maximum(p1, p2) - 255)
+    p1 += shift
+    p2 += shift
+    return used
+
+
+def extract_payload(
+    pixel1: np.ndarray, pixel2: np.ndarray, tables: tuple, n_bits: int | None = None
+) -> BitStream:
+    """
+    Estrae i bit nascosti nelle coppie
+
+    Args:
+        pixel1, pixel2: Coppie nell'ordine di scansione
+        tables: Tabelle restituite da range_tables
+        n_bits: Numero di bit da estrarre (default: tutte le coppie)
+
+    Returns:
+        Stream con i bit estratti (eventualmente più corto di n_bits)
+    """
+    lower, _, capacity = tables
+    abs_diff = np.abs(pixel2 - pixel1)
+    caps = capacity[abs_diff]
+    if n_bits is not None:
+        ends = np.cumsum(caps, dtype=np.int64)
+        used = int(np.searchsorted(ends, n_bits)) + 1
+        abs_diff, caps = abs_diff[:used], caps[:used]
+
+    # Clamp difensivo per casi limite
+    values = np.clip(abs_diff - lower[abs_diff], 0, (1 << caps) - 1)
+    bits = BitStream.from_uints(values, caps)
+    return bits if n_bits is None else bits[:n_bits]
+
+
+def pvd_capacity(
+    img_array: np.ndarray,
+    pair_step: int,
+    channels: list[int],
+    tables: tuple,
+    block_size: int = BLOCK_SIZE,
+) -> dict:
+    """
+    Capacità PVD esatta del carrier
+
+    Args:
+        img_array: Immagine come array (altezza, larghezza, canali)
+        pair_step: Distanza tra i pixel di una coppia
+        channels: Canali usati
+        tables: Tabelle (lower, upper, capacity) di range_tables
+        block_size: Lato dei blocchi della mappa
+
+    Returns:
+        Dizionario {'bits', 'map', 'heatmap', 'block_size'} (vedi capacity_estimate)
+    """
+    height, width = img_array.shape[:2]
+    region = carrier_region(img_array)
+    columns = pair_columns(width, pair_step)
+    stride = 2 * pair_step
+    stop = columns[-1] + 1 if len(columns) else 0
+
+    # Bit per coppia sommati sui canali, in righe allineate ai blocchi (la
+    # regione inizia dopo l'header): le colonne delle coppie sono una sequenza
+    # regolare, quindi bastano viste con passo e nessuna copia dei pixel.
+    # Al più 8 bit per canale: la somma sta in un uint8
+    capacity = tables[2].astype(np.uint8)
+    offset = height - len(region)
+    first_block = offset // block_size
+    pad = offset - first_block * block_size
+    n_blocks = -(-height // block_size) - first_block
+    caps = np.zeros((n_blocks * block_size, len(columns)), dtype=np.uint8)
+    region_caps = caps[pad : pad + len(region)]
+    for channel in channels:
+        first = region[:, 0:stop:stride, channel]
+        second = region[:, pair_step : stop + pair_step : stride, channel]
+        diff = np.maximum(first, second)
+        diff -= np.minimum(first, second)
+        region_caps += capacity[diff]
+
+    # Righe a blocchi, poi colonne a blocchi con somme cumulative (un blocco
+    # può non contenere coppie)
+    row_sums = caps.reshape(n_blocks, block_size, len(columns)).sum(
+        axis=1, dtype=np.int64
+    )
+    n_cols = -(-width // block_size)
+    edges = np.searchsorted(columns, np.arange(n_cols + 1) * block_size)
+    cumulative = np.pad(row_sums.cumsum(axis=1), ((0, 0), (1, 0)))
+
+    capacity_map = np.zeros((-(-height // block_size), n_cols), dtype=np.int64)
+    capacity_map[first_block:] = cumulative[:, edges[1:]] - cumulative[:, edges[:-1]]
+    return capacity_estimate(capacity_map, block_size)
@@ -0,0 +1,530 @@
+"""
+Scelta automatica dei parametri di occultamento con un PSNR minimo
+
+Ogni configurazione candidata viene valutata senza eseguire l'embedding:
+capacità esatta (come in core.capacity) e distorsione stimata, analitica per
+LSB e QIM (DWT immagini), sulla tabella degli errori per |diff| e su righe
+campionate per PVD, sui momenti dei coefficienti di tile campionate per il
+segno DWT (stringhe e file). Solo la configurazione scelta va poi nascosta.
+
+Tra le configurazioni che rispettano capacità e PSNR minimo si sceglie:
+- LSB e PVD: il PSNR stimato più alto (immagini LSB: prima più MSB segreti)
+- DWT: la forza di embedding più alta (ALPHA o STEP, più robusta), poi il
+  PSNR stimato (immagini: prima più bit segreti)
+"""
+
+import numpy as np
+import pywt
+from PIL import Image
+
+from config.constants import DataType, SteganographyMethod
+
+from .capacity import image_array, region_components
+from .container import HEADER_CAPACITY, carrier_region
+from .dwt.transform import BAND_NAMES, dwt_capacity, resolve_precision
+from .ecc import encoded_bits
+from .lsb import matrix_embedding
+from .metrics import QualityMetrics
+from .pvd.pair_operations import (
+    pair_columns,
+    pair_distortion,
+    pvd_capacity,
+    range_tables,
+)
+
+# Errore quadratico del contenitore: al più metà dei bit dell'header cambia LSB
+HEADER_SSE = HEADER_CAPACITY * 8 / 2
+
+
+class ParameterTuner:
+    """Classe per la ricerca dei parametri che rispettano un budget di PSNR"""
+
+    # Spazio di ricerca
+    LSB_N: list[int] = [1, 2, 3, 4, 5, 6, 7, 8]
+    PVD_PAIR_STEPS: list[int] = [1, 2, 3]
+    PVD_CHANNELS: list[list[int]] = [[0], [0, 1], [0, 1, 2]]
+    DWT_WAVELETS: list[str] = ["haar", "db2", "db4", "sym4", "coif1"]
+    DWT_BANDS: list[list[str]] = [["cH"], ["cH", "cV"], ["cH", "cV", "cD"]]
+    DWT_ALPHAS: list[float] = [0.05, 0.1, 0.15, 0.2, 0.3, 0.5]
+    DWT_STEPS: list[float] = [8.0, 12.0, 16.0, 20.0, 24.0, 28.0, 32.0]
+    DWT_BITS_SECRET: list[int] = [4, 3, 2]
+
+    # Campionamento
+    SAMPLE_ROWS: int = 256  # Righe campionate per le stime PVD
+    TILE_SIZE: int = 64  # Lato delle tile campionate per le stime DWT
+    MAX_TILES: int = 36  # Numero massimo di tile DWT
+    MAX_COEFFS: int = 8192  # Coefficienti campionati per banda e canale
+
+    @staticmethod
+    def tune(
+        engine: type,
+        img: Image.Image,
+        method: str,
+        data_type: str,
+        payload_size: int,
+        min_psnr: float,
+        ecc: bool = False,
+    ) -> dict:
+        """
+        Cerca la configurazione migliore per un payload e un PSNR minimo
+
+        Args:
+            engine: Classe dell'engine (metodo e tipo di dato)
+            img: Immagine host
+            method: Metodo di steganografia ('lsb', 'dwt', 'pvd')
+            data_type: Tipo di dato ('string', 'image', 'binary')
+            payload_size: Byte del payload (dopo l'eventuale compressione) per
+                stringhe e file, componenti RGB dell'immagine segreta
+                (larghezza * altezza * 3) per le immagini
+            min_psnr: PSNR minimo in dB
+            ecc: Se True il payload è protetto da Hamming(7,4) (stringhe e
+                file DWT/PVD, stringhe LSB)
+
+        Returns:
+            {
+                'params': argomenti per hide_* (solo LSB, es. n o lsb/msb),
+                'config': attributi di classe dell'engine (solo DWT e PVD),
+                'psnr': PSNR stimato in dB,
+                'candidates': configurazioni valutate
+            }
+
+        Raises:
+            ValueError: Se nessuna configurazione rispetta capacità e PSNR
+        """
+        if method == SteganographyMethod.LSB:
+            candidates = ParameterTuner._lsb_candidates(
+                engine, img, data_type, payload_size, ecc
+            )
+        elif method == SteganographyMethod.PVD:
+            candidates = ParameterTuner._pvd_candidates(
+                engine, img, data_type, payload_size, ecc
+            )
+        elif method == SteganographyMethod.DWT:
+            candidates = ParameterTuner._dwt_candidates(
+                engine, img, data_type, payload_size, ecc
+            )
+        else:
+            raise ValueError(f"Ricerca dei parametri non disponibile per {method}")
+
+        # Ordine: punteggio del metodo (primi elementi), poi PSNR stimato
+        feasible = [c for c in candidates if c["psnr"] >= min_psnr]
+        feasible.sort(key=lambda c: c["score"], reverse=True)
+        for candidate in feasible:
+            # Le stime campionate vanno confermate dalla capacità esatta
+            if candidate["check"] is None or candidate["check"]():
+                print(
+                    f"Parametri scelti ({method}): {candidate['params'] or candidate['config']}"
+                    f" - PSNR stimato {candidate['psnr']:.2f} dB"
+                )
+                return {
+                    "params": candidate["params"],
+                    "config": candidate["config"],
+                    "psnr": candidate["psnr"],
+                    "candidates": len(candidates),
+                }
+
+        best = max((c["psnr"] for c in candidates), default=None)
+        raise ValueError(
+            f"Nessuna configurazione {method} nasconde {payload_size} byte "
+            f"con PSNR >= {min_psnr} dB"
+            + (f" (massimo stimato: {best:.2f} dB)" if best is not None else "")
+        )
+
+    @staticmethod
+    def psnr(img: Image.Image, sse: float) -> float:
+        """PSNR stimato da un errore quadratico totale (header incluso)"""
+        mse = (sse + HEADER_SSE) / (img.width * img.height * 3)
+        return QualityMetrics.psnr_from_mse(mse)
+
+    @staticmethod
+    def _candidate(
+        img: Image.Image,
+        sse: float,
+        score: tuple = (),
+        params: dict | None = None,
+        config: dict | None = None,
+        check=None,
+    ) -> dict:
+        """Configurazione valutata (check: verifica della capacità esatta)"""
+        psnr = ParameterTuner.psnr(img, sse)
+        return {
+            "params": params or {},
+            "config": config or {},
+            "psnr": psnr,
+            "score": score + (psnr,),
+            "check": check,
+        }
+
+    @staticmethod
+    def _payload_bits(payload_size: int, ecc: bool) -> int:
+        """Bit nascosti per un payload di payload_size byte"""
+        return encoded_bits(payload_size) if ecc else payload_size * 8
+
+    # ======================================================
+    # LSB: errore analitico (bit del payload uniformi)
+    # ======================================================
+
+    @staticmethod
+    def lsb_sse(n_components: int, bits_per_component: int) -> float:
+        """Errore quadratico atteso sostituendo gli ultimi bit di n componenti"""
+        return n_components * (4**bits_per_component - 1) / 6
+
+    @staticmethod
+    def matrix_sse(n_bits: int, n_cover: int) -> float:
+        """Errore quadratico atteso del matrix embedding (un LSB per blocco)"""
+        k = matrix_embedding.choose_k(n_bits, n_cover)
+        return -(-n_bits // k) * (1 - 2.0**-k)
+
+    @staticmethod
+    def _lsb_candidates(
+        engine: type, img: Image.Image, data_type: str, payload_size: int, ecc: bool
+    ) -> list[dict]:
+        candidates = []
+        if data_type == DataType.IMAGE:
+            # Più MSB segreti possibile, poi il minimo LSB che basta
+            for msb in range(8, 0, -1):
+                for lsb in range(1, msb + 1):
+                    if engine.payload_capacity(img, lsb, msb) >= payload_size:
+                        sse = ParameterTuner.lsb_sse(-(-payload_size * msb // lsb), lsb)
+                        candidates.append(
+                            ParameterTuner._candidate(
+                                img,
+                                sse,
+                                (msb,),
+                                params={"lsb": lsb, "msb": msb, "div": 0},
+                            )
+                        )
+                        break
+            return candidates
+
+        n_cover = region_components(img.width, img.height)
+        if data_type == DataType.BINARY:
+            n_bits = ParameterTuner._payload_bits(payload_size, ecc)
+            n_cover = region_components(
+                img.width, img.height, 4 if img.mode == "RGBA" else 3
+            )
+            for n in ParameterTuner.LSB_N:
+                if engine.payload_capacity(img, n, ecc=ecc) >= payload_size:
+                    sse = ParameterTuner.lsb_sse(-(-n_bits // n), n)
+                    candidates.append(
+                        ParameterTuner._candidate(
+                            img, sse, params={"n": n, "div": 0, "matrix": False}
+                        )
+                    )
+        else:
+            n_bits = ParameterTuner._payload_bits(payload_size, ecc)
+            if n_bits <= n_cover:
+                candidates.append(
+                    ParameterTuner._candidate(
+                        img,
+                        ParameterTuner.lsb_sse(n_bits, 1),
+                        params={"matrix": False},
+                    )
+                )
+        if n_bits <= n_cover:
+            candidates.append(
+                ParameterTuner._candidate(
+                    img,
+                    ParameterTuner.matrix_sse(n_bits, n_cover),
+                    params=(
+                        {"n": 1, "div": 0, "matrix": True}
+                        if data_type == DataType.BINARY
+                        else {"matrix": True}
+                    ),
+                )
+            )
+        return candidates
+
+    # ======================================================
+    # PVD: errore atteso per |diff| su righe campionate
+    # ======================================================
+
+    @staticmethod
+    def pvd_row_stats(
+        sample: np.ndarray, pair_step: int, tables: tuple
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Bit ed errore quadratico atteso per riga campionata e canale
+
+        Args:
+            sample: Righe campionate della regione (righe, larghezza, 3) in int16
+            pair_step: Distanza tra i pixel di una coppia
+            tables: Tabelle di range_tables
+
+        Returns:
+            Tupla (bit, errore) di array (canali, righe)
+        """
+        columns = pair_columns(sample.shape[1], pair_step)
+        abs_diff = np.abs(sample[:, columns + pair_step] - sample[:, columns])
+        bits = tables[2][abs_diff].sum(axis=1, dtype=np.int64)
+        errors = pair_distortion(tables)[abs_diff].sum(axis=1)
+        return bits.T, errors.T
+
+    @staticmethod
+    def fill_sse(bits: np.ndarray, errors: np.ndarray, n_bits: int) -> float | None:
+        """
+        Errore quadratico delle prime unità (righe o bande) che contengono n_bits
+
+        L'ultima unità usata contribuisce in proporzione ai bit che ospita.
+
+        Returns:
+            Errore stimato, None se le unità non bastano
+        """
+        ends = np.cumsum(bits)
+        if not ends.size or ends[-1] < n_bits:
+            return None
+        last = int(np.searchsorted(ends, n_bits))
+        start = ends[last - 1] if last else 0
+        partial = (n_bits - start) / bits[last] if bits[last] else 0.0
+        return float(errors[:last].sum() + partial * errors[last])
+
+    @staticmethod
+    def _pvd_candidates(
+        engine: type, img: Image.Image, data_type: str, payload_size: int, ecc: bool
+    ) -> list[dict]:
+        array = image_array(img)
+        region = carrier_region(array)
+        rows = np.unique(
+            np.linspace(
+                0, len(region) - 1, min(len(region), ParameterTuner.SAMPLE_ROWS)
+            )
+            .round()
+            .astype(np.int64)
+        )
+        sample = region[rows].astype(np.int16)
+        weight = len(region) / len(rows)  # Righe rappresentate da ogni campione
+
+        if data_type == DataType.IMAGE:
+            n_bits = payload_size * engine.SECRET_BITS
+        else:
+            n_bits = ParameterTuner._payload_bits(payload_size, ecc)
+        fallback = getattr(engine, "FALLBACK_RANGE", None)
+
+        candidates = []
+        for ranges in (engine.RANGES_QUALITY, engine.RANGES_CAPACITY):
+            tables = range_tables(ranges, fallback)
+            for pair_step in ParameterTuner.PVD_PAIR_STEPS:
+                bits, errors = ParameterTuner.pvd_row_stats(sample, pair_step, tables)
+                for channels in ParameterTuner.PVD_CHANNELS:
+                    # Ordine di scansione (canale, riga, colonna)
+                    sse = ParameterTuner.fill_sse(
+                        bits[channels].reshape(-1) * weight,
+                        errors[channels].reshape(-1) * weight,
+                        n_bits,
+                    )
+                    if sse is None:
+                        continue
+
+                    def check(pair_step=pair_step, channels=channels, tables=tables):
+                        capacity = pvd_capacity(array, pair_step, channels, tables)
+                        return capacity["bits"] >= n_bits
+
+                    candidates.append(
+                        ParameterTuner._candidate(
+                            img,
+                            sse,
+                            config={
+                                "RANGES": ranges,
+                                "PAIR_STEP": pair_step,
+                                "CHANNELS": channels,
+                            },
+                            check=check,
+                        )
+                    )
+        return candidates
+
+    # ======================================================
+    # DWT: regole dell'engine su coefficienti campionati
+    # ======================================================
+
+    @staticmethod
+    def sample_tiles(region: np.ndarray) -> np.ndarray:
+        """Tile (n, lato, lato, canali) a intervalli regolari sulla regione"""
+        size = min(ParameterTuner.TILE_SIZE, *region.shape[:2])
+        per_side = max(1, int(np.sqrt(ParameterTuner.MAX_TILES)))
+        rows = np.unique(
+            np.linspace(0, region.shape[0] - size, per_side).astype(np.int64)
+        )
+        cols = np.unique(
+            np.linspace(0, region.shape[1] - size, per_side).astype(np.int64)
+        )
+        return np.stack(
+            [region[r : r + size, c : c + size] for r in rows for c in cols]
+        )
+
+    @staticmethod
+    def band_samples(tiles: np.ndarray, wavelet: str, dtype: type) -> dict:
+        """
+        |coefficienti| di livello 1 delle tile ed errore della sola ricostruzione
+
+        I coefficienti di bordo delle tile (influenzati dall'estensione del
+        segnale) sono esclusi.
+
+        Returns:
+            {
+                'cH', 'cV', 'cD': |coefficienti| per canale (canali, n),
+                'floor': errore quadratico medio per pixel della ricostruzione
+                    senza modifiche (conversione a uint8), per canale
+            }
+        """
+        approx, details = pywt.dwt2(tiles.astype(dtype), wavelet, axes=(1, 2))
+        margin = pywt.Wavelet(wavelet).dec_len // 2
+        samples = {}
+        for name, band in zip(BAND_NAMES, details):
+            inner = band[:, margin : -margin or None, margin : -margin or None]
+            inner = inner if inner.size else band
+            values = np.moveaxis(inner, -1, 0).reshape(tiles.shape[-1], -1)
+            stride = -(-values.shape[1] // ParameterTuner.MAX_COEFFS)
+            samples[name] = np.abs(values[:, ::stride])
+
+        restored = pywt.idwt2((approx, details), wavelet, axes=(1, 2))
+        restored = restored[:, : tiles.shape[1], : tiles.shape[2]]
+        error = np.clip(restored, 0, 255).astype(np.uint8).astype(np.int16) - tiles
+        samples["floor"] = (error.astype(np.float64) ** 2).mean(axis=(0, 1, 2))
+        return samples
+
+    @staticmethod
+    def sign_error(coeffs: np.ndarray, delta: float) -> np.ndarray:
+        """
+        Errore atteso per coefficiente delle stringhe: |c| + delta col segno del bit
+
+        Args:
+            coeffs: |coefficienti| campionati (ultimo asse)
+            delta: Incremento del modulo (ALPHA * 50)
+        """
+        return (0.5 * delta**2 + 0.5 * (2 * coeffs + delta) ** 2).mean(axis=-1)
+
+    @staticmethod
+    def scale_error(coeffs: np.ndarray, strength: float) -> np.ndarray:
+        """
+        Errore atteso per coefficiente dei file: |c| (almeno 2) moltiplicato
+        per strength col segno del bit
+
+        Args:
+            coeffs: |coefficienti| campionati (ultimo asse)
+            strength: Moltiplicatore del modulo (max(5, 1 / ALPHA))
+        """
+        magnitude = np.where(coeffs < 1.0, 2.0, coeffs) * strength
+        return (magnitude**2 + coeffs**2).mean(axis=-1)
+
+    @staticmethod
+    def qim_error(coeffs: np.ndarray, step: float) -> np.ndarray:
+        """
+        Errore atteso per coefficiente della QIM delle immagini: centro del bin
+        la cui parità è il bit
+
+        Args:
+            coeffs: |coefficienti| campionati (ultimo asse)
+            step: Step di quantizzazione
+        """
+        index = (coeffs // step).astype(np.int64)
+        total = np.zeros(coeffs.shape)
+        for bit in (0, 1):
+            moved = index + np.where(index % 2 != bit, 1 if bit else -1, 0)
+            total += ((np.maximum(moved, 0) + 0.5) * step - coeffs) ** 2
+        return (total / 2).mean(axis=-1)
+
+    @staticmethod
+    def _dwt_candidates(
+        engine: type, img: Image.Image, data_type: str, payload_size: int, ecc: bool
+    ) -> list[dict]:
+        array = image_array(img)
+        region = carrier_region(array)
+        tiles = ParameterTuner.sample_tiles(region).astype(np.int16)
+        dtype = resolve_precision(engine.PRECISION)
+        region_pixels = region.shape[0] * region.shape[1]
+        n_bits = ParameterTuner._payload_bits(payload_size, ecc)
+
+        candidates = []
+        for wavelet in ParameterTuner.DWT_WAVELETS:
+            samples = ParameterTuner.band_samples(tiles, wavelet, dtype)
+            band_rows, band_cols = pywt.wavedecn_shapes(
+                region.shape[:2], wavelet, level=1
+            )[1]["dd"]
+            band_size = band_rows * band_cols
+
+            if data_type == DataType.IMAGE:
+                # Errore per banda e STEP sul canale usato (bande di pari
+                # dimensione: per più bande basta la media)
+                errors = {
+                    (band, step): ParameterTuner.qim_error(
+                        samples[band][engine.CHANNEL], step
+                    )
+                    for band in BAND_NAMES
+                    for step in ParameterTuner.DWT_STEPS
+                }
+                floor = samples["floor"][engine.CHANNEL] * region_pixels
+                for bands in ParameterTuner.DWT_BANDS:
+                    capacity = dwt_capacity(img.height, img.width, wavelet, bands, 1, 1)
+                    for bits_secret in ParameterTuner.DWT_BITS_SECRET:
+                        n_secret = payload_size * bits_secret
+                        if capacity["bits"] < n_secret:
+                            continue
+                        for step in ParameterTuner.DWT_STEPS:
+                            error = np.mean([errors[band, step] for band in bands])
+                            candidates.append(
+                                ParameterTuner._candidate(
+                                    img,
+                                    floor + n_secret * error,
+                                    (bits_secret, step),
+                                    config={
+                                        "WAVELET": wavelet,
+                                        "STEP": step,
+                                        "BITS_SECRET": bits_secret,
+                                        "BANDS": bands,
+                                        "LEVELS": 1,
+                                    },
+                                )
+                            )
+                continue
+
+            # Forza dell'embedding (il punteggio) ed errore per banda e canale,
+            # come li usa l'engine
+            errors = {}
+            for alpha in ParameterTuner.DWT_ALPHAS:
+                for band in BAND_NAMES:
+                    if data_type == DataType.BINARY:
+                        strength = max(5.0, 1.0 / alpha)
+                        error = ParameterTuner.scale_error(samples[band], strength)
+                    else:
+                        strength = alpha
+                        error = ParameterTuner.sign_error(samples[band], alpha * 50.0)
+                    errors[alpha, band] = (strength, error)
+
+            for bands in ParameterTuner.DWT_BANDS:
+                for use_all in (True, False):
+                    channels = [0, 1, 2] if use_all else [engine.CHANNEL]
+                    capacity = dwt_capacity(
+                        img.height, img.width, wavelet, bands, 1, len(channels)
+                    )
+                    if capacity["bits"] < n_bits:
+                        continue
+                    floor = samples["floor"][channels].sum() * region_pixels
+                    for alpha in ParameterTuner.DWT_ALPHAS:
+                        # Riempimento per canale, poi per banda
+                        sse = ParameterTuner.fill_sse(
+                            np.full(len(channels) * len(bands), band_size),
+                            np.array(
+                                [
+                                    band_size * errors[alpha, band][1][channel]
+                                    for channel in channels
+                                    for band in bands
+                                ]
+                            ),
+                            n_bits,
+                        )
+                        candidates.append(
+                            ParameterTuner._candidate(
+                                img,
+                                floor + sse,
+                                (errors[alpha, bands[0]][0],),
+                                config={
+                                    "WAVELET": wavelet,
+                                    "ALPHA": alpha,
+                                    "BANDS": bands,
+                                    "LEVELS": 1,
+                                    "USE_ALL_CHANNELS": use_all,
+                                },
+                            )
+                        )
+        return candidates
@@ -2,8 +2,6 @@
 Validazione dei parametri per le operazioni di steganografia
 """
 
-from PIL import Image
-
 from config.constants import CompressionMode, ErrorMessages, ValidationLimits
 
 
@@ -38,45 +36,6 @@ class ParameterValidator:
         ]:
             raise ValueError(ErrorMessages.INVALID_ZIP_MODE)
 
-    @staticmethod
-    def validate_image_size_for_message(img: Image.Image, message: str) -> None:
-        """Valida che l'immagine sia abbastanza grande per il messaggio"""
-        if (img.width * img.height) * 3 < len(message) * 8:
-            raise ValueError(
-                ErrorMessages.IMAGE_TOO_SMALL_MESSAGE.format(
-                    msg_len=len(message), width=img.width, height=img.height
-                )
-            )
-
-    @staticmethod
-    def validate_image_size_for_image(
-        host_img: Image.Image, secret_img: Image.Image, lsb: int, msb: int
-    ) -> None:
-        """Valida che l'immagine host sia abbastanza grande per l'immagine segreta"""
-        if (lsb * host_img.width * host_img.height * 3) < (
-            msb * secret_img.width * secret_img.height * 3
-        ):
-            raise ValueError(
-                ErrorMessages.IMAGE_TOO_SMALL_IMAGE.format(
-                    host_width=host_img.width,
-                    host_height=host_img.height,
-                    secret_width=secret_img.width,
-                    secret_height=secret_img.height,
-                )
-            )
-
-    @staticmethod
-    def validate_image_size_for_file(
-        img: Image.Image, file_size: int, n: int, channels: int
-    ) -> None:
-        """Valida che l'immagine sia abbastanza grande per il file"""
-        if (img.width * img.height) * channels * n < file_size * 8:
-            raise ValueError(
-                ErrorMessages.IMAGE_TOO_SMALL_FILE.format(
-                    file_size=file_size, width=img.width, height=img.height
-                )
-            )
-
     @staticmethod
     def validate_div_for_images(
         div: float, arr1_len: int, arr2_len: int, lsb: int, msb: int
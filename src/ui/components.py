@@ -4,8 +4,15 @@ Componenti helper per l'interfaccia Streamlit
 
 import os
 import tempfile
+from concurrent.futures import Future
+from typing import BinaryIO
 
 import streamlit as st
+from PIL import Image
+
+from config.constants import DataType, SteganographyMethod
+
+from .image_utils import ImageDisplay
 
 
 def save_uploaded_file(uploaded_file, suffix: str = "") -> str | None:
@@ -21,12 +28,13 @@ def save_uploaded_file(uploaded_file, suffix: str = "") -> str | None:
 
 def display_backup_options(
     data_type_key: str, show_manual: bool = True
-) -> tuple[str | None, bool, bool]:
+) -> tuple[BinaryIO | None, bool, bool]:
     """
     Mostra le opzioni di backup e recupero parametri
 
     Returns:
-        Tuple di (backup_file_path, use_recent, manual_params)
+        Tuple di (backup_file, use_recent, manual_params); backup_file è il
+        file caricato (oggetto file) o None
     """
     st.subheader("🔧 Gestione Parametri")
 
@@ -42,20 +50,19 @@ def display_backup_options(
         horizontal=True,
     )
 
-    backup_file_path = None
+    backup_file = None
     use_recent = param_choice == "Automatico (usa variabili recenti)"
     manual_params = param_choice == "Inserimento manuale"
 
     if param_choice == "File backup (.dat)":
+        # Il file caricato viene letto direttamente, senza copia su disco
         backup_file = st.file_uploader(
             "Carica file backup (.dat)",
             type=["dat"],
             key=f"backup_upload_{data_type_key}",
         )
-        if backup_file:
-            backup_file_path = save_uploaded_file(backup_file)
 
-    return backup_file_path, use_recent, manual_params
+    return backup_file, use_recent, manual_params
 
 
 def display_image_info(uploaded_file, img, caption: str) -> None:
@@ -82,3 +89,119 @@ def cleanup_temp_file(file_path: str) -> None:
 def create_download_button(data, filename: str, mime: str, label: str) -> None:
     """Crea un pulsante di download"""
     st.download_button(label=label, data=data, file_name=filename, mime=mime)
+
+
+def display_capacity(
+    host_image, method: str, data_type: str, needed: int | None = None
+) -> None:
+    """
+    Mostra la capacità esatta dell'immagine host con la configurazione scelta
+
+    La capacità utile (header escluso) vale per tutti i metodi; per DWT e PVD,
+    la cui capacità dipende dal contenuto dell'immagine, mostra anche la mappa
+    per blocchi. Nessuna stima esegue l'embedding. Se needed è indicato
+    (stessa unità della capacità) segnala anche se il payload ci sta.
+    """
+    from src.steganografia import capacity, capacity_map
+
+    try:
+        img = Image.open(host_image)
+        # La stima di DWT e PVD (la parte costosa) è calcolata una sola volta
+        # e riusata sia per la capacità utile sia per la mappa
+        estimate = None
+        config = None
+        if method in (SteganographyMethod.DWT, SteganographyMethod.PVD):
+            estimate = capacity_map(img, method, data_type)
+            config = {"estimate": estimate}
+        usable = capacity(img, method, data_type, config)
+    except ValueError as e:
+        st.warning(f"⚠️ Capacità non calcolabile: {str(e)}")
+        return
+
+    unit = "componenti RGB" if data_type == DataType.IMAGE else "byte"
+    st.info(f"📦 Capacità utile: {usable:,} {unit} (header escluso)")
+    if needed is not None:
+        if needed > usable:
+            st.error(
+                f"❌ **Capacità insufficiente**: servono {needed:,} {unit}, "
+                f"disponibili {usable:,}"
+            )
+        elif usable:
+            st.success(
+                f"✅ **Capacità sufficiente**: {needed:,} / {usable:,} {unit} "
+                f"({needed / usable:.1%} utilizzato)"
+            )
+    if estimate is not None:
+        ImageDisplay.show_capacity_map(estimate)
+
+
+def display_hide_preview(
+    host_image, payload, method: str, data_type: str, **options
+) -> None:
+    """
+    Mostra l'anteprima rapida dell'occultamento su un carrier ridotto
+
+    Viene ricalcolata a ogni modifica dei parametri; l'occultamento a piena
+    risoluzione resta affidato al pulsante di conferma.
+    """
+    from src.steganografia import preview_hide
+
+    try:
+        with st.spinner("Calcolo anteprima..."):
+            preview = preview_hide(
+                Image.open(host_image),
+                payload,
+                method,
+                data_type,
+                change_maps=True,
+                **options,
+            )
+    except Exception as e:
+        st.warning(f"⚠️ Anteprima non disponibile: {str(e)}")
+        return
+
+    img = preview["image"]
+    st.caption(
+        f"⚡ Anteprima su {img.width}x{img.height} px con il payload scalato "
+        f"({preview['scale']:.1%}): metriche stimate"
+    )
+    st.image(img, caption="Anteprima del risultato", width=400)
+    display_quality_metrics(preview)
+
+
+def display_quality_metrics(results: dict) -> None:
+    """
+    Mostra SSIM, PSNR e mappa delle modifiche dei risultati di un occultamento
+
+    Se le metriche sono ancora in calcolo (Future) attende il risultato con uno
+    spinner e lo salva nei risultati, così i rerun successivi non attendono.
+    """
+    metrics = results.get("metrics")
+    if metrics is None:
+        return
+    if isinstance(metrics, Future):
+        with st.spinner("Calcolo metriche di qualità..."):
+            try:
+                metrics = metrics.result()
+            except Exception as e:
+                st.warning(f"⚠️ Metriche non disponibili: {str(e)}")
+                del results["metrics"]
+                return
+        results["metrics"] = metrics
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric(
+            label="SSIM (Similarità Strutturale)",
+            value="n/d" if metrics["ssim"] is None else f"{metrics['ssim']:.4f}",
+            help="1.0 = immagini identiche",
+        )
+    with col2:
+        st.metric(
+            label="PSNR (Rapporto Segnale/Rumore)",
+            value=f"{metrics['psnr']:.2f} dB",
+            help="Valori più alti = migliore qualità",
+        )
+
+    if "change_maps" in metrics:
+        ImageDisplay.show_change_maps(metrics["change_maps"])
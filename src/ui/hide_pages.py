@@ -3,14 +3,20 @@ Pagine per nascondere dati nell'interfaccia Streamlit
 """
 
 import io
-import os
 
 import streamlit as st
 from PIL import Image
 
-from config.constants import CompressionMode, SteganographyMethod
+from config.constants import CompressionMode, DataType, SteganographyMethod
 
-from .components import cleanup_temp_file, create_download_button, save_uploaded_file
+from .components import (
+    cleanup_temp_file,
+    create_download_button,
+    display_capacity,
+    display_hide_preview,
+    display_quality_metrics,
+    save_uploaded_file,
+)
 from .image_utils import ImageDisplay
 
 
@@ -104,6 +110,7 @@ class HideDataPages:
             from src.steganografia.dwt.message_operations import (
                 MessageSteganography as DWT_Msg,
             )
+            from src.steganografia.dwt.transform import band_options
 
             preset = st.selectbox(
                 "📋 Preconfigurazione DWT:",
@@ -124,6 +131,7 @@ class HideDataPages:
                 DWT_Msg.ALPHA = 0.1
                 DWT_Msg.BANDS = ["cH"]
                 DWT_Msg.USE_ALL_CHANNELS = True
+                DWT_Msg.LEVELS = 1
                 st.info(
                     "⚖️ Wavelet Haar, alpha 0.1, banda cH, tutti i canali - Compromesso qualità/robustezza"
                 )
@@ -132,6 +140,7 @@ class HideDataPages:
                 DWT_Msg.ALPHA = 0.05
                 DWT_Msg.BANDS = ["cH"]
                 DWT_Msg.USE_ALL_CHANNELS = True
+                DWT_Msg.LEVELS = 1
                 st.info(
                     "🎨 Wavelet Haar, alpha 0.05, banda cH, tutti i canali - Minima distorsione, fragile"
                 )
@@ -140,6 +149,7 @@ class HideDataPages:
                 DWT_Msg.ALPHA = 0.3
                 DWT_Msg.BANDS = ["cH", "cV"]
                 DWT_Msg.USE_ALL_CHANNELS = True
+                DWT_Msg.LEVELS = 1
                 st.info(
                     "💪 Wavelet Daubechies 4, alpha 0.3, 2 bande, tutti i canali - Più robusto, resiste meglio a modifiche"
                 )
@@ -148,6 +158,7 @@ class HideDataPages:
                 DWT_Msg.ALPHA = 0.15
                 DWT_Msg.BANDS = ["cH", "cV", "cD"]
                 DWT_Msg.USE_ALL_CHANNELS = True
+                DWT_Msg.LEVELS = 1
                 st.info(
                     "📦 Alpha 0.15, 3 bande (tutte), tutti i canali - Massima capacità"
                 )
@@ -170,17 +181,26 @@ class HideDataPages:
                         help="Basso=invisibile ma fragile, Alto=visibile ma robusto",
                         key="dwt_msg_hide_alpha",
                     )
+                    levels = st.slider(
+                        "Livelli DWT",
+                        min_value=1,
+                        max_value=3,
+                        value=1,
+                        help="Livelli più profondi = più robusto a ricompressione, meno capacità",
+                        key="dwt_msg_hide_levels",
+                    )
                 with col2:
+                    options = band_options(levels)
                     bands_selection = st.multiselect(
                         "Bande DWT",
-                        options=["cH", "cV", "cD"],
-                        default=["cH"],
-                        help="cH=orizzontale, cV=verticale, cD=diagonale. Più bande = più capacità",
-                        key="dwt_msg_hide_bands",
+                        options=options,
+                        default=[options[0]],
+                        help="cH=orizzontale, cV=verticale, cD=diagonale (il numero indica il livello). Più bande = più capacità",
+                        key=f"dwt_msg_hide_bands_{levels}",
                     )
                     if not bands_selection:
                         st.error("⚠️ Seleziona almeno una banda!")
-                        bands_selection = ["cH"]
+                        bands_selection = [options[0]]
                     use_all_channels = st.checkbox(
                         "Usa tutti i canali RGB",
                         value=True,
@@ -191,9 +211,23 @@ class HideDataPages:
                 DWT_Msg.WAVELET = wavelet
                 DWT_Msg.ALPHA = alpha
                 DWT_Msg.BANDS = bands_selection
+                DWT_Msg.LEVELS = levels
                 DWT_Msg.USE_ALL_CHANNELS = use_all_channels
                 DWT_Msg.CHANNEL = 0  # Sempre R quando single-channel
 
+        # Capacità esatta con la configurazione scelta
+        if host_image:
+            display_capacity(host_image, selected_method, DataType.STRING)
+
+        # Anteprima rapida su un carrier ridotto
+        if st.checkbox("⚡ Anteprima rapida", key="hide_string_preview"):
+            if host_image and message:
+                display_hide_preview(
+                    host_image, message, selected_method, DataType.STRING
+                )
+            else:
+                st.info("Carica un'immagine e inserisci un messaggio per l'anteprima")
+
         output_name = st.text_input(
             "📁 Nome file output", value="image_with_message.png"
         )
@@ -212,7 +246,11 @@ class HideDataPages:
                         # Nascondi messaggio
                         with st.spinner("Nascondendo messaggio..."):
                             result_img, metrics, percentage = hide_message(
-                                img, message, method=selected_method
+                                img,
+                                message,
+                                method=selected_method,
+                                async_metrics=True,
+                                change_maps=True,
                             )
 
                         st.success("✅ Messaggio nascosto con successo!")
@@ -251,24 +289,6 @@ class HideDataPages:
             if "preview_info" in result_data:
                 st.info(result_data["preview_info"])
 
-            # Mostra metriche se disponibili
-            if "metrics" in result_data:
-
-                metrics = result_data["metrics"]
-                col1, col2 = st.columns(2)
-                with col1:
-                    st.metric(
-                        label="SSIM (Similarità Strutturale)",
-                        value=f"{metrics['ssim']:.4f}",
-                        help="1.0 = immagini identiche",
-                    )
-                with col2:
-                    st.metric(
-                        label="PSNR (Rapporto Segnale/Rumore)",
-                        value=f"{metrics['psnr']:.2f} dB",
-                        help="Valori più alti = migliore qualità",
-                    )
-
             # Mostra sempre l'anteprima dell'immagine risultato
             if "preview_image" in result_data:
                 st.image(
@@ -284,6 +304,9 @@ class HideDataPages:
                 "📥 Scarica immagine con messaggio nascosto",
             )
 
+            # Metriche calcolate in background: mostrate dopo il download
+            display_quality_metrics(result_data)
+
     @staticmethod
     def hide_image_page(selected_method):
         """Pagina per nascondere immagini"""
@@ -369,6 +392,7 @@ class HideDataPages:
 
             # Importa le costanti DWT
             from src.steganografia.dwt.image_operations import ImageSteganography as DWT
+            from src.steganografia.dwt.transform import band_options
 
             # Applica preset
             if preset == "⚖️ Bilanciato (consigliato)":
@@ -399,7 +423,8 @@ class HideDataPages:
                 default_wavelet = DWT.WAVELET
                 default_step = DWT.STEP
                 default_bits = DWT.BITS_SECRET
-                default_bands = DWT.BANDS
+                default_bands = ["cH", "cV"]
+            default_levels = 1
 
             # Parametri personalizzabili (se preset personalizzato)
             if preset == "⚙️ Personalizzato":
@@ -429,59 +454,39 @@ class HideDataPages:
                         help="2=massima capacità, 4=massima qualità (4 MSB)",
                         key="dwt_bits_slider",
                     )
+                    levels_value = st.slider(
+                        "Livelli DWT",
+                        min_value=1,
+                        max_value=3,
+                        value=default_levels,
+                        help="Livelli più profondi = più robusto a ricompressione, meno capacità",
+                        key="dwt_img_levels",
+                    )
                 with col2:
+                    options = band_options(levels_value)
                     bands_selection = st.multiselect(
                         "Bande DWT",
-                        options=["cH", "cV", "cD"],
-                        default=default_bands,
-                        help="cH=orizzontale, cV=verticale, cD=diagonale. Più bande = più capacità ma più distorsione",
-                        key="dwt_bands_multi",
+                        options=options,
+                        default=default_bands if levels_value == 1 else [options[0]],
+                        help="cH=orizzontale, cV=verticale, cD=diagonale (il numero indica il livello). Più bande = più capacità ma più distorsione",
+                        key=f"dwt_bands_multi_{levels_value}",
                     )
                     if not bands_selection:
                         st.error("⚠️ Seleziona almeno una banda!")
-                        bands_selection = ["cH"]
+                        bands_selection = [options[0]]
             else:
                 wavelet_value = default_wavelet
                 step_value = default_step
                 bits_secret = default_bits
                 bands_selection = default_bands
+                levels_value = default_levels
 
             # Applica i parametri (SOLO quelli usati)
             DWT.WAVELET = wavelet_value
             DWT.STEP = step_value
             DWT.BITS_SECRET = bits_secret
             DWT.BANDS = bands_selection
-
-            # Calcola capacità DWT teorica (si aggiorna dinamicamente con i parametri)
-            if host_image and secret_image:
-                host_info = ImageDisplay.get_image_info(host_image)
-                secret_info = ImageDisplay.get_image_info(secret_image)
-                if host_info and secret_info:
-                    # Capacità DWT: usa TUTTI i coefficienti (filtro epsilon, non STEP)
-                    # Formula: (W*H/4) * len(bands) coefficienti per livello DWT 1
-                    host_w, host_h = host_info["width"], host_info["height"]
-
-                    # Con epsilon filter, praticamente TUTTI i coefficienti sono utilizzabili (~99%)
-                    dwt_capacity_bits = int(
-                        (host_w * host_h / 4) * len(bands_selection) * 0.99
-                    )
-                    secret_w, secret_h = secret_info["width"], secret_info["height"]
-                    secret_bits_needed = secret_w * secret_h * 3 * bits_secret
-
-                    if secret_bits_needed > dwt_capacity_bits:
-                        st.error(
-                            f"❌ **Capacità insufficiente**: L'immagine segreta richiede {secret_bits_needed:,} bit, "
-                            f"ma la capacità DWT è ~{dwt_capacity_bits:,} bit. "
-                            f"Riduci dimensione secret, bits/pixel o usa più bande."
-                        )
-                    else:
-                        usage_pct = (secret_bits_needed / dwt_capacity_bits) * 100
-                        st.success(
-                            f"✅ **Capacità DWT sufficiente**: {secret_bits_needed:,} / ~{dwt_capacity_bits:,} bit ({usage_pct:.1f}% utilizzato)"
-                        )
-                        st.info(
-                            f"ℹ️ {len(bands_selection)} banda/e × {host_w}×{host_h}/4 coefficienti = ~{dwt_capacity_bits:,} bit"
-                        )
+            DWT.LEVELS = levels_value
 
             # Non mostrare LSB/MSB/DIV per DWT
             lsb = 0
@@ -623,6 +628,29 @@ class HideDataPages:
             )
             st.info(f"ℹ️ Il metodo {method_name} non richiede parametri aggiuntivi")
 
+        # Capacità esatta con la configurazione scelta
+        if host_image:
+            needed = None
+            if secret_image:
+                secret_w, secret_h = Image.open(secret_image).size
+                needed = secret_w * secret_h * 3
+            display_capacity(host_image, selected_method, DataType.IMAGE, needed)
+
+        # Anteprima rapida su un carrier ridotto
+        if st.checkbox("⚡ Anteprima rapida", key="hide_image_preview"):
+            if host_image and secret_image:
+                display_hide_preview(
+                    host_image,
+                    Image.open(secret_image),
+                    selected_method,
+                    DataType.IMAGE,
+                    lsb=lsb,
+                    msb=msb,
+                    div=int(div),
+                )
+            else:
+                st.info("Carica entrambe le immagini per l'anteprima")
+
         col1, col2 = st.columns(2)
         with col1:
             output_name = st.text_input(
@@ -653,7 +681,8 @@ class HideDataPages:
                         img2 = Image.open(secret_path)
 
                         # Nascondi immagine
-                        backup_file = backup_name if save_backup else None
+                        # Backup scritto in memoria e offerto per il download
+                        backup_file = io.BytesIO() if save_backup else None
                         with st.spinner("Nascondendo immagine..."):
                             result = hide_image(
                                 img1,
@@ -663,6 +692,8 @@ class HideDataPages:
                                 int(div),
                                 backup_file,
                                 method=selected_method,
+                                async_metrics=True,
+                                change_maps=True,
                             )
 
                         if result:  # Controllo successo
@@ -695,15 +726,13 @@ class HideDataPages:
                             }
 
                             # Aggiungi backup se richiesto
-                            if backup_file and os.path.exists(backup_file):
-                                with open(backup_file, "rb") as f:
-                                    downloads["backup"] = {
-                                        "data": f.read(),
-                                        "filename": backup_file,
-                                        "mime": "application/octet-stream",
-                                        "label": "💾 Scarica file backup parametri",
-                                    }
-                                cleanup_temp_file(backup_file)
+                            if backup_file is not None:
+                                downloads["backup"] = {
+                                    "data": backup_file.getvalue(),
+                                    "filename": backup_name,
+                                    "mime": "application/json",
+                                    "label": "💾 Scarica file backup parametri",
+                                }
 
                             st.session_state["hide_image_results"] = downloads
 
@@ -730,22 +759,6 @@ class HideDataPages:
             if "preview_image" in downloads:
                 if "preview_info" in downloads:
                     st.info(downloads["preview_info"])
-                # Mostra metriche se disponibili
-                if "metrics" in downloads:
-                    metrics = downloads["metrics"]
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        st.metric(
-                            label="SSIM (Similarità Strutturale)",
-                            value=f"{metrics['ssim']:.4f}",
-                            help="1.0 = immagini identiche",
-                        )
-                    with col2:
-                        st.metric(
-                            label="PSNR (Rapporto Segnale/Rumore)",
-                            value=f"{metrics['psnr']:.2f} dB",
-                            help="Valori più alti = migliore qualità",
-                        )
                 st.image(
                     downloads["preview_image"],
                     caption="Anteprima immagine con immagine nascosta",
@@ -772,6 +785,9 @@ class HideDataPages:
                     backup_data["label"],
                 )
 
+            # Metriche calcolate in background: mostrate dopo il download
+            display_quality_metrics(downloads)
+
     @staticmethod
     def hide_binary_page(selected_method):
         """Pagina per nascondere file binari"""
@@ -827,6 +843,7 @@ class HideDataPages:
             from src.steganografia.dwt.binary_operations import (
                 BinarySteganography as DWT_Binary,
             )
+            from src.steganografia.dwt.transform import band_options
 
             # Preset selector
             dwt_preset = st.selectbox(
@@ -866,6 +883,7 @@ class HideDataPages:
                 default_alpha = 0.1
                 default_bands = ["cH"]
                 default_multi_channel = False
+            default_levels = 1
 
             # Mostra controlli solo in modalità Personalizzato
             if dwt_preset == "⚙️ Personalizzato":
@@ -894,64 +912,41 @@ class HideDataPages:
                         key="dwt_binary_multi_channel",
                     )
                 with col2:
+                    levels_value = st.slider(
+                        "Livelli DWT",
+                        min_value=1,
+                        max_value=3,
+                        value=default_levels,
+                        help="Livelli più profondi = più robusto a ricompressione, meno capacità",
+                        key="dwt_binary_levels",
+                    )
+                    options = band_options(levels_value)
                     bands_selection = st.multiselect(
                         "Bande DWT",
-                        options=["cH", "cV", "cD"],
-                        default=default_bands,
-                        help="cH=orizzontale, cV=verticale, cD=diagonale. Più bande = più capacità",
-                        key="dwt_binary_bands_multi",
+                        options=options,
+                        default=default_bands if levels_value == 1 else [options[0]],
+                        help="cH=orizzontale, cV=verticale, cD=diagonale (il numero indica il livello). Più bande = più capacità",
+                        key=f"dwt_binary_bands_multi_{levels_value}",
                     )
                     if not bands_selection:
                         st.error("⚠️ Seleziona almeno una banda!")
-                        bands_selection = ["cH"]
+                        bands_selection = [options[0]]
             else:
                 # Usa valori del preset
                 wavelet_value = default_wavelet
                 alpha_value = default_alpha
                 bands_selection = default_bands
                 multi_channel = default_multi_channel
+                levels_value = default_levels
 
             # Applica configurazione a DWT Binary (SOLO PARAMETRI USATI)
             DWT_Binary.WAVELET = wavelet_value
             DWT_Binary.ALPHA = alpha_value
             DWT_Binary.BANDS = bands_selection
+            DWT_Binary.LEVELS = levels_value
             DWT_Binary.USE_ALL_CHANNELS = multi_channel
             DWT_Binary.CHANNEL = 0  # Sempre canale R quando multi_channel=False
 
-            # Calcola capacità DWT per binary
-            if host_image and secret_file:
-                host_info = ImageDisplay.get_image_info(host_image)
-                if host_info:
-                    host_w, host_h = host_info["width"], host_info["height"]
-                    file_size = len(secret_file.getvalue())
-
-                    # Calcolo capacità: coefficienti per banda × numero bande × numero canali
-                    coeffs_per_band = (host_w * host_h) // 4  # DWT livello 1
-                    num_bands = len(bands_selection)
-                    num_channels = 3 if multi_channel else 1
-
-                    # Header overhead: magic(16) + size(32) + terminator(16) = 64 bit
-                    overhead_bits = 64
-                    capacity_bits = (
-                        coeffs_per_band * num_bands * num_channels
-                    ) - overhead_bits
-                    file_bits_needed = file_size * 8
-
-                    if file_bits_needed > capacity_bits:
-                        st.error(
-                            f"❌ **Capacità insufficiente**: Il file richiede {file_bits_needed:,} bit, "
-                            f"ma la capacità DWT è ~{capacity_bits:,} bit. "
-                            f"Usa più bande/canali o comprimi il file."
-                        )
-                    else:
-                        usage_pct = (file_bits_needed / capacity_bits) * 100
-                        st.success(
-                            f"✅ **Capacità DWT sufficiente**: {file_bits_needed:,} / ~{capacity_bits:,} bit ({usage_pct:.1f}% utilizzato)"
-                        )
-                        st.info(
-                            f"ℹ️ {num_channels} canale/i × {num_bands} banda/e × {coeffs_per_band:,} coeff = ~{capacity_bits:,} bit"
-                        )
-
             n = 0
             div = 0.0
 
@@ -1072,6 +1067,26 @@ class HideDataPages:
             with col3:
                 st.write("")
 
+        # Capacità esatta con la configurazione scelta
+        if host_image:
+            needed = len(secret_file.getvalue()) if secret_file else None
+            display_capacity(host_image, selected_method, DataType.BINARY, needed)
+
+        # Anteprima rapida su un carrier ridotto
+        if st.checkbox("⚡ Anteprima rapida", key="hide_binary_preview"):
+            if host_image and secret_file:
+                display_hide_preview(
+                    host_image,
+                    secret_file.getvalue(),
+                    selected_method,
+                    DataType.BINARY,
+                    compression_mode=zip_mode,
+                    n=n,
+                    div=int(div),
+                )
+            else:
+                st.info("Carica un'immagine e un file per l'anteprima")
+
         col1, col2 = st.columns(2)
         with col1:
             output_name = st.text_input(
@@ -1099,7 +1114,8 @@ class HideDataPages:
                         img = Image.open(host_path)
 
                         # Nascondi file
-                        backup_file = backup_name if save_backup else None
+                        # Backup scritto in memoria e offerto per il download
+                        backup_file = io.BytesIO() if save_backup else None
                         with st.spinner("Nascondendo file..."):
                             result = hide_bin_file(
                                 img,
@@ -1109,6 +1125,8 @@ class HideDataPages:
                                 int(div),
                                 backup_file,
                                 method=selected_method,
+                                async_metrics=True,
+                                change_maps=True,
                             )
 
                         if result:  # Controllo successo
@@ -1145,15 +1163,13 @@ class HideDataPages:
                             }
 
                             # Aggiungi backup se richiesto
-                            if backup_file and os.path.exists(backup_file):
-                                with open(backup_file, "rb") as f:
-                                    downloads["backup"] = {
-                                        "data": f.read(),
-                                        "filename": backup_file,
-                                        "mime": "application/octet-stream",
-                                        "label": "💾 Scarica file backup parametri",
-                                    }
-                                cleanup_temp_file(backup_file)
+                            if backup_file is not None:
+                                downloads["backup"] = {
+                                    "data": backup_file.getvalue(),
+                                    "filename": backup_name,
+                                    "mime": "application/json",
+                                    "label": "💾 Scarica file backup parametri",
+                                }
 
                             st.session_state["hide_binary_results"] = downloads
 
@@ -1180,22 +1196,6 @@ class HideDataPages:
             if "preview_image" in downloads:
                 if "preview_info" in downloads:
                     st.info(downloads["preview_info"])
-                # Mostra metriche se disponibili
-                if "metrics" in downloads:
-                    metrics = downloads["metrics"]
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        st.metric(
-                            label="SSIM (Similarità Strutturale)",
-                            value=f"{metrics['ssim']:.4f}",
-                            help="1.0 = immagini identiche",
-                        )
-                    with col2:
-                        st.metric(
-                            label="PSNR (Rapporto Segnale/Rumore)",
-                            value=f"{metrics['psnr']:.2f} dB",
-                            help="Valori più alti = migliore qualità",
-                        )
                 st.image(
                     downloads["preview_image"],
                     caption="Anteprima immagine con file nascosto",
@@ -1221,3 +1221,6 @@ class HideDataPages:
                     backup_data["mime"],
                     backup_data["label"],
                 )
+
+            # Metriche calcolate in background: mostrate dopo il download
+            display_quality_metrics(downloads)
@@ -88,6 +88,49 @@ class ImageDisplay:
                 processed_image, "🔒 Immagine con Dati Nascosti", max_width=max_width
             )
 
+    @staticmethod
+    def show_change_maps(change_maps: dict, max_width: int = 300):
+        """
+        Mostra dove sono stati nascosti i dati: residuo amplificato e heatmap
+
+        Args:
+            change_maps: Mappe prodotte da QualityMetrics.change_maps
+            max_width: Larghezza massima per ogni mappa
+        """
+        block = change_maps["block_size"]
+        scale = f" (blocchi {block}x{block} px)" if block > 1 else ""
+        with st.expander("🔍 Mappa delle modifiche"):
+            col1, col2 = st.columns(2)
+            with col1:
+                st.image(
+                    change_maps["residual"],
+                    caption=f"Differenza amplificata{scale}",
+                    width=max_width,
+                )
+            with col2:
+                st.image(
+                    change_maps["heatmap"],
+                    caption="Pixel modificati per zona (nero = nessuno, bianco = tutti)",
+                    width=max_width,
+                )
+
+    @staticmethod
+    def show_capacity_map(estimate: dict, max_width: int = 300):
+        """
+        Mostra la mappa della capacità per blocchi dell'immagine host
+
+        Args:
+            estimate: Stima prodotta da capacity_map
+            max_width: Larghezza massima della mappa
+        """
+        block = estimate["block_size"]
+        with st.expander("🗺️ Mappa della capacità"):
+            st.image(
+                estimate["heatmap"],
+                caption=f"Bit disponibili per blocco {block}x{block} px (bianco = massimo)",
+                width=max_width,
+            )
+
     @staticmethod
     def get_image_info(image_data) -> dict:
         """
@@ -2,6 +2,8 @@
 Layout e istruzioni per l'interfaccia Streamlit
 """
 
+import uuid
+
 import streamlit as st
 
 
@@ -44,6 +46,13 @@ class AppLayout:
             unsafe_allow_html=True,
         )
 
+    @staticmethod
+    def get_session_id() -> str:
+        """Identificativo stabile della sessione utente corrente"""
+        if "session_id" not in st.session_state:
+            st.session_state.session_id = uuid.uuid4().hex
+        return st.session_state.session_id
+
     @staticmethod
     def setup_sidebar():
         """Configura la sidebar con cards verticali per i metodi"""
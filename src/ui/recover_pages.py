@@ -110,6 +110,7 @@ class RecoverDataPages:
             from src.steganografia.dwt.message_operations import (
                 MessageSteganography as DWT_Msg,
             )
+            from src.steganografia.dwt.transform import band_options
 
             preset = st.selectbox(
                 "📋 Preconfigurazione DWT:",
@@ -131,24 +132,28 @@ class RecoverDataPages:
                 DWT_Msg.BANDS = ["cH"]
 
                 DWT_Msg.USE_ALL_CHANNELS = True
+                DWT_Msg.LEVELS = 1
                 st.info("⚖️ Wavelet Haar, alpha 0.1, banda cH, tutti i canali")
             elif preset == "🎨 Qualità":
                 DWT_Msg.WAVELET = "haar"
                 DWT_Msg.ALPHA = 0.05
                 DWT_Msg.BANDS = ["cH"]
                 DWT_Msg.USE_ALL_CHANNELS = True
+                DWT_Msg.LEVELS = 1
                 st.info("🎨 Wavelet Haar, alpha 0.05, banda cH, tutti i canali")
             elif preset == "💪 Robustezza":
                 DWT_Msg.WAVELET = "db4"
                 DWT_Msg.ALPHA = 0.3
                 DWT_Msg.BANDS = ["cH", "cV"]
                 DWT_Msg.USE_ALL_CHANNELS = True
+                DWT_Msg.LEVELS = 1
                 st.info("💪 Wavelet Daubechies 4, alpha 0.3, 2 bande, tutti i canali")
             elif preset == "📦 Capacità":
                 DWT_Msg.WAVELET = "haar"
                 DWT_Msg.ALPHA = 0.15
                 DWT_Msg.BANDS = ["cH", "cV", "cD"]
                 DWT_Msg.USE_ALL_CHANNELS = True
+                DWT_Msg.LEVELS = 1
                 st.info("📦 Alpha 0.15, 3 bande (tutte), tutti i canali")
             else:
                 col1, col2 = st.columns(2)
@@ -167,16 +172,24 @@ class RecoverDataPages:
                         step=0.05,
                         key="dwt_msg_recover_alpha",
                     )
+                    levels = st.slider(
+                        "Livelli DWT",
+                        min_value=1,
+                        max_value=3,
+                        value=1,
+                        key="dwt_msg_recover_levels",
+                    )
                 with col2:
+                    options = band_options(levels)
                     bands_selection = st.multiselect(
                         "Bande DWT",
-                        options=["cH", "cV", "cD"],
-                        default=["cH"],
-                        key="dwt_msg_recover_bands",
+                        options=options,
+                        default=[options[0]],
+                        key=f"dwt_msg_recover_bands_{levels}",
                     )
                     if not bands_selection:
                         st.error("⚠️ Seleziona almeno una banda!")
-                        bands_selection = ["cH"]
+                        bands_selection = [options[0]]
                     use_all_channels = st.checkbox(
                         "Usa tutti i canali RGB",
                         value=True,
@@ -187,6 +200,7 @@ class RecoverDataPages:
                 DWT_Msg.WAVELET = wavelet
                 DWT_Msg.ALPHA = alpha
                 DWT_Msg.BANDS = bands_selection
+                DWT_Msg.LEVELS = levels
                 DWT_Msg.USE_ALL_CHANNELS = use_all_channels
                 DWT_Msg.CHANNEL = 0  # Sempre R quando single-channel
 
@@ -286,7 +300,7 @@ class RecoverDataPages:
             )
 
         # Opzioni parametri
-        backup_file_path, use_recent, manual_params = display_backup_options(
+        backup_file, use_recent, manual_params = display_backup_options(
             "image_get", show_manual=True
         )
 
@@ -298,6 +312,7 @@ class RecoverDataPages:
             st.info("💡 Configura i parametri DWT usati durante l'occultamento")
 
             from src.steganografia.dwt.image_operations import ImageSteganography as DWT
+            from src.steganografia.dwt.transform import band_options
 
             preset = st.selectbox(
                 "📋 Preconfigurazione DWT:",
@@ -316,18 +331,21 @@ class RecoverDataPages:
                 DWT.STEP = 12.0
                 DWT.BITS_SECRET = 3
                 DWT.BANDS = ["cH", "cV"]
+                DWT.LEVELS = 1
                 st.info("✅ Wavelet Haar, STEP=12, 3-bit, cH+cV")
             elif preset == "🎨 Qualità":
                 DWT.WAVELET = "haar"
                 DWT.STEP = 24.0
                 DWT.BITS_SECRET = 4
                 DWT.BANDS = ["cH"]
+                DWT.LEVELS = 1
                 st.info("🎨 STEP=24, 4-bit, cH")
             elif preset == "📦 Capacità":
                 DWT.WAVELET = "haar"
                 DWT.STEP = 8.0
                 DWT.BITS_SECRET = 2
                 DWT.BANDS = ["cH", "cV", "cD"]
+                DWT.LEVELS = 1
                 st.info("📦 STEP=8, 2-bit, tutte bande")
             else:
                 col1, col2 = st.columns(2)
@@ -342,21 +360,26 @@ class RecoverDataPages:
                         "STEP", 8.0, 32.0, 12.0, 4.0, key="dwt_img_rec_step"
                     )
                     bits_val = st.slider("Bit Secret", 2, 4, 3, key="dwt_img_rec_bits")
+                    levels_val = st.slider(
+                        "Livelli DWT", 1, 3, 1, key="dwt_img_rec_levels"
+                    )
                 with col2:
+                    options = band_options(levels_val)
                     bands_val = st.multiselect(
                         "Bande",
-                        ["cH", "cV", "cD"],
-                        default=["cH", "cV"],
-                        key="dwt_img_rec_bands",
+                        options,
+                        default=["cH", "cV"] if levels_val == 1 else [options[0]],
+                        key=f"dwt_img_rec_bands_{levels_val}",
                     )
                     if not bands_val:
                         st.error("⚠️ Seleziona almeno una banda!")
-                        bands_val = ["cH"]
+                        bands_val = [options[0]]
 
                 DWT.WAVELET = wavelet_val
                 DWT.STEP = step_val
                 DWT.BITS_SECRET = bits_val
                 DWT.BANDS = bands_val
+                DWT.LEVELS = levels_val
 
         elif manual_params and selected_method == SteganographyMethod.PVD:
             st.info("💡 Configura i parametri PVD usati durante l'occultamento")
@@ -488,7 +511,7 @@ class RecoverDataPages:
                                 div,
                                 width,
                                 height,
-                                backup_file_path,
+                                backup_file,
                                 method=selected_method,
                             )
 
@@ -572,13 +595,13 @@ class RecoverDataPages:
             ImageDisplay.show_image_details(hidden_image, "Dettagli Immagine")
 
         # Opzioni parametri
-        backup_file_path, use_recent, manual_params = display_backup_options(
+        backup_file, use_recent, manual_params = display_backup_options(
             "binary_get", show_manual=True
         )
 
         # Se l'utente sceglie parametri manuali, ignora il backup
         if manual_params:
-            backup_file_path = None
+            backup_file = None
 
         # Configurazione metodo SOLO se parametri manuali
         dwt_alpha = dwt_bands = dwt_use_all_channels = None
@@ -596,6 +619,7 @@ class RecoverDataPages:
             from src.steganografia.dwt.binary_operations import (
                 BinarySteganography as DWT_Binary,
             )
+            from src.steganografia.dwt.transform import band_options
 
             preset = st.selectbox(
                 "📋 Preconfigurazione DWT:",
@@ -615,18 +639,21 @@ class RecoverDataPages:
 
                 DWT_Binary.BANDS = ["cH"]
                 DWT_Binary.USE_ALL_CHANNELS = False
+                DWT_Binary.LEVELS = 1
                 st.info("⚖️ Wavelet Haar, ALPHA=0.1, banda cH, canale R")
             elif preset == "📦 Massima Capacità":
                 DWT_Binary.WAVELET = "haar"
                 DWT_Binary.ALPHA = 0.15
                 DWT_Binary.BANDS = ["cH", "cV", "cD"]
                 DWT_Binary.USE_ALL_CHANNELS = True
+                DWT_Binary.LEVELS = 1
                 st.info("📦 ALPHA=0.15, tutte le bande, tutti i canali")
             elif preset == "🎨 Massima Qualità":
                 DWT_Binary.WAVELET = "haar"
                 DWT_Binary.ALPHA = 0.05
                 DWT_Binary.BANDS = ["cH"]
                 DWT_Binary.USE_ALL_CHANNELS = False
+                DWT_Binary.LEVELS = 1
                 st.info("🎨 ALPHA=0.05, banda cH, canale R")
             else:
                 col1, col2 = st.columns(2)
@@ -644,19 +671,24 @@ class RecoverDataPages:
                         "Tutti i canali", value=False, key="dwt_bin_rec_multi"
                     )
                 with col2:
+                    levels_val = st.slider(
+                        "Livelli DWT", 1, 3, 1, key="dwt_bin_rec_levels"
+                    )
+                    options = band_options(levels_val)
                     bands_val = st.multiselect(
                         "Bande",
-                        ["cH", "cV", "cD"],
-                        default=["cH"],
-                        key="dwt_bin_rec_bands",
+                        options,
+                        default=[options[0]],
+                        key=f"dwt_bin_rec_bands_{levels_val}",
                     )
                     if not bands_val:
                         st.error("⚠️ Seleziona almeno una banda!")
-                        bands_val = ["cH"]
+                        bands_val = [options[0]]
 
                 DWT_Binary.WAVELET = wavelet_val
                 DWT_Binary.ALPHA = alpha_val
                 DWT_Binary.BANDS = bands_val
+                DWT_Binary.LEVELS = levels_val
                 DWT_Binary.USE_ALL_CHANNELS = multi_ch
 
         elif (
@@ -842,7 +874,7 @@ class RecoverDataPages:
                                 n,
                                 div,
                                 size,
-                                backup_file_path,
+                                backup_file,
                                 method=selected_method,
                                 dwt_alpha=dwt_alpha,
                                 dwt_bands=dwt_bands,
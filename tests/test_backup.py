@@ -0,0 +1,74 @@
+"""
+Test del formato dei file di backup
+"""
+
+import os
+import pickle
+
+import pytest
+
+from config.constants import DataType
+from src.steganografia.backup import BackupFormat
+
+RECORD = {
+    "type": DataType.BINARY,
+    "params": {
+        "method": "dwt",
+        "size": 12,
+        "wavelet": "haar",
+        "channel": 0,
+        "bands": ["cH"],
+        "levels": 1,
+        "alpha": 0.1,
+        "use_all_channels": False,
+    },
+}
+
+
+class _Exploit:
+    """Oggetto il cui unpickling eseguirebbe una funzione arbitraria"""
+
+    def __reduce__(self):
+        return (os.getcwd, ())
+
+
+def test_round_trip():
+    assert BackupFormat.loads(BackupFormat.dumps([RECORD])) == [RECORD]
+
+
+def test_validate_rejects_missing_and_wrong_params():
+    missing = {"type": RECORD["type"], "params": dict(RECORD["params"])}
+    del missing["params"]["alpha"]
+    with pytest.raises(ValueError, match="mancante"):
+        BackupFormat.validate(missing)
+    BackupFormat.validate(missing, complete=False)
+
+    wrong = {"type": RECORD["type"], "params": {**RECORD["params"], "levels": "1"}}
+    with pytest.raises(ValueError, match="non valido"):
+        BackupFormat.validate(wrong)
+
+
+def test_validate_rejects_unknown_method():
+    record = {"type": DataType.BINARY, "params": {"method": "ignoto"}}
+    with pytest.raises(ValueError, match="non riconosciuto"):
+        BackupFormat.validate(record)
+
+
+def test_loads_rejects_unknown_documents():
+    with pytest.raises(ValueError):
+        BackupFormat.loads(b'{"format": "altro", "records": []}')
+    with pytest.raises(ValueError):
+        BackupFormat.loads(b"\xff\xfe non json")
+
+
+def test_legacy_pickle_requires_opt_in():
+    data = pickle.dumps(RECORD)
+    with pytest.raises(ValueError):
+        BackupFormat.loads(data)
+    assert BackupFormat.loads(data, allow_pickle=True) == [RECORD]
+
+
+def test_legacy_pickle_with_global_is_rejected():
+    data = pickle.dumps({"type": DataType.BINARY, "params": _Exploit()})
+    with pytest.raises(pickle.UnpicklingError):
+        BackupFormat.loads(data, allow_pickle=True)
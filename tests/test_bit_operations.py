@@ -0,0 +1,67 @@
+"""
+Test di BitStream
+"""
+
+import numpy as np
+import pytest
+
+from src.steganografia.bit_operations import BitStream
+
+DATA = bytes([0b10110010, 0b01011100, 0xFF, 0x00, 0x5A])
+
+
+def test_bytes_round_trip():
+    stream = BitStream.from_bytes(DATA)
+    assert len(stream) == len(DATA) * 8
+    assert stream.to_bytes() == DATA
+    assert BitStream.from_bits(stream.to_bits()) == stream
+
+
+def test_from_str_and_padding_is_zeroed():
+    stream = BitStream.from_str("101")
+    assert len(stream) == 3
+    assert stream.to_bytes() == bytes([0b10100000])
+    # I bit oltre la lunghezza vengono azzerati
+    truncated = BitStream(np.array([0xFF], dtype=np.uint8), 3)
+    assert truncated.to_bytes() == bytes([0b11100000])
+
+
+def test_invalid_length():
+    with pytest.raises(ValueError):
+        BitStream(np.zeros(1, dtype=np.uint8), 9)
+
+
+def test_unaligned_slices():
+    stream = BitStream.from_bytes(DATA)
+    bits = stream.to_bits()
+    for start, stop in [(0, 8), (3, 17), (5, 40), (13, 13)]:
+        assert np.array_equal(stream[start:stop].to_bits(), bits[start:stop])
+
+
+def test_concat():
+    a, b = BitStream.from_str("101"), BitStream.from_str("0011")
+    assert a + b == BitStream.from_str("1010011")
+    assert BitStream.concat(a, b, a) == BitStream.from_str("1010011101")
+
+
+def test_uint_round_trip():
+    values = np.array([0, 1, 5, 1023, 77])
+    stream = BitStream.from_uints(values, 10)
+    assert len(stream) == 50
+    assert np.array_equal(stream.read_uints(np.arange(5) * 10, 10), values)
+    assert stream.read_uint(30, 10) == 1023
+    assert BitStream.from_uint(77, 7) == BitStream.from_str("1001101")
+
+
+def test_read_past_the_end():
+    stream = BitStream.from_str("1011")
+    # read_uints completa con zeri, read_uint rifiuta
+    assert stream.read_uints(np.array([2]), 4)[0] == 0b1100
+    with pytest.raises(ValueError):
+        stream.read_uint(2, 4)
+
+
+def test_find():
+    stream = BitStream.from_bytes(DATA)
+    assert stream.find(BitStream.from_str("0101110")) == 8
+    assert stream.find(BitStream.from_str("1" * 9)) == -1
@@ -0,0 +1,38 @@
+"""
+Test del riuso della stima di capacità di DWT e PVD
+"""
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from config.constants import DataType
+from src.steganografia import capacity, capacity_map
+from src.steganografia.dwt.message_operations import MessageSteganography as DwtMessage
+from src.steganografia.pvd.binary_operations import BinarySteganography as PvdBinary
+
+
+@pytest.fixture
+def host():
+    rng = np.random.default_rng(7)
+    return Image.fromarray(rng.integers(0, 256, (128, 128, 3), dtype=np.uint8))
+
+
+@pytest.mark.parametrize(
+    "method, data_type, engine",
+    [("pvd", DataType.BINARY, PvdBinary), ("dwt", DataType.STRING, DwtMessage)],
+)
+def test_capacity_reuses_estimate(host, monkeypatch, method, data_type, engine):
+    expected = capacity(host, method, data_type)
+    calls = []
+    original = engine.capacity
+
+    def counting(img):
+        calls.append(img)
+        return original(img)
+
+    monkeypatch.setattr(engine, "capacity", staticmethod(counting))
+    estimate = capacity_map(host, method, data_type)
+    usable = capacity(host, method, data_type, {"estimate": estimate})
+    assert usable == expected
+    assert len(calls) == 1
@@ -0,0 +1,97 @@
+"""
+Test dell'header del contenitore, del descrittore DWT e della pipeline del payload
+"""
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from config.constants import DataType, SteganographyMethod
+from src.steganografia.bit_operations import BitStream
+from src.steganografia.container import (
+    CODEC_NONE,
+    DESCRIPTOR_BITS,
+    FLAG_ECC,
+    build_descriptor,
+    build_header,
+    decode_payload,
+    encode_payload,
+    read_descriptor,
+    read_header,
+    verify_payload,
+    write_header,
+)
+
+PAYLOAD = b"payload di prova " * 8
+PARAMS = {"n": 2, "div": 1.5, "zip_mode": 0}
+
+
+def _carrier(header: BitStream) -> np.ndarray:
+    rng = np.random.default_rng(4)
+    pixels = rng.integers(0, 256, (64, 64, 3), dtype=np.uint8)
+    write_header(pixels, header)
+    return pixels
+
+
+def test_header_round_trip():
+    header = build_header(
+        SteganographyMethod.LSB, DataType.BINARY, PARAMS, PAYLOAD, flags=FLAG_ECC
+    )
+    read = read_header(Image.fromarray(_carrier(header)))
+    assert read["method"] == SteganographyMethod.LSB
+    assert read["data_type"] == DataType.BINARY
+    assert read["params"] == PARAMS
+    assert read["payload_length"] == len(PAYLOAD)
+    assert read["flags"] == FLAG_ECC
+    assert read["codec"] == CODEC_NONE
+
+
+def test_header_crc_rejects_corruption():
+    header = build_header(SteganographyMethod.LSB, DataType.BINARY, PARAMS, PAYLOAD)
+    pixels = _carrier(header)
+    # Un bit dei parametri JSON (dopo i 18 byte della parte fissa)
+    pixels.reshape(-1)[18 * 8 + 3] ^= 1
+    assert read_header(Image.fromarray(pixels)) is None
+
+
+def test_read_header_without_container():
+    rng = np.random.default_rng(5)
+    pixels = rng.integers(0, 256, (64, 64, 3), dtype=np.uint8)
+    assert read_header(Image.fromarray(pixels)) is None
+
+
+def test_verify_payload():
+    header = read_header(
+        Image.fromarray(
+            _carrier(
+                build_header(SteganographyMethod.PVD, DataType.STRING, {}, PAYLOAD)
+            )
+        )
+    )
+    assert verify_payload(header, PAYLOAD)
+    corrupted = b"X" + PAYLOAD[1:]
+    with pytest.raises(ValueError):
+        verify_payload(header, corrupted)
+    assert verify_payload(header, corrupted, strict=False) is False
+
+
+@pytest.mark.parametrize("ecc", [False, True])
+def test_payload_pipeline_round_trip(ecc):
+    payload_bytes, bits, flags = encode_payload(PAYLOAD, ecc)
+    assert len(payload_bytes) < len(PAYLOAD)  # Payload ripetitivo: compresso
+    header = read_descriptor(build_descriptor(payload_bytes, flags))
+    assert decode_payload(header, bits) == PAYLOAD
+
+
+def test_descriptor_survives_a_damaged_copy():
+    bits = build_descriptor(PAYLOAD, flags=FLAG_ECC).to_bits()
+    assert len(bits) == DESCRIPTOR_BITS
+    # Prima copia completamente invertita: il voto a maggioranza la scarta
+    bits[: DESCRIPTOR_BITS // 3] ^= 1
+    descriptor = read_descriptor(BitStream.from_bits(bits))
+    assert descriptor["payload_length"] == len(PAYLOAD)
+    assert descriptor["flags"] == FLAG_ECC
+
+
+def test_descriptor_absent():
+    assert read_descriptor(BitStream.from_bits(np.zeros(DESCRIPTOR_BITS))) is None
@@ -0,0 +1,71 @@
+"""
+Test della cache delle decomposizioni DWT
+"""
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from src.steganografia import hide_message
+from src.steganografia.dwt import transform
+from src.steganografia.dwt.message_operations import MessageSteganography
+from src.steganografia.dwt.transform import DecompositionCache, decomposition_cache
+
+
+@pytest.fixture
+def counted_decompose(monkeypatch):
+    """Conta le decomposizioni effettivamente calcolate"""
+    calls = []
+    original = transform.decompose
+
+    def counting(*args, **kwargs):
+        calls.append(args[1:])
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(transform, "decompose", counting)
+    decomposition_cache.clear()
+    yield calls
+    decomposition_cache.clear()
+
+
+@pytest.fixture
+def host():
+    rng = np.random.default_rng(0)
+    return Image.fromarray(rng.integers(0, 256, (256, 256, 3), dtype=np.uint8))
+
+
+@pytest.fixture(autouse=True)
+def all_channels(monkeypatch):
+    monkeypatch.setattr(MessageSteganography, "USE_ALL_CHANNELS", True)
+
+
+def test_second_hide_on_same_host_uses_cache(counted_decompose, host, monkeypatch):
+    # Limite più piccolo di un singolo canale: l'immagine corrente resta in cache
+    monkeypatch.setattr(DecompositionCache, "MAX_BYTES", 1024)
+
+    hide_message(host, "primo", method="dwt", metrics_level="psnr")
+    first = len(counted_decompose)
+    assert first == 3
+
+    hide_message(host, "secondo", method="dwt", metrics_level="psnr")
+    assert len(counted_decompose) == first
+
+
+def test_other_image_evicts_previous_host(counted_decompose, host, monkeypatch):
+    monkeypatch.setattr(DecompositionCache, "MAX_BYTES", 1024)
+    other = Image.fromarray(np.asarray(host)[::-1].copy())
+
+    hide_message(host, "a", method="dwt", metrics_level="psnr")
+    hide_message(other, "b", method="dwt", metrics_level="psnr")
+    hide_message(host, "c", method="dwt", metrics_level="psnr")
+
+    assert len(counted_decompose) == 9
+
+
+def test_zero_limit_disables_cache(counted_decompose, host, monkeypatch):
+    monkeypatch.setattr(DecompositionCache, "MAX_BYTES", 0)
+
+    hide_message(host, "a", method="dwt", metrics_level="psnr")
+    hide_message(host, "a", method="dwt", metrics_level="psnr")
+
+    assert len(counted_decompose) == 6
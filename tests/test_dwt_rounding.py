@@ -0,0 +1,32 @@
+"""
+Test dell'arrotondamento dei pixel ricostruiti dagli engine DWT
+"""
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from src.steganografia import hide_bin_file, hide_message
+
+# Righe oltre l'header e i pochi coefficienti toccati da un payload breve
+UNTOUCHED_FROM = 32
+
+
+@pytest.fixture
+def host():
+    rng = np.random.default_rng(1)
+    return Image.fromarray(rng.integers(0, 256, (256, 256, 3), dtype=np.uint8))
+
+
+def test_dwt_message_keeps_unchanged_region(host):
+    stego, _, _ = hide_message(host, "ciao", method="dwt", metrics_level="psnr")
+    original = np.array(host)[UNTOUCHED_FROM:]
+    assert np.array_equal(np.array(stego)[UNTOUCHED_FROM:], original)
+
+
+def test_dwt_binary_keeps_unchanged_region(host, tmp_path):
+    secret = tmp_path / "secret.bin"
+    secret.write_bytes(b"ciao")
+    stego = hide_bin_file(host, str(secret), method="dwt", metrics_level="psnr")[0]
+    original = np.array(host)[UNTOUCHED_FROM:]
+    assert np.array_equal(np.array(stego)[UNTOUCHED_FROM:], original)
@@ -0,0 +1,40 @@
+"""
+Test del codice di Hamming(7,4) dei payload
+"""
+
+import numpy as np
+
+from src.steganografia.bit_operations import BitStream
+from src.steganografia.ecc import (
+    CODEWORD_BITS,
+    encoded_bits,
+    hamming_decode,
+    hamming_encode,
+)
+
+DATA = bytes(range(256))
+
+
+def test_hamming_round_trip():
+    bits = hamming_encode(DATA)
+    assert len(bits) == encoded_bits(len(DATA))
+    assert hamming_decode(bits, len(DATA)) == (DATA, 0)
+
+
+def test_hamming_corrects_one_bit_per_codeword():
+    bits = hamming_encode(DATA).to_bits()
+    n_codewords = len(bits) // CODEWORD_BITS
+    # Un bit diverso in ogni parola di codice
+    positions = np.arange(n_codewords) * CODEWORD_BITS + np.arange(n_codewords) % 7
+    bits[positions] ^= 1
+
+    decoded, corrected = hamming_decode(BitStream.from_bits(bits), len(DATA))
+    assert decoded == DATA
+    assert corrected == n_codewords
+
+
+def test_hamming_two_bits_in_a_codeword_are_not_corrected():
+    bits = hamming_encode(DATA[:1]).to_bits()
+    bits[:2] ^= 1
+    decoded, _ = hamming_decode(BitStream.from_bits(bits), 1)
+    assert decoded != DATA[:1]
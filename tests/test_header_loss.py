@@ -0,0 +1,85 @@
+"""
+Test del recupero DWT quando l'header del contenitore nei pixel è perso
+"""
+
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from src.steganografia import (
+    detect_method,
+    get_bin_file,
+    get_image,
+    get_message,
+    hide_bin_file,
+    hide_image,
+    hide_message,
+)
+from src.steganografia.dwt.message_operations import MessageSteganography as DwtMessage
+
+
+@pytest.fixture
+def host():
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 1, 512)
+    base = np.outer(np.sin(x * 7), np.cos(x * 5)) * 100 + 128
+    rgb = np.stack([base, base * 0.8 + 20, base * 0.6 + 40], axis=-1)
+    noisy = rgb + rng.normal(0, 8, rgb.shape)
+    return Image.fromarray(np.clip(noisy, 0, 255).astype(np.uint8))
+
+
+def _jpeg(img: Image.Image, quality: int) -> Image.Image:
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=quality)
+    return Image.open(io.BytesIO(buf.getvalue()))
+
+
+def _drop_header(img: Image.Image) -> Image.Image:
+    """Inverte gli LSB della prima riga, dove inizia l'header del contenitore"""
+    pixels = np.array(img)
+    pixels[0] ^= 1
+    return Image.fromarray(pixels)
+
+
+def test_dwt_message_survives_jpeg(host, monkeypatch):
+    monkeypatch.setattr(DwtMessage, "BANDS", ["cH2"])
+    monkeypatch.setattr(DwtMessage, "LEVELS", 2)
+    monkeypatch.setattr(DwtMessage, "ALPHA", 1.0)
+    message = "Messaggio di prova robusto"
+    stego, _, _ = hide_message(
+        host, message, method="dwt", ecc=True, metrics_level="psnr"
+    )
+
+    recompressed = _jpeg(stego, 85)
+    assert get_message(recompressed, method="dwt") == message
+    assert detect_method(recompressed, "string") == "dwt"
+
+
+def test_dwt_binary_without_header(host, tmp_path):
+    secret = tmp_path / "secret.bin"
+    secret.write_bytes(b"payload binario" * 4)
+    stego = hide_bin_file(host, str(secret), method="dwt", metrics_level="psnr")[0]
+
+    output = tmp_path / "out.bin"
+    get_bin_file(_drop_header(stego), str(output), method="dwt")
+    assert output.read_bytes() == secret.read_bytes()
+
+
+def test_dwt_image_without_header_uses_backup(host, tmp_path):
+    rng = np.random.default_rng(2)
+    secret = Image.fromarray(rng.integers(0, 256, (16, 16, 3), dtype=np.uint8))
+    backup = str(tmp_path / "backup.json")
+    stego = hide_image(
+        host, secret, method="dwt", backup_file=backup, metrics_level="psnr"
+    )[0]
+
+    expected = get_image(stego, str(tmp_path / "ref.png"), method="dwt")
+    recovered = get_image(
+        _drop_header(stego),
+        str(tmp_path / "out.png"),
+        method="dwt",
+        backup_file=backup,
+    )
+    assert np.array_equal(np.array(recovered), np.array(expected))
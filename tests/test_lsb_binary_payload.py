@@ -0,0 +1,59 @@
+"""
+Test della pipeline del contenitore (compressione, ECC) per i file LSB
+"""
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from src.steganografia import get_bin_file, hide_bin_file
+from src.steganografia.container import (
+    CODEC_NONE,
+    FLAG_ECC,
+    carrier_region,
+    read_header,
+)
+
+
+@pytest.fixture
+def host():
+    rng = np.random.default_rng(3)
+    return Image.fromarray(rng.integers(0, 256, (128, 128, 3), dtype=np.uint8))
+
+
+@pytest.fixture
+def secret(tmp_path):
+    path = tmp_path / "secret.txt"
+    path.write_bytes(b"riga ripetuta del file segreto\n" * 40)
+    return path
+
+
+def _flip_first_carrier_bit(img: Image.Image) -> Image.Image:
+    pixels = np.array(img)
+    carrier_region(pixels)[0, 0, 0] ^= 1
+    return Image.fromarray(pixels)
+
+
+def test_lsb_binary_header_records_codec_and_ecc(host, secret, tmp_path):
+    stego = hide_bin_file(host, str(secret), ecc=True, metrics_level="psnr")[0]
+    header = read_header(stego)
+    assert header["flags"] & FLAG_ECC
+    assert header["codec"] != CODEC_NONE
+    assert header["payload_length"] < secret.stat().st_size
+
+    output = tmp_path / "out.txt"
+    get_bin_file(stego, str(output))
+    assert output.read_bytes() == secret.read_bytes()
+
+
+def test_lsb_binary_ecc_corrects_single_bit(host, secret, tmp_path):
+    stego = hide_bin_file(host, str(secret), ecc=True, metrics_level="psnr")[0]
+    output = tmp_path / "out.txt"
+    get_bin_file(_flip_first_carrier_bit(stego), str(output))
+    assert output.read_bytes() == secret.read_bytes()
+
+
+def test_lsb_binary_without_ecc_rejects_corruption(host, secret, tmp_path):
+    stego = hide_bin_file(host, str(secret), metrics_level="psnr")[0]
+    with pytest.raises(ValueError):
+        get_bin_file(_flip_first_carrier_bit(stego), str(tmp_path / "out.txt"))
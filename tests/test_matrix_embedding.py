@@ -0,0 +1,39 @@
+"""
+Test del matrix embedding sul piano LSB
+"""
+
+import numpy as np
+import pytest
+
+from src.steganografia.bit_operations import BitStream
+from src.steganografia.lsb import matrix_embedding
+
+
+@pytest.fixture
+def cover():
+    rng = np.random.default_rng(6)
+    return rng.integers(0, 256, 4096, dtype=np.uint8)
+
+
+@pytest.mark.parametrize("k", [1, 2, 3, 5])
+def test_extract_after_embed(cover, k):
+    rng = np.random.default_rng(k)
+    bits = BitStream.from_bits(rng.integers(0, 2, 500))
+    original = cover.copy()
+
+    changed = matrix_embedding.embed(cover, bits, k)
+    assert matrix_embedding.extract(cover, len(bits), k) == bits
+    # Al più un LSB invertito per blocco, nessun altro bit toccato
+    assert changed == np.count_nonzero(cover != original) <= -(-len(bits) // k)
+    assert np.all((cover ^ original) <= 1)
+
+
+def test_choose_k_fits_the_cover():
+    k = matrix_embedding.choose_k(500, 4096)
+    assert (4096 // ((1 << k) - 1)) * k >= 500
+    assert (4096 // ((1 << (k + 1)) - 1)) * (k + 1) < 500
+
+
+def test_choose_k_rejects_oversized_payload():
+    with pytest.raises(ValueError):
+        matrix_embedding.choose_k(5000, 4096)
@@ -0,0 +1,44 @@
+"""
+Test della creazione del pool condiviso delle metriche in background
+"""
+
+import threading
+import time
+
+import numpy as np
+
+from src.steganografia import metrics
+from src.steganografia.metrics import QualityMetrics
+
+
+def test_background_pool_created_once(monkeypatch):
+    created = []
+    real_executor = metrics.ThreadPoolExecutor
+
+    def slow_executor(*args, **kwargs):
+        time.sleep(0.05)  # Allarga la finestra di una creazione concorrente
+        created.append(real_executor(*args, **kwargs))
+        return created[-1]
+
+    monkeypatch.setattr(metrics, "ThreadPoolExecutor", slow_executor)
+    monkeypatch.setattr(QualityMetrics, "_executor", None)
+
+    image = np.zeros((16, 16, 3), dtype=np.uint8)
+    start = threading.Barrier(4)
+    futures = []
+
+    def submit():
+        start.wait()
+        futures.append(
+            QualityMetrics.calculate_metrics(image, image, "psnr", background=True)
+        )
+
+    threads = [threading.Thread(target=submit) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(created) == 1
+    assert all(future.result()["mse"] == 0 for future in futures)
+    created[0].shutdown()
@@ -0,0 +1,24 @@
+"""
+Test della misura opzionale del picco di memoria delle operazioni DWT
+"""
+
+import tracemalloc
+
+from src.steganografia.dwt import transform
+
+
+def _traced() -> bool:
+    return tracemalloc.is_tracing()
+
+
+def test_peak_memory_disabled_by_default(monkeypatch, capsys):
+    monkeypatch.setattr(transform, "TRACK_MEMORY", False)
+    assert transform.track_peak_memory("Prova")(_traced)() is False
+    assert "Picco memoria" not in capsys.readouterr().out
+
+
+def test_peak_memory_opt_in(monkeypatch, capsys):
+    monkeypatch.setattr(transform, "TRACK_MEMORY", True)
+    assert transform.track_peak_memory("Prova")(_traced)() is True
+    assert "Prova - Picco memoria" in capsys.readouterr().out
+    assert not tracemalloc.is_tracing()
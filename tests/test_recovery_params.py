@@ -0,0 +1,49 @@
+"""
+Test dell'isolamento dei parametri di recupero dalla configurazione degli engine
+"""
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from src.steganografia import get_image, get_message, hide_image, hide_message
+from src.steganografia.dwt.image_operations import ImageSteganography as DwtImage
+from src.steganografia.dwt.message_operations import MessageSteganography as DwtMessage
+from src.steganografia.pvd.message_operations import MessageSteganography as PvdMessage
+
+
+@pytest.fixture
+def host():
+    rng = np.random.default_rng(1)
+    return Image.fromarray(rng.integers(0, 256, (256, 256, 3), dtype=np.uint8))
+
+
+def test_dwt_get_message_keeps_class_config(host, monkeypatch):
+    monkeypatch.setattr(DwtMessage, "BANDS", ["cD"])
+    monkeypatch.setattr(DwtMessage, "ALPHA", 0.2)
+    stego, _, _ = hide_message(host, "ciao", method="dwt", metrics_level="psnr")
+
+    monkeypatch.setattr(DwtMessage, "BANDS", ["cH", "cV"])
+    monkeypatch.setattr(DwtMessage, "ALPHA", 0.05)
+    assert get_message(stego, method="dwt") == "ciao"
+    assert DwtMessage.BANDS == ["cH", "cV"]
+    assert DwtMessage.ALPHA == 0.05
+
+
+def test_dwt_get_image_keeps_class_config(host, monkeypatch, tmp_path):
+    secret = Image.fromarray(np.full((8, 8, 3), 200, dtype=np.uint8))
+    monkeypatch.setattr(DwtImage, "STEP", 32.0)
+    stego = hide_image(host, secret, method="dwt", metrics_level="psnr")[0]
+
+    monkeypatch.setattr(DwtImage, "STEP", 8.0)
+    get_image(stego, str(tmp_path / "out.png"), method="dwt")
+    assert DwtImage.STEP == 8.0
+
+
+def test_pvd_get_message_keeps_class_ranges(host, monkeypatch):
+    monkeypatch.setattr(PvdMessage, "RANGES", PvdMessage.RANGES_CAPACITY)
+    stego, _, _ = hide_message(host, "ciao", method="pvd", metrics_level="psnr")
+
+    monkeypatch.setattr(PvdMessage, "RANGES", PvdMessage.RANGES_QUALITY)
+    assert get_message(stego, method="pvd") == "ciao"
+    assert PvdMessage.RANGES == PvdMessage.RANGES_QUALITY